@@ -0,0 +1,200 @@
+"""
+Benchmark for the LLM prompt size.
+
+Seeds a database with synthetic visits, builds each popular url's summary
+inputs once, then renders them both as the previous text summary (raw dict
+dumps, kept verbatim below with the previous prompt templates) and with
+summary_encoder.encode_summary in the current templates. Reports estimated
+tokens per summary and per insight/graph/chat prompt (and cl100k counts when
+tiktoken and its encoding are available).
+
+With --llm, each insight prompt is also streamed from the configured
+endpoint (OPENROUTER_API_KEY, OPENROUTER_API_URL) to time the first token
+and the whole completion.
+
+Run from ai-service/:
+    python -m benchmarks.bench_prompts [--visits N] [--urls-to-encode K] [--llm]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.generator import seed_database
+from src.geo import geo_breakdown
+from src.summary_encoder import encode_summary, estimate_tokens
+
+GRAPH_TYPE = "device_breakdown"
+CHAT_MESSAGE = "Where does most of my traffic come from, and when?"
+
+
+# The pre-encoder summary, kept verbatim as the baseline
+def legacy_summary(bundle, breakdowns, unique_visitors, top_referrers_db) -> str:
+    clicks_over_time_db = bundle["clicks_over_time"]
+    summary_parts = []
+    summary_parts.append(f"Total clicks: {bundle['total_clicks']}")
+    summary_parts.append(f"Unique visitors: {unique_visitors}")
+
+    if clicks_over_time_db:
+        daily_clicks = Counter()
+        for point in clicks_over_time_db:
+            timestamp = point["timestamp"]
+            day = datetime.fromisoformat(timestamp).date() if isinstance(timestamp, str) else timestamp.date()
+            daily_clicks[day] += point["count"]
+        most_active_day = min(daily_clicks, key=lambda day: (-daily_clicks[day], day))
+        summary_parts.append(f"Most active day: {most_active_day}")
+    if top_referrers_db:
+        top_3_referrers = ", ".join([f"{r.value} ({r.count} clicks)" for r in top_referrers_db])
+        summary_parts.append(f"Top referrers: {top_3_referrers}")
+
+    if breakdowns["device"]:
+        summary_parts.append(f"Device breakdown: {dict(breakdowns['device'].most_common())}")
+    if breakdowns["os"]:
+        summary_parts.append(f"OS breakdown: {dict(breakdowns['os'].most_common())}")
+    if breakdowns["browser"]:
+        summary_parts.append(f"Browser breakdown: {dict(breakdowns['browser'].most_common())}")
+
+    if breakdowns["geo"]:
+        top_locations = ", ".join(
+            f"{'/'.join(filter(None, (item['country'], item['region'], item['city'])))} ({item['count']} clicks)"
+            for item in geo_breakdown(breakdowns["geo"], limit=5)
+        )
+        summary_parts.append(f"Top locations: {top_locations}")
+    else:
+        summary_parts.append("Geolocation is unavailable because IPs are hashed for privacy.")
+    return ". ".join(summary_parts)
+
+
+def legacy_insight_prompt(data_summary: str) -> str:
+    return f"""
+    Analyze the following traffic data for a shortened URL and provide a concise, actionable insight. Focus on patterns, trends, and potential implications.
+
+    **Data Summary:**
+    {data_summary}
+
+    **Task:**
+    Generate a short, natural language insight (1-3 sentences). For example: "Traffic spiked on Tuesday morning, primarily from mobile users in France using Chrome, suggesting a successful mobile campaign targeting that demographic." or "Unusual activity detected with a high volume of requests from bots between 2-4 AM."
+    """
+
+
+def legacy_graph_insight_prompt(graph_type: str, summary: str) -> str:
+    return f"""
+You are an analytics expert. A user is viewing the graph: {graph_type} for a specific shortened URL.
+
+Overall data summary:
+{summary}
+
+Task:
+1. Focus ONLY on insights relevant to the graph type "{graph_type}".
+2. Describe the pattern, anomalies, and possible causes.
+3. Suggest 1–2 concrete actions the user could take.
+
+Respond in 3–5 concise sentences.
+"""
+
+
+def legacy_chat_prompt(summary: str, message: str, context) -> str:
+    return f"""
+You are an AI assistant helping a user understand analytics for a shortened URL.
+
+Analytics summary:
+{summary}
+
+User context: {context or "general"}
+User question: {message}
+
+Answer clearly and concretely. Refer to the data patterns when possible. Keep it under 8 sentences.
+"""
+
+
+def _cl100k():
+    """tiktoken's cl100k encoder, or None when it (or its encoding file) is unavailable"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def _prompts(summary: str, legacy: bool) -> dict:
+    from src import analytics
+
+    if legacy:
+        return {
+            "insight": legacy_insight_prompt(summary),
+            "graph": legacy_graph_insight_prompt(GRAPH_TYPE, summary),
+            "chat": legacy_chat_prompt(summary, CHAT_MESSAGE, None),
+        }
+    return {
+        "insight": analytics._insight_prompt(summary),
+        "graph": analytics._graph_insight_prompt(GRAPH_TYPE, summary),
+        "chat": analytics._chat_prompt(summary, CHAT_MESSAGE, None),
+    }
+
+
+async def _stream_timings(prompt: str):
+    """(seconds to the first delta, seconds to the end of the completion)"""
+    from src.analytics import MISTRAL_MODEL
+    from src.llm import get_llm_client
+
+    started = time.perf_counter()
+    first = None
+    async for _ in get_llm_client().stream_chat_completion(MISTRAL_MODEL, prompt):
+        if first is None:
+            first = time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visits", type=int, default=200_000)
+    parser.add_argument("--urls", type=int, default=200)
+    parser.add_argument("--urls-to-encode", type=int, default=20, help="most popular urls whose summaries are compared")
+    parser.add_argument("--llm", action="store_true", help="also time streamed completions of the insight prompts")
+    args = parser.parse_args()
+
+    from src.analytics import _summary_data
+
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')}")
+    seed_database(engine, args.visits, args.urls)
+    db = sessionmaker(bind=engine)()
+    inputs = [data for data in (_summary_data(db, url_id) for url_id in range(1, args.urls_to_encode + 1)) if data]
+
+    encoders = {"legacy": lambda data: legacy_summary(*data), "compact": lambda data: encode_summary(*data)}
+    cl100k = _cl100k()
+    print(f"{len(inputs)} urls, {args.visits:,} visits; tokens are local estimates" + (" / cl100k" if cl100k else ""))
+    print(f"{'':<10} {'encode':>9} {'summary':>12} {'insight':>12} {'graph':>12} {'chat':>12}")
+    rendered = {}
+    for name, encode in encoders.items():
+        started = time.perf_counter()
+        summaries = [encode(data) for data in inputs]
+        encode_ms = (time.perf_counter() - started) * 1000 / len(summaries)
+        prompts = [_prompts(summary, legacy=name == "legacy") for summary in summaries]
+        rendered[name] = prompts
+
+        def column(texts):
+            estimated = statistics.mean(estimate_tokens(text) for text in texts)
+            if cl100k is None:
+                return f"{estimated:12.0f}"
+            return f"{estimated:6.0f}/{statistics.mean(len(cl100k.encode(text)) for text in texts):<5.0f}"
+
+        print(f"{name:<10} {encode_ms:7.2f}ms {column(summaries)} "
+              + " ".join(column([prompt[kind] for prompt in prompts]) for kind in ("insight", "graph", "chat")))
+
+    if args.llm:
+        print(f"\n{'':<10} {'first token':>12} {'completion':>12}   (insight prompts, medians)")
+        for name, prompts in rendered.items():
+            timings = [asyncio.run(_stream_timings(prompt["insight"])) for prompt in prompts]
+            first = statistics.median(t[0] for t in timings if t[0] is not None)
+            print(f"{name:<10} {first * 1000:10.0f}ms {statistics.median(t[1] for t in timings) * 1000:10.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
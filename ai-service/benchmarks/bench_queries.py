@@ -0,0 +1,144 @@
+"""
+Benchmark for the analytics query layer.
+
+Seeds a database with synthetic visits, then compares the original
+per-insight query (get_basic_stats with its correlated COUNT(DISTINCT)
+subquery) against get_analytics_bundle, checking that both return the same
+totals and hourly series. Unique visitors now come from HLL sketches and top
+referrers from the heavy-hitter tables, so neither is part of the bundle.
+For the whole pipeline see benchmarks.bench_suite.
+
+Run from ai-service/:
+    python -m benchmarks.bench_queries [--visits N] [--database-url URL]
+
+Without --database-url a temporary SQLite file is used, with a DATE_TRUNC
+function registered so the legacy Postgres SQL can run for comparison.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from src.database import get_analytics_bundle
+
+# The pre-bundle query, kept verbatim as the baseline
+LEGACY_BASIC_STATS = text("""
+    SELECT
+        COUNT(*) as total_clicks,
+        (SELECT COUNT(DISTINCT visitor_ip_hash) FROM visits WHERE url_id = :url_id) as unique_visitors,
+        DATE_TRUNC('hour', clicked_at) as click_hour,
+        COUNT(*) as hourly_clicks
+    FROM visits
+    WHERE url_id = :url_id
+    GROUP BY DATE_TRUNC('hour', clicked_at)
+    ORDER BY click_hour;
+""")
+
+REFERERS = ["https://google.com", "https://t.co", "https://www.facebook.com", "https://news.ycombinator.com",
+            "https://www.reddit.com", "https://www.linkedin.com", None, ""]
+
+
+def legacy_basic_stats(db, url_id):
+    rows = db.execute(LEGACY_BASIC_STATS, {"url_id": url_id}).fetchall()
+    total_clicks = sum(row.total_clicks for row in rows)
+    return total_clicks, [{"timestamp": row.click_hour, "count": row.hourly_clicks} for row in rows]
+
+
+def _sqlite_date_trunc(unit, value):
+    return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:00:00")
+
+
+def make_engine(database_url):
+    engine = create_engine(database_url)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _register(dbapi_connection, _):
+            dbapi_connection.create_function("DATE_TRUNC", 2, _sqlite_date_trunc)
+    return engine
+
+
+def seed(engine, visits: int, urls: int, seed_value: int = 11) -> None:
+    rng = random.Random(seed_value)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS visits (
+                id INTEGER PRIMARY KEY,
+                url_id INTEGER,
+                visitor_ip_hash TEXT,
+                visitor_ip_prefix TEXT,
+                user_agent TEXT,
+                referer TEXT,
+                clicked_at TIMESTAMP
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_visits_url_id ON visits (url_id)"))
+        start = datetime(2024, 1, 1)
+        weights = [1 / (rank + 1) for rank in range(urls)]
+        rows = [
+            {
+                "url_id": rng.choices(range(1, urls + 1), weights=weights)[0],
+                "visitor_ip_hash": f"ip{rng.randrange(visits // 4 + 1)}",
+                "user_agent": "Mozilla/5.0",
+                "referer": rng.choice(REFERERS),
+                "clicked_at": start + timedelta(seconds=rng.randrange(90 * 86400)),
+            }
+            for _ in range(visits)
+        ]
+        conn.execute(text("""
+            INSERT INTO visits (url_id, visitor_ip_hash, user_agent, referer, clicked_at)
+            VALUES (:url_id, :visitor_ip_hash, :user_agent, :referer, :clicked_at)
+        """), rows)
+
+
+def _median_ms(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visits", type=int, default=200_000)
+    parser.add_argument("--urls", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", help="existing database to use (seeded only when --seed is given)")
+    parser.add_argument("--seed", action="store_true", help="seed --database-url before benchmarking")
+    args = parser.parse_args()
+
+    tmpdir = None
+    database_url = args.database_url
+    if not database_url:
+        tmpdir = tempfile.mkdtemp()
+        database_url = f"sqlite:///{os.path.join(tmpdir, 'bench.sqlite3')}"
+    engine = make_engine(database_url)
+    if not args.database_url or args.seed:
+        seed(engine, args.visits, args.urls)
+
+    db = sessionmaker(bind=engine)()
+    url_id = 1  # most popular url under the Zipf weights
+    legacy = lambda: legacy_basic_stats(db, url_id)
+    bundled = lambda: get_analytics_bundle(db, url_id)
+
+    total_clicks, clicks_over_time = legacy()
+    bundle = bundled()
+    assert bundle["total_clicks"] == total_clicks
+    assert bundle["clicks_over_time"] == clicks_over_time
+
+    print(f"{engine.dialect.name}: url_id={url_id} with {total_clicks:,} visits, {len(clicks_over_time):,} hourly buckets")
+    legacy_ms = _median_ms(legacy, args.repeat)
+    bundle_ms = _median_ms(bundled, args.repeat)
+    print(f"legacy (correlated subquery)            {legacy_ms:8.1f} ms")
+    print(f"get_analytics_bundle                     {bundle_ms:8.1f} ms  ({legacy_ms / bundle_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
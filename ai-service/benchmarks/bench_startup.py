@@ -0,0 +1,74 @@
+"""
+Import-time budget for the service.
+
+Imports src.main in fresh interpreters under `python -X importtime`, with no
+DATABASE_URL or OPENROUTER_API_KEY set, and reports the median cumulative
+import time, the slowest modules, and any module that should only load on
+first use (pandas, numpy, httpx, geoip2, uvicorn). Exits non-zero when the
+median exceeds --budget-ms or a deferred module was imported, so it can gate CI.
+
+Run from ai-service/:
+    python -m benchmarks.bench_startup [--runs N] [--budget-ms MS]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+DEFERRED_MODULES = ("pandas", "numpy", "httpx", "geoip2", "uvicorn")
+
+
+def import_profile(target: str = "src.main") -> Tuple[int, Dict[str, int]]:
+    """(cumulative microseconds for target, self microseconds per module) from one fresh interpreter"""
+    env = {key: value for key, value in os.environ.items() if key not in ("DATABASE_URL", "OPENROUTER_API_KEY")}
+    env["PYTHONPATH"] = os.getcwd()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=tempfile.gettempdir(), env=env, capture_output=True, text=True, check=True,
+    )
+    total, self_times = 0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        self_times[name] = int(self_us)
+        if name == target:
+            total = int(cumulative_us)
+    return total, self_times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=900.0)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    totals: List[int] = []
+    self_times: Dict[str, List[int]] = {}
+    for _ in range(args.runs):
+        total, modules = import_profile()
+        totals.append(total)
+        for name, self_us in modules.items():
+            self_times.setdefault(name, []).append(self_us)
+
+    median_ms = statistics.median(totals) / 1000
+    print(f"import src.main: median {median_ms:.0f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    print(f"\nslowest modules (self time):")
+    slowest = sorted(self_times.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:args.top]
+    for name, samples in slowest:
+        print(f"  {name:<48} {statistics.median(samples) / 1000:7.1f} ms")
+
+    loaded = [module for module in DEFERRED_MODULES if module in self_times]
+    if loaded:
+        print(f"\nimported at startup but should load on first use: {', '.join(loaded)}")
+    if median_ms > args.budget_ms or loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+End-to-end benchmark suite for the analytics service.
+
+Seeds SQLite (default, a temporary file) or a local Postgres with synthetic
+visits from benchmarks.generator (10^3 to 10^7 rows), then times each stage
+(enrichment backfill, rollup refresh, analytics sources, range queries, batch
+analytics, summary builders, heavy hitters, the DuckDB copy when duckdb is
+installed) and each HTTP endpoint through the
+ASGI app. Every stage reports median/min/max wall time over --repeat runs and,
+from one extra run under tracemalloc, its peak Python allocation.
+
+Results go to a JSON file (--output) tagged with the git commit, so runs can be
+compared between commits:
+
+    python -m benchmarks.bench_suite --visits 1000000 --output before.json
+    git checkout feature && python -m benchmarks.bench_suite --visits 1000000 --compare before.json
+
+Cold stages (backfill, refresh) reset their tables before every run. The LLM
+call of the AI endpoints is replaced by an echo, so they measure everything
+but the model.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.generator import seed_database
+
+SEED_END = datetime(2024, 4, 1)  # generator default: visits cover the days before this
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable[[], object], reset: Optional[Callable[[], None]] = None, repeat: Optional[int] = None):
+        self.name = name
+        self.fn = fn
+        self.reset = reset
+        self.repeat = repeat
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run(stage: Stage, repeat: int, memory: bool) -> dict:
+    timings = []
+    for _ in range(stage.repeat or repeat):
+        if stage.reset:
+            stage.reset()
+        started = time.perf_counter()
+        stage.fn()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    result = {
+        "stage": stage.name,
+        "runs": len(timings),
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "max_ms": round(max(timings), 3),
+    }
+    if memory:
+        if stage.reset:
+            stage.reset()
+        tracemalloc.start()
+        stage.fn()
+        result["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    return result
+
+
+def _latest_visits(db, url_id: int, limit: int):
+    return db.execute(
+        text("""
+            SELECT id, url_id, visitor_ip_hash, visitor_ip_prefix, user_agent, referer, clicked_at
+            FROM visits WHERE url_id = :url_id ORDER BY clicked_at DESC LIMIT :limit
+        """),
+        {"url_id": url_id, "limit": limit},
+    ).fetchall()
+
+
+def build_stages(session_factory, client, urls: int) -> List[Stage]:
+    from src import analytics, user_agents
+    from src.analytics import _build_common_summary, enrich_visit_data, get_analytics_summary, get_batch_analytics, get_full_analytics
+    from src.enrichment import enrich_batch, ensure_enrichment_columns
+    from src.heavy_hitters import catch_up_heavy_hitters, ensure_heavy_hitter_table, top_referrers
+    from src.olap import get_olap_analytics, get_olap_summary_data, olap_store
+    from src.rollups import ensure_rollup_tables, refresh_rollups, refresh_rollups_for_urls
+    from src.sketches import ensure_sketch_table
+
+    # In memory, so closing the store empties it for the cold sync
+    olap_store.path = ":memory:"
+    db = session_factory()
+    ensure_enrichment_columns(db)
+    ensure_rollup_tables(db)
+    ensure_sketch_table(db)
+    ensure_heavy_hitter_table(db)
+
+    def execute(*statements: str) -> None:
+        for statement in statements:
+            db.execute(text(statement))
+        db.commit()
+
+    def reset_enrichment() -> None:
+        user_agents.cache_clear()
+        execute(
+            "UPDATE visits SET device_type = NULL, os = NULL, browser = NULL, referrer_host = NULL, is_bot = NULL",
+            "DELETE FROM enrichment_checkpoints WHERE name = 'visits_enrichment'",
+        )
+
+    def reset_rollups() -> None:
+        execute("DELETE FROM visit_rollups", "DELETE FROM rollup_watermarks", "DELETE FROM visitor_sketches")
+
+    def reset_heavy_hitters() -> None:
+        execute("DELETE FROM referrer_heavy_hitters", "DELETE FROM enrichment_checkpoints WHERE name = 'referrer_heavy_hitters'")
+
+    def backfill() -> None:
+        while enrich_batch(db):
+            pass
+
+    top_url = 1  # most popular under the generator's Zipf weights
+    top_urls = list(range(1, min(urls, 100) + 1))
+    month = (SEED_END - timedelta(days=30), SEED_END)
+    afternoon = (SEED_END - timedelta(days=1, hours=9, minutes=30), SEED_END - timedelta(hours=7))
+    window_params = {"from": month[0].isoformat(), "to": month[1].isoformat(), "bucket": "day"}
+
+    # Everything but the model call
+    analytics._call_mistral = lambda prompt, *args, **kwargs: _echo(prompt)
+
+    def summary_from_duckdb() -> str:
+        analytics.ANALYTICS_SOURCE = "duckdb"
+        try:
+            return _build_common_summary(top_url, db)
+        finally:
+            analytics.ANALYTICS_SOURCE = "rollups"
+
+    # ANALYTICS_SOURCE=duckdb: the cold sync copies every visit (an in-memory store starts empty again once closed)
+    olap = [
+        Stage("olap.sync[cold]", lambda: olap_store.sync(db), reset=olap_store.close, repeat=1),
+        Stage("olap.sync[warm]", lambda: olap_store.sync(db)),
+        Stage("analytics.full[duckdb]", lambda: get_full_analytics(top_url, db, source="duckdb")),
+        Stage("analytics.full[duckdb, exclude_bots]", lambda: get_full_analytics(top_url, db, source="duckdb", exclude_bots=True)),
+        Stage("analytics.range[30 days, day, duckdb]", lambda: get_olap_analytics(db, top_url, month[0], month[1], "day")),
+        Stage("analytics.range[unaligned, minute, duckdb]", lambda: get_olap_analytics(db, top_url, afternoon[0], afternoon[1], "minute")),
+        Stage(f"analytics.batch[{len(top_urls)} urls, duckdb]", lambda: get_batch_analytics(top_urls, db, source="duckdb")),
+        Stage("summary.data[duckdb]", lambda: get_olap_summary_data(db, top_url)),
+        Stage("summary.build[duckdb]", summary_from_duckdb),
+    ] if importlib.util.find_spec("duckdb") else []
+
+    return [
+        Stage("enrichment.backfill", backfill, reset=reset_enrichment, repeat=1),
+        Stage("rollups.refresh[top url, cold]", lambda: refresh_rollups(db, top_url), reset=reset_rollups, repeat=1),
+        Stage(f"rollups.refresh[{len(top_urls)} urls, cold]", lambda: refresh_rollups_for_urls(db, top_urls), reset=reset_rollups, repeat=1),
+        Stage("rollups.refresh[warm]", lambda: refresh_rollups_for_urls(db, top_urls)),
+        Stage("analytics.full[rollups]", lambda: get_full_analytics(top_url, db, source="rollups")),
+        Stage("analytics.full[stream]", lambda: get_full_analytics(top_url, db, source="stream")),
+        Stage("analytics.full[exclude_bots]", lambda: get_full_analytics(top_url, db, exclude_bots=True)),
+        Stage("analytics.range[30 days, day]", lambda: get_full_analytics(top_url, db, start=month[0], end=month[1], bucket="day")),
+        Stage("analytics.range[unaligned, minute]", lambda: get_full_analytics(top_url, db, start=afternoon[0], end=afternoon[1], bucket="minute")),
+        Stage(f"analytics.batch[{len(top_urls)} urls]", lambda: get_batch_analytics(top_urls, db)),
+        Stage("enrich_visit_data[1000 visits]", lambda: enrich_visit_data(_latest_visits(db, top_url, 1000))),
+        Stage("summary.build", lambda: _build_common_summary(top_url, db)),
+        Stage("summary.cached", lambda: get_analytics_summary(top_url, db)),
+        Stage("heavy_hitters.catch_up[cold]", lambda: catch_up_heavy_hitters(db), reset=reset_heavy_hitters, repeat=1),
+        Stage("heavy_hitters.top[global]", lambda: top_referrers(db)),
+        Stage("GET /analytics/{url_id}", lambda: _ok(client.get(f"/analytics/{top_url}"))),
+        Stage("GET /analytics/{url_id}?from&to&bucket", lambda: _ok(client.get(f"/analytics/{top_url}", params=window_params))),
+        Stage("GET /analytics/{url_id}?exclude_bots", lambda: _ok(client.get(f"/analytics/{top_url}", params={"exclude_bots": "true"}))),
+        Stage("POST /analytics/batch", lambda: _ok(client.post("/analytics/batch", json={"url_ids": top_urls}))),
+        Stage("GET /analytics/referrers/top", lambda: _ok(client.get("/analytics/referrers/top"))),
+        Stage("GET /analytics/{url_id}/export[csv]", lambda: _ok(client.get(f"/analytics/{top_url}/export"))),
+        Stage("POST /ai/insight", lambda: _ok(client.post("/ai/insight", json={"url_id": top_url, "bypass_cache": True}))),
+        Stage("POST /ai/chat", lambda: _ok(client.post("/ai/chat", json={"url_id": top_url, "message": "Who visits?", "bypass_cache": True}))),
+    ] + olap
+
+
+async def _echo(prompt: str) -> str:
+    return prompt
+
+
+def _ok(response):
+    response.raise_for_status()
+    return response
+
+
+def compare(results: List[dict], baseline_path: str, threshold: float) -> List[str]:
+    """Prints each stage against the baseline file; returns the stages slower than threshold x"""
+    with open(baseline_path) as handle:
+        baseline = {entry["stage"]: entry for entry in json.load(handle)["results"]}
+    regressions = []
+    print(f"\n{'stage':<44} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for entry in results:
+        before = baseline.get(entry["stage"])
+        if before is None or before["median_ms"] == 0:
+            continue
+        ratio = entry["median_ms"] / before["median_ms"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{entry['stage']:<44} {before['median_ms']:>8.1f}ms {entry['median_ms']:>8.1f}ms {ratio:>6.2f}x{flag}")
+        if flag:
+            regressions.append(entry["stage"])
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visits", type=int, default=100_000, help="rows to seed (10^3 to 10^7)")
+    parser.add_argument("--urls", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", help="existing database to use (seeded only when --seed is given)")
+    parser.add_argument("--seed", action="store_true", help="seed --database-url before benchmarking")
+    parser.add_argument("--stages", help="comma-separated stage name prefixes to run")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run of each stage")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')}"
+    # The service modules read their config at import time
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    os.environ.setdefault("ENRICHMENT_WORKER", "0")
+    os.environ.setdefault("TOPK_WORKER", "0")
+
+    engine = create_engine(database_url)
+    results = []
+    if not args.database_url or args.seed:
+        started = time.perf_counter()
+        written = seed_database(engine, args.visits, args.urls)
+        elapsed = time.perf_counter() - started
+        results.append({"stage": "seed", "runs": 1, "median_ms": round(elapsed * 1000, 3), "rows": written})
+        print(f"seeded {written:,} visits in {elapsed:.1f}s")
+
+    from fastapi.testclient import TestClient
+    from src.database import get_db, get_read_db
+    from src.main import app
+
+    session_factory = sessionmaker(bind=engine)
+
+    def bench_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = bench_db
+    app.dependency_overrides[get_read_db] = bench_db
+    stages = build_stages(session_factory, TestClient(app), args.urls)
+    if args.stages:
+        prefixes = tuple(prefix.strip() for prefix in args.stages.split(","))
+        stages = [stage for stage in stages if stage.name.startswith(prefixes)]
+
+    print(f"\n{'stage':<44} {'median':>10} {'min':>10} {'peak':>12}")
+    for stage in stages:
+        entry = _run(stage, args.repeat, memory=not args.no_memory)
+        results.append(entry)
+        peak = f"{entry['peak_kib']:,.0f} KiB" if "peak_kib" in entry else ""
+        print(f"{entry['stage']:<44} {entry['median_ms']:>8.1f}ms {entry['min_ms']:>8.1f}ms {peak:>12}")
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "dialect": engine.dialect.name,
+            "visits": args.visits,
+            "urls": args.urls,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            # ru_maxrss is KiB on Linux, bytes on macOS
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"\nresults written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(f"{len(regressions)} stage(s) regressed beyond {args.threshold}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Micro-benchmark for user-agent classification.
+
+Compares the original substring-chain parser with the token-table matcher,
+the memoized classifier and the distinct-value batch API on a Zipf-like
+mix of real browser, mobile and crawler UAs. Uncached, the matcher is slower
+than the legacy chain (it tests every token and the bot signatures); the
+speedups come from classifying each distinct UA once. Then times bot detection against
+a large signature set (the built-ins padded with synthetic crawler names, or
+a file with one signature per line): naive per-signature search versus the
+single-pass trie regex, uncached and over distinct-value batches. The batch
+rate is mostly dict hits over the few hundred distinct UAs in the column; the
+uncached rate is what matching itself sustains.
+
+Run from ai-service/:  python -m benchmarks.bench_user_agents [--visits N] [--signatures N | --signature-file PATH]
+"""
+import argparse
+import random
+import string
+import time
+
+from src import user_agents
+
+BASE_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_{v} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.6099.144 Mobile Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.{v} Safari/605.1.15",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36 Edg/{v}.0.2210.91",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36 OPR/{v}.0.0.0",
+    "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+    "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)",
+    "Twitterbot/1.0",
+    "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)",
+]
+
+
+def legacy_parse_user_agent(user_agent_string):
+    if not user_agent_string:
+        return {"device_type": None, "os": None, "browser": None}
+    ua = user_agent_string.lower()
+    device_type = "Desktop"
+    os_info = "Unknown OS"
+    browser_info = "Unknown Browser"
+    if "mobile" in ua or "android" in ua or "iphone" in ua or "ipad" in ua:
+        device_type = "Mobile/Tablet"
+    if "windows" in ua:
+        os_info = "Windows"
+    elif "macintosh" in ua or "mac os x" in ua:
+        os_info = "macOS"
+    elif "android" in ua:
+        os_info = "Android"
+    elif "iphone" in ua or "ipad" in ua or "ios" in ua:
+        os_info = "iOS"
+    elif "linux" in ua:
+        os_info = "Linux"
+    if "chrome" in ua and "chromium" not in ua and "edg" not in ua:
+        browser_info = "Chrome"
+    elif "firefox" in ua:
+        browser_info = "Firefox"
+    elif "safari" in ua and "chrome" not in ua:
+        browser_info = "Safari"
+    elif "edg" in ua:
+        browser_info = "Edge"
+    elif "opera" in ua or "opr" in ua:
+        browser_info = "Opera"
+    elif "bot" in ua or "crawler" in ua or "spider" in ua:
+        browser_info = "Bot/Crawler"
+    return {"device_type": device_type, "os": os_info, "browser": browser_info}
+
+
+def generate_user_agents(n: int, seed: int = 7) -> list:
+    """Zipf-weighted over UA families, with a long tail of version variants"""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(len(BASE_USER_AGENTS))]
+    families = rng.choices(BASE_USER_AGENTS, weights=weights, k=n)
+    return [family.format(v=100 + min(int(rng.paretovariate(2.0)), 30)) for family in families]
+
+
+def synthetic_signatures(n: int, seed: int = 11) -> list:
+    """Built-in signatures padded with made-up crawler names up to n entries"""
+    rng = random.Random(seed)
+    signatures = list(user_agents.BOT_SIGNATURES)
+    suffixes = ["bot", "-crawler", "spider", "fetcher", "/"]
+    while len(signatures) < n:
+        name = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+        signatures.append(name + rng.choice(suffixes))
+    return signatures
+
+
+def _time(label: str, fn, n: int) -> float:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed * 1000:9.1f} ms  {n / elapsed:12,.0f} UAs/s")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visits", type=int, default=200_000)
+    parser.add_argument("--signatures", type=int, default=3_000)
+    parser.add_argument("--signature-file")
+    args = parser.parse_args()
+
+    column = generate_user_agents(args.visits)
+    print(f"{args.visits:,} visits, {len(set(column)):,} distinct user agents\n")
+
+    uncached = user_agents.classify_user_agent.__wrapped__
+    baseline = _time("legacy substring chain (per row)", lambda: [legacy_parse_user_agent(ua) for ua in column], args.visits)
+    unmemoized = _time("token-table matcher, uncached", lambda: [uncached(ua) for ua in column], args.visits)
+    user_agents.cache_clear()
+    cached = _time("memoized classifier (per row)", lambda: [user_agents.classify_user_agent(ua) for ua in column], args.visits)
+    user_agents.cache_clear()
+    batch = _time("batch over distinct values", lambda: user_agents.classify_distinct(column), args.visits)
+
+    # The matcher alone does more work per string than the legacy chain; the gain is the memoization
+    print(f"\nvs legacy: uncached {unmemoized / baseline:.1f}x slower, memoized {baseline / cached:.1f}x faster, "
+          f"batch {baseline / batch:.1f}x faster")
+
+    signatures = user_agents.load_bot_signatures(args.signature_file) if args.signature_file else synthetic_signatures(args.signatures)
+    user_agents.set_bot_signatures(signatures)
+    distinct = list(set(column))
+    print(f"\nbot detection: {len(set(signatures)):,} signatures, {len(distinct):,} distinct user agents\n")
+    sample = distinct[:1000]
+    lowered = [ua.lower() for ua in sample]
+    _time("naive search per signature", lambda: [any(s in ua for s in signatures) for ua in lowered], len(sample))
+    uncached_bot = user_agents.is_bot_user_agent.__wrapped__
+    matching = _time("trie regex, uncached (distinct)", lambda: [uncached_bot(ua) for ua in distinct], len(distinct))
+    user_agents.cache_clear()
+    bots = _time("batch over distinct values (rows)", lambda: _flag_bots(column), args.visits)
+    print(f"\nmatching: {len(distinct) / matching:,.0f} UAs/s uncached; batches: {args.visits / bots:,.0f} UAs/s, "
+          f"which are dict hits over {len(distinct):,} distinct UAs, not matching speed")
+    user_agents.set_bot_signatures(user_agents.load_bot_signatures())
+
+
+def _flag_bots(column: list) -> list:
+    """The batch pattern the enrichment path uses: one check per distinct value, mapped back"""
+    table = {ua: user_agents.is_bot_user_agent(ua) for ua in set(column)}
+    return [table[ua] for ua in column]
+
+
+if __name__ == "__main__":
+    main()
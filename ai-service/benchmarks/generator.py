@@ -0,0 +1,209 @@
+"""
+Synthetic visit generator for the benchmarks.
+
+Visits follow what the production tables look like: Zipfian url popularity,
+a weighted mix of real browser/mobile/crawler user agents and referrers (a
+few big sources plus a long tail), repeat visitors, and diurnal timestamps
+(quiet nights, evening peak, quieter weekends). Rows come out in time order,
+chunk by chunk, so 10^7 visits never sit in memory at once.
+
+Used by bench_suite; can also seed a database on its own:
+    python -m benchmarks.generator --visits 1000000 --database-url postgresql://...
+"""
+import argparse
+import csv
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+# (template, weight); {v}/{m} are filled with major/minor versions
+USER_AGENT_FAMILIES = [
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36", 30),
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_{m} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.{m} Mobile/15E148 Safari/604.1", 18),
+    ("Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.6099.144 Mobile Safari/537.36", 16),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.{m} Safari/605.1.15", 8),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36 Edg/{v}.0.2210.91", 6),
+    ("Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0", 4),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36 OPR/{v}.0.0.0", 1),
+    ("Mozilla/5.0 (iPad; CPU OS 16_{m} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/{v}.0 Mobile/15E148 Safari/604.1", 2),
+    # crawlers and link previews, ~10% of traffic
+    ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", 2),
+    ("Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm) Chrome/{v}.0 Safari/537.36", 1),
+    ("facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)", 2),
+    ("Twitterbot/1.0", 1),
+    ("Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)", 1),
+    ("Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)", 1),
+    ("curl/8.{m}.0", 1),
+    ("python-requests/2.3{m}.0", 1),
+]
+
+# (referer, weight); None is a direct visit
+REFERRERS = [
+    (None, 35), ("https://www.google.com/", 18), ("https://t.co/", 8), ("https://www.facebook.com/", 6),
+    ("https://l.instagram.com/", 4), ("https://www.linkedin.com/", 4), ("https://www.reddit.com/", 3),
+    ("https://news.ycombinator.com/", 2), ("https://www.bing.com/", 2), ("https://duckduckgo.com/", 1),
+    ("android-app://com.slack", 1), ("", 1),
+]
+LONG_TAIL_REFERRERS = 2000  # blogs and newsletters, Zipf-weighted, sharing LONG_TAIL_SHARE of traffic
+LONG_TAIL_SHARE = 0.15
+
+# Relative traffic per UTC hour: trough around 04:00, peak around 20:00
+HOURLY_WEIGHTS = [3, 2, 1.5, 1, 1, 1.5, 3, 5, 7, 8, 8, 8.5, 9, 9, 8.5, 8.5, 9, 10, 11, 12, 12.5, 11, 8, 5]
+WEEKEND_FACTOR = 0.7
+
+COLUMNS = ("url_id", "visitor_ip_hash", "visitor_ip_prefix", "user_agent", "referer", "clicked_at")
+
+
+def _zipf_weights(n: int, s: float) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def user_agent_pool() -> Tuple[List[str], np.ndarray]:
+    """Every family rendered with a spread of versions; the newest versions are the most common"""
+    pool, weights = [], []
+    for template, weight in USER_AGENT_FAMILIES:
+        variants = sorted({template.format(v=115 + i, m=i) for i in range(8)})
+        version_weights = _zipf_weights(len(variants), 1.2) * weight
+        pool.extend(variants)
+        weights.extend(version_weights)
+    weights = np.array(weights)
+    return pool, weights / weights.sum()
+
+
+def referrer_pool() -> Tuple[List[str], np.ndarray]:
+    pool = [referer for referer, _ in REFERRERS]
+    head = np.array([weight for _, weight in REFERRERS], dtype=float)
+    head = head / head.sum() * (1 - LONG_TAIL_SHARE)
+    pool.extend(f"https://blog{i}.example.com/posts/{i * 7 % 97}" for i in range(LONG_TAIL_REFERRERS))
+    tail = _zipf_weights(LONG_TAIL_REFERRERS, 1.0) * LONG_TAIL_SHARE
+    return pool, np.concatenate([head, tail])
+
+
+def generate_visits(
+    visits: int, urls: int, days: int = 90, end: datetime = datetime(2024, 4, 1),
+    chunk_size: int = 100_000, seed: int = 11,
+) -> Iterator[List[tuple]]:
+    """
+    Yields chunks of row tuples (see COLUMNS) in clicked_at order. url ids run
+    1..urls with Zipf(1.1) popularity; each url has its own returning visitors.
+    """
+    rng = np.random.default_rng(seed)
+    start = end - timedelta(days=days)
+    ua_pool, ua_weights = user_agent_pool()
+    referer_values, referer_weights = referrer_pool()
+    url_weights = _zipf_weights(urls, 1.1)
+    hour_weights = np.array(HOURLY_WEIGHTS) / sum(HOURLY_WEIGHTS)
+
+    day_weights = np.array([
+        WEEKEND_FACTOR if (start + timedelta(days=day)).weekday() >= 5 else 1.0 for day in range(days)
+    ])
+    per_day = rng.multinomial(visits, day_weights / day_weights.sum())
+
+    pending: List[tuple] = []
+    for day, count in enumerate(per_day):
+        if count == 0:
+            continue
+        url_ids = rng.choice(urls, size=count, p=url_weights) + 1
+        seconds = np.sort(rng.choice(24, size=count, p=hour_weights) * 3600 + rng.integers(0, 3600, size=count))
+        # Roughly three visits per visitor; a url's visitors come back across days
+        visitors = url_ids * 1_000_003 + (rng.pareto(1.5, size=count) * 50).astype(np.int64) % max(visits // urls // 3, 1)
+        user_agents = rng.choice(len(ua_pool), size=count, p=ua_weights)
+        referers = rng.choice(len(referer_values), size=count, p=referer_weights)
+        day_start = start + timedelta(days=day)
+        for url_id, second, visitor, ua, referer in zip(
+            url_ids.tolist(), seconds.tolist(), visitors.tolist(), user_agents.tolist(), referers.tolist(),
+        ):
+            pending.append((
+                url_id,
+                f"{visitor:064x}",
+                f"{visitor >> 16 & 255}.{visitor >> 8 & 255}.{visitor & 255}.0",
+                ua_pool[ua],
+                referer_values[referer],
+                day_start + timedelta(seconds=second),
+            ))
+            if len(pending) == chunk_size:
+                yield pending
+                pending = []
+    if pending:
+        yield pending
+
+
+def create_schema(engine) -> None:
+    """The visits table as the Node server creates and migrates it, plus the url_id index the AI service relies on"""
+    postgres = engine.dialect.name == "postgresql"
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS visits (
+                id {"SERIAL" if postgres else "INTEGER"} PRIMARY KEY,
+                url_id INTEGER,
+                visitor_ip_hash VARCHAR(64),
+                visitor_ip_prefix VARCHAR(45),
+                user_agent TEXT,
+                referer TEXT,
+                clicked_at {"TIMESTAMP WITH TIME ZONE" if postgres else "TIMESTAMP"} DEFAULT CURRENT_TIMESTAMP,
+                device_type VARCHAR(32),
+                os VARCHAR(32),
+                browser VARCHAR(32),
+                referrer_host VARCHAR(255),
+                is_bot BOOLEAN
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_visits_url_id ON visits (url_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_visits_unenriched ON visits (url_id, id) WHERE is_bot IS NULL"))
+
+
+def _copy_chunk(engine, rows: List[tuple]) -> None:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([value if value is not None else r"\N" for value in row[:-1]] + [f"{row[-1].isoformat()}+00:00"])
+    buffer.seek(0)
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY visits ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def seed_database(engine, visits: int, urls: int, days: int = 90, chunk_size: int = 100_000, seed: int = 11) -> int:
+    """Creates the schema and inserts the generated visits (COPY on Postgres); returns rows written"""
+    create_schema(engine)
+    written = 0
+    insert = text(f"INSERT INTO visits ({', '.join(COLUMNS)}) VALUES ({', '.join(':' + column for column in COLUMNS)})")
+    for rows in generate_visits(visits, urls, days=days, chunk_size=chunk_size, seed=seed):
+        if engine.dialect.name == "postgresql":
+            _copy_chunk(engine, rows)
+        else:
+            with engine.begin() as conn:
+                conn.execute(insert, [dict(zip(COLUMNS, row)) for row in rows])
+        written += len(rows)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visits", type=int, default=100_000)
+    parser.add_argument("--urls", type=int, default=1_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--database-url", help="defaults to a SQLite file in a temporary directory")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'visits.sqlite3')}"
+    engine = create_engine(database_url)
+    started = time.perf_counter()
+    written = seed_database(engine, args.visits, args.urls, days=args.days, seed=args.seed)
+    print(f"seeded {written:,} visits into {database_url} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
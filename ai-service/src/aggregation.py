@@ -0,0 +1,109 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional
+import os
+import pandas as pd
+
+from .database import stream_visits, stream_visits_for_urls
+from .frames import visits_to_frame
+from .geo import GEO_BREAKDOWN_LIMIT, geo_breakdown
+from .hll import HyperLogLog
+from .metrics import timed
+from .sketches import attach_unique_visitors
+
+# Config
+AGGREGATION_CHUNK_SIZE = int(os.getenv("AGGREGATION_CHUNK_SIZE", "5000"))
+
+class VisitAggregator:
+    """
+    Running counters over a url's full visit history.
+
+    Chunks of raw visits are folded in one at a time and then dropped, so peak
+    memory depends on the chunk size and the number of distinct values
+    (devices, dates, referrers...), not on how many visits exist.
+    """
+
+    def __init__(self):
+        self.total_clicks = 0
+        self.by_date = Counter()
+        self.by_hour = Counter()
+        self.device = Counter()
+        self.browser = Counter()
+        self.os = Counter()
+        self.referrer = Counter()
+        self.geo = Counter()
+        self.visitors = HyperLogLog()
+        self.day_visitors: Dict[datetime, HyperLogLog] = {}
+
+    @timed("aggregate")
+    def fold(self, frame: pd.DataFrame) -> None:
+        if frame.empty:
+            return
+        self.total_clicks += len(frame)
+        self.by_date.update(_counts(frame["clicked_at"].dt.strftime("%Y-%m-%d")))
+        self.by_hour.update(_counts(frame["clicked_at"].dt.hour))
+        self.device.update(_counts(frame["device_type"]))
+        self.browser.update(_counts(frame["browser"]))
+        self.os.update(_counts(frame["os"]))
+        self.referrer.update(_counts(frame["referer"].astype(object).fillna("Direct")))
+        self.geo.update(_counts(frame["location"]))
+
+        # Visitors are only sketched, so memory stays bounded by days, not visitors
+        visitors = frame[["clicked_at", "visitor_ip_hash"]].dropna()
+        for day, hashes in visitors["visitor_ip_hash"].groupby(visitors["clicked_at"].dt.floor("D")):
+            hashed = HyperLogLog.hash_values(hashes.unique())
+            self.visitors.add_hashes(hashed)
+            self.day_visitors.setdefault(day.to_pydatetime(), HyperLogLog()).add_hashes(hashed)
+
+    def to_analytics(self) -> dict:
+        """Same shape as get_full_analytics."""
+        def ranked(counter: Counter, key: str, limit: Optional[int] = None) -> List[dict]:
+            items = sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+            return [{key: value, "count": count} for value, count in items[:limit]]
+
+        result = {
+            "total_clicks": self.total_clicks,
+            "clicks_over_time": [{"date": date, "count": count} for date, count in sorted(self.by_date.items())],
+            "device_breakdown": ranked(self.device, "device"),
+            "browser_breakdown": ranked(self.browser, "browser"),
+            "os_breakdown": ranked(self.os, "os"),
+            "referrer_breakdown": ranked(self.referrer, "referrer", limit=10),
+            "geo_breakdown": geo_breakdown(self.geo, limit=GEO_BREAKDOWN_LIMIT),
+            "hourly_pattern": [{"hour": int(hour), "count": count} for hour, count in sorted(self.by_hour.items())],
+        }
+        return attach_unique_visitors(result, self.day_visitors)
+
+def _counts(column: pd.Series) -> dict:
+    # observed-only counts as plain ints (categoricals otherwise report zero rows)
+    return {value: int(count) for value, count in column.value_counts().items() if count}
+
+def aggregate_visits(
+    db: Session, url_id: int, chunk_size: int = AGGREGATION_CHUNK_SIZE,
+    start: Optional[datetime] = None, end: Optional[datetime] = None, exclude_bots: bool = False,
+) -> VisitAggregator:
+    """
+    Streams every visit for the url (optionally only those in [start, end), and
+    without bots) in chunk_size batches and folds each one into a VisitAggregator.
+    No row limit and no SQL-side aggregation.
+    """
+    aggregator = VisitAggregator()
+    for chunk in stream_visits(db, url_id, chunk_size=chunk_size, start=start, end=end, exclude_bots=exclude_bots):
+        aggregator.fold(visits_to_frame(chunk))
+    return aggregator
+
+def aggregate_visits_for_urls(
+    db: Session, url_ids: Iterable[int], chunk_size: int = AGGREGATION_CHUNK_SIZE
+) -> Dict[int, VisitAggregator]:
+    """
+    Like aggregate_visits, but for many urls through a single cursor; each chunk
+    is classified once and split by url_id.
+    """
+    aggregators = {url_id: VisitAggregator() for url_id in url_ids}
+    if not aggregators:
+        return aggregators
+    for chunk in stream_visits_for_urls(db, aggregators, chunk_size=chunk_size):
+        frame = visits_to_frame(chunk)
+        for url_id, group in frame.groupby("url_id", sort=False):
+            aggregators[int(url_id)].fold(group)
+    return aggregators
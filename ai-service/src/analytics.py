@@ -1,86 +1,82 @@
 from fastapi import HTTPException, Depends
 from sqlalchemy.orm import Session
-import requests
-import pandas as pd
-import geoip2.database
+from starlette.concurrency import run_in_threadpool
+import logging
 import os
+from collections import Counter
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-
-from .database import get_db, get_raw_visits, get_basic_stats, get_top_referrers
+from typing import AsyncIterator, List, Dict, Any, Optional
+
+from .database import get_db, get_visits_fingerprint, primary_session, get_analytics_bundle, get_click_series, get_first_visit_time, group_visits
+from .cache import SummaryCache
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .llm_cache import LLMResponseCache
+from .llm import LLMError, get_llm_client
+from .metrics import LLM_PROMPT_TOKENS, lru_stats, register_cache, timed
+from .user_agents import classify_user_agent, classify_distinct
+from .user_agents import cache_info as ua_cache_info
+from .geo import EMPTY_LOCATION, location_key, lookup_ip
+from .geo import cache_info as geo_cache_info
+from .rollups import refresh_rollups, get_rollup_analytics, refresh_rollups_for_urls, get_rollup_analytics_for_urls
+from .rollups import GRANULARITY_DAY, GRANULARITY_HOUR, _to_utc_naive, get_first_rollup_bucket, get_human_analytics, get_rollup_range_analytics, get_rollup_series, get_window_analytics
+from .heavy_hitters import DIRECT_REFERRER, top_referrers
+from .topk import HeavyHitter
+from .hll import HyperLogLog
+from .sketches import bucket_unique_visitors, count_unique_visitors, load_day_sketches
+from .timeseries import choose_bucket, format_bucket, is_aligned, merge_points
+from .summary_encoder import encode_summary, estimate_tokens
 from .models import EnrichedVisit, GeoInfo, AICreateRequest, AICreateResponse, GraphInsightRequest, GraphInsightResponse, ChatRequest, ChatResponse
 
 # Config
-GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", "./GeoLite2-City.mmdb") # Path to GeoLite2 City DB
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 MISTRAL_MODEL = "mistralai/devstral-2512:free"
-
-if not OPENROUTER_API_KEY:
-    raise ValueError("OPENROUTER_API_KEY not set in .env file")
-
-# GeoIP2 Reader (initialize once)
-try:
-    geoip_reader = geoip2.database.Reader(GEOIP_DB_PATH)
-except FileNotFoundError:
-    print(f"Warning: GeoLite2 City database not found at {GEOIP_DB_PATH}. Geolocation will be disabled.")
-    geoip_reader = None
-except Exception as e:
-    print(f"Warning: Error loading GeoIP database: {e}. Geolocation will be disabled.")
-    geoip_reader = None
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1024"))
+SUMMARY_CACHE_PROBE_INTERVAL = float(os.getenv("SUMMARY_CACHE_PROBE_INTERVAL", "5")) # seconds an entry is trusted without probing
+NO_VISITS_SUMMARY = "No visit data available."
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600")) # seconds, 0 = no expiry
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") # optional SQLite file for a restart-proof tier
+ANALYTICS_MAX_POINTS = int(os.getenv("ANALYTICS_MAX_POINTS", "500")) # time series longer than this are downsampled
+ANALYTICS_SOURCE = os.getenv("ANALYTICS_SOURCE", "rollups") # "rollups", "stream" (chunked full-history scan) or "duckdb" (see olap.py)
+
+summary_cache = SummaryCache(maxsize=SUMMARY_CACHE_SIZE, probe_interval=SUMMARY_CACHE_PROBE_INTERVAL)
+llm_cache = LLMResponseCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL, path=LLM_CACHE_PATH)
+
+# Concurrent identical requests (a shared dashboard, a page loading several charts at once) share one computation
+analytics_flight = SingleFlight("analytics")
+summary_flight = SingleFlight("summary")
+llm_flight = AsyncSingleFlight("llm")
+
+# Hit ratios on /metrics
+register_cache("summary", summary_cache.stats)
+register_cache("llm", llm_cache.stats)
+register_cache("user_agent", lambda: lru_stats(ua_cache_info()))
+register_cache("geoip", lambda: lru_stats(geo_cache_info()))
+
+logger = logging.getLogger(__name__)
 
 # Helper functions
 
 def parse_user_agent(user_agent_string: Optional[str]) -> Dict[str, Optional[str]]:
-    if not user_agent_string:
-        return {"device_type": None, "os": None, "browser": None}
-
-    ua = user_agent_string.lower()
-    device_type = "Desktop"
-    os_info = "Unknown OS"
-    browser_info = "Unknown Browser"
-
-    if "mobile" in ua or "android" in ua or "iphone" in ua or "ipad" in ua:
-        device_type = "Mobile/Tablet"
-    if "windows" in ua:
-        os_info = "Windows"
-    elif "macintosh" in ua or "mac os x" in ua:
-        os_info = "macOS"
-    elif "android" in ua:
-        os_info = "Android"
-    elif "iphone" in ua or "ipad" in ua or "ios" in ua:
-        os_info = "iOS"
-    elif "linux" in ua:
-        os_info = "Linux"
-
-    if "chrome" in ua and "chromium" not in ua and "edg" not in ua: # Simple Chrome check
-        browser_info = "Chrome"
-    elif "firefox" in ua:
-        browser_info = "Firefox"
-    elif "safari" in ua and "chrome" not in ua: # Safari check, careful of Chrome on iOS
-        browser_info = "Safari"
-    elif "edg" in ua:
-        browser_info = "Edge"
-    elif "opera" in ua or "opr" in ua:
-        browser_info = "Opera"
-    elif "bot" in ua or "crawler" in ua or "spider" in ua:
-        browser_info = "Bot/Crawler" # Special case
-
-    return {"device_type": device_type, "os": os_info, "browser": browser_info}
-
-def get_geolocation(ip_address_hash: Optional[str]) -> Optional[GeoInfo]:
-    if not geoip_reader or not ip_address_hash:
+    return classify_user_agent(user_agent_string)._asdict()
+
+def get_geolocation(ip_prefix: Optional[str]) -> Optional[GeoInfo]:
+    location = lookup_ip(ip_prefix)
+    if location == EMPTY_LOCATION:
         return None
-    
-    # TODO
-    
-    return None
+    return GeoInfo(**location._asdict())
 
+@timed("enrich")
 def enrich_visit_data(raw_visits: List[Any]) -> List[EnrichedVisit]:
+    """
+    Object-per-visit enrichment, for API surfaces that need EnrichedVisit models.
+    Aggregation paths should use visits_to_frame instead.
+    """
+    ua_table = classify_distinct(visit.user_agent for visit in raw_visits)
     enriched_data = []
     for visit in raw_visits:
-        ua_parsed = parse_user_agent(visit.user_agent)
-        geo_info = get_geolocation(visit.visitor_ip_hash) 
+        ua_parsed = ua_table[visit.user_agent]._asdict()
+        # Only the anonymized prefix can be located; the hash is one-way
+        geo_info = get_geolocation(getattr(visit, "visitor_ip_prefix", None))
 
         enriched_visit = EnrichedVisit(
             id=visit.id,
@@ -89,259 +85,360 @@ def enrich_visit_data(raw_visits: List[Any]) -> List[EnrichedVisit]:
             device_type=ua_parsed["device_type"],
             os=ua_parsed["os"],
             browser=ua_parsed["browser"],
-            referer=visit.referer,  # ← ADD THIS LINE
+            referer=visit.referer,
             geolocation=geo_info
         )
         enriched_data.append(enriched_visit)
     return enriched_data
 
-def generate_ai_insight(url_id: int, db: Session) -> str:
-    raw_visits_list = get_raw_visits(db, url_id, limit=500) # Limit raw data for performance
-    if not raw_visits_list:
+async def generate_ai_insight(url_id: int, db: Session, bypass_cache: bool = False, exclude_bots: bool = False,
+                              raise_errors: bool = False) -> str:
+    data_summary = await run_in_threadpool(get_analytics_summary, url_id, db, exclude_bots)
+    if data_summary == NO_VISITS_SUMMARY:
         return "No visit data available to generate insights."
 
-    enriched_visits = enrich_visit_data(raw_visits_list)
-    
-    df = pd.DataFrame([visit.model_dump() for visit in enriched_visits])
-
-    total_clicks_from_db, clicks_over_time_db = get_basic_stats(db, url_id)
-    top_referrers_db = get_top_referrers(db, url_id)
-    
-    summary_parts = []
-    summary_parts.append(f"Total clicks: {total_clicks_from_db}")
-    
-    if clicks_over_time_db:
-        summary_parts.append(f"Clicks peaked between {clicks_over_time_db[0]['timestamp'].strftime('%H:%M')} and {clicks_over_time_db[-1]['timestamp'].strftime('%H:%M')} on average per hour.")
-        hourly_df = pd.DataFrame(clicks_over_time_db)
-        if not hourly_df.empty:
-            hourly_df['timestamp'] = pd.to_datetime(hourly_df['timestamp'])
-            hourly_df['day'] = hourly_df['timestamp'].dt.date
-            daily_clicks = hourly_df.groupby('day')['count'].sum()
-            if not daily_clicks.empty:
-                most_active_day = daily_clicks.idxmax()
-                summary_parts.append(f"The most active day appears to be: {most_active_day}")
-            else:
-                summary_parts.append("No specific day pattern detected.")
-        else:
-            summary_parts.append("No specific day pattern detected.")
-
-    if top_referrers_db:
-        top_3_referrers = ", ".join([f"{r['referer']} ({r['count']} clicks)" for r in top_referrers_db[:3]])
-        summary_parts.append(f"Top referrers include: {top_3_referrers}")
-    else:
-        summary_parts.append("No referrers detected.")
-
-    if df['device_type'].nunique() > 1:
-        device_counts = df['device_type'].value_counts().to_dict()
-        summary_parts.append(f"Device usage breakdown: {device_counts}")
-    elif not df.empty:
-        summary_parts.append(f"Majority device type: {df['device_type'].iloc[0]}")
-
-    if df['os'].nunique() > 1:
-        os_counts = df['os'].value_counts().to_dict()
-        summary_parts.append(f"Operating System breakdown: {os_counts}")
-    elif not df.empty:
-        summary_parts.append(f"Majority OS: {df['os'].iloc[0]}")
-        
-    if df['browser'].nunique() > 1:
-        browser_counts = df['browser'].value_counts().to_dict()
-        summary_parts.append(f"Browser breakdown: {browser_counts}")
-    elif not df.empty:
-        summary_parts.append(f"Majority browser: {df['browser'].iloc[0]}")
-
-    summary_parts.append("Due to privacy measures (IP hashing), precise geolocation data cannot be provided in this analysis.")
-
-    data_summary = ". ".join(summary_parts)
-
-    prompt = f"""
-    Analyze the following traffic data for a shortened URL and provide a concise, actionable insight. Focus on patterns, trends, and potential implications.
-
-    **Data Summary:**
-    {data_summary}
-
-    **Task:**
-    Generate a short, natural language insight (1-3 sentences). For example: "Traffic spiked on Tuesday morning, primarily from mobile users in France using Chrome, suggesting a successful mobile campaign targeting that demographic." or "Unusual activity detected with a high volume of requests from bots between 2-4 AM."
-    """
+    return await _call_mistral(_insight_prompt(data_summary), bypass_cache=bypass_cache, raise_errors=raise_errors)
+
+def _summary_breakdowns(db: Session, url_id: int, exclude_bots: bool = False) -> Dict[str, Counter]:
+  """
+  Full-history device/OS/browser/location counts, grouped in SQL on the persisted
+  enrichment columns (IP prefixes are grouped first, then geolocated per prefix).
+  Without bots, referrer hosts are grouped here too: the heavy-hitter tables count every visit.
+  """
+  dimensions = ("device", "os", "browser", "ip_prefix") + (("referrer_host",) if exclude_bots else ())
+  breakdowns = {"device": Counter(), "os": Counter(), "browser": Counter(), "geo": Counter(), "referrer_host": Counter()}
+  for row in group_visits(db, url_id, dimensions, exclude_bots=exclude_bots):
+      if row.dimension == "ip_prefix":
+          key = location_key(lookup_ip(row.value))
+          if key is not None:
+              breakdowns["geo"][key] += row.clicks
+      elif row.value is not None:
+          breakdowns[row.dimension][row.value] += row.clicks
+  return breakdowns
+
+def _summary_unique_visitors(db: Session, url_id: int, exclude_bots: bool = False) -> int:
+  # HyperLogLog estimate from the daily (or human) sketches, kept current by refresh_rollups
+  with primary_session(db) as primary:
+      refresh_rollups(primary, url_id)
+  return HyperLogLog.union(load_day_sketches(db, [url_id], humans=exclude_bots)[url_id].values()).estimate()
+
+def _summary_data(db: Session, url_id: int, exclude_bots: bool = False):
+  """
+  (totals and hourly series, breakdown counters, unique visitors, top 3 referrer
+  hosts) from the visits table, or None when the url has no visits.
+  """
+  # Totals and hourly series in one round trip
+  bundle = get_analytics_bundle(db, url_id, exclude_bots)
+  if bundle["total_clicks"] == 0:
+      return None
+  breakdowns = _summary_breakdowns(db, url_id, exclude_bots)
+  unique_visitors = _summary_unique_visitors(db, url_id, exclude_bots)
+  if exclude_bots:
+      referrers = [HeavyHitter(host, count, 0) for host, count in breakdowns["referrer_host"].most_common(3) if host]
+  else:
+      referrers = [hitter for hitter in top_referrers(db, url_id, limit=4) if hitter.value != DIRECT_REFERRER][:3]
+  return bundle, breakdowns, unique_visitors, referrers
+
+def _olap_caught_up(db: Session) -> bool:
+  # The sync worker builds the DuckDB copy; reads only top it up by one batch
+  from .olap import olap_store
+  return olap_store.catch_up(db)
+
+@timed("summary")
+def _build_common_summary(url_id: int, db: Session, exclude_bots: bool = False) -> str:
+  """
+  The url's analytics as a compact, token-budgeted text for the LLM prompts
+  (see summary_encoder.encode_summary).
+  """
+  if ANALYTICS_SOURCE == "duckdb" and _olap_caught_up(db):
+      from .olap import get_olap_summary_data
+      data = get_olap_summary_data(db, url_id, exclude_bots, sync=False)
+  else:
+      data = _summary_data(db, url_id, exclude_bots)
+  if data is None:
+      return NO_VISITS_SUMMARY
+  return encode_summary(*data)
+
+def get_analytics_summary(url_id: int, db: Session, exclude_bots: bool = False) -> str:
+  """
+  Shared, cached summary for the insight, graph-insight and chat prompts.
+  Rebuilt only when the url's visit fingerprint changes.
+  """
+  return summary_cache.get_or_build(
+      (url_id, exclude_bots) if exclude_bots else url_id,
+      probe=lambda: get_visits_fingerprint(db, url_id),
+      build=lambda: summary_flight.do((url_id, exclude_bots), lambda: _build_common_summary(url_id, db, exclude_bots)),
+  )
 
-    # 4. Call OpenAI API (OpenRouter)
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": MISTRAL_MODEL,
-        "messages": [{"role": "user", "content": prompt}]
-    }
-
-    try:
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload)
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        
-        api_response = response.json()
-        if api_response and api_response.get("choices") and len(api_response["choices"]) > 0:
-            # Ensure we get the actual message content
-            content = api_response["choices"][0].get("message", {}).get("content")
-            return content.strip() if content else "AI returned an empty response."
-        else:
-            return "AI returned an unexpected response format."
-
-    except requests.exceptions.RequestException as e:
-        return f"Error calling AI API: {e}"
-    except Exception as e:
-        return f"An unexpected error occurred during AI processing: {e}"
-
-def _build_common_summary(url_id: int, db: Session) -> str:
+async def _call_mistral(prompt: str, bypass_cache: bool = False, raise_errors: bool = False) -> str:
   """
-  Reuse your existing logic to build a textual summary for the URL.
+  Sends the prompt to OpenRouter. Successful completions are cached by model + prompt,
+  so byte-identical prompts are answered locally unless bypass_cache is set; while one
+  is on its way upstream, identical calls (bypassing or not) wait for it instead.
+  Failures are answered as text unless raise_errors is set (the job queue retries them).
   """
-  raw_visits_list = get_raw_visits(db, url_id, limit=500)
-  if not raw_visits_list:
-      return "No visit data available."
-
-  enriched_visits = enrich_visit_data(raw_visits_list)
-  df = pd.DataFrame([visit.model_dump() for visit in enriched_visits])
-
-  total_clicks_from_db, clicks_over_time_db = get_basic_stats(db, url_id)
-  top_referrers_db = get_top_referrers(db, url_id)
-
-  summary_parts = []
-  summary_parts.append(f"Total clicks: {total_clicks_from_db}")
-
-  if clicks_over_time_db:
-      hourly_df = pd.DataFrame(clicks_over_time_db)
-      hourly_df['timestamp'] = pd.to_datetime(hourly_df['timestamp'])
-      hourly_df['day'] = hourly_df['timestamp'].dt.date
-      daily_clicks = hourly_df.groupby('day')['count'].sum()
-      if not daily_clicks.empty:
-          most_active_day = daily_clicks.idxmax()
-          summary_parts.append(f"Most active day: {most_active_day}")
-  if top_referrers_db:
-      top_3_referrers = ", ".join([f"{r['referer']} ({r['count']} clicks)" for r in top_referrers_db[:3]])
-      summary_parts.append(f"Top referrers: {top_3_referrers}")
-
-  if 'device_type' in df and not df.empty:
-      device_counts = df['device_type'].value_counts().to_dict()
-      summary_parts.append(f"Device breakdown: {device_counts}")
-  if 'os' in df and not df.empty:
-      os_counts = df['os'].value_counts().to_dict()
-      summary_parts.append(f"OS breakdown: {os_counts}")
-  if 'browser' in df and not df.empty:
-      browser_counts = df['browser'].value_counts().to_dict()
-      summary_parts.append(f"Browser breakdown: {browser_counts}")
-
-  summary_parts.append("Geolocation is unavailable because IPs are hashed for privacy.")
-  return ". ".join(summary_parts)
-
-def _call_mistral(prompt: str) -> str:
-  headers = {
-      "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-      "Content-Type": "application/json",
-  }
-  payload = {
-      "model": MISTRAL_MODEL,
-      "messages": [{"role": "user", "content": prompt}],
-  }
+  if not bypass_cache:
+      cached = llm_cache.get(MISTRAL_MODEL, prompt)
+      if cached is not None:
+          return cached
   try:
-      resp = requests.post(OPENROUTER_API_URL, headers=headers, json=payload)
-      resp.raise_for_status()
-      data = resp.json()
-      content = (
-          data.get("choices", [{}])[0]
-          .get("message", {})
-          .get("content")
-      )
-      return content.strip() if content else "AI returned an empty response."
-  except requests.RequestException as e:
-      return f"Error calling AI API: {e}"
+      return await llm_flight.do((MISTRAL_MODEL, prompt), lambda: _request_mistral(prompt))
+  except LLMError as e:
+      if raise_errors:
+          raise
+      # Still answered as text, but logged and counted in llm_requests_total{outcome="error"}
+      logger.warning(f"LLM call failed: {e}")
+      return str(e)
   except Exception as e:
+      if raise_errors:
+          raise
+      logger.error(f"Unexpected LLM error: {e}", exc_info=True)
       return f"Unexpected AI error: {e}"
 
-def generate_graph_insight(url_id: int, graph_type: str, db: Session) -> str:
-  summary = _build_common_summary(url_id, db)
-  prompt = f"""
-You are an analytics expert. A user is viewing the graph: {graph_type} for a specific shortened URL.
+async def _request_mistral(prompt: str) -> str:
+  LLM_PROMPT_TOKENS.observe(estimate_tokens(prompt))
+  content = await get_llm_client().chat_completion(MISTRAL_MODEL, prompt)
+  if not content:
+      raise LLMError("AI returned an empty response.")
+  content = content.strip()
+  llm_cache.set(MISTRAL_MODEL, prompt, content)
+  return content
 
-Overall data summary:
+async def _stream_mistral(prompt: str, bypass_cache: bool = False) -> AsyncIterator[str]:
+  """
+  Streaming counterpart of _call_mistral: yields content deltas as they arrive.
+  A cached completion is replayed as a single chunk; a completed stream is cached.
+  Raises LLMError if the upstream call fails.
+  """
+  if not bypass_cache:
+      cached = llm_cache.get(MISTRAL_MODEL, prompt)
+      if cached is not None:
+          yield cached
+          return
+
+  parts = []
+  LLM_PROMPT_TOKENS.observe(estimate_tokens(prompt))
+  async for delta in get_llm_client().stream_chat_completion(MISTRAL_MODEL, prompt):
+      parts.append(delta)
+      yield delta
+
+  content = "".join(parts).strip()
+  if content:
+      llm_cache.set(MISTRAL_MODEL, prompt, content)
+
+# Prompt templates: the summary is the only large part, so the instructions stay short.
+# Summary shares are percentages of the url's clicks.
+
+def _insight_prompt(summary: str) -> str:
+  return f"""
+Analyze this shortened URL's traffic and give one concise, actionable insight about its patterns, trends and implications.
+
+Data (shares are % of clicks):
 {summary}
 
-Task:
-1. Focus ONLY on insights relevant to the graph type "{graph_type}".
-2. Describe the pattern, anomalies, and possible causes.
-3. Suggest 1–2 concrete actions the user could take.
+Answer in 1-3 sentences, e.g. "Traffic spiked on Tuesday morning, mostly from mobile users in France, suggesting the mobile campaign worked." or "Bots made most requests between 2-4 AM."
+"""
+
+def _graph_insight_prompt(graph_type: str, summary: str) -> str:
+  return f"""
+You are an analytics expert. A user is viewing the "{graph_type}" graph of a shortened URL.
+
+Data (shares are % of clicks):
+{summary}
 
-Respond in 3–5 concise sentences.
+Covering only what is relevant to "{graph_type}": describe the pattern, anomalies and likely causes, then suggest 1-2 concrete actions. Answer in 3-5 concise sentences.
 """
-  return _call_mistral(prompt)
 
-def generate_ai_chat_response(url_id: int, message: str, context: str | None, db: Session) -> str:
-  summary = _build_common_summary(url_id, db)
-  prompt = f"""
-You are an AI assistant helping a user understand analytics for a shortened URL.
+def _chat_prompt(summary: str, message: str, context: str | None) -> str:
+  return f"""
+You help a user understand the analytics of a shortened URL.
 
-Analytics summary:
+Data (shares are % of clicks):
 {summary}
 
 User context: {context or "general"}
 User question: {message}
 
-Answer clearly and concretely. Refer to the data patterns when possible. Keep it under 8 sentences.
+Answer clearly and concretely, referring to the data where possible, in under 8 sentences.
 """
-  return _call_mistral(prompt)
 
-def get_full_analytics(url_id: int, db: Session) -> dict:
+async def generate_graph_insight(url_id: int, graph_type: str, db: Session, bypass_cache: bool = False, exclude_bots: bool = False,
+                                 raise_errors: bool = False) -> str:
+  summary = await run_in_threadpool(get_analytics_summary, url_id, db, exclude_bots)
+  return await _call_mistral(_graph_insight_prompt(graph_type, summary), bypass_cache=bypass_cache, raise_errors=raise_errors)
+
+async def stream_graph_insight(url_id: int, graph_type: str, db: Session, bypass_cache: bool = False, exclude_bots: bool = False) -> AsyncIterator[str]:
+  """
+  Builds the summary up front (while the request's session is open) and returns
+  an iterator of completion deltas.
+  """
+  summary = await run_in_threadpool(get_analytics_summary, url_id, db, exclude_bots)
+  return _stream_mistral(_graph_insight_prompt(graph_type, summary), bypass_cache=bypass_cache)
+
+async def generate_ai_chat_response(url_id: int, message: str, context: str | None, db: Session, bypass_cache: bool = False,
+                                    exclude_bots: bool = False, raise_errors: bool = False) -> str:
+  summary = await run_in_threadpool(get_analytics_summary, url_id, db, exclude_bots)
+  return await _call_mistral(_chat_prompt(summary, message, context), bypass_cache=bypass_cache, raise_errors=raise_errors)
+
+async def stream_ai_chat_response(url_id: int, message: str, context: str | None, db: Session, bypass_cache: bool = False, exclude_bots: bool = False) -> AsyncIterator[str]:
+  summary = await run_in_threadpool(get_analytics_summary, url_id, db, exclude_bots)
+  return _stream_mistral(_chat_prompt(summary, message, context), bypass_cache=bypass_cache)
+
+@timed("analytics")
+def get_full_analytics(
+    url_id: int,
+    db: Session,
+    source: str = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Optional[str] = None,
+    max_points: int = None,
+    exclude_bots: bool = False,
+) -> dict:
     """
-    Returns complete analytics with device, browser, referrer, and hourly breakdowns.
+    Returns complete analytics with device, browser, OS, referrer, and hourly breakdowns.
+
+    "rollups" (default): visits newer than the rollup watermark are folded in first, then
+    the answer is read from the rollup tables, so the cost does not grow with visit volume.
+    "stream": the full history is streamed in fixed-size chunks into running counters,
+    with no rollup tables involved.
+    "duckdb": visits are copied (incrementally) into a local columnar store and every
+    breakdown is grouped there in one scan; see olap.py. Until the copy is within
+    one batch of the visits table, the rollups answer instead.
+
+    Passing start/end/bucket restricts everything to [start, end) and buckets
+    clicks_over_time by minute/hour/day/week/month (see get_range_analytics).
+    exclude_bots leaves crawler visits out and keeps the shape it is combined
+    with (alone, the all-time daily payload). The rollups count every visit, so
+    there its breakdowns are grouped from raw visits and its unique visitors come
+    from the human sketches.
+
+    Identical calls made while one is running wait for it and get the same dict.
     """
-
-    raw_visits_list = get_raw_visits(db, url_id, limit=1000)
-    if not raw_visits_list:
-        return {
-            "total_clicks": 0,
-            "clicks_over_time": [],
-            "device_breakdown": [],
-            "browser_breakdown": [],
-            "referrer_breakdown": [],
-            "hourly_pattern": [],
-        }
-    
-    enriched_visits = enrich_visit_data(raw_visits_list)
-    df = pd.DataFrame([visit.model_dump() for visit in enriched_visits])
-    
-
-    total_clicks = len(df)
-    
-    df['clicked_at'] = pd.to_datetime(df['clicked_at'])
-    df['date'] = df['clicked_at'].dt.date
-    clicks_over_time = (
-        df.groupby('date')
-        .size()
-        .reset_index(name='count')
+    source = source or ANALYTICS_SOURCE
+    if source not in ("rollups", "stream", "duckdb"):
+        raise ValueError(f"Unknown analytics source: {source}")
+    return analytics_flight.do(
+        (url_id, source, start, end, bucket, max_points, exclude_bots),
+        lambda: _full_analytics(url_id, db, source, start, end, bucket, max_points, exclude_bots),
     )
-    clicks_over_time['date'] = clicks_over_time['date'].astype(str)
-    clicks_over_time_list = clicks_over_time.to_dict('records')
-    
-    device_counts = df['device_type'].value_counts().reset_index()
-    device_counts.columns = ['device', 'count']
-    device_breakdown = device_counts.to_dict('records')
-    
-    browser_counts = df['browser'].value_counts().reset_index()
-    browser_counts.columns = ['browser', 'count']
-    browser_breakdown = browser_counts.to_dict('records')
-    
-    df['referrer_clean'] = df['referer'].fillna('Direct')
-    referrer_counts = df['referrer_clean'].value_counts().reset_index()
-    referrer_counts.columns = ['referrer', 'count']
-    referrer_breakdown = referrer_counts.head(10).to_dict('records')
-    
-    df['hour'] = df['clicked_at'].dt.hour
-    hourly_counts = df.groupby('hour').size().reset_index(name='count')
-    hourly_pattern = hourly_counts.to_dict('records')
-    
-    return {
-        "total_clicks": total_clicks,
-        "clicks_over_time": clicks_over_time_list,
-        "device_breakdown": device_breakdown,
-        "browser_breakdown": browser_breakdown,
-        "referrer_breakdown": referrer_breakdown,
-        "hourly_pattern": hourly_pattern,
-    }
+
+def _full_analytics(
+    url_id: int,
+    db: Session,
+    source: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    bucket: Optional[str],
+    max_points: Optional[int],
+    exclude_bots: bool,
+) -> dict:
+    ranged = start is not None or end is not None or bucket is not None
+    if source == "duckdb":
+        if not _olap_caught_up(db):
+            return _full_analytics(url_id, db, "rollups", start, end, bucket, max_points, exclude_bots)
+        from .olap import get_olap_analytics
+        if ranged:
+            return get_olap_analytics(
+                db, url_id, start, end, bucket or "day", max_points or ANALYTICS_MAX_POINTS, exclude_bots, sync=False,
+            )
+        return get_olap_analytics(db, url_id, exclude_bots=exclude_bots, sync=False)
+    if ranged:
+        return get_range_analytics(
+            url_id, db, source, start, end, bucket or "day", max_points or ANALYTICS_MAX_POINTS, exclude_bots,
+        )
+    if source == "stream":
+        from .aggregation import aggregate_visits  # pandas is imported on first use
+        return aggregate_visits(db, url_id, exclude_bots=exclude_bots).to_analytics()
+    with primary_session(db) as primary:
+        refresh_rollups(primary, url_id)
+    if exclude_bots:
+        return get_human_analytics(db, url_id)
+    return get_rollup_analytics(db, url_id)
+
+def get_range_analytics(
+    url_id: int,
+    db: Session,
+    source: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    bucket: str,
+    max_points: int,
+    exclude_bots: bool = False,
+) -> dict:
+    """
+    Analytics for [start, end) with the time series truncated in SQL. The bucket is
+    coarsened until the range fits in max_points, so a yearly chart moves as few
+    rows as a daily one. Ranges aligned to whole days/hours are answered from the
+    rollups; anything finer reads raw visits.
+    """
+    start = _to_utc_naive(start) if start is not None else None
+    end = _to_utc_naive(end) if end is not None else None
+    if start is not None and end is not None and start >= end:
+        raise ValueError("'from' must be earlier than 'to'")
+
+    if source == "rollups":
+        with primary_session(db) as primary:
+            refresh_rollups(primary, url_id)
+        first = start or get_first_rollup_bucket(db, url_id)
+    else:
+        first = start or get_first_visit_time(db, url_id)
+    bucket = choose_bucket(_to_utc_naive(first) if first else datetime.utcnow(), end or datetime.utcnow(), bucket, max_points)
+
+    granularity = None
+    if source == "rollups" and bucket != "minute" and not exclude_bots:
+        if bucket != "hour" and is_aligned(start, "day") and is_aligned(end, "day"):
+            granularity = GRANULARITY_DAY
+        elif is_aligned(start, "hour") and is_aligned(end, "hour"):
+            granularity = GRANULARITY_HOUR
+
+    # Unique visitors per point need whole-day sketches, so only day and coarser buckets get them
+    day_sketches = None
+    if granularity:
+        result = get_rollup_range_analytics(db, url_id, granularity, start, end)
+        series = get_rollup_series(db, url_id, granularity, bucket, start, end)
+    elif source == "rollups":
+        result = get_window_analytics(db, url_id, start, end, exclude_bots)
+        series = get_click_series(db, url_id, bucket, start, end, exclude_bots)
+    else:
+        from .aggregation import aggregate_visits
+        aggregator = aggregate_visits(db, url_id, start=start, end=end, exclude_bots=exclude_bots)
+        result = aggregator.to_analytics()
+        series = get_click_series(db, url_id, bucket, start, end, exclude_bots)
+        day_sketches = aggregator.day_visitors
+    if source == "rollups" and is_aligned(start, "day") and is_aligned(end, "day"):
+        day_sketches = load_day_sketches(db, [url_id], start, end, humans=exclude_bots)[url_id]
+        result["unique_visitors"] = HyperLogLog.union(day_sketches.values()).estimate()
+    elif source == "rollups":
+        result["unique_visitors"] = count_unique_visitors(db, url_id, start, end, exclude_bots)
+
+    points = [{"date": format_bucket(_to_utc_naive(point["bucket"]), bucket), "count": int(point["count"])} for point in series]
+    if day_sketches is not None and bucket in ("day", "week", "month"):
+        uniques = {day.date().isoformat(): count for day, count in bucket_unique_visitors(day_sketches, bucket).items()}
+        for point in points:
+            point["unique_visitors"] = uniques.get(point["date"], 0)
+    result["clicks_over_time"] = merge_points(points, max_points)
+    result["bucket"] = bucket
+    return result
+
+@timed("analytics")
+def get_batch_analytics(url_ids: List[int], db: Session, source: str = None) -> Dict[int, dict]:
+    """
+    get_full_analytics for many urls at once, keyed by url_id, using set-based
+    queries instead of one round of queries per url.
+    """
+    url_ids = list(dict.fromkeys(url_ids))
+    source = source or ANALYTICS_SOURCE
+    if source == "stream":
+        from .aggregation import aggregate_visits_for_urls
+        return {url_id: aggregate.to_analytics() for url_id, aggregate in aggregate_visits_for_urls(db, url_ids).items()}
+    if source == "duckdb":
+        if _olap_caught_up(db):
+            from .olap import get_olap_analytics_for_urls
+            return get_olap_analytics_for_urls(db, url_ids, sync=False)
+        source = "rollups"
+    if source != "rollups":
+        raise ValueError(f"Unknown analytics source: {source}")
+    with primary_session(db) as primary:
+        refresh_rollups_for_urls(primary, url_ids)
+    return get_rollup_analytics_for_urls(db, url_ids)
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, NamedTuple, Optional, Tuple
+import time
+
+_MISSING = object()
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU mapping with hit/miss/eviction counters.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Like get, but leaves the hit/miss counters to the caller."""
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+class _SummaryEntry(NamedTuple):
+    fingerprint: Tuple
+    value: Any
+    checked_at: float
+
+class SummaryCache:
+    """
+    Per-url_id cache of analytics summaries, validated against a cheap
+    freshness probe (e.g. max visit id and count) instead of a fixed TTL.
+
+    Within probe_interval seconds of the last successful validation an entry
+    is served without probing, so bursts of calls skip the database entirely.
+    """
+
+    def __init__(self, maxsize: int, probe_interval: float = 0.0):
+        self.probe_interval = probe_interval
+        self._cache = LRUCache(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_build(self, url_id: int, probe: Callable[[], Tuple], build: Callable[[], Any]) -> Any:
+        entry: Optional[_SummaryEntry] = self._cache.peek(url_id)
+        now = time.monotonic()
+        if entry is not None and now - entry.checked_at < self.probe_interval:
+            self.hits += 1
+            return entry.value
+
+        # Probe before building: if visits land in between, the stored fingerprint
+        # is older than the summary and the next call simply rebuilds.
+        fingerprint = tuple(probe())
+        if entry is not None:
+            if entry.fingerprint == fingerprint:
+                self._cache.set(url_id, entry._replace(checked_at=now))
+                self.hits += 1
+                return entry.value
+            self.invalidations += 1
+
+        self.misses += 1
+        value = build()
+        self._cache.set(url_id, _SummaryEntry(fingerprint, value, now))
+        return value
+
+    def invalidate(self, url_id: int) -> None:
+        self._cache.pop(url_id)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self.hits = self.misses = self.invalidations = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "maxsize": self._cache.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self._cache.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
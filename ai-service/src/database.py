@@ -1,73 +1,548 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timezone
+from functools import lru_cache
+from threading import Lock
+from typing import Iterable, List, NamedTuple, Optional, Tuple
 from sqlalchemy.orm import sessionmaker, Session
+import logging
 import os
+import re
+import time
 from dotenv import load_dotenv
 
+from .enrichment import referrer_host
+from .metrics import DB_ROUTED_STATEMENTS, instrument_sqlalchemy, register_pool, timed
+from .user_agents import classify_user_agent, is_bot_user_agent
+
 load_dotenv()
+logger = logging.getLogger(__name__)
 
+# Config
 DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL not set in .env file")
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")  # optional read replica for analytics reads
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free pooled connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds before a pooled connection is replaced
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))  # seconds
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "30000"))  # ms per statement on the primary, 0 = none
+DB_REPLICA_STATEMENT_TIMEOUT = int(os.getenv("DB_REPLICA_STATEMENT_TIMEOUT", str(DB_STATEMENT_TIMEOUT)))  # ms, 0 = none
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "30"))  # seconds of replay lag before reads fall back to the primary
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))  # seconds between replica lag checks
+VISIT_SETTLE_SECONDS = float(os.getenv("VISIT_SETTLE_SECONDS", "5"))  # age before a visit is folded into id-watermark state
+
+# Session factories; bound to the engines by init_engine (the startup hook) or on
+# the first get_db, so importing this module never connects or needs DATABASE_URL.
+# SessionLocal always uses the primary; ReadSessionLocal (analytics reads) routes
+# to the replica when one is configured, see RoutingSession.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+# Time every SQL statement, on any engine, as the "db" stage
+instrument_sqlalchemy()
+
+_engine: Optional[Engine] = None
+_replica: Optional["Replica"] = None
+_engine_lock = Lock()
+
+def _engine_options(database_url: str, statement_timeout: int) -> dict:
+    """Pool and timeout settings; SQLite keeps SQLAlchemy's defaults (it has no server to time out)."""
+    backend = make_url(database_url).get_backend_name()
+    if backend == "sqlite":
+        return {}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        # Dead connections (failover, idle timeouts) are replaced on checkout instead of failing a request
+        "pool_pre_ping": True,
+    }
+    if backend == "postgresql":
+        connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT}
+        if statement_timeout:
+            # Every statement on these connections is cancelled server-side after statement_timeout ms
+            connect_args["options"] = f"-c statement_timeout={statement_timeout}"
+        options["connect_args"] = connect_args
+    return options
+
+def pool_stats(engine: Engine) -> dict:
+    """Connection pool occupancy for /metrics; empty for pools without a fixed size (SQLite)."""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    checked_out = pool.checkedout()
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    capacity = pool.size() + max_overflow if max_overflow >= 0 else 0  # -1 = unbounded overflow
+    return {
+        "checked_out": checked_out,
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "capacity": capacity,
+        "saturation": checked_out / capacity if capacity else 0.0,
+    }
+
+# Replica lag: 0 on a primary, or when every received WAL record has been replayed
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+def measure_replica_lag(engine: Engine) -> float:
+    with engine.connect() as conn:
+        if engine.dialect.name != "postgresql":
+            conn.execute(text("SELECT 1"))
+            return 0.0
+        return float(conn.execute(REPLICA_LAG_QUERY).scalar() or 0)
+
+class Replica:
+    """
+    A read replica and whether it is fit to serve reads: its lag is measured at
+    most every check_interval seconds, and a replica that lags more than max_lag
+    or cannot be reached is skipped until a later check says otherwise.
+    """
+
+    def __init__(self, engine: Engine, max_lag: float = DB_REPLICA_MAX_LAG, check_interval: float = DB_REPLICA_CHECK_INTERVAL):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag: Optional[float] = None  # None until measured, or while unreachable
+        self._checked_at = float("-inf")
+        self._lock = Lock()
+
+    def state(self) -> str:
+        """"available", "lagging" or "unavailable"."""
+        if time.monotonic() - self._checked_at >= self.check_interval and self._lock.acquire(blocking=False):
+            # One caller re-measures; the others use the last result meanwhile
+            try:
+                self.lag = measure_replica_lag(self.engine)
+            except Exception as e:
+                logger.warning(f"Read replica check failed: {e}")
+                self.lag = None
+            finally:
+                self._checked_at = time.monotonic()
+                self._lock.release()
+        if self.lag is None:
+            return "unavailable"
+        return "available" if self.lag <= self.max_lag else "lagging"
+
+# Statements the replica can answer: one SELECT (or WITH ... SELECT) that writes and locks nothing
+_READ_STATEMENT = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_WRITE_KEYWORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|ALTER|DROP|TRUNCATE|LOCK|NEXTVAL|SETVAL)\b|\bFOR\s+(UPDATE|SHARE|NO\s+KEY\s+UPDATE|KEY\s+SHARE)\b", re.IGNORECASE)
+
+@lru_cache(maxsize=1024)
+def is_read_statement(sql: str) -> bool:
+    return bool(_READ_STATEMENT.match(sql)) and not _WRITE_KEYWORDS.search(sql)
+
+class RoutingSession(Session):
+    """
+    Session for analytics reads. While the replica is healthy, read-only SELECTs
+    go to it and everything else to the primary. The first write pins the session
+    to the primary for the rest of its life, so a session never acts on a stale
+    replica view of its own writes. Read paths keep their rollup refreshes on a
+    separate primary session (see primary_session) and stay unpinned.
+    """
 
-engine = create_engine(DATABASE_URL)
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        primary = super().get_bind(mapper, clause=clause, **kwargs)
+        replica = _replica
+        if replica is None or clause is None or self.info.get("pinned_to_primary"):
+            return primary
+        if not is_read_statement(str(clause)):
+            self.info["pinned_to_primary"] = True
+            DB_ROUTED_STATEMENTS.inc("primary", "write")
+            return primary
+        state = replica.state()
+        if state != "available":
+            DB_ROUTED_STATEMENTS.inc("primary", f"replica_{state}")
+            return primary
+        DB_ROUTED_STATEMENTS.inc("replica", "read")
+        return replica.engine
 
-# Session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
 
-# Function to get a DB session
+# Function to create the engines once and bind the session factories to them
+def init_engine(database_url: Optional[str] = None, replica_url: Optional[str] = None) -> Engine:
+    global _engine, _replica
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                database_url = database_url or DATABASE_URL
+                if not database_url:
+                    raise ValueError("DATABASE_URL not set in .env file")
+                engine = create_engine(database_url, **_engine_options(database_url, DB_STATEMENT_TIMEOUT))
+                register_pool("primary", lambda: pool_stats(engine))
+                replica_url = replica_url or DATABASE_REPLICA_URL
+                if replica_url:
+                    replica_engine = create_engine(replica_url, **_engine_options(replica_url, DB_REPLICA_STATEMENT_TIMEOUT))
+                    register_pool("replica", lambda: pool_stats(replica_engine))
+                    _replica = Replica(replica_engine)
+                SessionLocal.configure(bind=engine)
+                ReadSessionLocal.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+def engine_initialized() -> bool:
+    return _engine is not None
+
+def replica_status() -> str:
+    """For the readiness probe: "not_configured", "available", "lagging" or "unavailable"."""
+    return _replica.state() if _replica is not None else "not_configured"
+
+# Function to check the database answers (for the readiness probe)
+def ping_database() -> None:
+    with init_engine().connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+# Function to get a DB session (primary)
 def get_db():
+    init_engine()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
-# Function to fetch raw visits for a given URL ID
-def get_raw_visits(db: Session, url_id: int, limit: int = 1000):
-    # IMPORTANT: Use text() for raw SQL queries for security with SQLAlchemy
-    # This assumes your 'visits' table has url_id, clicked_at, visitor_ip_hash, user_agent, referer
+# Function to get a DB session for analytics reads (replica when healthy, see RoutingSession)
+def get_read_db():
+    init_engine()
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Session for the writes a read path makes (folding new visits into the rollups):
+# a read session would be pinned to the primary by the first of them, so they go
+# through a short-lived primary session instead and db keeps reading from the replica
+@contextmanager
+def primary_session(db: Session):
+    if not isinstance(db, RoutingSession):
+        yield db
+        return
+    primary = SessionLocal(bind=db.get_bind())
+    try:
+        yield primary
+    finally:
+        primary.close()
+
+# Incremental consumers (rollups and sketches, referrer tables, the DuckDB copy)
+# follow visits by id watermark. A SERIAL id is taken at INSERT but only becomes
+# visible at COMMIT, so a higher id can show up before a lower one. Each batch
+# therefore ends before its first visit younger than VISIT_SETTLE_SECONDS: a lower
+# id still in flight then commits ahead of the watermark instead of behind it.
+# This assumes visit inserts commit within that time (the redirect path's are
+# single statements).
+def _settled_fence_sql(db: Session) -> str:
+    """SQL for the first id of the CTE "batch" that is too recent to fold, or past its last id"""
+    if db.get_bind().dialect.name == "sqlite":
+        unsettled = "clicked_at >= datetime('now', :settle_offset)"
+    else:
+        unsettled = "clicked_at >= now() - make_interval(secs => :settle_seconds)"
+    return f"(SELECT COALESCE(MIN(CASE WHEN {unsettled} THEN id END), MAX(id) + 1) FROM batch)"
+
+def _settle_params() -> dict:
+    return {"settle_seconds": VISIT_SETTLE_SECONDS, "settle_offset": f"-{VISIT_SETTLE_SECONDS} seconds"}
+
+# Function to fetch the next batch of settled visits across all URLs after a given id (for mirrors kept by id watermark)
+def get_visit_batch(db: Session, after_id: int, limit: int = 50000):
+    query = text(f"""
+        WITH batch AS (
+            SELECT id, url_id, visitor_ip_hash, visitor_ip_prefix, user_agent, referer, clicked_at
+            FROM visits
+            WHERE id > :after_id
+            ORDER BY id
+            LIMIT :limit
+        )
+        SELECT * FROM batch
+        WHERE id < {_settled_fence_sql(db)}
+        ORDER BY id
+    """)
+    return db.execute(query, {"after_id": after_id, "limit": limit, **_settle_params()}).fetchall()
+
+# Function to stream all visits for a URL in fixed-size chunks (server-side cursor on Postgres)
+def stream_visits(db: Session, url_id: int, chunk_size: int = 5000, start=None, end=None, exclude_bots: bool = False):
+    return stream_visits_for_urls(db, [url_id], chunk_size=chunk_size, start=start, end=end, exclude_bots=exclude_bots)
+
+# Function to stream the visits of several URLs through one cursor, in fixed-size chunks
+def stream_visits_for_urls(db: Session, url_ids: Iterable[int], chunk_size: int = 5000, start=None, end=None,
+                           exclude_bots: bool = False):
+    url_ids = list(url_ids)
+    bot_filter, bot_params = _bot_filter(db, url_ids, exclude_bots)
+    query = text(f"""
+        SELECT id, url_id, visitor_ip_hash, visitor_ip_prefix, user_agent, referer, clicked_at
+        FROM visits
+        WHERE url_id IN :url_ids
+          {_time_range_sql(start, end)} {bot_filter}
+    """).bindparams(bindparam("url_ids", expanding=True))
+    result = db.execute(
+        query,
+        {"url_ids": url_ids, **_time_params(db, start, end), **bot_params},
+        execution_options={"stream_results": True, "yield_per": chunk_size},
+    )
+    try:
+        for chunk in result.partitions(chunk_size):
+            yield chunk
+    finally:
+        result.close()
+
+# Function to fetch a cheap freshness fingerprint (newest visit id, visit count) for a URL
+def get_visits_fingerprint(db: Session, url_id: int):
     query = text("""
-        SELECT id, url_id, visitor_ip_hash, user_agent, referer, clicked_at
+        SELECT MAX(id) AS max_id, COUNT(*) AS visit_count
         FROM visits
         WHERE url_id = :url_id
-        ORDER BY clicked_at DESC
-        LIMIT :limit
     """)
-    return db.execute(query, {"url_id": url_id, "limit": limit}).fetchall()
-
-# Function to fetch basic stats for a URL
-def get_basic_stats(db: Session, url_id: int):
-    stats_query = text("""
-        SELECT
-            COUNT(*) as total_clicks,
-            (SELECT COUNT(DISTINCT visitor_ip_hash) FROM visits WHERE url_id = :url_id) as unique_visitors,
-            DATE_TRUNC('hour', clicked_at) as click_hour,
-            COUNT(*) as hourly_clicks
+    row = db.execute(query, {"url_id": url_id}).fetchone()
+    return row.max_id, row.visit_count
+
+# Time buckets understood by _bucket_sql (Postgres DATE_TRUNC units)
+TIME_BUCKETS = ("minute", "hour", "day", "week", "month")
+
+# SQLite (used by the test fixture) has no DATE_TRUNC; strftime yields the same
+# bucket as text, matching how SQLite returns every other timestamp. Weeks start
+# on Monday like DATE_TRUNC('week'): jump to the next Sunday, then back six days.
+_SQLITE_BUCKET_SQL = {
+    "minute": "strftime('%Y-%m-%d %H:%M:00', {column})",
+    "hour": "strftime('%Y-%m-%d %H:00:00', {column})",
+    "day": "strftime('%Y-%m-%d 00:00:00', {column})",
+    "week": "strftime('%Y-%m-%d 00:00:00', {column}, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m-01 00:00:00', {column})",
+}
+
+# SQL expression truncating a timestamp column to the given bucket, per dialect
+def _bucket_sql(db: Session, bucket: str, column: str = "clicked_at") -> str:
+    if bucket not in TIME_BUCKETS:
+        raise ValueError(f"Unknown time bucket: {bucket}")
+    if db.get_bind().dialect.name == "sqlite":
+        return _SQLITE_BUCKET_SQL[bucket].format(column=column)
+    return f"DATE_TRUNC('{bucket}', {column})"
+
+# SQL expression truncating clicked_at to the hour, per dialect
+def _hour_bucket_sql(db: Session) -> str:
+    return _bucket_sql(db, "hour")
+
+# SQL expression for clicked_at as UTC wall-clock time (rollup buckets are stored that way)
+def _utc_clicked_at_sql(db: Session) -> str:
+    if db.get_bind().dialect.name == "sqlite":
+        return "clicked_at"
+    return "(clicked_at AT TIME ZONE 'UTC')"
+
+# Optional clicked_at bounds, bound as :start / :end
+def _time_range_sql(start=None, end=None) -> str:
+    clauses = []
+    if start is not None:
+        clauses.append("AND clicked_at >= :start")
+    if end is not None:
+        clauses.append("AND clicked_at < :end")
+    return " ".join(clauses)
+
+# Bot filter on the persisted is_bot column. Reads never write it: visits the
+# enrichment worker has not reached yet (is_bot NULL) are classified here, once per
+# distinct user agent, and the bots among them are left out by their UA string.
+def _bot_filter(db: Session, url_ids: Iterable[int], exclude_bots: bool = False) -> Tuple[str, dict]:
+    """(SQL clause, its bound parameters) leaving bots out of the urls' visits, or ("", {})"""
+    if not exclude_bots:
+        return "", {}
+    user_agents = db.execute(
+        text("SELECT DISTINCT user_agent FROM visits WHERE url_id IN :url_ids AND is_bot IS NULL")
+        .bindparams(bindparam("url_ids", expanding=True)),
+        {"url_ids": list(url_ids)},
+    ).scalars()
+    bots = sorted(user_agent for user_agent in user_agents if is_bot_user_agent(user_agent))
+    params = {f"unenriched_bot_{index}": user_agent for index, user_agent in enumerate(bots)}
+    unenriched = "is_bot IS NULL"
+    if bots:
+        unenriched += f" AND (user_agent IS NULL OR user_agent NOT IN ({', '.join(f':{name}' for name in params)}))"
+    return f"AND (NOT is_bot OR ({unenriched}))", params
+
+# clicked_at bounds as the driver expects them: aware UTC for Postgres TIMESTAMPTZ,
+# naive UTC for SQLite, which compares timestamps as text
+def _time_params(db: Session, start=None, end=None) -> dict:
+    def convert(value):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        value = value.astimezone(timezone.utc)
+        return value.replace(tzinfo=None) if db.get_bind().dialect.name == "sqlite" else value
+    return {"start": convert(start), "end": convert(end)}
+
+# Function to fetch click counts per time bucket, truncated in the database
+def get_click_series(db: Session, url_id: int, bucket: str, start=None, end=None, exclude_bots: bool = False):
+    """
+    Returns [{"bucket", "count"}] for visits in [start, end), oldest first. Only the
+    buckets leave the database; start and end (UTC) are optional.
+    """
+    bot_filter, bot_params = _bot_filter(db, [url_id], exclude_bots)
+    series_query = text(f"""
+        SELECT {_bucket_sql(db, bucket, _utc_clicked_at_sql(db))} AS bucket, COUNT(*) AS clicks
         FROM visits
         WHERE url_id = :url_id
-        GROUP BY DATE_TRUNC('hour', clicked_at)
-        ORDER BY click_hour;
+          {_time_range_sql(start, end)} {bot_filter}
+        GROUP BY 1
+        ORDER BY 1
     """)
-    basic_stats = db.execute(stats_query, {"url_id": url_id}).fetchall()
-
-    # Process results into a more usable format for frontend
-    total_clicks = 0
-    clicks_over_time = []
-    if basic_stats:
-        total_clicks = sum([row.total_clicks for row in basic_stats if row.total_clicks is not None]) # Handle potential None if no data
-        clicks_over_time = [{"timestamp": row.click_hour, "count": row.hourly_clicks} for row in basic_stats]
-    
-    return total_clicks, clicks_over_time
-
-# Function to fetch top referrers
-def get_top_referrers(db: Session, url_id: int, limit: int = 10):
-    referer_query = text("""
-        SELECT referer, COUNT(*) as count
+    rows = db.execute(series_query, {"url_id": url_id, **_time_params(db, start, end), **bot_params}).fetchall()
+    return [{"bucket": row.bucket, "count": row.clicks} for row in rows]
+
+# Visit columns readers can group on. The enrichment columns (device_type, os,
+# browser, referrer_host) are filled in by the enrichment worker; until then
+# group_visits classifies those visits in memory (see _group_unenriched).
+GROUPABLE_COLUMNS = {
+    "total": None,
+    "device": "device_type",
+    "os": "os",
+    "browser": "browser",
+    "referrer": "referer",
+    "referrer_host": "referrer_host",
+    "ip_prefix": "visitor_ip_prefix",
+}
+
+ENRICHED_DIMENSIONS = ("device", "os", "browser", "referrer_host")
+
+class GroupedVisits(NamedTuple):
+    bucket: object
+    dimension: str
+    value: Optional[str]
+    clicks: int
+
+@timed("enrich")
+def _group_unenriched(db: Session, dimensions, bucket: str, filters: str, params: dict) -> List[GroupedVisits]:
+    """
+    group_visits rows of the enrichment-column dimensions for visits the enrichment
+    worker has not reached yet, grouped in SQL per user agent (and referer) and
+    classified in memory. Their NULL columns are dropped by the callers' folds.
+    """
+    dimensions = [dimension for dimension in dimensions if dimension in ENRICHED_DIMENSIONS]
+    if not dimensions:
+        return []
+    referer = "referer" if "referrer_host" in dimensions else "NULL"
+    rows = db.execute(text(f"""
+        SELECT {bucket} AS bucket, user_agent, {referer} AS referer, COUNT(*) AS clicks
         FROM visits
-        WHERE url_id = :url_id AND referer IS NOT NULL AND referer != ''
-        GROUP BY referer
-        ORDER BY count DESC
-        LIMIT :limit;
+        WHERE url_id = :url_id AND is_bot IS NULL {filters}
+        GROUP BY 1, 2, 3
+    """), params).fetchall()
+    counts = Counter()
+    for row in rows:
+        classification = classify_user_agent(row.user_agent)
+        values = {
+            "device": classification.device_type,
+            "os": classification.os,
+            "browser": classification.browser,
+            "referrer_host": referrer_host(row.referer),
+        }
+        for dimension in dimensions:
+            counts[(row.bucket, dimension, values[dimension])] += row.clicks
+    return [GroupedVisits(bucket, dimension, value, clicks) for (bucket, dimension, value), clicks in counts.items()]
+
+# Function to count a URL's visits per value of several columns in one statement
+def group_visits(db: Session, url_id: int, dimensions, by_hour: bool = False,
+                 after_id=None, upto_id=None, start=None, end=None, exclude_bots: bool = False):
+    """
+    Returns rows (bucket, dimension, value, clicks); bucket is the UTC hour when
+    by_hour is set, else NULL. Visits can be limited to an id range (after_id, upto_id]
+    and/or a [start, end) time range, and bots left out. Each dimension is one
+    GROUP BY over a shared CTE. A (bucket, dimension, value) can come back twice,
+    once for enriched visits and once for the rest, so callers sum the rows.
+    """
+    bucket = _bucket_sql(db, "hour", _utc_clicked_at_sql(db)) if by_hour else "NULL"
+    bot_filter, bot_params = _bot_filter(db, [url_id], exclude_bots)
+    filters = f"{_time_range_sql(start, end)} {bot_filter}"
+    if after_id is not None:
+        filters += " AND id > :after_id"
+    if upto_id is not None:
+        filters += " AND id <= :upto_id"
+
+    parts = []
+    for dimension in dimensions:
+        column = GROUPABLE_COLUMNS[dimension]
+        if column is None:
+            parts.append(f"SELECT bucket, '{dimension}' AS dimension, '' AS value, COUNT(*) AS clicks FROM url_visits GROUP BY bucket")
+        else:
+            parts.append(f"SELECT bucket, '{dimension}' AS dimension, {column} AS value, COUNT(*) AS clicks FROM url_visits GROUP BY bucket, {column}")
+    columns = ", ".join(sorted({column for column in GROUPABLE_COLUMNS.values() if column}))
+    grouped_query = text(f"""
+        WITH url_visits AS (
+            SELECT {bucket} AS bucket, {columns}
+            FROM visits
+            WHERE url_id = :url_id {filters}
+        )
+        {" UNION ALL ".join(parts)}
     """)
-    referrers_data = db.execute(referer_query, {"url_id": url_id, "limit": limit}).fetchall()
-    return [{"referer": row.referer, "count": row.count} for row in referrers_data]
\ No newline at end of file
+    params = {"url_id": url_id, "after_id": after_id, "upto_id": upto_id, **_time_params(db, start, end), **bot_params}
+    return db.execute(grouped_query, params).fetchall() + _group_unenriched(db, dimensions, bucket, filters, params)
+
+# Function to find the id window of the next batch of a URL's settled visits after a given id
+def get_visit_id_window(db: Session, url_id: int, after_id: int, limit: int = 5000):
+    """
+    Returns (last id, visit count) of the next `limit` visits after after_id,
+    cut before the first one that has not settled yet (see _settled_fence_sql).
+    """
+    row = db.execute(
+        text(f"""
+            WITH batch AS (
+                SELECT id, clicked_at FROM visits
+                WHERE url_id = :url_id AND id > :after_id
+                ORDER BY id
+                LIMIT :limit
+            )
+            SELECT MAX(id) AS last_id, COUNT(*) AS visits
+            FROM batch
+            WHERE id < {_settled_fence_sql(db)}
+        """),
+        {"url_id": url_id, "after_id": after_id, "limit": limit, **_settle_params()},
+    ).fetchone()
+    return row.last_id, row.visits
+
+# Function to fetch the oldest visit time for a URL
+def get_first_visit_time(db: Session, url_id: int):
+    return db.execute(
+        text("SELECT MIN(clicked_at) FROM visits WHERE url_id = :url_id"),
+        {"url_id": url_id},
+    ).scalar()
+
+# Function to fetch totals and the hourly series in one round trip
+def get_analytics_bundle(db: Session, url_id: int, exclude_bots: bool = False):
+    """
+    One statement, each part a CTE over the url's visits, merged with UNION ALL
+    and told apart by the "kind" column. Unique visitors come from HyperLogLog
+    sketches (see sketches.py) and top referrers from the Space-Saving tables
+    (see heavy_hitters.py), so neither rescans the url's visits.
+    """
+    bot_filter, bot_params = _bot_filter(db, [url_id], exclude_bots)
+    bundle_query = text(f"""
+        WITH url_visits AS (
+            SELECT clicked_at
+            FROM visits
+            WHERE url_id = :url_id {bot_filter}
+        ),
+        hourly AS (
+            SELECT {_hour_bucket_sql(db)} AS bucket, COUNT(*) AS clicks
+            FROM url_visits
+            GROUP BY 1
+        ),
+        totals AS (
+            SELECT COUNT(*) AS clicks
+            FROM url_visits
+        )
+        SELECT 'hour' AS kind, bucket, clicks FROM hourly
+        UNION ALL
+        SELECT 'total', NULL, clicks FROM totals
+    """)
+    rows = db.execute(bundle_query, {"url_id": url_id, **bot_params}).fetchall()
+
+    bundle = {"total_clicks": 0, "clicks_over_time": []}
+    for row in rows:
+        if row.kind == "hour":
+            bundle["clicks_over_time"].append({"timestamp": row.bucket, "count": row.clicks})
+        else:
+            bundle["total_clicks"] = row.clicks
+    bundle["clicks_over_time"].sort(key=lambda item: item["timestamp"])
+    return bundle
\ No newline at end of file
@@ -0,0 +1,296 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+import logging
+import os
+import threading
+import weakref
+
+from .metrics import timed
+from .user_agents import bot_signatures_digest, classify_user_agent, is_bot_user_agent
+
+logger = logging.getLogger(__name__)
+
+# Config
+ENRICHMENT_BATCH_SIZE = int(os.getenv("ENRICHMENT_BATCH_SIZE", "5000"))
+ENRICHMENT_INTERVAL = float(os.getenv("ENRICHMENT_INTERVAL", "5")) # seconds the backfill worker idles once caught up
+ENRICHMENT_WORKER = os.getenv("ENRICHMENT_WORKER", "1") == "1"
+
+# Columns derived once per visit and persisted on the visits table. is_bot is
+# always written, so "is_bot IS NULL" marks rows that still need enriching.
+# The columns and the partial index over unenriched rows are part of the visits
+# schema the Node server migrates at startup (server/src/db.ts, initDB): ALTER
+# TABLE or CREATE INDEX on visits from a request would block the redirect path's
+# inserts, so this service only checks that they are there.
+ENRICHMENT_COLUMNS = {
+    "device_type": "VARCHAR(32)",
+    "os": "VARCHAR(32)",
+    "browser": "VARCHAR(32)",
+    "referrer_host": "VARCHAR(255)",
+    "is_bot": "BOOLEAN",
+}
+
+CHECKPOINT_NAME = "visits_enrichment"
+
+# Saved classifications depend on the bot signature set they were derived with.
+# When the active set (user_agents.bot_signatures_digest) differs from the one
+# recorded here, the visits that existed at that point, up to rederive_upto, are
+# re-derived behind their own checkpoint.
+REDERIVE_NAME = "bot_signatures"
+
+_initialized_engines = weakref.WeakSet()
+
+# Schema management
+
+def ensure_enrichment_columns(db: Session) -> None:
+    engine = db.get_bind()
+    if engine in _initialized_engines:
+        return
+
+    existing = {column["name"] for column in inspect(db.connection()).get_columns("visits")}
+    missing = [name for name in ENRICHMENT_COLUMNS if name not in existing]
+    if missing:
+        raise RuntimeError(
+            f"visits has no {', '.join(missing)} column(s); start the server once so initDB migrates the visits table"
+        )
+    db.execute(text("""
+        CREATE TABLE IF NOT EXISTS enrichment_checkpoints (
+            name VARCHAR(64) PRIMARY KEY,
+            last_visit_id BIGINT NOT NULL DEFAULT 0
+        )
+    """))
+    db.execute(text("""
+        CREATE TABLE IF NOT EXISTS rederive_checkpoints (
+            name VARCHAR(64) PRIMARY KEY,
+            digest VARCHAR(16) NOT NULL,
+            rederive_upto BIGINT NOT NULL,
+            last_visit_id BIGINT NOT NULL DEFAULT 0
+        )
+    """))
+    db.commit()
+    _initialized_engines.add(engine)
+
+# Helper functions
+
+def referrer_host(referer: Optional[str]) -> Optional[str]:
+    if not referer:
+        return None
+    try:
+        host = urlsplit(referer if "//" in referer else f"//{referer}").hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    return host[4:] if host.startswith("www.") else host
+
+@timed("enrich")
+def _enrich_rows(db: Session, rows) -> None:
+    if not rows:
+        return
+    updates = []
+    for row in rows:
+        classification = classify_user_agent(row.user_agent)
+        updates.append({
+            "id": row.id,
+            "device_type": classification.device_type,
+            "os": classification.os,
+            "browser": classification.browser,
+            "referrer_host": referrer_host(row.referer),
+            "is_bot": is_bot_user_agent(row.user_agent),
+        })
+    db.execute(
+        text("""
+            UPDATE visits
+            SET device_type = :device_type, os = :os, browser = :browser,
+                referrer_host = :referrer_host, is_bot = :is_bot
+            WHERE id = :id
+        """),
+        updates,
+    )
+
+def _get_checkpoint(db: Session, name: str = CHECKPOINT_NAME) -> int:
+    row = db.execute(
+        text("SELECT last_visit_id FROM enrichment_checkpoints WHERE name = :name"),
+        {"name": name},
+    ).fetchone()
+    return row.last_visit_id if row else 0
+
+# Enrichment
+
+def enrich_batch(db: Session, batch_size: int = ENRICHMENT_BATCH_SIZE) -> int:
+    """
+    Backfill step: enriches the next batch of visits after the checkpoint (in id
+    order, across all urls) and advances the checkpoint. Returns rows scanned;
+    0 means the backfill has caught up.
+    """
+    ensure_enrichment_columns(db)
+    db.execute(
+        text("""
+            INSERT INTO enrichment_checkpoints (name, last_visit_id)
+            VALUES (:name, 0)
+            ON CONFLICT (name) DO NOTHING
+        """),
+        {"name": CHECKPOINT_NAME},
+    )
+    checkpoint = _get_checkpoint(db)
+    rows = db.execute(
+        text("""
+            SELECT id, user_agent, referer, is_bot
+            FROM visits
+            WHERE id > :checkpoint
+            ORDER BY id
+            LIMIT :limit
+        """),
+        {"checkpoint": checkpoint, "limit": batch_size},
+    ).fetchall()
+    if not rows:
+        db.commit()
+        return 0
+
+    # Rows already enriched are skipped; updates are idempotent, so a concurrent
+    # worker covering the same range only wastes effort
+    _enrich_rows(db, [row for row in rows if row.is_bot is None])
+    db.execute(
+        text("""
+            UPDATE enrichment_checkpoints
+            SET last_visit_id = :last_visit_id
+            WHERE name = :name AND last_visit_id < :last_visit_id
+        """),
+        {"name": CHECKPOINT_NAME, "last_visit_id": rows[-1].id},
+    )
+    db.commit()
+    return len(rows)
+
+def rederive_batch(db: Session, batch_size: int = ENRICHMENT_BATCH_SIZE) -> int:
+    """
+    Re-derives the next batch of visits enriched under another bot signature set,
+    rewriting only rows whose classification changed, along with the rollup
+    counters and human sketches already folded from them (see
+    rollups.refold_visits); the DuckDB copy rebuilds itself under the new set (see
+    OlapStore). Visits after rederive_upto are enriched with the active set
+    already. Returns rows scanned; 0 means the saved flags match the active set.
+    """
+    ensure_enrichment_columns(db)
+    digest = bot_signatures_digest()
+    params = {"name": REDERIVE_NAME, "digest": digest}
+    # The first run cannot know which set earlier visits were enriched with, and a
+    # switch to another set starts over: either way every visit so far is re-derived
+    db.execute(
+        text("""
+            INSERT INTO rederive_checkpoints (name, digest, rederive_upto, last_visit_id)
+            SELECT :name, :digest, COALESCE(MAX(id), 0), 0 FROM visits WHERE true
+            ON CONFLICT (name) DO NOTHING
+        """),
+        params,
+    )
+    db.execute(
+        text("""
+            UPDATE rederive_checkpoints
+            SET digest = :digest, rederive_upto = (SELECT COALESCE(MAX(id), 0) FROM visits), last_visit_id = 0
+            WHERE name = :name AND digest <> :digest
+        """),
+        params,
+    )
+    progress = db.execute(
+        text("SELECT rederive_upto, last_visit_id FROM rederive_checkpoints WHERE name = :name"),
+        params,
+    ).fetchone()
+    if progress.last_visit_id >= progress.rederive_upto:
+        db.commit()
+        return 0
+    rows = db.execute(
+        text("""
+            SELECT id, url_id, clicked_at, user_agent, referer, device_type, os, browser, is_bot
+            FROM visits
+            WHERE id > :after_id AND id <= :upto_id
+            ORDER BY id
+            LIMIT :limit
+        """),
+        {"after_id": progress.last_visit_id, "upto_id": progress.rederive_upto, "limit": batch_size},
+    ).fetchall()
+
+    # Unenriched rows are left to the backfill
+    changed = [
+        row for row in rows
+        if row.is_bot is not None
+        and (tuple(classify_user_agent(row.user_agent)), is_bot_user_agent(row.user_agent))
+        != ((row.device_type, row.os, row.browser), bool(row.is_bot))
+    ]
+    _enrich_rows(db, changed)
+    # Counts already folded from the saved columns follow them (rollups imports
+    # database, which imports this module)
+    from .rollups import refold_visits
+    refold_visits(db, changed)
+    db.execute(
+        text("""
+            UPDATE rederive_checkpoints
+            SET last_visit_id = :last_visit_id
+            WHERE name = :name AND digest = :digest AND last_visit_id < :last_visit_id
+        """),
+        {**params, "last_visit_id": rows[-1].id if rows else progress.rederive_upto},
+    )
+    db.commit()
+    return len(rows)
+
+class EnrichmentWorker:
+    """
+    Background thread running enrich_batch until caught up, then polling every
+    interval seconds for new visits. It is the only writer of the enrichment
+    columns: readers classify the visits it has not reached yet in memory.
+    Subclasses swap in another checkpointed batch step via step/thread_name.
+    """
+
+    thread_name = "visit-enrichment"
+
+    def __init__(self, session_factory: Callable[[], Session], interval: float = ENRICHMENT_INTERVAL,
+                 batch_size: int = ENRICHMENT_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def step(self, db: Session) -> int:
+        return enrich_batch(db, self.batch_size)
+
+    def run_once(self) -> int:
+        """Runs batches until caught up; returns rows scanned."""
+        scanned = 0
+        db = self.session_factory()
+        try:
+            while not self._stop.is_set():
+                count = self.step(db)
+                scanned += count
+                if count < self.batch_size:
+                    break
+        finally:
+            db.close()
+        return scanned
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Background worker {self.thread_name} error: {e}", exc_info=True)
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+class RederiveWorker(EnrichmentWorker):
+    """Re-derives saved classifications after the bot signature set changes (see rederive_batch)."""
+
+    thread_name = "visit-rederive"
+
+    def step(self, db: Session) -> int:
+        return rederive_batch(db, self.batch_size)
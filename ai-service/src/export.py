@@ -0,0 +1,198 @@
+from datetime import datetime
+from functools import lru_cache
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+import csv
+import io
+import os
+
+from .database import stream_visits_for_urls
+from .enrichment import referrer_host
+from .geo import lookup_distinct
+from .metrics import span
+from .rollups import _to_utc_naive
+from .user_agents import classify_distinct, is_bot_user_agent
+
+# Config
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "10000"))  # rows per record batch / Parquet row group
+
+# Raw visits plus the columns the analytics derive from them, streamed chunk by
+# chunk off a server-side cursor: each chunk becomes one CSV block, Arrow record
+# batch or Parquet row group and is released before the next is read, so memory
+# stays flat however many rows are exported. pyarrow is only needed (and only
+# imported) for the Arrow and Parquet formats.
+
+EXPORT_COLUMNS = (
+    "id", "url_id", "clicked_at", "visitor_ip_hash", "visitor_ip_prefix", "user_agent", "referer",
+    "referrer_host", "device_type", "os", "browser", "is_bot", "country", "region", "city",
+)
+
+class ExportFormat(NamedTuple):
+    media_type: str
+    extension: str
+    needs_pyarrow: bool
+
+EXPORT_FORMATS = {
+    "csv": ExportFormat("text/csv; charset=utf-8", "csv", False),
+    "arrow": ExportFormat("application/vnd.apache.arrow.stream", "arrows", True),
+    "parquet": ExportFormat("application/vnd.apache.parquet", "parquet", True),
+}
+
+def check_format(fmt: str) -> ExportFormat:
+    """Raises ValueError for unknown formats, or Arrow/Parquet without pyarrow installed."""
+    export_format = EXPORT_FORMATS.get(fmt)
+    if export_format is None:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if export_format.needs_pyarrow:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"The {fmt} export format requires pyarrow, which is not installed")
+    return export_format
+
+def export_columns(chunk) -> Dict[str, list]:
+    """One chunk of visit rows as columns, derived fields resolved once per distinct value."""
+    user_agents = classify_distinct(row.user_agent for row in chunk)
+    locations = lookup_distinct(row.visitor_ip_prefix for row in chunk)
+    columns: Dict[str, list] = {name: [] for name in EXPORT_COLUMNS}
+    for row in chunk:
+        classification = user_agents[row.user_agent]
+        location = locations[row.visitor_ip_prefix]
+        columns["id"].append(row.id)
+        columns["url_id"].append(row.url_id)
+        columns["clicked_at"].append(_to_utc_naive(row.clicked_at))
+        columns["visitor_ip_hash"].append(row.visitor_ip_hash)
+        columns["visitor_ip_prefix"].append(row.visitor_ip_prefix)
+        columns["user_agent"].append(row.user_agent)
+        columns["referer"].append(row.referer)
+        columns["referrer_host"].append(referrer_host(row.referer))
+        columns["device_type"].append(classification.device_type)
+        columns["os"].append(classification.os)
+        columns["browser"].append(classification.browser)
+        columns["is_bot"].append(is_bot_user_agent(row.user_agent))
+        columns["country"].append(location.country)
+        columns["region"].append(location.region)
+        columns["city"].append(location.city)
+    return columns
+
+def _column_batches(db: Session, url_ids: Iterable[int], start: Optional[datetime], end: Optional[datetime],
+                    chunk_size: int) -> Iterator[Dict[str, list]]:
+    for chunk in stream_visits_for_urls(db, url_ids, chunk_size=chunk_size, start=start, end=end):
+        with span("export"):
+            columns = export_columns(chunk)
+        yield columns
+
+# Encoders: each takes column batches and yields bytes
+
+def iter_csv(batches: Iterable[Dict[str, list]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for columns in batches:
+        for values in zip(*(columns[name] for name in EXPORT_COLUMNS)):
+            writer.writerow(
+                # clicked_at is UTC; None becomes an empty field
+                value.isoformat() + "Z" if isinstance(value, datetime) else value
+                for value in values
+            )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+@lru_cache(maxsize=1)
+def arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("url_id", pa.int64()),
+        ("clicked_at", pa.timestamp("us", tz="UTC")),
+        ("visitor_ip_hash", pa.string()),
+        ("visitor_ip_prefix", pa.string()),
+        ("user_agent", pa.string()),
+        ("referer", pa.string()),
+        ("referrer_host", pa.string()),
+        ("device_type", pa.string()),
+        ("os", pa.string()),
+        ("browser", pa.string()),
+        ("is_bot", pa.bool_()),
+        ("country", pa.string()),
+        ("region", pa.string()),
+        ("city", pa.string()),
+    ])
+
+class _ByteSink:
+    """Write-only file object the Arrow/Parquet writers write into; drain() hands the bytes on."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+def _record_batches(batches: Iterable[Dict[str, list]]):
+    import pyarrow as pa
+
+    schema = arrow_schema()
+    for columns in batches:
+        yield pa.RecordBatch.from_pydict(columns, schema=schema)
+
+def iter_arrow(batches: Iterable[Dict[str, list]]) -> Iterator[bytes]:
+    """Arrow IPC stream format: schema message, then one message per record batch."""
+    import pyarrow as pa
+
+    sink = _ByteSink()
+    with pa.ipc.new_stream(sink, arrow_schema()) as writer:
+        for batch in _record_batches(batches):
+            writer.write_batch(batch)
+            yield sink.drain()
+    # End-of-stream marker
+    yield sink.drain()
+
+def iter_parquet(batches: Iterable[Dict[str, list]]) -> Iterator[bytes]:
+    """Parquet with one row group per batch; the footer is written when the stream ends."""
+    import pyarrow.parquet as pq
+
+    sink = _ByteSink()
+    with pq.ParquetWriter(sink, arrow_schema(), compression="zstd") as writer:
+        for batch in _record_batches(batches):
+            writer.write_batch(batch)
+            yield sink.drain()
+    # Parquet footer
+    yield sink.drain()
+
+_ENCODERS = {"csv": iter_csv, "arrow": iter_arrow, "parquet": iter_parquet}
+
+def export_visits(db: Session, url_ids: Iterable[int], fmt: str = "csv", start: Optional[datetime] = None,
+                  end: Optional[datetime] = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Streams the visits of url_ids in [start, end) with derived columns, encoded as
+    fmt. A plain generator: the caller drives it (StreamingResponse runs it in the
+    threadpool), and the cursor is closed when it is exhausted or closed.
+    """
+    check_format(fmt)
+    return _ENCODERS[fmt](_column_batches(db, list(url_ids), start, end, chunk_size))
@@ -0,0 +1,60 @@
+from operator import attrgetter
+from typing import Any, Sequence
+import numpy as np
+import pandas as pd
+
+from .geo import lookup_ip, location_key
+from .metrics import timed
+from .user_agents import EMPTY_CLASSIFICATION, classify_user_agent
+
+VISIT_COLUMNS = ["id", "url_id", "visitor_ip_hash", "visitor_ip_prefix", "user_agent", "referer", "clicked_at"]
+UA_FIELDS = ("device_type", "os", "browser")
+GEO_FIELDS = ("country", "region", "city", "location")  # location: "country|region|city" counting key
+
+_visit_getter = attrgetter(*VISIT_COLUMNS)
+
+def _map_distinct(column: pd.Series, resolve, empty, fields) -> pd.DataFrame:
+    # Runs resolve once per distinct value and maps the results back through the
+    # factorized codes; missing values get code -1, which indexes the trailing empty result
+    codes, uniques = pd.factorize(column, use_na_sentinel=True)
+    results = [resolve(value) for value in uniques] + [empty]
+    columns = {}
+    for position, field in enumerate(fields):
+        values = np.array([result[position] for result in results], dtype=object)
+        columns[field] = pd.Categorical(values[codes])
+    return pd.DataFrame(columns, index=column.index)
+
+def classify_column(user_agents: pd.Series) -> pd.DataFrame:
+    """
+    Classifies a column of raw user agents, running the classifier once per
+    distinct value and mapping the results back through the factorized codes.
+    """
+    return _map_distinct(user_agents, classify_user_agent, EMPTY_CLASSIFICATION, UA_FIELDS)
+
+def locate_column(ip_prefixes: pd.Series) -> pd.DataFrame:
+    """
+    Geolocates a column of anonymized IP prefixes, one GeoIP lookup per distinct prefix.
+    """
+    def resolve(ip_prefix):
+        location = lookup_ip(ip_prefix)
+        return (*location, location_key(location))
+    return _map_distinct(ip_prefixes, resolve, (None,) * len(GEO_FIELDS), GEO_FIELDS)
+
+@timed("enrich")
+def visits_to_frame(raw_visits: Sequence[Any]) -> pd.DataFrame:
+    """
+    Builds the enriched visits DataFrame straight from result rows, without
+    per-row model objects: categorical device/os/browser, geo (see locate_column)
+    and referer columns, and a datetime64 clicked_at (UTC, tz-naive).
+    """
+    df = pd.DataFrame.from_records(
+        [_visit_getter(visit) for visit in raw_visits],
+        columns=VISIT_COLUMNS,
+    )
+    df["clicked_at"] = pd.to_datetime(df["clicked_at"], utc=True).dt.tz_localize(None)
+    for field, column in classify_column(df["user_agent"]).items():
+        df[field] = column
+    for field, column in locate_column(df["visitor_ip_prefix"]).items():
+        df[field] = column
+    df["referer"] = pd.Categorical(df["referer"])
+    return df
@@ -0,0 +1,117 @@
+from functools import lru_cache
+from threading import Lock
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional
+import os
+
+if TYPE_CHECKING:
+    import geoip2.database
+
+# Config
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", "./GeoLite2-City.mmdb") # Path to GeoLite2 City DB
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "65536"))  # distinct IP prefixes kept resolved
+GEO_BREAKDOWN_LIMIT = 50
+
+class GeoLocation(NamedTuple):
+    country: Optional[str]
+    region: Optional[str]
+    city: Optional[str]
+
+EMPTY_LOCATION = GeoLocation(None, None, None)
+
+# Lookups key on the anonymized prefix the server stores per visit (IPv4 /24,
+# IPv6 /48), never on a full address; the hashed IP cannot be geolocated.
+
+# geoip2/maxminddb are imported with the reader, on the first lookup
+_reader: Optional["geoip2.database.Reader"] = None
+_reader_loaded = False
+_reader_lock = Lock()
+
+def _mmap_mode() -> int:
+    import maxminddb
+
+    # The C extension maps the file too and is much faster than the pure Python reader
+    try:
+        import maxminddb.extension  # noqa: F401
+        return maxminddb.MODE_MMAP_EXT
+    except ImportError:
+        return maxminddb.MODE_MMAP
+
+def _open_reader(path: str) -> Optional["geoip2.database.Reader"]:
+    import geoip2.database
+
+    try:
+        return geoip2.database.Reader(path, mode=_mmap_mode())
+    except FileNotFoundError:
+        print(f"Warning: GeoLite2 City database not found at {path}. Geolocation will be disabled.")
+    except Exception as e:
+        print(f"Warning: Error loading GeoIP database: {e}. Geolocation will be disabled.")
+    return None
+
+def get_reader() -> Optional["geoip2.database.Reader"]:
+    """The shared memory-mapped reader, opened on first use (None if unavailable)."""
+    global _reader, _reader_loaded
+    if not _reader_loaded:
+        with _reader_lock:
+            if not _reader_loaded:
+                _reader = _open_reader(GEOIP_DB_PATH)
+                _reader_loaded = True
+    return _reader
+
+def set_database(path: Optional[str]) -> None:
+    """Switches to another .mmdb file (None disables geolocation) and clears the lookup cache."""
+    global _reader, _reader_loaded
+    with _reader_lock:
+        if _reader is not None:
+            _reader.close()
+        _reader = _open_reader(path) if path else None
+        _reader_loaded = True
+    lookup_ip.cache_clear()
+
+@lru_cache(maxsize=GEOIP_CACHE_SIZE)
+def lookup_ip(ip_address: Optional[str]) -> GeoLocation:
+    reader = get_reader()
+    if reader is None or not ip_address:
+        return EMPTY_LOCATION
+    from geoip2.errors import AddressNotFoundError
+
+    try:
+        response = reader.city(ip_address)
+    except (AddressNotFoundError, ValueError):
+        return EMPTY_LOCATION
+    subdivision = response.subdivisions.most_specific
+    return GeoLocation(
+        country=response.country.iso_code,
+        region=subdivision.name,
+        city=response.city.name,
+    )
+
+def location_key(location: GeoLocation) -> Optional[str]:
+    """Flat "country|region|city" key used for counting (None when unlocated)."""
+    if not location.country:
+        return None
+    return "|".join(part or "" for part in location)
+
+def geo_breakdown(counts: Dict[str, int], limit: Optional[int] = None) -> List[dict]:
+    """Ranks location_key counts into the AnalyticsData.geo_breakdown shape."""
+    items = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    breakdown = []
+    for key, count in items:
+        country, region, city = key.split("|")
+        breakdown.append({"country": country, "region": region or None, "city": city or None, "count": count})
+    return breakdown
+
+def lookup_distinct(ip_addresses: Iterable[Optional[str]]) -> Dict[Optional[str], GeoLocation]:
+    """Resolves each distinct address once."""
+    return {ip_address: lookup_ip(ip_address) for ip_address in set(ip_addresses)}
+
+def reader_status() -> str:
+    """For the readiness probe: "not_loaded" until the first lookup, then "loaded" or "unavailable"."""
+    if not _reader_loaded:
+        return "not_loaded"
+    return "loaded" if _reader is not None else "unavailable"
+
+def cache_info():
+    return lookup_ip.cache_info()
+
+def cache_clear() -> None:
+    lookup_ip.cache_clear()
@@ -0,0 +1,181 @@
+from collections import Counter, defaultdict
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional
+import os
+import weakref
+
+from .database import get_visit_batch, primary_session
+from .enrichment import EnrichmentWorker, _get_checkpoint, ensure_enrichment_columns, referrer_host
+from .metrics import timed
+from .topk import HeavyHitter, SpaceSaving
+
+# Config
+TOPK_CAPACITY = int(os.getenv("TOPK_CAPACITY", "100")) # counters kept per url
+TOPK_GLOBAL_CAPACITY = int(os.getenv("TOPK_GLOBAL_CAPACITY", "1000")) # counters kept across all links
+TOPK_BATCH_SIZE = int(os.getenv("TOPK_BATCH_SIZE", "5000"))
+TOPK_WORKER = os.getenv("TOPK_WORKER", "1") == "1"
+
+# Space-Saving tables of referrer hosts ("Direct" when there is none), one per url
+# plus one for all links under scope 0 (url ids start at 1). They are fed from new
+# visits in id order behind their own checkpoint, so memory and storage stay
+# bounded by the capacities whatever the visit volume.
+
+GLOBAL_SCOPE = 0
+DIRECT_REFERRER = "Direct"
+CHECKPOINT_NAME = "referrer_heavy_hitters"
+
+_initialized_engines = weakref.WeakSet()
+
+def ensure_heavy_hitter_table(db: Session) -> None:
+    engine = db.get_bind()
+    if engine in _initialized_engines:
+        return
+    # The checkpoint lives in enrichment_checkpoints
+    ensure_enrichment_columns(db)
+    db.execute(text("""
+        CREATE TABLE IF NOT EXISTS referrer_heavy_hitters (
+            scope INTEGER NOT NULL,
+            referrer VARCHAR(255) NOT NULL,
+            clicks BIGINT NOT NULL,
+            error BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, referrer)
+        )
+    """))
+    db.commit()
+    _initialized_engines.add(engine)
+
+def normalize_referrer(referer: Optional[str]) -> str:
+    host = referrer_host(referer)
+    return host[:255] if host else DIRECT_REFERRER
+
+def _load_summaries(db: Session, scopes: List[int], capacity: int, global_capacity: int) -> Dict[int, SpaceSaving]:
+    rows = db.execute(
+        text("""
+            SELECT scope, referrer, clicks, error FROM referrer_heavy_hitters
+            WHERE scope IN :scopes
+        """).bindparams(bindparam("scopes", expanding=True)),
+        {"scopes": scopes},
+    ).fetchall()
+    counters = defaultdict(dict)
+    for row in rows:
+        counters[row.scope][row.referrer] = (row.clicks, row.error)
+    return {
+        scope: SpaceSaving(global_capacity if scope == GLOBAL_SCOPE else capacity, counters[scope])
+        for scope in scopes
+    }
+
+# Feed
+
+@timed("heavy_hitters")
+def update_heavy_hitters(db: Session, batch_size: int = TOPK_BATCH_SIZE, capacity: int = TOPK_CAPACITY,
+                         global_capacity: int = TOPK_GLOBAL_CAPACITY) -> int:
+    """
+    Folds the next batch of settled visits after the checkpoint into the per-url and
+    global tables. Returns rows scanned; 0 means the tables are current.
+    """
+    ensure_heavy_hitter_table(db)
+    db.execute(
+        text("""
+            INSERT INTO enrichment_checkpoints (name, last_visit_id)
+            VALUES (:name, 0)
+            ON CONFLICT (name) DO NOTHING
+        """),
+        {"name": CHECKPOINT_NAME},
+    )
+    checkpoint = _get_checkpoint(db, CHECKPOINT_NAME)
+    rows = get_visit_batch(db, checkpoint, batch_size)
+    if not rows:
+        db.commit()
+        return 0
+
+    # Counts are not idempotent, so the batch is claimed first: a concurrent feeder
+    # that read the same checkpoint finds it moved and backs off
+    claimed = db.execute(
+        text("""
+            UPDATE enrichment_checkpoints
+            SET last_visit_id = :last_visit_id
+            WHERE name = :name AND last_visit_id = :checkpoint
+        """),
+        {"name": CHECKPOINT_NAME, "checkpoint": checkpoint, "last_visit_id": rows[-1].id},
+    )
+    if claimed.rowcount != 1:
+        db.rollback()
+        return len(rows)
+
+    counts = defaultdict(Counter)
+    for row in rows:
+        referrer = normalize_referrer(row.referer)
+        counts[row.url_id][referrer] += 1
+        counts[GLOBAL_SCOPE][referrer] += 1
+    scopes = sorted(counts)
+    summaries = _load_summaries(db, scopes, capacity, global_capacity)
+    for scope, summary in summaries.items():
+        summary.update(counts[scope])
+
+    db.execute(
+        text("DELETE FROM referrer_heavy_hitters WHERE scope IN :scopes").bindparams(bindparam("scopes", expanding=True)),
+        {"scopes": scopes},
+    )
+    db.execute(
+        text("""
+            INSERT INTO referrer_heavy_hitters (scope, referrer, clicks, error)
+            VALUES (:scope, :referrer, :clicks, :error)
+        """),
+        [
+            {"scope": scope, "referrer": hitter.value, "clicks": hitter.count, "error": hitter.error}
+            for scope, summary in summaries.items()
+            for hitter in summary.top()
+        ],
+    )
+    db.commit()
+    return len(rows)
+
+def catch_up_heavy_hitters(db: Session, batch_size: int = TOPK_BATCH_SIZE) -> int:
+    """Runs the feed until current (backfills, benchmarks); returns rows scanned."""
+    scanned = 0
+    while True:
+        count = update_heavy_hitters(db, batch_size)
+        scanned += count
+        if count < batch_size:
+            return scanned
+
+class HeavyHitterWorker(EnrichmentWorker):
+    """Keeps the referrer tables current in the background (see EnrichmentWorker)."""
+
+    thread_name = "referrer-heavy-hitters"
+
+    def step(self, db: Session) -> int:
+        return update_heavy_hitters(db, self.batch_size)
+
+# Reads
+
+def top_referrers(db: Session, url_id: Optional[int] = None, limit: int = 10) -> List[HeavyHitter]:
+    """
+    Top referrer hosts for a url, or across all links when url_id is None, read from
+    the Space-Saving table instead of grouping raw visits. The table is as current as
+    the last fed batch (see heavy_hitters_lag); HeavyHitterWorker keeps it fed, and
+    without it each read folds in at most one batch.
+    """
+    with primary_session(db) as primary:
+        if TOPK_WORKER:
+            ensure_heavy_hitter_table(primary)
+        else:
+            update_heavy_hitters(primary, TOPK_BATCH_SIZE)
+    rows = db.execute(
+        text("""
+            SELECT referrer, clicks, error FROM referrer_heavy_hitters
+            WHERE scope = :scope
+            ORDER BY clicks DESC, referrer
+            LIMIT :limit
+        """),
+        {"scope": GLOBAL_SCOPE if url_id is None else url_id, "limit": limit},
+    ).fetchall()
+    return [HeavyHitter(row.referrer, row.clicks, row.error) for row in rows]
+
+def heavy_hitters_lag(db: Session) -> int:
+    """Visit ids past the checkpoint, i.e. roughly how many visits the tables have not counted yet."""
+    with primary_session(db) as primary:
+        ensure_heavy_hitter_table(primary)
+    last_visit_id = db.execute(text("SELECT MAX(id) FROM visits")).scalar() or 0
+    return max(last_visit_id - _get_checkpoint(db, CHECKPOINT_NAME), 0)
@@ -0,0 +1,131 @@
+from hashlib import blake2b
+from typing import TYPE_CHECKING, Iterable, Optional
+import math
+import os
+import zlib
+
+# numpy is imported by the methods that use it, so importing the service does
+# not load it (see startup.HEAVY_MODULES)
+if TYPE_CHECKING:
+    import numpy as np
+
+# Config
+HLL_PRECISION = int(os.getenv("HLL_PRECISION", "12"))
+
+class HyperLogLog:
+    """
+    Mergeable distinct-count sketch (Flajolet et al. HyperLogLog with linear
+    counting for small cardinalities), 2**precision one-byte registers.
+
+    Error bound: the relative standard error is 1.04 / sqrt(2**precision), i.e.
+    about 1.6% at the default precision 12 (4 KiB of registers, ~2 KiB once
+    compressed); ~95% of estimates land within twice that. Counts below
+    2.5 * 2**precision go through linear counting: exact or off by one or two
+    for small counts, noisier (up to ~3% standard error) just below the switch
+    (around 10k distinct values at precision 12). Merging sketches (union) adds
+    no error beyond that of the merged result.
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional["np.ndarray"] = None):
+        import numpy as np
+
+        if not 11 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 11 and 16")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = registers if registers is not None else np.zeros(self.size, dtype=np.uint8)
+
+    @staticmethod
+    def hash_values(values: Iterable[str]) -> "np.ndarray":
+        import numpy as np
+
+        return np.fromiter(
+            (int.from_bytes(blake2b(value.encode("utf-8"), digest_size=8).digest(), "big") for value in values),
+            dtype=np.uint64,
+        )
+
+    def add(self, values: Iterable[str]) -> None:
+        self.add_hashes(self.hash_values(values))
+
+    def add_hashes(self, hashes: "np.ndarray") -> None:
+        import numpy as np
+
+        if len(hashes) == 0:
+            return
+        remaining_bits = 64 - self.precision
+        index = (hashes >> np.uint64(remaining_bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << remaining_bits) - 1)
+        # Rank = position of the leftmost 1-bit in the remaining bits. They fit a
+        # float64 mantissa exactly, so frexp's exponent is their bit length.
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        rank = (remaining_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        import numpy as np
+
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def reduce(self, precision: int) -> "HyperLogLog":
+        """
+        The same sketch at a lower precision, as if its values had been added there:
+        the index bits dropped from each register lead its remaining bits instead.
+        """
+        import numpy as np
+
+        if precision == self.precision:
+            return self
+        if precision > self.precision:
+            raise ValueError("Cannot raise the precision of a HyperLogLog sketch")
+        shift = self.precision - precision
+        index = np.arange(self.size, dtype=np.int64)
+        dropped = index & ((1 << shift) - 1)
+        bit_length = np.frexp(dropped.astype(np.float64))[1]
+        ranks = np.where(dropped != 0, shift - bit_length + 1, self.registers.astype(np.int64) + shift)
+        ranks[self.registers == 0] = 0
+        reduced = HyperLogLog(precision)
+        np.maximum.at(reduced.registers, index >> shift, ranks.astype(np.uint8))
+        return reduced
+
+    @classmethod
+    def union(cls, sketches: Iterable["HyperLogLog"], precision: Optional[int] = None) -> "HyperLogLog":
+        """
+        Merges sketches at the given precision, by default the lowest one among
+        them (stored sketches keep the precision they were built with), reducing
+        the others to it. An empty union uses HLL_PRECISION.
+        """
+        sketches = list(sketches)
+        if precision is None:
+            precision = min((sketch.precision for sketch in sketches), default=HLL_PRECISION)
+        merged = cls(precision)
+        for sketch in sketches:
+            merged.merge(sketch.reduce(precision))
+        return merged
+
+    def estimate(self) -> int:
+        import numpy as np
+
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        raw = alpha * size * size / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * size and zeros:
+            return int(round(size * math.log(size / zeros)))
+        return int(round(raw))
+
+    # Storage: one precision byte followed by the zlib-compressed registers
+    # (sparse days compress to a few dozen bytes)
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        import numpy as np
+
+        precision = data[0]
+        registers = np.frombuffer(zlib.decompress(bytes(data[1:])), dtype=np.uint8).copy()
+        return cls(precision, registers)
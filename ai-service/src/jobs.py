@@ -0,0 +1,540 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from threading import Event, Lock, Thread
+from typing import Any, Awaitable, Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+import uuid
+
+from sqlalchemy.orm import Session
+
+from .analytics import generate_ai_chat_response, generate_ai_insight, generate_graph_insight
+from .llm import close_llm_client
+from .metrics import AI_JOBS
+
+logger = logging.getLogger(__name__)
+
+# Config
+AI_JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", "4"))  # jobs run at once per process; 0 leaves them queued
+AI_JOB_QUEUE_PATH = os.getenv("AI_JOB_QUEUE_PATH")  # optional SQLite file; the default queue lives in this process
+AI_JOB_MAX_ATTEMPTS = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "3"))
+AI_JOB_RETRY_BACKOFF = float(os.getenv("AI_JOB_RETRY_BACKOFF", "2"))  # seconds before the first retry, doubled after each
+AI_JOB_LEASE = float(os.getenv("AI_JOB_LEASE", "300"))  # seconds a running job may take before it is run again
+AI_JOB_RESULT_TTL = float(os.getenv("AI_JOB_RESULT_TTL", "3600"))  # seconds finished jobs stay pollable
+AI_JOB_MAX_PENDING = int(os.getenv("AI_JOB_MAX_PENDING", "1000"))
+AI_JOB_CALLBACK_TIMEOUT = float(os.getenv("AI_JOB_CALLBACK_TIMEOUT", "10"))
+# Hosts a callback_url may point at (comma-separated); callbacks are refused when empty
+AI_JOB_CALLBACK_HOSTS = frozenset(
+    host.strip().lower() for host in os.getenv("AI_JOB_CALLBACK_HOSTS", "").split(",") if host.strip()
+)
+
+# Asynchronous mode for the AI endpoints: a submission is stored and answered
+# with a job id at once, and a fixed pool of worker coroutines (on a thread with
+# its own event loop, like the enrichment worker) runs it. Identical pending jobs
+# are merged, the next job goes to the user served least recently, and failures
+# are retried with exponential backoff. Results are polled via GET /ai/jobs/{id}
+# or POSTed to the submission's callback_url, whose host must be allowlisted in
+# AI_JOB_CALLBACK_HOSTS so submissions cannot make this service call arbitrary hosts.
+#
+# A claimed job is leased: its run_after becomes the lease expiry, and a job
+# still "running" past it (its worker died) is claimed again like a queued one.
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+PENDING = (QUEUED, RUNNING)
+
+class QueueFull(Exception):
+    """Raised by submit when AI_JOB_MAX_PENDING jobs are already waiting or running."""
+
+class Job(NamedTuple):
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    user: str
+    dedup_key: str
+    status: str = QUEUED
+    attempts: int = 0
+    result: Optional[str] = None
+    error: Optional[str] = None  # last failure; a retried job keeps it until it succeeds
+    callback_url: Optional[str] = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+    run_after: float = 0.0  # queued: earliest start; running: lease expiry
+
+def dedup_key(kind: str, payload: Dict[str, Any]) -> str:
+    # bypass_cache changes where the answer comes from, not what is asked
+    fields = {name: value for name, value in payload.items() if name != "bypass_cache"}
+    return hashlib.sha256(json.dumps([kind, fields], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def new_job(kind: str, payload: Dict[str, Any], user: str, callback_url: Optional[str] = None) -> Job:
+    now = time.time()
+    return Job(
+        uuid.uuid4().hex, kind, payload, user, dedup_key(kind, payload),
+        callback_url=callback_url, created_at=now, updated_at=now, run_after=now,
+    )
+
+def callback_allowed(url: str) -> bool:
+    """True for an http(s) URL whose host is in AI_JOB_CALLBACK_HOSTS."""
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname
+    except ValueError:
+        return False
+    return parts.scheme in ("http", "https") and host is not None and host in AI_JOB_CALLBACK_HOSTS
+
+def job_status(job: Job) -> Dict[str, Any]:
+    """The public view of a job (API responses and callbacks)."""
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "url_id": job.payload.get("url_id"),
+        "status": job.status,
+        "attempts": job.attempts,
+        "result": job.result,
+        "error": job.error,
+        "created_at": datetime.fromtimestamp(job.created_at, timezone.utc).isoformat(),
+        "updated_at": datetime.fromtimestamp(job.updated_at, timezone.utc).isoformat(),
+    }
+
+# Stores
+
+class MemoryJobStore:
+    """Jobs in a dict: nothing survives a restart and only this process's workers see them."""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._pending: Dict[str, str] = {}  # dedup key -> job id, in submission order
+        self._last_served: Dict[str, int] = {}
+        self._served = 0
+        self._lock = Lock()
+
+    def submit(self, job: Job, max_pending: int = AI_JOB_MAX_PENDING) -> Tuple[Job, bool]:
+        """Stores job, or returns the pending job it duplicates; the flag is True if job was stored."""
+        with self._lock:
+            existing = self._pending.get(job.dedup_key)
+            if existing is not None:
+                return self._jobs[existing], False
+            if len(self._pending) >= max_pending:
+                raise QueueFull(f"{max_pending} AI jobs are already pending")
+            self._jobs[job.id] = job
+            self._pending[job.dedup_key] = job.id
+            return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def claim(self, now: float, lease: float) -> Optional[Job]:
+        with self._lock:
+            ready = [self._jobs[job_id] for job_id in self._pending.values() if self._jobs[job_id].run_after <= now]
+            if not ready:
+                return None
+            # Least recently served user first; min() keeps submission order among equals
+            job = min(ready, key=lambda candidate: self._last_served.get(candidate.user, 0))
+            self._served += 1
+            self._last_served[job.user] = self._served
+            job = self._jobs[job.id] = job._replace(
+                status=RUNNING, attempts=job.attempts + 1, updated_at=now, run_after=now + lease,
+            )
+            return job
+
+    def update(self, job_id: str, now: float, **changes) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = self._jobs[job_id] = job._replace(updated_at=now, **changes)
+            if job.status not in PENDING and self._pending.get(job.dedup_key) == job_id:
+                del self._pending[job.dedup_key]
+            return job
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            return min((self._jobs[job_id].run_after for job_id in self._pending.values()), default=None)
+
+    def purge(self, before: float) -> int:
+        """Drops finished jobs last updated before `before`."""
+        with self._lock:
+            expired = [job.id for job in self._jobs.values() if job.status not in PENDING and job.updated_at < before]
+            for job_id in expired:
+                del self._jobs[job_id]
+            waiting = {self._jobs[job_id].user for job_id in self._pending.values()}
+            self._last_served = {user: served for user, served in self._last_served.items() if user in waiting}
+            return len(expired)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def close(self) -> None:
+        pass
+
+_JOB_COLUMNS = ("id", "kind", "payload", "user", "dedup_key", "status", "attempts", "result", "error",
+                "callback_url", "created_at", "updated_at", "run_after")
+
+class SQLiteJobStore:
+    """
+    Jobs in a local SQLite file: queued work survives a restart, and processes on
+    the same host can share the queue (claims run in IMMEDIATE transactions).
+    The file is opened on first use.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS ai_jobs (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    user TEXT NOT NULL,
+                    dedup_key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    callback_url TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    run_after REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_ai_jobs_pending ON ai_jobs (run_after) WHERE status IN ('queued', 'running');
+                CREATE INDEX IF NOT EXISTS idx_ai_jobs_dedup ON ai_jobs (dedup_key) WHERE status IN ('queued', 'running');
+                CREATE TABLE IF NOT EXISTS ai_job_users (
+                    user TEXT PRIMARY KEY,
+                    last_served INTEGER NOT NULL
+                );
+            """)
+            self._db = db
+        return self._db
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Job:
+        values = {name: row[name] for name in _JOB_COLUMNS}
+        values["payload"] = json.loads(values["payload"])
+        return Job(**values)
+
+    def submit(self, job: Job, max_pending: int = AI_JOB_MAX_PENDING) -> Tuple[Job, bool]:
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT * FROM ai_jobs WHERE dedup_key = ? AND status IN ('queued', 'running') LIMIT 1", (job.dedup_key,),
+            ).fetchone()
+            if row is not None:
+                return self._job(row), False
+            pending = db.execute("SELECT COUNT(*) FROM ai_jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if pending >= max_pending:
+                raise QueueFull(f"{max_pending} AI jobs are already pending")
+            values = job._asdict()
+            values["payload"] = json.dumps(job.payload)
+            db.execute(
+                f"INSERT INTO ai_jobs ({', '.join(_JOB_COLUMNS)}) VALUES ({', '.join('?' for _ in _JOB_COLUMNS)})",
+                [values[name] for name in _JOB_COLUMNS],
+            )
+            return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM ai_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def claim(self, now: float, lease: float) -> Optional[Job]:
+        with self._transaction() as db:
+            row = db.execute("""
+                SELECT j.* FROM ai_jobs j
+                LEFT JOIN ai_job_users u ON u.user = j.user
+                WHERE j.status IN ('queued', 'running') AND j.run_after <= ?
+                ORDER BY COALESCE(u.last_served, 0), j.seq
+                LIMIT 1
+            """, (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "INSERT OR REPLACE INTO ai_job_users (user, last_served) "
+                "SELECT ?, COALESCE(MAX(last_served), 0) + 1 FROM ai_job_users",
+                (row["user"],),
+            )
+            job = self._job(row)._replace(status=RUNNING, attempts=row["attempts"] + 1, updated_at=now, run_after=now + lease)
+            db.execute(
+                "UPDATE ai_jobs SET status = ?, attempts = ?, updated_at = ?, run_after = ? WHERE id = ?",
+                (job.status, job.attempts, job.updated_at, job.run_after, job.id),
+            )
+            return job
+
+    def update(self, job_id: str, now: float, **changes) -> Optional[Job]:
+        changes["updated_at"] = now
+        unknown = set(changes) - set(Job._fields)
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        assignments = ", ".join(f"{name} = ?" for name in changes)
+        with self._transaction() as db:
+            db.execute(f"UPDATE ai_jobs SET {assignments} WHERE id = ?", [*changes.values(), job_id])
+            row = db.execute("SELECT * FROM ai_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            return self._connect().execute(
+                "SELECT MIN(run_after) FROM ai_jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+
+    def purge(self, before: float) -> int:
+        with self._transaction() as db:
+            deleted = db.execute(
+                "DELETE FROM ai_jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?", (before,),
+            ).rowcount
+            db.execute(
+                "DELETE FROM ai_job_users WHERE user NOT IN "
+                "(SELECT user FROM ai_jobs WHERE status IN ('queued', 'running'))"
+            )
+            return deleted
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._connect().execute("SELECT status, COUNT(*) FROM ai_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+# Worker pool
+
+Handler = Callable[[Dict[str, Any], Session], Awaitable[str]]
+
+class JobQueue:
+    """
+    Runs stored jobs on `workers` coroutines sharing one background event loop.
+    submit() and get() are safe from any thread; start()/stop() bracket the pool.
+    """
+
+    thread_name = "ai-jobs"
+
+    def __init__(self, store, session_factory: Callable[[], Session], handlers: Dict[str, Handler],
+                 workers: int = AI_JOB_WORKERS, max_attempts: int = AI_JOB_MAX_ATTEMPTS,
+                 backoff: float = AI_JOB_RETRY_BACKOFF, lease: float = AI_JOB_LEASE,
+                 result_ttl: float = AI_JOB_RESULT_TTL, max_pending: int = AI_JOB_MAX_PENDING,
+                 poll_interval: float = 1.0):
+        self.store = store
+        self.session_factory = session_factory
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.result_ttl = result_ttl
+        self.max_pending = max_pending
+        # Upper bound on how long an idle worker sleeps (jobs from other processes, due retries)
+        self.poll_interval = poll_interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._started = Event()
+        self._thread: Optional[Thread] = None
+
+    def submit(self, kind: str, payload: Dict[str, Any], user: str, callback_url: Optional[str] = None) -> Tuple[Job, bool]:
+        """Queues a job, or returns the identical one already pending (flag False)."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown AI job kind: {kind}")
+        job, created = self.store.submit(new_job(kind, payload, user, callback_url), self.max_pending)
+        AI_JOBS.inc(kind, "submitted" if created else "deduplicated")
+        if created:
+            self._notify()
+        return job, created
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.store.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float, interval: float = 0.1) -> Optional[Job]:
+        """Long-poll: returns once the job has finished or timeout seconds have passed."""
+        deadline = time.monotonic() + timeout
+        job = self.store.get(job_id)
+        while job is not None and job.status in PENDING and time.monotonic() < deadline:
+            await asyncio.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+            job = self.store.get(job_id)
+        return job
+
+    def _notify(self) -> None:
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            pass  # the loop has just been closed
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._started.clear()
+            self._thread = Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+            self._started.wait()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stops the pool; jobs that were running go back to the queue without using up an attempt."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._loop = loop
+        self._started.set()
+        try:
+            loop.run_until_complete(self._serve())
+            # The LLM client is per event loop; this one is going away
+            loop.run_until_complete(close_llm_client())
+        finally:
+            self._loop = None
+            loop.close()
+
+    async def _serve(self) -> None:
+        workers = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        while not self._stop.is_set():
+            try:
+                self.store.purge(time.time() - self.result_ttl)
+            except Exception as e:
+                logger.error(f"AI job purge failed: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=60)
+            except asyncio.TimeoutError:
+                pass
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                job = self.store.claim(time.time(), self.lease)
+            except Exception as e:
+                logger.error(f"AI job claim failed: {e}", exc_info=True)
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            if job.attempts > self.max_attempts:
+                # Its lease ran out on the last attempt (the worker running it died)
+                await self._failed(job, "Job did not finish within its lease")
+                continue
+            await self._execute(job)
+
+    async def _idle(self) -> None:
+        due = self.store.next_due()
+        timeout = self.poll_interval if due is None else min(self.poll_interval, max(0.0, due - time.time()))
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _execute(self, job: Job) -> None:
+        db = self.session_factory()
+        try:
+            result = await self.handlers[job.kind](job.payload, db)
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back for the next start
+            self.store.update(job.id, time.time(), status=QUEUED, attempts=job.attempts - 1, run_after=time.time())
+            raise
+        except Exception as e:
+            await self._retry_or_fail(job, e)
+        else:
+            stored = self.store.update(job.id, time.time(), status=SUCCEEDED, result=result, error=None)
+            AI_JOBS.inc(job.kind, SUCCEEDED)
+            await self._callback(stored)
+        finally:
+            db.close()
+
+    async def _retry_or_fail(self, job: Job, error: Exception) -> None:
+        if job.attempts >= self.max_attempts:
+            logger.error(f"AI job {job.id} ({job.kind}) failed after {job.attempts} attempts: {error}")
+            await self._failed(job, str(error))
+            return
+        # Exponential backoff with jitter, so retries of a burst do not arrive together
+        delay = self.backoff * 2 ** (job.attempts - 1) * random.uniform(1.0, 1.25)
+        logger.warning(f"AI job {job.id} ({job.kind}) attempt {job.attempts} failed, retrying in {delay:.1f}s: {error}")
+        now = time.time()
+        self.store.update(job.id, now, status=QUEUED, error=str(error), run_after=now + delay)
+        AI_JOBS.inc(job.kind, "retried")
+
+    async def _failed(self, job: Job, error: str) -> None:
+        stored = self.store.update(job.id, time.time(), status=FAILED, error=error)
+        AI_JOBS.inc(job.kind, FAILED)
+        await self._callback(stored)
+
+    async def _callback(self, job: Optional[Job]) -> None:
+        # None: the job expired from the store while it ran, so there is nothing to report
+        if job is None or not job.callback_url:
+            return
+        if not callback_allowed(job.callback_url):
+            logger.warning(f"AI job {job.id} callback to {job.callback_url} skipped: host not in AI_JOB_CALLBACK_HOSTS")
+            return
+        import httpx
+
+        try:
+            async with httpx.AsyncClient(timeout=AI_JOB_CALLBACK_TIMEOUT) as client:
+                response = await client.post(job.callback_url, json=job_status(job))
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"AI job {job.id} callback to {job.callback_url} failed: {e}")
+
+# Handlers: failures raise instead of being answered as text, so they are retried
+
+async def _insight_job(payload: Dict[str, Any], db: Session) -> str:
+    return await generate_ai_insight(
+        payload["url_id"], db, bypass_cache=payload.get("bypass_cache", False),
+        exclude_bots=payload.get("exclude_bots", False), raise_errors=True,
+    )
+
+async def _graph_insight_job(payload: Dict[str, Any], db: Session) -> str:
+    return await generate_graph_insight(
+        payload["url_id"], payload["graph_type"], db, bypass_cache=payload.get("bypass_cache", False),
+        exclude_bots=payload.get("exclude_bots", False), raise_errors=True,
+    )
+
+async def _chat_job(payload: Dict[str, Any], db: Session) -> str:
+    return await generate_ai_chat_response(
+        payload["url_id"], payload["message"], payload.get("context"), db,
+        bypass_cache=payload.get("bypass_cache", False), exclude_bots=payload.get("exclude_bots", False),
+        raise_errors=True,
+    )
+
+JOB_HANDLERS: Dict[str, Handler] = {"insight": _insight_job, "graph_insight": _graph_insight_job, "chat": _chat_job}
+
+def make_job_queue(session_factory: Callable[[], Session]) -> JobQueue:
+    store = SQLiteJobStore(AI_JOB_QUEUE_PATH) if AI_JOB_QUEUE_PATH else MemoryJobStore()
+    return JobQueue(store, session_factory, JOB_HANDLERS)
@@ -0,0 +1,141 @@
+from typing import AsyncIterator, Optional
+import asyncio
+import json
+import os
+import weakref
+
+from .metrics import LLM_REQUESTS, span
+
+# Config
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))  # outstanding LLM calls per process
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "8"))
+
+class LLMError(Exception):
+    """Raised when the upstream LLM call fails or returns an unusable payload."""
+
+class LLMClient:
+    """
+    Pooled async HTTP client for OpenRouter chat completions.
+
+    Connections are kept alive between calls, connect/read timeouts are explicit,
+    and a semaphore caps how many completions are in flight at once so a burst of
+    chat requests queues here instead of piling onto the upstream.
+    """
+
+    def __init__(self, api_url: str, api_key: Optional[str], max_concurrency: int = LLM_MAX_CONCURRENCY):
+        import httpx  # deferred until the first LLM call: it is a slow import
+
+        self.api_url = api_url
+        self.api_key = api_key
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+        )
+
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+    async def chat_completion(self, model: str, prompt: str) -> Optional[str]:
+        import httpx
+
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        outcome = "error"
+        try:
+            with span("llm"):
+                async with self._semaphore:
+                    try:
+                        resp = await self._http.post(self.api_url, headers=self._headers(), json=payload)
+                        resp.raise_for_status()
+                        data = resp.json()
+                    except httpx.HTTPError as e:
+                        raise LLMError(f"Error calling AI API: {e}") from e
+                    except ValueError as e:
+                        raise LLMError(f"AI returned invalid JSON: {e}") from e
+
+            try:
+                content = data["choices"][0]["message"].get("content")
+            except (KeyError, IndexError, TypeError, AttributeError) as e:
+                raise LLMError("AI returned an unexpected response format.") from e
+            outcome = "ok" if content else "empty"
+            return content
+        finally:
+            LLM_REQUESTS.inc(outcome)
+
+    async def stream_chat_completion(self, model: str, prompt: str) -> AsyncIterator[str]:
+        """
+        Streams a completion, yielding content deltas as the upstream produces them
+        (OpenAI-style Server-Sent Events with "stream": true).
+        """
+        import httpx
+
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+        }
+        # The span covers the whole stream, up to the last delta
+        outcome = "error"
+        try:
+            with span("llm"):
+                async with self._semaphore:
+                    try:
+                        async with self._http.stream("POST", self.api_url, headers=self._headers(), json=payload) as resp:
+                            resp.raise_for_status()
+                            outcome = "empty"
+                            async for line in resp.aiter_lines():
+                                # Blank lines separate events; ":" lines are keep-alive comments
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:"):].strip()
+                                if data == "[DONE]":
+                                    return
+                                try:
+                                    delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                                except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                                    outcome = "error"
+                                    raise LLMError("AI returned an unexpected stream chunk.") from e
+                                if delta:
+                                    outcome = "ok"
+                                    yield delta
+                    except httpx.HTTPError as e:
+                        outcome = "error"
+                        raise LLMError(f"Error calling AI API: {e}") from e
+        finally:
+            LLM_REQUESTS.inc(outcome)
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+# One client per event loop: pooled connections and the semaphore are bound to
+# the loop that created them (production runs a single loop; tests may not).
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LLMClient]" = weakref.WeakKeyDictionary()
+
+def get_llm_client() -> LLMClient:
+    if not OPENROUTER_API_KEY:
+        raise LLMError("OPENROUTER_API_KEY not set in .env file")
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.api_url != OPENROUTER_API_URL:
+        client = LLMClient(OPENROUTER_API_URL, OPENROUTER_API_KEY)
+        _clients[loop] = client
+    return client
+
+async def close_llm_client() -> None:
+    loop = asyncio.get_running_loop()
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
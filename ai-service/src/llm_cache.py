@@ -0,0 +1,120 @@
+from threading import Lock
+from typing import NamedTuple, Optional
+import hashlib
+import sqlite3
+import time
+
+from .cache import LRUCache
+
+class _CachedResponse(NamedTuple):
+    response: str
+    expires_at: float
+
+class LLMResponseCache:
+    """
+    Two-tier cache of LLM completions keyed on a hash of model + prompt.
+
+    The in-memory LRU tier answers repeated prompts within a process; the
+    optional SQLite tier (enabled by passing a path) survives restarts; its
+    file is opened on first use, not at construction. Entries expire after
+    ttl seconds (0 keeps them until evicted).
+    """
+
+    def __init__(self, maxsize: int, ttl: float = 0.0, path: Optional[str] = None):
+        self.ttl = ttl
+        self.path = path
+        self._memory = LRUCache(maxsize)
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self.path and self._disk is None:
+            with self._disk_lock:
+                if self._disk is None:
+                    disk = sqlite3.connect(self.path, check_same_thread=False)
+                    disk.execute("""
+                        CREATE TABLE IF NOT EXISTS llm_responses (
+                            key TEXT PRIMARY KEY,
+                            response TEXT NOT NULL,
+                            expires_at REAL NOT NULL
+                        )
+                    """)
+                    disk.commit()
+                    self._disk = disk
+        return self._disk
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl > 0 else float("inf")
+
+    def get(self, model: str, prompt: str) -> Optional[str]:
+        key = self.make_key(model, prompt)
+        now = time.time()
+
+        entry: Optional[_CachedResponse] = self._memory.peek(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self.hits += 1
+                return entry.response
+            self._memory.pop(key)
+
+        disk = self._connect()
+        if disk is not None:
+            with self._disk_lock:
+                row = disk.execute(
+                    "SELECT response, expires_at FROM llm_responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] <= now:
+                    disk.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                    disk.commit()
+                    row = None
+            if row is not None:
+                self._memory.set(key, _CachedResponse(row[0], row[1]))
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    def set(self, model: str, prompt: str, response: str) -> None:
+        key = self.make_key(model, prompt)
+        entry = _CachedResponse(response, self._expires_at())
+        self._memory.set(key, entry)
+        disk = self._connect()
+        if disk is not None:
+            # sqlite REAL can't hold inf; a far-future timestamp means "no expiry"
+            expires_at = entry.expires_at if entry.expires_at != float("inf") else 1e18
+            with self._disk_lock:
+                disk.execute(
+                    "INSERT OR REPLACE INTO llm_responses (key, response, expires_at) VALUES (?, ?, ?)",
+                    (key, response, expires_at),
+                )
+                disk.commit()
+
+    def clear(self) -> None:
+        self._memory.clear()
+        self.hits = self.disk_hits = self.misses = 0
+        disk = self._connect()
+        if disk is not None:
+            with self._disk_lock:
+                disk.execute("DELETE FROM llm_responses")
+                disk.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._memory),
+            "maxsize": self._memory.maxsize,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self._memory.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
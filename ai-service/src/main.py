@@ -1,13 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException, APIRouter
+from fastapi import FastAPI, Depends, HTTPException, APIRouter, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from typing import List
-import uvicorn
+from typing import AsyncIterator, List, Literal, Optional
+from datetime import datetime
+import json
+from contextlib import asynccontextmanager
 import os
 import logging
-from .database import get_db, get_basic_stats, get_top_referrers
+from .database import ReadSessionLocal, SessionLocal, get_db, get_read_db, init_engine
+from .enrichment import ENRICHMENT_WORKER, EnrichmentWorker, RederiveWorker
+from .heavy_hitters import TOPK_BATCH_SIZE, TOPK_WORKER, HeavyHitterWorker, heavy_hitters_lag, top_referrers
 from .analytics import generate_ai_insight
-from .models import AICreateRequest, AICreateResponse, AnalyticsData, GraphInsightRequest, GraphInsightResponse, ChatRequest, ChatResponse
-from .analytics import generate_ai_insight, generate_graph_insight, generate_ai_chat_response, get_full_analytics
+from .models import AICreateRequest, AICreateResponse, AIJobRequest, AIJobResponse, AnalyticsData, ExportRequest, ReadinessResponse, BatchAnalyticsRequest, BatchAnalyticsResponse, UrlAnalyticsData, TopReferrer, TopReferrersResponse, GraphInsightRequest, GraphInsightResponse, ChatRequest, ChatResponse
+from .llm import LLMError, close_llm_client
+from .metrics import MetricsMiddleware, render_metrics
+from .startup import resource_status, start_warm_up
+from .export import EXPORT_FORMATS, check_format, export_visits
+from .jobs import AI_JOB_WORKERS, QueueFull, callback_allowed, job_status, make_job_queue
+from .olap import OLAP_WORKER, OlapSyncWorker, olap_store
+from .analytics import ANALYTICS_SOURCE, generate_ai_insight, generate_graph_insight, generate_ai_chat_response, get_full_analytics, get_batch_analytics
+from .analytics import stream_graph_insight, stream_ai_chat_response
 
 from dotenv import load_dotenv
 logger = logging.getLogger(__name__)
@@ -15,7 +28,80 @@ logger = logging.getLogger(__name__)
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI(title="URL Shortener AI Service")
+# Config
+WARM_UP = os.getenv("WARM_UP", "1") == "1"  # load pandas/httpx/GeoIP in the background after startup
+
+# Asynchronous AI jobs (POST /ai/jobs); the store is in-process unless AI_JOB_QUEUE_PATH is set
+job_queue = make_job_queue(ReadSessionLocal)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing is created at import time; a missing DATABASE_URL fails startup here
+    init_engine()
+    if WARM_UP:
+        start_warm_up()
+    # Backfill device/OS/browser/referrer columns on visits in the background, and
+    # re-derive them when the bot signature set changes
+    workers = []
+    if ENRICHMENT_WORKER:
+        workers.append(EnrichmentWorker(SessionLocal))
+        workers.append(RederiveWorker(SessionLocal))
+    # Feed the streaming top-referrer tables from new visits
+    if TOPK_WORKER:
+        workers.append(HeavyHitterWorker(SessionLocal, batch_size=TOPK_BATCH_SIZE))
+    # Run queued AI jobs on a bounded pool
+    if AI_JOB_WORKERS > 0:
+        workers.append(job_queue)
+    # Keep the DuckDB copy of visits caught up between analytics reads
+    if ANALYTICS_SOURCE == "duckdb" and OLAP_WORKER:
+        workers.append(OlapSyncWorker(ReadSessionLocal))
+    for worker in workers:
+        worker.start()
+    yield
+    for worker in workers:
+        worker.stop(timeout=5)
+    olap_store.close()
+    # Close pooled upstream connections on shutdown
+    await close_llm_client()
+
+app = FastAPI(title="URL Shortener AI Service", lifespan=lifespan)
+# Request latency histograms, plus a Server-Timing header when SERVER_TIMING=1
+app.add_middleware(MetricsMiddleware)
+
+# Server-Sent Events: one "data" event per completion delta, then "done" (or "error")
+async def _sse_events(deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+    try:
+        async for delta in deltas:
+            yield f"data: {json.dumps({'delta': delta})}\n\n"
+    except LLMError as e:
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        return
+    except Exception as e:
+        logger.error(f"Streaming AI error: {e}", exc_info=True)
+        yield f"event: error\ndata: {json.dumps({'detail': 'Unexpected AI error'})}\n\n"
+        return
+    yield f"event: done\ndata: {json.dumps({'generated_at': datetime.utcnow().isoformat()})}\n\n"
+
+def sse_response(deltas: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        _sse_events(deltas),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def export_response(db: Session, url_ids: List[int], fmt: str, start: Optional[datetime], end: Optional[datetime],
+                    filename: str) -> StreamingResponse:
+    try:
+        check_format(fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    export_format = EXPORT_FORMATS[fmt]
+    # A sync iterator: Starlette pulls each chunk in the threadpool, so the cursor never blocks the event loop
+    return StreamingResponse(
+        export_visits(db, url_ids, fmt, start=start, end=end),
+        media_type=export_format.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format.extension}"'},
+    )
 
 # Endpoints
 
@@ -23,46 +109,181 @@ app = FastAPI(title="URL Shortener AI Service")
 def read_root():
     return {"message": "AI Analytics Service is running."}
 
+# Readiness probe: 200 once the database answers, 503 otherwise; lists what is loaded
+@app.get("/ready", response_model=ReadinessResponse)
+def readiness(response: Response, db: Session = Depends(get_db)):
+    try:
+        db.execute(text("SELECT 1"))
+        database = "connected"
+    except Exception as e:
+        logger.warning(f"Readiness check failed: {e}")
+        database = "unavailable"
+    ready = database == "connected"
+    if not ready:
+        response.status_code = 503
+    return ReadinessResponse(ready=ready, database=database, resources=resource_status())
+
+# Prometheus scrape endpoint: request/stage latency, LLM outcomes, cache hit ratios
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Endpoint to generate AI insights for a specific URL
 @app.post("/ai/insight", response_model=AICreateResponse)
-def create_ai_insight(
+async def create_ai_insight(
     request_data: AICreateRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    insight = generate_ai_insight(request_data.url_id, db)
+    insight = await generate_ai_insight(
+        request_data.url_id, db, bypass_cache=request_data.bypass_cache, exclude_bots=request_data.exclude_bots,
+    )
     return AICreateResponse(insight=insight)
 
-# Endpoint to fetch basic analytics data
+# Endpoint to queue an insight, graph insight or chat answer; returns at once with a job id to poll
+@app.post("/ai/jobs", response_model=AIJobResponse, status_code=202)
+def submit_ai_job(request_data: AIJobRequest):
+    payload = request_data.model_dump(
+        include={"url_id", "graph_type", "message", "context", "bypass_cache", "exclude_bots"}, exclude_none=True,
+    )
+    user = str(request_data.user_id) if request_data.user_id is not None else f"url:{request_data.url_id}"
+    callback_url = str(request_data.callback_url) if request_data.callback_url else None
+    if callback_url and not callback_allowed(callback_url):
+        raise HTTPException(status_code=422, detail="callback_url host is not in AI_JOB_CALLBACK_HOSTS")
+    try:
+        job, created = job_queue.submit(request_data.kind, payload, user, callback_url=callback_url)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return AIJobResponse(**job_status(job), deduplicated=not created)
+
+# Endpoint to poll an AI job; ?wait= holds the request up to that many seconds for it to finish
+@app.get("/ai/jobs/{job_id}", response_model=AIJobResponse)
+async def get_ai_job(job_id: str, wait: float = Query(0, ge=0, le=30)):
+    job = await job_queue.wait(job_id, wait) if wait else job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return AIJobResponse(**job_status(job))
+
+# Endpoint to fetch analytics for many URLs at once (e.g. a whole dashboard)
+@app.post("/analytics/batch", response_model=BatchAnalyticsResponse)
+def get_batch_analytics_data(
+    request_data: BatchAnalyticsRequest,
+    db: Session = Depends(get_read_db)
+):
+    try:
+        results = get_batch_analytics(request_data.url_ids, db)
+        return BatchAnalyticsResponse(
+            results=[UrlAnalyticsData(url_id=url_id, **analytics) for url_id, analytics in results.items()]
+        )
+    except Exception as e:
+        logger.error(f"Batch analytics error for {len(request_data.url_ids)} urls: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to retrieve analytics data")
+
+# Endpoint to export the raw visits of many URLs with derived columns (CSV, Arrow IPC or Parquet)
+@app.post("/analytics/export")
+def export_visits_for_urls(
+    request_data: ExportRequest,
+    db: Session = Depends(get_read_db)
+):
+    return export_response(db, request_data.url_ids, request_data.format, request_data.start, request_data.end, "visits")
+
+# Endpoint to export one URL's raw visits with derived columns, optionally for a time range
+@app.get("/analytics/{url_id}/export")
+def export_url_visits(
+    url_id: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    format: Literal["csv", "arrow", "parquet"] = "csv",
+    db: Session = Depends(get_read_db)
+):
+    return export_response(db, [url_id], format, start, end, f"visits-{url_id}")
+
+# Endpoint to fetch the top referrer hosts of one URL, or across all links
+@app.get("/analytics/referrers/top", response_model=TopReferrersResponse)
+def get_top_referrers_data(
+    url_id: Optional[int] = None,
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    try:
+        hitters = top_referrers(db, url_id, limit)
+        return TopReferrersResponse(
+            url_id=url_id,
+            referrers=[TopReferrer(referrer=hitter.value, clicks=hitter.count, error=hitter.error) for hitter in hitters],
+            lag=heavy_hitters_lag(db),
+        )
+    except Exception as e:
+        logger.error(f"Top referrers error for url_id {url_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to retrieve top referrers")
+
+# Endpoint to fetch basic analytics data, optionally for a time range and bucket size
 @app.get("/analytics/{url_id}", response_model=AnalyticsData)
 def get_analytics_data(
     url_id: int,
-    db: Session = Depends(get_db)
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    bucket: Optional[Literal["minute", "hour", "day", "week", "month"]] = None,
+    max_points: Optional[int] = Query(None, ge=1, le=10000),
+    exclude_bots: bool = False,
+    db: Session = Depends(get_read_db)
 ):
     try:
-        analytics_dict = get_full_analytics(url_id, db)
+        analytics_dict = get_full_analytics(
+            url_id, db, start=start, end=end, bucket=bucket, max_points=max_points, exclude_bots=exclude_bots,
+        )
         return AnalyticsData(**analytics_dict)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Analytics error for url_id {url_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve analytics data")
 
     
 @app.post("/ai/graph-insight", response_model=GraphInsightResponse)
-def graph_insight(
+async def graph_insight(
     request_data: GraphInsightRequest,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
-    insight = generate_graph_insight(request_data.url_id, request_data.graph_type, db)
+    if request_data.stream:
+        deltas = await stream_graph_insight(
+            request_data.url_id,
+            request_data.graph_type,
+            db,
+            bypass_cache=request_data.bypass_cache,
+            exclude_bots=request_data.exclude_bots,
+        )
+        return sse_response(deltas)
+
+    insight = await generate_graph_insight(
+        request_data.url_id,
+        request_data.graph_type,
+        db,
+        bypass_cache=request_data.bypass_cache,
+        exclude_bots=request_data.exclude_bots,
+    )
     return GraphInsightResponse(insight=insight)
 
 @app.post("/ai/chat", response_model=ChatResponse)
-def ai_chat(
+async def ai_chat(
     request_data: ChatRequest,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
-    response = generate_ai_chat_response(
+    if request_data.stream:
+        deltas = await stream_ai_chat_response(
+            request_data.url_id,
+            request_data.message,
+            request_data.context,
+            db,
+            bypass_cache=request_data.bypass_cache,
+            exclude_bots=request_data.exclude_bots,
+        )
+        return sse_response(deltas)
+
+    response = await generate_ai_chat_response(
         request_data.url_id,
         request_data.message,
         request_data.context,
         db,
+        bypass_cache=request_data.bypass_cache,
+        exclude_bots=request_data.exclude_bots,
     )
     return ChatResponse(response=response)
\ No newline at end of file
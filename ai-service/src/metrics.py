@@ -0,0 +1,314 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import functools
+import inspect
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+# Config
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"  # add a Server-Timing header with per-stage durations
+
+# Prometheus-format metrics without a client library: a few counters and
+# fixed-bucket histograms, each observation one lock and a bisect, so the
+# instrumentation stays on permanently. Stage spans (db, enrich, aggregate,
+# rollups, summary, llm, ...) feed one histogram labelled by stage and, while a
+# request is being served, that request's Server-Timing totals.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items)
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+class Histogram:
+    """Cumulative-bucket histogram; per label set it keeps bucket counts, sum and count."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (+Inf last)..., sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return int(sum(series[:-1])) if series else 0
+
+    def sum(self, *label_values: str) -> float:
+        series = self._series.get(label_values)
+        return series[-1] if series else 0.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template and status.", ("method", "route", "status"),
+)
+STAGE_DURATION = Histogram(
+    "stage_duration_seconds", "Time spent per processing stage (db is per SQL statement).", ("stage",),
+)
+LLM_REQUESTS = Counter("llm_requests_total", "Upstream LLM calls by outcome (ok, empty, error).", ("outcome",))
+LLM_PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens", "Estimated tokens per prompt sent upstream (summary_encoder.estimate_tokens).", (),
+    buckets=(25, 50, 100, 200, 400, 800, 1600, 3200),
+)
+SINGLE_FLIGHT_REQUESTS = Counter(
+    "singleflight_requests_total",
+    "Calls that ran the computation (executed) or joined an identical one in flight (coalesced).", ("operation", "outcome"),
+)
+
+AI_JOBS = Counter(
+    "ai_jobs_total", "Background AI jobs by kind and outcome (submitted, deduplicated, retried, succeeded, failed).",
+    ("kind", "outcome"),
+)
+
+DB_ROUTED_STATEMENTS = Counter(
+    "db_routed_statements_total",
+    "Statements of analytics read sessions by target (primary, replica) and reason (read, write, replica_lagging, replica_unavailable).",
+    ("target", "reason"),
+)
+
+_metrics = [REQUEST_DURATION, STAGE_DURATION, LLM_REQUESTS, LLM_PROMPT_TOKENS, SINGLE_FLIGHT_REQUESTS, AI_JOBS, DB_ROUTED_STATEMENTS]
+_caches: Dict[str, Callable[[], dict]] = {}
+_pools: Dict[str, Callable[[], dict]] = {}
+
+def register_cache(name: str, stats: Callable[[], dict]) -> None:
+    """Exposes a cache whose stats() returns hits, misses and size (LRUCache.stats shape)."""
+    _caches[name] = stats
+
+def lru_stats(info) -> dict:
+    """Adapts functools.lru_cache's cache_info() to the stats() shape."""
+    lookups = info.hits + info.misses
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "hit_ratio": info.hits / lookups if lookups else 0.0}
+
+def _render_caches() -> List[str]:
+    stats = {name: collect() for name, collect in sorted(_caches.items())}
+    lines = []
+    for field, kind, help in (
+        ("hits", "counter", "Cache lookups answered from the cache."),
+        ("misses", "counter", "Cache lookups that had to compute the value."),
+        ("size", "gauge", "Entries currently held."),
+        ("hit_ratio", "gauge", "hits / (hits + misses) since the cache was last cleared."),
+    ):
+        name = f"cache_{field}_total" if kind == "counter" else f"cache_{field}"
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f'{name}{{cache="{cache}"}} {_format_value(values[field])}' for cache, values in stats.items())
+    return lines
+
+def register_pool(name: str, stats: Callable[[], dict]) -> None:
+    """Exposes a connection pool whose stats() returns checked_out, idle, overflow, capacity and saturation."""
+    _pools[name] = stats
+
+def _render_pools() -> List[str]:
+    stats = {name: values for name, values in ((name, collect()) for name, collect in sorted(_pools.items())) if values}
+    if not stats:
+        return []
+    lines = []
+    for field, help in (
+        ("checked_out", "Connections currently lent to sessions."),
+        ("idle", "Open connections waiting in the pool."),
+        ("overflow", "Connections open beyond pool_size."),
+        ("capacity", "pool_size + max_overflow: checkouts beyond this wait up to pool_timeout."),
+        ("saturation", "checked_out / capacity; at 1 new requests queue for a connection."),
+    ):
+        name = f"db_pool_{field}"
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f'{name}{{pool="{pool}"}} {_format_value(values[field])}' for pool, values in stats.items())
+    return lines
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.extend(_render_caches())
+    lines.extend(_render_pools())
+    return "\n".join(lines) + "\n"
+
+def reset_metrics() -> None:
+    for metric in _metrics:
+        metric.clear()
+
+# Spans
+
+# Stage name -> seconds for the request in flight; None when no header is wanted.
+# Threadpool calls run in a copy of the request context, so they add to the same dict.
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+def record_stage(stage: str, seconds: float) -> None:
+    STAGE_DURATION.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+class span:
+    """
+    Times a block as one stage:
+        with span("aggregate"):
+            ...
+    """
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> "span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        record_stage(self.stage, time.perf_counter() - self.started)
+
+def timed(stage: str):
+    """Decorator form of span for plain and async functions."""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# Every SQL statement on any engine counts as a "db" stage
+
+# The start time lives on the statement's execution context, not on the connection,
+# so a statement that raises (no after_cursor_execute) leaves nothing behind
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is not None:
+        record_stage("db", time.perf_counter() - started)
+
+def instrument_sqlalchemy() -> None:
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+# Requests
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"app;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+def _route_label(scope) -> str:
+    # The matched route's template (/analytics/{url_id}), never the raw path
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency by route and, when server_timing
+    is on, adding a Server-Timing header with the stages timed so far ("app" is
+    the time until the response started; streamed bodies continue after it).
+    """
+
+    def __init__(self, app, server_timing: Optional[bool] = None):
+        self.app = app
+        self.server_timing = server_timing  # None follows SERVER_TIMING
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        server_timing = SERVER_TIMING if self.server_timing is None else self.server_timing
+        timings = {} if server_timing else None
+        token = _request_timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timings is not None:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", server_timing_header(timings, time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            REQUEST_DURATION.observe(time.perf_counter() - started, scope["method"], _route_label(scope), str(status))
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, HttpUrl, model_validator
+from typing import Any, Dict, Literal, Optional, List, Union
 from datetime import datetime
 
 class AnalyticsData(BaseModel):
@@ -9,6 +9,8 @@ class AnalyticsData(BaseModel):
 
 class AICreateRequest(BaseModel):
     url_id: int
+    bypass_cache: bool = False
+    exclude_bots: bool = False  # summarize human traffic only
 
 class AICreateResponse(BaseModel):
     insight: str
@@ -32,6 +34,9 @@ class EnrichedVisit(BaseModel):
 class GraphInsightRequest(BaseModel):
     url_id: int
     graph_type: str
+    bypass_cache: bool = False
+    exclude_bots: bool = False
+    stream: bool = False  # respond with Server-Sent Events instead of JSON
 
 class GraphInsightResponse(BaseModel):
     insight: str
@@ -41,14 +46,49 @@ class ChatRequest(BaseModel):
     url_id: int
     message: str
     context: Optional[str] = None
+    bypass_cache: bool = False
+    exclude_bots: bool = False
+    stream: bool = False  # respond with Server-Sent Events instead of JSON
 
 class ChatResponse(BaseModel):
     response: str
     generated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class AIJobRequest(BaseModel):
+    kind: Literal["insight", "graph_insight", "chat"]
+    url_id: int
+    graph_type: Optional[str] = None  # graph_insight jobs
+    message: Optional[str] = None  # chat jobs
+    context: Optional[str] = None
+    bypass_cache: bool = False
+    exclude_bots: bool = False
+    user_id: Optional[Union[int, str]] = None  # jobs are scheduled round-robin per user (per url_id without one)
+    callback_url: Optional[HttpUrl] = None  # receives the finished job as a JSON POST; host must be in AI_JOB_CALLBACK_HOSTS
+
+    @model_validator(mode="after")
+    def check_kind_fields(self):
+        if self.kind == "graph_insight" and not self.graph_type:
+            raise ValueError("graph_type is required for graph_insight jobs")
+        if self.kind == "chat" and not self.message:
+            raise ValueError("message is required for chat jobs")
+        return self
+
+class AIJobResponse(BaseModel):
+    job_id: str
+    kind: str
+    url_id: Optional[int] = None
+    status: str  # queued, running, succeeded or failed
+    attempts: int
+    result: Optional[str] = None
+    error: Optional[str] = None  # last failure; a job being retried is queued again
+    created_at: datetime
+    updated_at: datetime
+    deduplicated: bool = False  # an identical job was already pending; this is that job
+
 class ClickOverTime(BaseModel):
     date: str  # or timestamp
     count: int
+    unique_visitors: Optional[int] = None  # HyperLogLog estimate, day/week/month points only
 
 class DeviceBreakdown(BaseModel):
     device: str
@@ -58,18 +98,64 @@ class BrowserBreakdown(BaseModel):
     browser: str
     count: int
 
+class OSBreakdown(BaseModel):
+    os: str
+    count: int
+
 class ReferrerBreakdown(BaseModel):
     referrer: str
     count: int
 
+class GeoBreakdown(BaseModel):
+    country: str
+    region: Optional[str] = None
+    city: Optional[str] = None
+    count: int
+
 class HourlyPattern(BaseModel):
     hour: int
     count: int
 
 class AnalyticsData(BaseModel):
     total_clicks: int
+    unique_visitors: Optional[int] = None  # HyperLogLog estimate, ~1.6% standard error
     clicks_over_time: List[ClickOverTime]
     device_breakdown: List[DeviceBreakdown]
     browser_breakdown: List[BrowserBreakdown]
+    os_breakdown: List[OSBreakdown] = []
     referrer_breakdown: List[ReferrerBreakdown]
-    hourly_pattern: List[HourlyPattern]
\ No newline at end of file
+    geo_breakdown: List[GeoBreakdown] = []
+    hourly_pattern: List[HourlyPattern]
+    bucket: Optional[str] = None  # clicks_over_time granularity when a range/bucket was requested
+
+class TopReferrer(BaseModel):
+    referrer: str  # referrer host, or "Direct"
+    clicks: int
+    error: int  # clicks may overstate the true count by at most this much
+
+class TopReferrersResponse(BaseModel):
+    url_id: Optional[int] = None  # None: across all links
+    referrers: List[TopReferrer]
+    lag: int = 0  # visit ids not yet counted in the tables
+
+class BatchAnalyticsRequest(BaseModel):
+    url_ids: List[int] = Field(..., min_length=1, max_length=1000)
+
+class ExportRequest(BaseModel):
+    url_ids: List[int] = Field(..., min_length=1, max_length=1000)
+    start: Optional[datetime] = Field(None, alias="from")
+    end: Optional[datetime] = Field(None, alias="to")
+    format: Literal["csv", "arrow", "parquet"] = "csv"
+
+    model_config = {"populate_by_name": True}
+
+class UrlAnalyticsData(AnalyticsData):
+    url_id: int
+
+class BatchAnalyticsResponse(BaseModel):
+    results: List[UrlAnalyticsData]
+
+class ReadinessResponse(BaseModel):
+    ready: bool
+    database: str  # "connected" or "unavailable"
+    resources: Dict[str, Any]  # engine, GeoIP reader, LLM key, heavy modules, warm-up
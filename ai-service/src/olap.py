@@ -0,0 +1,406 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+import os
+
+from sqlalchemy.orm import Session
+
+from .database import get_visit_batch
+from .enrichment import EnrichmentWorker, referrer_host
+from .geo import location_key, lookup_distinct
+from .metrics import timed
+from .rollups import GRANULARITY_ALL, ROLLUP_VALUE_MAX_LENGTH, _RangeRow, _analytics_from_rows, _to_utc_naive
+from .timeseries import choose_bucket, format_bucket, merge_points
+from .topk import HeavyHitter
+from .user_agents import bot_signatures_digest, classify_distinct, is_bot_user_agent
+
+# Config
+OLAP_PATH = os.getenv("OLAP_PATH", "analytics.duckdb")  # DuckDB file; ":memory:" rebuilds the copy after every restart
+OLAP_SYNC_BATCH_SIZE = int(os.getenv("OLAP_SYNC_BATCH_SIZE", "50000"))
+OLAP_SYNC_INTERVAL = float(os.getenv("OLAP_SYNC_INTERVAL", "5"))  # seconds the sync worker idles once caught up
+OLAP_WORKER = os.getenv("OLAP_WORKER", "1") == "1"  # only started with ANALYTICS_SOURCE=duckdb
+
+# Columnar analytics backend (ANALYTICS_SOURCE=duckdb): a DuckDB copy of visits
+# with the derived columns (device/OS/browser, referrer host, bot flag, location
+# key) computed once while copying. It follows visits by id watermark, in
+# batches, so the group-bys run here instead of competing with the redirect
+# path's inserts. The sync worker does the copying (including the initial
+# build); a read catches up by one batch at most and, while the copy is further
+# behind than that, is answered from the rollups instead (see catch_up). Like
+# the rollups, it only ever appends: visits deleted upstream stay counted. The
+# copy records the bot signature set it was derived with and starts over when
+# another one is active, as enrichment.rederive_batch does for the source visits.
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS visits (
+        id BIGINT NOT NULL,
+        url_id INTEGER NOT NULL,
+        clicked_at TIMESTAMP NOT NULL,
+        visitor_ip_hash VARCHAR,
+        referer VARCHAR,
+        referrer_host VARCHAR,
+        device_type VARCHAR,
+        os VARCHAR,
+        browser VARCHAR,
+        is_bot BOOLEAN NOT NULL,
+        location VARCHAR
+    );
+    CREATE TABLE IF NOT EXISTS sync_state (
+        name VARCHAR PRIMARY KEY,
+        last_visit_id BIGINT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS sync_signatures (
+        name VARCHAR PRIMARY KEY,
+        digest VARCHAR NOT NULL
+    );
+"""
+
+# Breakdown columns, grouped in one pass with GROUPING SETS; "total" is the empty set
+_DIMENSIONS = (
+    ("device", "device_type"),
+    ("browser", "browser"),
+    ("os", "os"),
+    ("referrer", f"LEFT(COALESCE(referer, 'Direct'), {ROLLUP_VALUE_MAX_LENGTH})"),
+    ("geo", "location"),
+    ("hour_of_day", "CAST(hour(clicked_at) AS VARCHAR)"),
+)
+
+def _visit_frame(rows):
+    """One batch of source visits as a DataFrame in the DuckDB column layout."""
+    import pandas as pd
+
+    user_agents = classify_distinct(row.user_agent for row in rows)
+    bots = {user_agent: is_bot_user_agent(user_agent) for user_agent in user_agents}
+    locations = {prefix: location_key(location) for prefix, location in lookup_distinct(row.visitor_ip_prefix for row in rows).items()}
+    hosts = {referer: referrer_host(referer) for referer in {row.referer for row in rows}}
+    return pd.DataFrame({
+        "id": [row.id for row in rows],
+        "url_id": [row.url_id for row in rows],
+        "clicked_at": pd.to_datetime([_to_utc_naive(row.clicked_at) for row in rows]),
+        "visitor_ip_hash": [row.visitor_ip_hash for row in rows],
+        "referer": [row.referer for row in rows],
+        "referrer_host": [host[:255] if host else None for host in (hosts[row.referer] for row in rows)],
+        "device_type": [user_agents[row.user_agent].device_type for row in rows],
+        "os": [user_agents[row.user_agent].os for row in rows],
+        "browser": [user_agents[row.user_agent].browser for row in rows],
+        "is_bot": [bots[row.user_agent] for row in rows],
+        "location": [locations[row.visitor_ip_prefix] for row in rows],
+    })
+
+class OlapStore:
+    """
+    The DuckDB database behind ANALYTICS_SOURCE=duckdb. Opened on first use;
+    each read runs on its own cursor, and syncs are serialized.
+    """
+
+    def __init__(self, path: str = OLAP_PATH):
+        self.path = path
+        self._connection = None
+        self._connect_lock = Lock()
+        self._sync_lock = Lock()
+        self._digest = None  # signature set the copy is known to be derived with
+
+    def _connect(self):
+        if self._connection is None:
+            with self._connect_lock:
+                if self._connection is None:
+                    try:
+                        import duckdb
+                    except ImportError as e:
+                        raise RuntimeError("ANALYTICS_SOURCE=duckdb requires the duckdb package") from e
+                    connection = duckdb.connect(self.path)
+                    connection.execute(_SCHEMA)
+                    self._connection = connection
+        return self._connection
+
+    def query(self, sql: str, params: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        cursor = self._connect().cursor()
+        try:
+            return cursor.execute(sql, params or {}).fetchall()
+        finally:
+            cursor.close()
+
+    def watermark(self) -> int:
+        rows = self.query("SELECT last_visit_id FROM sync_state WHERE name = 'visits'")
+        return rows[0][0] if rows else 0
+
+    def _match_signatures(self) -> None:
+        """
+        Empties the copy when it was derived with another bot signature set (or
+        with an unrecorded one); reads fall back to the rollups until it is copied
+        again. Called under the sync lock.
+        """
+        digest = bot_signatures_digest()
+        if self._digest == digest:
+            return
+        rows = self.query("SELECT digest FROM sync_signatures WHERE name = 'visits'")
+        if not rows or rows[0][0] != digest:
+            cursor = self._connect().cursor()
+            try:
+                cursor.execute("BEGIN TRANSACTION")
+                try:
+                    cursor.execute("DELETE FROM visits")
+                    cursor.execute("INSERT OR REPLACE INTO sync_state (name, last_visit_id) VALUES ('visits', 0)")
+                    cursor.execute(
+                        "INSERT OR REPLACE INTO sync_signatures (name, digest) VALUES ('visits', $digest)",
+                        {"digest": digest},
+                    )
+                    cursor.execute("COMMIT")
+                except BaseException:
+                    cursor.execute("ROLLBACK")
+                    raise
+            finally:
+                cursor.close()
+        self._digest = digest
+
+    @timed("olap_sync")
+    def sync_batch(self, db: Session, batch_size: int = OLAP_SYNC_BATCH_SIZE) -> int:
+        """Copies the next batch of visits past the watermark; returns how many were read."""
+        with self._sync_lock:
+            self._match_signatures()
+            rows = get_visit_batch(db, self.watermark(), batch_size)
+            if not rows:
+                return 0
+            frame = _visit_frame(rows)
+            cursor = self._connect().cursor()
+            try:
+                cursor.register("batch", frame)
+                # Rows and watermark in one transaction, so a batch is never counted twice
+                cursor.execute("BEGIN TRANSACTION")
+                try:
+                    cursor.execute("""
+                        INSERT INTO visits
+                        SELECT id, url_id, CAST(clicked_at AS TIMESTAMP), CAST(visitor_ip_hash AS VARCHAR),
+                               CAST(referer AS VARCHAR), CAST(referrer_host AS VARCHAR), CAST(device_type AS VARCHAR),
+                               CAST(os AS VARCHAR), CAST(browser AS VARCHAR), is_bot, CAST(location AS VARCHAR)
+                        FROM batch
+                    """)
+                    cursor.execute(
+                        "INSERT OR REPLACE INTO sync_state (name, last_visit_id) VALUES ('visits', $last_visit_id)",
+                        {"last_visit_id": rows[-1].id},
+                    )
+                    cursor.execute("COMMIT")
+                except BaseException:
+                    cursor.execute("ROLLBACK")
+                    raise
+            finally:
+                cursor.close()
+            return len(rows)
+
+    def sync(self, db: Session, batch_size: int = OLAP_SYNC_BATCH_SIZE) -> int:
+        """Copies batches until caught up with the source visits table."""
+        copied = 0
+        while True:
+            count = self.sync_batch(db, batch_size)
+            copied += count
+            if count < batch_size:
+                return copied
+
+    def catch_up(self, db: Session) -> bool:
+        """
+        Read-path sync: copies one batch at most, so a request never builds the copy
+        (OlapSyncWorker does). True when the copy is current.
+        """
+        return self.sync_batch(db, OLAP_SYNC_BATCH_SIZE) < OLAP_SYNC_BATCH_SIZE
+
+    def close(self) -> None:
+        with self._connect_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+                self._digest = None
+
+olap_store = OlapStore()
+
+class OlapSyncWorker(EnrichmentWorker):
+    """Keeps the DuckDB copy caught up with new visits between reads."""
+
+    thread_name = "olap-sync"
+
+    def __init__(self, session_factory, store: Optional[OlapStore] = None, interval: float = OLAP_SYNC_INTERVAL,
+                 batch_size: int = OLAP_SYNC_BATCH_SIZE):
+        super().__init__(session_factory, interval=interval, batch_size=batch_size)
+        self.store = store or olap_store
+
+    def step(self, db: Session) -> int:
+        return self.store.sync_batch(db, self.batch_size)
+
+# Reads
+
+def _filters(start: Optional[datetime], end: Optional[datetime], exclude_bots: bool) -> str:
+    clauses = ["url_id = $url_id"]
+    if start is not None:
+        clauses.append("clicked_at >= $start")
+    if end is not None:
+        clauses.append("clicked_at < $end")
+    if exclude_bots:
+        clauses.append("NOT is_bot")
+    return " AND ".join(clauses)
+
+def _params(url_id: int, start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    params: Dict[str, Any] = {"url_id": url_id}
+    if start is not None:
+        params["start"] = start
+    if end is not None:
+        params["end"] = end
+    return params
+
+def _breakdown_rows(store: OlapStore, where: str, params: Dict[str, Any]) -> Dict[int, List[_RangeRow]]:
+    """Totals and every breakdown per url from one scan, as all-time rollup rows."""
+    expressions = [expression for _, expression in _DIMENSIONS]
+    rows = store.query(f"""
+        SELECT url_id, GROUPING({", ".join(expressions)}) AS grouping_set, {", ".join(expressions)}, COUNT(*) AS clicks
+        FROM visits
+        WHERE {where}
+        GROUP BY GROUPING SETS ({", ".join(f"(url_id, {expression})" for expression in expressions)}, (url_id))
+    """, params)
+    # GROUPING() sets one bit per expression left out of the set, first expression highest
+    full_mask = (1 << len(_DIMENSIONS)) - 1
+    dimension_by_mask = {full_mask: ("total", None)}
+    for index, (dimension, _) in enumerate(_DIMENSIONS):
+        dimension_by_mask[full_mask ^ (1 << (len(_DIMENSIONS) - 1 - index))] = (dimension, index)
+    result = defaultdict(list)
+    for row in rows:
+        dimension, index = dimension_by_mask[row[1]]
+        value = "" if index is None else row[2 + index]
+        if value is None:
+            continue
+        result[row[0]].append(_RangeRow(GRANULARITY_ALL, dimension, value, int(row[-1])))
+    return result
+
+def _series(store: OlapStore, where: str, params: Dict[str, Any], bucket: str) -> List[Tuple[datetime, int, int]]:
+    return store.query(f"""
+        SELECT date_trunc('{bucket}', clicked_at) AS bucket, COUNT(*), COUNT(DISTINCT visitor_ip_hash)
+        FROM visits
+        WHERE {where}
+        GROUP BY 1
+        ORDER BY 1
+    """, params)
+
+@timed("olap")
+def get_olap_analytics(
+    db: Session,
+    url_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Optional[str] = None,
+    max_points: int = 500,
+    exclude_bots: bool = False,
+    store: Optional[OlapStore] = None,
+    sync: bool = True,
+) -> dict:
+    """
+    The get_full_analytics payload computed in DuckDB. Without a bucket it has the
+    default shape (daily series, all history); with one, the range shape of
+    get_range_analytics. Unique visitors are exact COUNT(DISTINCT)s here rather
+    than HyperLogLog estimates.
+    """
+    store = store or olap_store
+    if sync:
+        store.sync(db)
+    start = _to_utc_naive(start) if start is not None else None
+    end = _to_utc_naive(end) if end is not None else None
+    if start is not None and end is not None and start >= end:
+        raise ValueError("'from' must be earlier than 'to'")
+    where, params = _filters(start, end, exclude_bots), _params(url_id, start, end)
+
+    result = _analytics_from_rows(_breakdown_rows(store, where, params)[url_id])
+    total = store.query(f"SELECT COUNT(DISTINCT visitor_ip_hash), MIN(clicked_at) FROM visits WHERE {where}", params)[0]
+    result["unique_visitors"] = int(total[0])
+
+    if bucket is None:
+        result["clicks_over_time"] = [
+            {"date": format_bucket(day, "day"), "count": int(count), "unique_visitors": int(visitors)}
+            for day, count, visitors in _series(store, where, params, "day")
+        ]
+        return result
+
+    first = start or total[1]
+    bucket = choose_bucket(first or datetime.utcnow(), end or datetime.utcnow(), bucket, max_points)
+    points = []
+    for value, count, visitors in _series(store, where, params, bucket):
+        point = {"date": format_bucket(value, bucket), "count": int(count)}
+        # Like the rollup path: per-point uniques only for whole-day buckets
+        if bucket in ("day", "week", "month"):
+            point["unique_visitors"] = int(visitors)
+        points.append(point)
+    result["clicks_over_time"] = merge_points(points, max_points)
+    result["bucket"] = bucket
+    return result
+
+@timed("olap")
+def get_olap_analytics_for_urls(db: Session, url_ids: List[int], store: Optional[OlapStore] = None,
+                                sync: bool = True) -> Dict[int, dict]:
+    """
+    get_olap_analytics' default payload for many urls, keyed by url_id, from three
+    grouped scans over url_id IN (...) whatever the url count.
+    """
+    store = store or olap_store
+    if sync:
+        store.sync(db)
+    where, params = "url_id IN (SELECT UNNEST($url_ids))", {"url_ids": list(url_ids)}
+    rows_by_url = _breakdown_rows(store, where, params)
+    uniques = dict(store.query(
+        f"SELECT url_id, COUNT(DISTINCT visitor_ip_hash) FROM visits WHERE {where} GROUP BY url_id", params,
+    ))
+    daily = defaultdict(list)
+    for url_id, day, count, visitors in store.query(f"""
+        SELECT url_id, date_trunc('day', clicked_at) AS day, COUNT(*), COUNT(DISTINCT visitor_ip_hash)
+        FROM visits
+        WHERE {where}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """, params):
+        daily[url_id].append({"date": format_bucket(day, "day"), "count": int(count), "unique_visitors": int(visitors)})
+
+    results = {}
+    for url_id in url_ids:
+        result = _analytics_from_rows(rows_by_url[url_id])
+        result["unique_visitors"] = int(uniques.get(url_id, 0))
+        result["clicks_over_time"] = daily[url_id]
+        results[url_id] = result
+    return results
+
+@timed("olap")
+def get_olap_summary_data(db: Session, url_id: int, exclude_bots: bool = False, store: Optional[OlapStore] = None,
+                          sync: bool = True) -> Optional[Tuple[dict, Dict[str, Counter], int, List[HeavyHitter]]]:
+    """
+    Inputs for analytics._build_common_summary from DuckDB: (totals and hourly series,
+    breakdown counters, unique visitors, top 3 referrer hosts), or None without visits.
+    """
+    store = store or olap_store
+    if sync:
+        store.sync(db)
+    where, params = _filters(None, None, exclude_bots), _params(url_id, None, None)
+    total_clicks, unique_visitors = store.query(
+        f"SELECT COUNT(*), COUNT(DISTINCT visitor_ip_hash) FROM visits WHERE {where}", params,
+    )[0]
+    if not total_clicks:
+        return None
+
+    bundle = {
+        "total_clicks": int(total_clicks),
+        "clicks_over_time": [
+            {"timestamp": hour, "count": int(count)} for hour, count, _ in _series(store, where, params, "hour")
+        ],
+    }
+    names = ("device", "os", "browser", "geo", "referrer_host")
+    breakdowns = {name: Counter() for name in names}
+    rows = store.query(f"""
+        SELECT GROUPING(device_type, os, browser, location, referrer_host), device_type, os, browser, location, referrer_host,
+               COUNT(*)
+        FROM visits
+        WHERE {where}
+        GROUP BY GROUPING SETS ((device_type), (os), (browser), (location), (referrer_host))
+        ORDER BY ALL
+    """, params)
+    # Each row belongs to a single-column set: the one bit GROUPING() leaves clear
+    full_mask = (1 << len(names)) - 1
+    index_by_mask = {full_mask ^ (1 << (len(names) - 1 - index)): index for index in range(len(names))}
+    for row in rows:
+        index = index_by_mask[row[0]]
+        if row[1 + index] is not None:
+            breakdowns[names[index]][row[1 + index]] += int(row[-1])
+    referrers = sorted(breakdowns["referrer_host"].items(), key=lambda item: (-item[1], item[0]))[:3]
+    return bundle, breakdowns, int(unique_visitors), [HeavyHitter(host, count, 0) for host, count in referrers]
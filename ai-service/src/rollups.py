@@ -0,0 +1,453 @@
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+import os
+import weakref
+
+from .database import GroupedVisits, _bucket_sql, get_click_series, get_visit_id_window, group_visits
+from .geo import GEO_BREAKDOWN_LIMIT, geo_breakdown, location_key, lookup_ip
+from .metrics import timed
+from .sketches import attach_unique_visitors, ensure_sketch_table, load_day_sketches, rebuild_human_sketches, update_sketches
+from .user_agents import classify_user_agent, is_bot_user_agent
+
+# Config
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "5000"))
+ROLLUP_VALUE_MAX_LENGTH = 512  # keeps long referers inside the primary key index limits
+
+# Granularities kept per url_id. "all" is a single all-time bucket so the
+# dashboard breakdowns are read from a handful of rows regardless of traffic.
+GRANULARITY_HOUR = "hour"
+GRANULARITY_DAY = "day"
+GRANULARITY_ALL = "all"
+ALL_TIME_BUCKET = datetime(1970, 1, 1)
+
+# Dimensions counted at every granularity ("total" uses an empty value, "geo"
+# a "country|region|city" key and skips visits that could not be located)
+ROLLUP_DIMENSIONS = ("total", "device", "browser", "os", "referrer", "geo")
+
+_initialized_engines = weakref.WeakSet()
+
+# Table management
+
+def ensure_rollup_tables(db: Session) -> None:
+    engine = db.get_bind()
+    if engine in _initialized_engines:
+        return
+
+    db.execute(text("""
+        CREATE TABLE IF NOT EXISTS visit_rollups (
+            url_id INTEGER NOT NULL,
+            granularity VARCHAR(8) NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            dimension VARCHAR(16) NOT NULL,
+            value TEXT NOT NULL,
+            count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (url_id, granularity, bucket_start, dimension, value)
+        )
+    """))
+    db.execute(text("""
+        CREATE TABLE IF NOT EXISTS rollup_watermarks (
+            url_id INTEGER PRIMARY KEY,
+            last_visit_id BIGINT NOT NULL DEFAULT 0
+        )
+    """))
+    db.commit()
+    _initialized_engines.add(engine)
+
+# Helper functions
+
+def _to_utc_naive(value: Any) -> datetime:
+    # SQLite hands timestamps back as strings, Postgres as tz-aware datetimes
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+# Enrichment-column dimensions grouped in SQL; "ip_prefix" rows become "geo" counters
+ROLLUP_GROUPS = ("total", "device", "browser", "os", "referrer", "ip_prefix")
+
+def fold_groups(rows) -> Counter:
+    """
+    Folds hourly group counts (see database.group_visits with by_hour=True) into
+    rollup counters keyed by (granularity, bucket_start, dimension, value).
+    Day and all-time buckets are summed from the hourly rows; missing values are dropped.
+    """
+    counters = Counter()
+    for row in rows:
+        dimension, value = row.dimension, row.value
+        if dimension == "referrer":
+            value = (value if value is not None else "Direct")[:ROLLUP_VALUE_MAX_LENGTH]
+        elif dimension == "ip_prefix":
+            dimension, value = "geo", location_key(lookup_ip(value))
+        if value is None:
+            continue
+        hour, count = _to_utc_naive(row.bucket), int(row.clicks)
+        counters[(GRANULARITY_HOUR, hour, dimension, value)] += count
+        counters[(GRANULARITY_DAY, hour.replace(hour=0), dimension, value)] += count
+        counters[(GRANULARITY_ALL, ALL_TIME_BUCKET, dimension, value)] += count
+        if dimension == "total":
+            # Hour-of-day pattern only makes sense as an all-time counter
+            counters[(GRANULARITY_ALL, ALL_TIME_BUCKET, "hour_of_day", str(hour.hour))] += count
+    return counters
+
+def _get_watermark(db: Session, url_id: int) -> int:
+    row = db.execute(
+        text("SELECT last_visit_id FROM rollup_watermarks WHERE url_id = :url_id"),
+        {"url_id": url_id},
+    ).fetchone()
+    return row.last_visit_id if row else 0
+
+def _upsert_counters(db: Session, url_id: int, counters: Counter) -> None:
+    if not counters:
+        return
+    db.execute(
+        text("""
+            INSERT INTO visit_rollups (url_id, granularity, bucket_start, dimension, value, count)
+            VALUES (:url_id, :granularity, :bucket_start, :dimension, :value, :count)
+            ON CONFLICT (url_id, granularity, bucket_start, dimension, value)
+            DO UPDATE SET count = visit_rollups.count + excluded.count
+        """),
+        [
+            {
+                "url_id": url_id,
+                "granularity": granularity,
+                "bucket_start": bucket_start,
+                "dimension": dimension,
+                "value": value,
+                "count": count,
+            }
+            for (granularity, bucket_start, dimension, value), count in counters.items()
+        ],
+    )
+
+# Incremental refresh
+
+@timed("rollups")
+def refresh_rollups(db: Session, url_id: int, batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """
+    Folds every settled visit newer than the url's high-water mark into the
+    rollups (see database.get_visit_id_window). Returns the number of visits folded in.
+
+    Each batch claims its range by moving the watermark with a compare-and-set
+    UPDATE before writing counters, so concurrent refreshes never double count.
+    Counts are grouped in SQL on the persisted enrichment columns (see
+    database.group_visits for visits not enriched yet). The sketch tables are
+    created here too, so reads that follow a refresh never issue DDL.
+    """
+    ensure_rollup_tables(db)
+    ensure_sketch_table(db)
+    db.execute(
+        text("""
+            INSERT INTO rollup_watermarks (url_id, last_visit_id)
+            VALUES (:url_id, 0)
+            ON CONFLICT (url_id) DO NOTHING
+        """),
+        {"url_id": url_id},
+    )
+    db.commit()
+
+    folded = 0
+    while True:
+        watermark = _get_watermark(db, url_id)
+        new_watermark, batch_visits = get_visit_id_window(db, url_id, watermark, limit=batch_size)
+        if not batch_visits:
+            db.commit()
+            return folded
+
+        claimed = db.execute(
+            text("""
+                UPDATE rollup_watermarks
+                SET last_visit_id = :new_watermark
+                WHERE url_id = :url_id AND last_visit_id = :watermark
+            """),
+            {"url_id": url_id, "watermark": watermark, "new_watermark": new_watermark},
+        )
+        if claimed.rowcount == 0:
+            # Another worker folded this range first; re-read the watermark
+            db.rollback()
+            continue
+
+        rows = group_visits(db, url_id, ROLLUP_GROUPS, by_hour=True, after_id=watermark, upto_id=new_watermark)
+        _upsert_counters(db, url_id, fold_groups(rows))
+        update_sketches(db, url_id, watermark, new_watermark)
+        db.commit()
+        folded += batch_visits
+
+        if batch_visits < batch_size:
+            return folded
+
+def refresh_rollups_for_urls(db: Session, url_ids: Iterable[int], batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """
+    Brings the rollups of many urls up to date. One statement seeds missing
+    watermarks and one finds the urls with visits past their watermark; only
+    those are refreshed, so an idle dashboard costs two queries, not one per url.
+    """
+    url_ids = list(url_ids)
+    if not url_ids:
+        return 0
+    ensure_rollup_tables(db)
+    ensure_sketch_table(db)
+    db.execute(
+        text("""
+            INSERT INTO rollup_watermarks (url_id, last_visit_id)
+            VALUES (:url_id, 0)
+            ON CONFLICT (url_id) DO NOTHING
+        """),
+        [{"url_id": url_id} for url_id in url_ids],
+    )
+    pending = db.execute(
+        text("""
+            SELECT w.url_id
+            FROM rollup_watermarks w
+            WHERE w.url_id IN :url_ids
+              AND EXISTS (
+                  SELECT 1 FROM visits v
+                  WHERE v.url_id = w.url_id AND v.id > w.last_visit_id
+              )
+        """).bindparams(bindparam("url_ids", expanding=True)),
+        {"url_ids": url_ids},
+    ).scalars().all()
+    db.commit()
+    return sum(refresh_rollups(db, url_id, batch_size=batch_size) for url_id in pending)
+
+def refold_visits(db: Session, rows) -> None:
+    """
+    Moves visits already folded into the rollups from the counters of their saved
+    device/OS/browser to those of the active classification, and rebuilds the
+    human sketches of the days where a bot flag flips. For visits whose
+    enrichment columns are being rewritten (see enrichment.rederive_batch): rows
+    carry the saved columns, and this runs in the caller's transaction, after the
+    rewrite.
+    """
+    if not rows:
+        return
+    ensure_rollup_tables(db)
+    lock = "" if db.get_bind().dialect.name == "sqlite" else "FOR UPDATE"
+    # Locked watermarks hold off refreshes until the rewrite commits, so every
+    # visit up to them was folded with its saved columns
+    watermarks = dict(db.execute(
+        text(f"""
+            SELECT url_id, last_visit_id FROM rollup_watermarks
+            WHERE url_id IN :url_ids
+            ORDER BY url_id
+            {lock}
+        """).bindparams(bindparam("url_ids", expanding=True)),
+        {"url_ids": sorted({row.url_id for row in rows})},
+    ).fetchall())
+
+    moved = defaultdict(list)
+    flipped = defaultdict(set)
+    for row in rows:
+        if row.id > watermarks.get(row.url_id, 0):
+            continue
+        hour = _to_utc_naive(row.clicked_at).replace(minute=0, second=0, microsecond=0)
+        saved = (row.device_type, row.os, row.browser)
+        for dimension, old, new in zip(("device", "os", "browser"), saved, classify_user_agent(row.user_agent)):
+            if old != new:
+                moved[row.url_id] += [GroupedVisits(hour, dimension, old, -1), GroupedVisits(hour, dimension, new, 1)]
+        if bool(row.is_bot) != is_bot_user_agent(row.user_agent):
+            flipped[row.url_id].add(hour.replace(hour=0))
+
+    for url_id, groups in moved.items():
+        _upsert_counters(db, url_id, fold_groups(groups))
+    if moved:
+        db.execute(
+            text("DELETE FROM visit_rollups WHERE url_id IN :url_ids AND count <= 0")
+            .bindparams(bindparam("url_ids", expanding=True)),
+            {"url_ids": list(moved)},
+        )
+    for url_id, days in flipped.items():
+        rebuild_human_sketches(db, url_id, sorted(days), watermarks[url_id])
+
+# Reads
+
+def get_rollup_analytics(db: Session, url_id: int) -> dict:
+    """
+    Builds the /analytics payload from the all-time and daily rollups.
+    """
+    return get_rollup_analytics_for_urls(db, [url_id])[url_id]
+
+def get_rollup_analytics_for_urls(db: Session, url_ids: Iterable[int]) -> Dict[int, dict]:
+    """
+    Builds /analytics payloads for many urls from a single rollup query (plus one
+    for their unique-visitor sketches).
+    """
+    rows_by_url: Dict[int, list] = {url_id: [] for url_id in url_ids}
+    if not rows_by_url:
+        return {}
+    ensure_rollup_tables(db)
+    rows = db.execute(
+        text("""
+            SELECT url_id, granularity, bucket_start, dimension, value, count
+            FROM visit_rollups
+            WHERE url_id IN :url_ids
+              AND (granularity = :all_granularity
+                   OR (granularity = :day_granularity AND dimension = 'total'))
+        """).bindparams(bindparam("url_ids", expanding=True)),
+        {"url_ids": list(rows_by_url), "all_granularity": GRANULARITY_ALL, "day_granularity": GRANULARITY_DAY},
+    ).fetchall()
+    for row in rows:
+        rows_by_url[row.url_id].append(row)
+    sketches = load_day_sketches(db, rows_by_url)
+    return {
+        url_id: attach_unique_visitors(_analytics_from_rows(url_rows), sketches[url_id])
+        for url_id, url_rows in rows_by_url.items()
+    }
+
+def _analytics_from_rows(rows) -> dict:
+    total_clicks = 0
+    daily: List[dict] = []
+    breakdowns: Dict[str, Dict[str, int]] = {dimension: {} for dimension in ROLLUP_DIMENSIONS + ("hour_of_day",)}
+    for row in rows:
+        if row.granularity == GRANULARITY_DAY:
+            daily.append({"date": _to_utc_naive(row.bucket_start).date().isoformat(), "count": int(row.count)})
+        elif row.dimension == "total":
+            total_clicks = int(row.count)
+        else:
+            breakdowns[row.dimension][row.value] = int(row.count)
+
+    def ranked(dimension: str, key: str, limit: Optional[int] = None) -> List[dict]:
+        items = sorted(breakdowns[dimension].items(), key=lambda item: (-item[1], item[0]))
+        return [{key: value, "count": count} for value, count in items[:limit]]
+
+    return {
+        "total_clicks": total_clicks,
+        "clicks_over_time": sorted(daily, key=lambda item: item["date"]),
+        "device_breakdown": ranked("device", "device"),
+        "browser_breakdown": ranked("browser", "browser"),
+        "os_breakdown": ranked("os", "os"),
+        "referrer_breakdown": ranked("referrer", "referrer", limit=10),
+        "geo_breakdown": geo_breakdown(breakdowns["geo"], limit=GEO_BREAKDOWN_LIMIT),
+        "hourly_pattern": sorted(
+            ({"hour": int(hour), "count": count} for hour, count in breakdowns["hour_of_day"].items()),
+            key=lambda item: item["hour"],
+        ),
+    }
+
+# Range reads (arbitrary [start, end) windows aligned to the chosen granularity)
+
+def _bucket_range_sql(start: Optional[datetime], end: Optional[datetime]) -> str:
+    clauses = []
+    if start is not None:
+        clauses.append("AND bucket_start >= :start")
+    if end is not None:
+        clauses.append("AND bucket_start < :end")
+    return " ".join(clauses)
+
+class _RangeRow(NamedTuple):
+    granularity: str
+    dimension: str
+    value: str
+    count: int
+
+def _hour_of_day_sql(db: Session) -> str:
+    if db.get_bind().dialect.name == "sqlite":
+        return "CAST(strftime('%H', bucket_start) AS INTEGER)"
+    return "CAST(EXTRACT(HOUR FROM bucket_start) AS INTEGER)"
+
+def get_first_rollup_bucket(db: Session, url_id: int) -> Optional[datetime]:
+    ensure_rollup_tables(db)
+    value = db.execute(
+        text("""
+            SELECT MIN(bucket_start) FROM visit_rollups
+            WHERE url_id = :url_id AND granularity = :granularity AND dimension = 'total'
+        """),
+        {"url_id": url_id, "granularity": GRANULARITY_HOUR},
+    ).scalar()
+    return _to_utc_naive(value) if value is not None else None
+
+def get_rollup_series(
+    db: Session, url_id: int, granularity: str, bucket: str,
+    start: Optional[datetime] = None, end: Optional[datetime] = None,
+) -> List[dict]:
+    """
+    Click counts per bucket, re-truncated in SQL from hour or day rollups.
+    start/end must be aligned to granularity for the window to be exact.
+    """
+    ensure_rollup_tables(db)
+    rows = db.execute(
+        text(f"""
+            SELECT {_bucket_sql(db, bucket, "bucket_start")} AS bucket, SUM(count) AS clicks
+            FROM visit_rollups
+            WHERE url_id = :url_id AND granularity = :granularity AND dimension = 'total'
+              {_bucket_range_sql(start, end)}
+            GROUP BY 1
+            ORDER BY 1
+        """),
+        {"url_id": url_id, "granularity": granularity, "start": start, "end": end},
+    ).fetchall()
+    return [{"bucket": row.bucket, "count": int(row.clicks)} for row in rows]
+
+def get_rollup_range_analytics(
+    db: Session, url_id: int, granularity: str,
+    start: Optional[datetime] = None, end: Optional[datetime] = None,
+) -> dict:
+    """
+    Totals and breakdowns for a window, summed in SQL from hour or day rollups
+    (the hour-of-day pattern always comes from hour rollups). clicks_over_time is
+    left empty; see get_rollup_series.
+    """
+    ensure_rollup_tables(db)
+    params = {"url_id": url_id, "granularity": granularity, "start": start, "end": end}
+    rows = db.execute(
+        text(f"""
+            SELECT dimension, value, SUM(count) AS count
+            FROM visit_rollups
+            WHERE url_id = :url_id AND granularity = :granularity
+              {_bucket_range_sql(start, end)}
+            GROUP BY dimension, value
+        """),
+        params,
+    ).fetchall()
+    hours = db.execute(
+        text(f"""
+            SELECT {_hour_of_day_sql(db)} AS hour, SUM(count) AS count
+            FROM visit_rollups
+            WHERE url_id = :url_id AND granularity = :granularity AND dimension = 'total'
+              {_bucket_range_sql(start, end)}
+            GROUP BY 1
+        """),
+        {**params, "granularity": GRANULARITY_HOUR},
+    ).fetchall()
+
+    # Reuse the all-time row layout: each summed row is an "all" bucket
+    summed = [
+        _RangeRow(GRANULARITY_ALL, row.dimension, row.value, row.count) for row in rows
+    ] + [
+        _RangeRow(GRANULARITY_ALL, "hour_of_day", str(row.hour), row.count) for row in hours
+    ]
+    return _analytics_from_rows(summed)
+
+def get_window_analytics(db: Session, url_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         exclude_bots: bool = False) -> dict:
+    """
+    Same payload as get_rollup_range_analytics for windows that do not line up
+    with rollup buckets, or that leave bots out (the rollups count every visit):
+    counted straight from visits, grouped in SQL on the enrichment columns and
+    folded the same way.
+    """
+    counters = fold_groups(group_visits(
+        db, url_id, ROLLUP_GROUPS, by_hour=True, start=start, end=end, exclude_bots=exclude_bots,
+    ))
+    return _analytics_from_rows([
+        _RangeRow(granularity, dimension, value, count)
+        for (granularity, _, dimension, value), count in counters.items()
+        if granularity == GRANULARITY_ALL
+    ])
+
+def get_human_analytics(db: Session, url_id: int) -> dict:
+    """
+    The get_rollup_analytics payload (all history, daily series) without bots.
+    The rollups count every visit, so the breakdowns and the series are grouped
+    from visits, as in get_window_analytics; unique visitors, overall and per
+    day, come from the human sketches kept by refresh_rollups.
+    """
+    result = get_window_analytics(db, url_id, exclude_bots=True)
+    result["clicks_over_time"] = [
+        {"date": _to_utc_naive(point["bucket"]).date().isoformat(), "count": int(point["count"])}
+        for point in get_click_series(db, url_id, "day", exclude_bots=True)
+    ]
+    return attach_unique_visitors(result, load_day_sketches(db, [url_id], humans=True)[url_id])
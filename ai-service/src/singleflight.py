@@ -0,0 +1,87 @@
+from threading import Event, Lock
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+
+from .metrics import SINGLE_FLIGHT_REQUESTS
+
+# Request coalescing: while a computation for a key is running, identical calls
+# wait for it and share its result (or exception) instead of repeating the SQL,
+# pandas or LLM work. Nothing outlives the call; remembering results is left to
+# the caches in front of it. Shared results must be treated as read-only.
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesces calls from threads (sync endpoints and run_in_threadpool work)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            SINGLE_FLIGHT_REQUESTS.inc(self.name, "coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLE_FLIGHT_REQUESTS.inc(self.name, "executed")
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+class AsyncSingleFlight:
+    """
+    Coalesces coroutine calls on one event loop. The work runs as its own task and
+    every caller awaits it shielded, so a caller that disconnects does not cancel
+    it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda finished: self._finished(key, finished))
+            SINGLE_FLIGHT_REQUESTS.inc(self.name, "executed")
+        else:
+            SINGLE_FLIGHT_REQUESTS.inc(self.name, "coalesced")
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Marks the exception retrieved even if every caller has gone away
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
@@ -0,0 +1,211 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, Optional
+import weakref
+
+from .database import _bot_filter, _bucket_sql, _utc_clicked_at_sql, _time_params, _time_range_sql
+from .hll import HyperLogLog
+from .user_agents import is_bot_user_agent
+
+# Unique visitors are HyperLogLog sketches of visitor_ip_hash, one per url per
+# UTC day, so any set of days or urls can be merged without rescanning visits.
+# Human visitors (exclude_bots) get their own sketches, of the visits the bot
+# filter keeps, in a table of the same layout.
+SKETCH_TABLES = {False: "visitor_sketches", True: "human_visitor_sketches"}
+
+_initialized_engines = weakref.WeakSet()
+
+def ensure_sketch_table(db: Session) -> None:
+    engine = db.get_bind()
+    if engine in _initialized_engines:
+        return
+    blob_type = "BLOB" if engine.dialect.name == "sqlite" else "BYTEA"
+    for table in SKETCH_TABLES.values():
+        db.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                url_id INTEGER NOT NULL,
+                day TIMESTAMP NOT NULL,
+                registers {blob_type} NOT NULL,
+                PRIMARY KEY (url_id, day)
+            )
+        """))
+    db.commit()
+    _initialized_engines.add(engine)
+
+def _to_day(value) -> datetime:
+    # SQLite hands timestamps back as strings, Postgres as datetimes
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+
+# Writes
+
+def update_sketches(db: Session, url_id: int, after_id: int, upto_id: int) -> None:
+    """
+    Folds the visitors of visits in the id window (after_id, upto_id] into the
+    url's daily sketches, and those of human visits into its human sketches.
+    Runs inside the caller's transaction (see refresh_rollups).
+    """
+    ensure_sketch_table(db)
+    # Unenriched visits carry their user agent, so the bot check runs once per distinct UA
+    rows = db.execute(
+        text(f"""
+            SELECT DISTINCT {_bucket_sql(db, "day", _utc_clicked_at_sql(db))} AS day, visitor_ip_hash, is_bot,
+                   CASE WHEN is_bot IS NULL THEN user_agent END AS user_agent
+            FROM visits
+            WHERE url_id = :url_id AND id > :after_id AND id <= :upto_id
+              AND visitor_ip_hash IS NOT NULL
+        """),
+        {"url_id": url_id, "after_id": after_id, "upto_id": upto_id},
+    ).fetchall()
+    visitors_by_day = {humans: defaultdict(list) for humans in SKETCH_TABLES}
+    for row in rows:
+        day = _to_day(row.day)
+        visitors_by_day[False][day].append(row.visitor_ip_hash)
+        is_bot = is_bot_user_agent(row.user_agent) if row.is_bot is None else row.is_bot
+        if not is_bot:
+            visitors_by_day[True][day].append(row.visitor_ip_hash)
+    for humans, table in SKETCH_TABLES.items():
+        _fold_visitors(db, table, url_id, visitors_by_day[humans])
+
+def _fold_visitors(db: Session, table: str, url_id: int, visitors_by_day: Dict[datetime, list]) -> None:
+    if not visitors_by_day:
+        return
+    days = list(visitors_by_day)
+    # Create missing rows first so concurrent refreshes of other id windows
+    # serialize on the row lock instead of overwriting each other's registers
+    db.execute(
+        text(f"""
+            INSERT INTO {table} (url_id, day, registers)
+            VALUES (:url_id, :day, :registers)
+            ON CONFLICT (url_id, day) DO NOTHING
+        """),
+        [{"url_id": url_id, "day": day, "registers": HyperLogLog().to_bytes()} for day in days],
+    )
+    lock = "" if db.get_bind().dialect.name == "sqlite" else "FOR UPDATE"
+    stored = db.execute(
+        text(f"""
+            SELECT day, registers FROM {table}
+            WHERE url_id = :url_id AND day IN :days
+            {lock}
+        """).bindparams(bindparam("days", expanding=True)),
+        {"url_id": url_id, "days": days},
+    ).fetchall()
+
+    updates = []
+    for row in stored:
+        sketch = HyperLogLog.from_bytes(row.registers)
+        sketch.add(visitors_by_day[_to_day(row.day)])
+        updates.append({"url_id": url_id, "day": row.day, "registers": sketch.to_bytes()})
+    db.execute(
+        text(f"UPDATE {table} SET registers = :registers WHERE url_id = :url_id AND day = :day"),
+        updates,
+    )
+
+def rebuild_human_sketches(db: Session, url_id: int, days: Iterable[datetime], upto_id: int) -> None:
+    """
+    Recomputes the url's human sketches of whole days from the visits folded so
+    far (up to upto_id). Registers cannot forget a visitor, so a day where a bot
+    flag was rewritten (see rollups.refold_visits) is rebuilt rather than patched.
+    """
+    ensure_sketch_table(db)
+    table = SKETCH_TABLES[True]
+    updates = []
+    for day in days:
+        rows = db.execute(
+            text(f"""
+                SELECT DISTINCT visitor_ip_hash, is_bot, CASE WHEN is_bot IS NULL THEN user_agent END AS user_agent
+                FROM visits
+                WHERE url_id = :url_id AND id <= :upto_id AND visitor_ip_hash IS NOT NULL
+                {_time_range_sql(day, day + timedelta(days=1))}
+            """),
+            {"url_id": url_id, "upto_id": upto_id, **_time_params(db, day, day + timedelta(days=1))},
+        ).fetchall()
+        sketch = HyperLogLog()
+        sketch.add({
+            row.visitor_ip_hash for row in rows
+            if not (is_bot_user_agent(row.user_agent) if row.is_bot is None else row.is_bot)
+        })
+        updates.append({"url_id": url_id, "day": day, "registers": sketch.to_bytes()})
+    if updates:
+        db.execute(
+            text(f"""
+                INSERT INTO {table} (url_id, day, registers)
+                VALUES (:url_id, :day, :registers)
+                ON CONFLICT (url_id, day) DO UPDATE SET registers = excluded.registers
+            """),
+            updates,
+        )
+
+# Reads
+
+def load_day_sketches(
+    db: Session, url_ids: Iterable[int], start: Optional[datetime] = None, end: Optional[datetime] = None,
+    humans: bool = False,
+) -> Dict[int, Dict[datetime, HyperLogLog]]:
+    """Daily sketches per url (of human visitors only with humans), optionally for days in [start, end) only."""
+    url_ids = list(url_ids)
+    sketches: Dict[int, Dict[datetime, HyperLogLog]] = {url_id: {} for url_id in url_ids}
+    if not url_ids:
+        return sketches
+    ensure_sketch_table(db)
+    filters = ""
+    if start is not None:
+        filters += " AND day >= :start"
+    if end is not None:
+        filters += " AND day < :end"
+    rows = db.execute(
+        text(f"""
+            SELECT url_id, day, registers FROM {SKETCH_TABLES[humans]}
+            WHERE url_id IN :url_ids {filters}
+        """).bindparams(bindparam("url_ids", expanding=True)),
+        {"url_ids": url_ids, "start": start, "end": end},
+    ).fetchall()
+    for row in rows:
+        sketches[row.url_id][_to_day(row.day)] = HyperLogLog.from_bytes(row.registers)
+    return sketches
+
+def count_unique_visitors(db: Session, url_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          exclude_bots: bool = False) -> int:
+    """
+    Exact visitor count for an arbitrary [start, end) window, counted in SQL.
+    For windows that do not line up with whole days; whole-day windows merge
+    the daily (or human) sketches instead.
+    """
+    bot_filter, bot_params = _bot_filter(db, [url_id], exclude_bots)
+    return int(db.execute(
+        text(f"""
+            SELECT COUNT(DISTINCT visitor_ip_hash) FROM visits
+            WHERE url_id = :url_id
+            {_time_range_sql(start, end)} {bot_filter}
+        """),
+        {"url_id": url_id, **_time_params(db, start, end), **bot_params},
+    ).scalar() or 0)
+
+def bucket_day(day: datetime, bucket: str) -> datetime:
+    """Maps a UTC day onto its day/week (Monday)/month bucket."""
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+def bucket_unique_visitors(day_sketches: Dict[datetime, HyperLogLog], bucket: str) -> Dict[datetime, int]:
+    """Unique visitors per day/week/month bucket, merging the daily sketches in each."""
+    grouped: Dict[datetime, list] = defaultdict(list)
+    for day, sketch in day_sketches.items():
+        grouped[bucket_day(day, bucket)].append(sketch)
+    return {key: HyperLogLog.union(sketches).estimate() for key, sketches in grouped.items()}
+
+def attach_unique_visitors(result: dict, day_sketches: Dict[datetime, HyperLogLog]) -> dict:
+    """
+    Adds unique_visitors to an analytics payload: the union of all daily sketches,
+    and per point of a daily clicks_over_time series.
+    """
+    result["unique_visitors"] = HyperLogLog.union(day_sketches.values()).estimate()
+    daily = {day.date().isoformat(): sketch.estimate() for day, sketch in day_sketches.items()}
+    for point in result["clicks_over_time"]:
+        point["unique_visitors"] = daily.get(point["date"], 0)
+    return result
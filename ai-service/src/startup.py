@@ -0,0 +1,54 @@
+from typing import Dict
+import logging
+import sys
+import threading
+import time
+
+from . import llm
+from .database import engine_initialized, replica_status
+from .geo import get_reader, reader_status
+
+logger = logging.getLogger(__name__)
+
+# Importing the package is cheap and has no side effects: the engine, the GeoIP
+# reader, the LLM HTTP client, the disk LLM cache and the pandas aggregation
+# path are all created on first use. warm_up front-loads the slow ones in the
+# background after startup, so the first request does not pay for them either.
+
+HEAVY_MODULES = ("pandas", "numpy", "httpx", "geoip2")
+
+_warm_up_state = "off"
+_warm_up_seconds = None
+
+def warm_up() -> None:
+    """Imports the pandas/httpx paths and opens the GeoIP reader."""
+    global _warm_up_state, _warm_up_seconds
+    _warm_up_state = "running"
+    started = time.perf_counter()
+    try:
+        from . import aggregation  # noqa: F401  (pandas, numpy)
+        import httpx  # noqa: F401
+        get_reader()
+    except Exception as e:
+        _warm_up_state = "failed"
+        logger.error(f"Warm-up failed: {e}", exc_info=True)
+        return
+    _warm_up_seconds = round(time.perf_counter() - started, 3)
+    _warm_up_state = "done"
+
+def start_warm_up() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def resource_status() -> Dict[str, object]:
+    """What has been loaded so far; the database check is added by the /ready endpoint."""
+    return {
+        "engine": "initialized" if engine_initialized() else "not_initialized",
+        "replica": replica_status(),
+        "geoip": reader_status(),
+        "llm": "configured" if llm.OPENROUTER_API_KEY else "missing_api_key",
+        "modules": {module: module in sys.modules for module in HEAVY_MODULES},
+        "warm_up": _warm_up_state,
+        "warm_up_seconds": _warm_up_seconds,
+    }
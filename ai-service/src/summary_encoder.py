@@ -0,0 +1,105 @@
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import math
+import os
+import re
+
+from .geo import geo_breakdown
+from .topk import HeavyHitter
+
+# Config
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "200"))  # estimated tokens per encoded summary
+SUMMARY_TOP_N = int(os.getenv("SUMMARY_TOP_N", "5"))  # entries kept per breakdown before the rest is folded into "other"
+
+# Compact analytics summaries for LLM prompts: one line per section, entries
+# ranked by count (ties by name) with shares of clicks instead of raw counts,
+# and the long tail folded into "other". Sections are trimmed to fit a token
+# budget measured with estimate_tokens, so the same data always encodes to the
+# same text (and the LLM cache keeps hitting).
+
+_TOKEN_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local approximation of BPE token counts, with no tokenizer dependency: a
+    token per started 4 letters of a word, per group of up to 3 digits (as
+    cl100k splits numbers) and per punctuation mark. Common words cost one
+    token in real vocabularies, so longer ones are over- rather than
+    under-counted.
+    """
+    return sum(math.ceil(len(piece) / 4) if piece[0].isalpha() else 1 for piece in _TOKEN_PIECES.findall(text))
+
+def most_active_day(clicks_over_time: Iterable[dict]) -> Optional[datetime]:
+    """Busiest day of an hourly series ({"timestamp", "count"} points), earliest first on ties."""
+    daily_clicks = Counter()
+    for point in clicks_over_time:
+        timestamp = point["timestamp"]
+        day = datetime.fromisoformat(timestamp).date() if isinstance(timestamp, str) else timestamp.date()
+        daily_clicks[day] += point["count"]
+    if not daily_clicks:
+        return None
+    return min(daily_clicks, key=lambda day: (-daily_clicks[day], day))
+
+def _share(count: int, total: int) -> str:
+    percent = 100 * count / total if total else 0
+    return "<1%" if 0 < percent < 0.5 else f"{percent:.0f}%"
+
+def _ranked(counts: Dict[str, int], total: int, top_n: int) -> str:
+    items = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    entries = [f"{name} {_share(count, total)}" for name, count in items[:top_n]]
+    rest = sum(count for _, count in items[top_n:])
+    if rest:
+        entries.append(f"other {_share(rest, total)}")
+    return ", ".join(entries)
+
+def _sections(bundle: dict, breakdowns: Dict[str, Counter], unique_visitors: int,
+              referrers: List[HeavyHitter]) -> List[Tuple[str, Optional[Dict[str, int]], int]]:
+    """(label, counts, total) per section, most important first; counts None = fixed text in label."""
+    total_clicks = bundle["total_clicks"]
+    headline = f"Total clicks: {total_clicks}; unique visitors: {unique_visitors}"
+    busiest = most_active_day(bundle["clicks_over_time"])
+    if busiest is not None:
+        headline += f"; most active day: {busiest}"
+    sections = [(headline, None, 0)]
+    if breakdowns["device"]:
+        sections.append(("Devices", breakdowns["device"], sum(breakdowns["device"].values())))
+    if referrers:
+        # Already referrer hosts; shares are of all clicks, so the remainder is direct or smaller sources
+        sections.append(("Top referrers", {hitter.value: hitter.count for hitter in referrers}, total_clicks))
+    if breakdowns["geo"]:
+        locations = {
+            "/".join(filter(None, (item["country"], item["region"], item["city"]))): item["count"]
+            for item in geo_breakdown(breakdowns["geo"])
+        }
+        sections.append(("Locations", locations, sum(breakdowns["geo"].values())))
+    else:
+        sections.append(("Locations: unavailable (IPs are hashed)", None, 0))
+    if breakdowns["browser"]:
+        sections.append(("Browsers", breakdowns["browser"], sum(breakdowns["browser"].values())))
+    if breakdowns["os"]:
+        sections.append(("OS", breakdowns["os"], sum(breakdowns["os"].values())))
+    return sections
+
+def _render(sections, top_n: int) -> str:
+    return "\n".join(label if counts is None else f"{label}: {_ranked(counts, total, top_n)}" for label, counts, total in sections)
+
+def encode_summary(bundle: dict, breakdowns: Dict[str, Counter], unique_visitors: int, referrers: List[HeavyHitter],
+                   budget: Optional[int] = None, top_n: Optional[int] = None) -> str:
+    """
+    Encodes the summary inputs (as returned by analytics._summary_data) within
+    budget estimated tokens (default SUMMARY_TOKEN_BUDGET): fewer entries per
+    breakdown first, then the least important sections are dropped. The
+    headline line is always kept.
+    """
+    budget = SUMMARY_TOKEN_BUDGET if budget is None else budget
+    top_n = SUMMARY_TOP_N if top_n is None else top_n
+    sections = _sections(bundle, breakdowns, unique_visitors, referrers)
+    for keep in range(max(top_n, 1), 0, -1):
+        text = _render(sections, keep)
+        if estimate_tokens(text) <= budget:
+            return text
+    while len(sections) > 1 and estimate_tokens(text) > budget:
+        sections.pop()
+        text = _render(sections, 1)
+    return text
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+import math
+
+from .database import TIME_BUCKETS
+
+# Approximate bucket widths, only used to estimate how many points a range yields
+BUCKET_WIDTHS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=30.44),
+}
+
+def choose_bucket(start: datetime, end: datetime, bucket: str, max_points: int) -> str:
+    """
+    Returns the requested bucket, or the first coarser one that keeps the range
+    under max_points, so long ranges are downsampled before leaving the database.
+    """
+    if bucket not in TIME_BUCKETS:
+        raise ValueError(f"Unknown time bucket: {bucket}")
+    span = end - start
+    for candidate in TIME_BUCKETS[TIME_BUCKETS.index(bucket):]:
+        if span / BUCKET_WIDTHS[candidate] <= max_points:
+            return candidate
+    return TIME_BUCKETS[-1]
+
+def merge_points(series: List[dict], max_points: int) -> List[dict]:
+    """
+    Last-resort downsampling once even monthly buckets exceed max_points: sums runs
+    of adjacent points, keeping the first point's date. Per-point unique visitors
+    do not sum, so merged points drop them.
+    """
+    if len(series) <= max_points:
+        return series
+    size = math.ceil(len(series) / max_points)
+    return [
+        {"date": series[i]["date"], "count": sum(point["count"] for point in series[i:i + size])}
+        for i in range(0, len(series), size)
+    ]
+
+def format_bucket(value: datetime, bucket: str) -> str:
+    # Day and coarser buckets keep the plain date format used by the default series
+    if bucket in ("day", "week", "month"):
+        return value.date().isoformat()
+    return value.isoformat()
+
+def is_aligned(value: Optional[datetime], granularity: str) -> bool:
+    if value is None:
+        return True
+    if granularity == "day":
+        return value == value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value == value.replace(minute=0, second=0, microsecond=0)
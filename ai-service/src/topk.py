@@ -0,0 +1,62 @@
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+import heapq
+
+
+class HeavyHitter(NamedTuple):
+    value: str
+    count: int
+    error: int  # count overstates the true frequency by at most this much
+
+
+class SpaceSaving:
+    """
+    Space-Saving top-K summary (Metwally et al.) over at most `capacity` counters.
+
+    Guarantees, after a stream of N events: every value seen more than N / capacity
+    times is kept, and each kept count overstates its true frequency by at most its
+    error (itself at most N / capacity). While fewer than `capacity` distinct values
+    have been seen, counts are exact.
+    """
+
+    def __init__(self, capacity: int, counters: Optional[Mapping[str, Tuple[int, int]]] = None):
+        if capacity < 1:
+            raise ValueError("SpaceSaving capacity must be at least 1")
+        self.capacity = capacity
+        # value -> [count, error]
+        self.counters: Dict[str, List[int]] = {value: [count, error] for value, (count, error) in (counters or {}).items()}
+        # Min-heap of (count, value); entries go stale as counts grow and are skipped on pop
+        self._heap = [(count, value) for value, (count, _) in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def update(self, counts: Mapping[str, int]) -> None:
+        """Adds pre-aggregated counts, e.g. one batch of visits grouped by value."""
+        # Largest first, so a batch's heavy values take free counters before its tail
+        for value, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+            entry = self.counters.get(value)
+            if entry is not None:
+                entry[0] += count
+            elif len(self.counters) < self.capacity:
+                entry = self.counters[value] = [count, 0]
+            else:
+                # Weighted Space-Saving: the newcomer inherits the evicted minimum as its error
+                floor = self._pop_min()
+                entry = self.counters[value] = [floor + count, floor]
+            heapq.heappush(self._heap, (entry[0], value))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(entry[0], value) for value, entry in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self) -> int:
+        while True:
+            count, value = heapq.heappop(self._heap)
+            entry = self.counters.get(value)
+            if entry is not None and entry[0] == count:
+                del self.counters[value]
+                return count
+
+    def top(self, limit: Optional[int] = None) -> List[HeavyHitter]:
+        hitters = sorted(
+            (HeavyHitter(value, count, error) for value, (count, error) in self.counters.items()),
+            key=lambda hitter: (-hitter.count, hitter.value),
+        )
+        return hitters if limit is None else hitters[:limit]
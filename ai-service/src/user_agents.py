@@ -0,0 +1,229 @@
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional
+import hashlib
+import os
+import re
+
+# Config
+UA_CACHE_SIZE = int(os.getenv("UA_CACHE_SIZE", "4096"))  # distinct UA strings kept classified
+BOT_SIGNATURES_PATH = os.getenv("BOT_SIGNATURES_PATH")  # extra crawler signatures, one per line
+
+class UAClassification(NamedTuple):
+    device_type: Optional[str]
+    os: Optional[str]
+    browser: Optional[str]
+
+EMPTY_CLASSIFICATION = UAClassification(None, None, None)
+
+# Every substring the classification rules look at. Each one is tested once per
+# distinct UA with a plain `in` (a combined regex alternation measured no faster
+# in CPython), then the precedence rules below only do set lookups. Uncached,
+# this is slower than the original short-circuiting chain, because every token
+# is tested and the bot signatures are scanned too. The speedup comes from
+# memoizing per raw UA string, since traffic repeats a small set of distinct UAs.
+_TOKENS = (
+    "mobile", "android", "iphone", "ipad",
+    "windows", "macintosh", "mac os x", "ios", "linux",
+    "chromium", "chrome", "firefox", "safari", "edg", "opera", "opr",
+)
+
+_MOBILE_TOKENS = frozenset({"mobile", "android", "iphone", "ipad"})
+_MAC_TOKENS = frozenset({"macintosh", "mac os x"})
+_IOS_TOKENS = frozenset({"iphone", "ipad", "ios"})
+_OPERA_TOKENS = frozenset({"opera", "opr"})
+
+# Lowercase product names and markers of crawlers, previews, monitors and HTTP
+# libraries. A signature only matches at the start of a UA token (see
+# _TOKEN_START), so "yandex" finds YandexBot but not a word merely containing it;
+# generic words that also occur in real browsers' UAs ("bot", "preview", "ruby",
+# ...) are left out in favour of the products using them and of _BOT_SUFFIX.
+# Most crawlers also claim Chrome/Safari, so a signature match decides the browser
+# before any browser token is looked at.
+BOT_SIGNATURES = (
+    # generic markers
+    "crawler", "spider", "slurp", "scraper", "headlesschrome", "phantomjs", "archiver",
+    "+http://", "+https://", "validator",
+    # search engines
+    "googlebot", "google-inspectiontool", "googleother", "google-extended", "storebot-google",
+    "adsbot-google", "mediapartners-google", "apis-google", "feedfetcher-google", "google-read-aloud",
+    "google favicon", "googleproducer", "bingbot", "bingpreview", "msnbot", "adidxbot", "yandexbot",
+    "yandeximages", "yandexmobilebot", "baiduspider", "duckduckbot", "duckassistbot", "sogou web spider",
+    "exabot", "seznambot", "naverbot", "yeti/", "daumoa", "coccocbot", "qwantify", "petalbot", "applebot",
+    "mojeekbot", "yahoo! slurp", "teoma", "ia_archiver", "archive.org_bot", "heritrix", "gigablast",
+    "gigabot", "ccbot", "neevabot", "yisouspider", "360spider", "bytespider", "haosouspider",
+    "easouspider", "sosospider",
+    # SEO and marketing crawlers
+    "ahrefsbot", "ahrefssiteaudit", "semrushbot", "siteauditbot", "mj12bot", "dotbot", "rogerbot",
+    "blexbot", "serpstatbot", "dataforseobot", "barkrowler", "seokicks", "linkdexbot", "spbot",
+    "screaming frog", "sitebulb", "megaindex", "zoominfobot", "seekport", "netestate", "ltx71",
+    "linkpadbot", "awariobot", "brandwatch", "mauibot", "cliqzbot", "domainstatsbot", "turnitinbot",
+    "grapeshotcrawler", "proximic", "similartech", "builtwith", "wappalyzer", "linkfluence",
+    # AI crawlers
+    "gptbot", "chatgpt-user", "oai-searchbot", "claudebot", "claude-web", "anthropic-ai",
+    "perplexitybot", "perplexity-user", "cohere-ai", "diffbot", "amazonbot", "meta-externalagent",
+    "meta-externalfetcher", "timpibot", "omgili", "youbot", "imagesiftbot", "ai2bot", "img2dataset",
+    # link previews and social
+    "facebookexternalhit", "facebookcatalog", "facebot", "twitterbot", "linkedinbot", "slackbot",
+    "slack-imgproxy", "discordbot", "telegrambot", "whatsapp/", "skypeuripreview", "pinterestbot",
+    "redditbot", "embedly", "iframely", "vkshare", "bitlybot", "flipboardproxy",
+    "quora link preview", "outbrain", "nuzzel", "mastodon/", "pleroma", "misskey", "bluesky",
+    "google-pagerenderer", "xing-contenttabreceiver", "line-poker", "kakaotalk-scrap",
+    "microsoftpreview", "mattermost", "rocket.chat",
+    # feed readers
+    "feedly", "feedbin", "inoreader", "newsblur", "tiny tiny rss", "theoldreader", "feedspot",
+    "feedvalidator", "netnewswire", "miniflux", "superfeedr", "feedburner", "bloglovin",
+    # uptime and performance monitors
+    "pingdom", "uptimerobot", "statuscake", "site24x7", "newrelicpinger", "datadog", "gtmetrix",
+    "chrome-lighthouse", "google page speed", "webpagetest", "catchpoint", "dynatrace",
+    "freshping", "hetrixtools", "better uptime", "betteruptime", "checkly", "nagios", "zabbix",
+    "icinga", "prtg", "cloudflare-alwaysonline", "cloudflare-healthchecks", "elb-healthchecker",
+    "kube-probe", "googlestackdrivermonitoring", "amazon-route53-health-check", "pingbot",
+    # security scanners
+    "nmap scripting engine", "masscan", "zgrab", "nikto", "sqlmap", "nuclei", "wpscan", "acunetix",
+    "nessus", "qualysguard", "openvas", "censysinspect", "expanse, a palo alto networks company",
+    "internet-measurement", "paloaltonetworks", "netcraft", "securitytrails", "detectify",
+    "project-resonance", "l9explore", "leakix", "fuzz faster u fool", "dirbuster", "gobuster",
+    "httpx - open-source", "whatweb",
+    # HTTP clients and automation
+    "curl/", "wget/", "libwww-perl", "lwp::", "python-requests", "python-urllib", "python-httpx",
+    "aiohttp", "httpie", "go-http-client", "okhttp", "java/", "apache-httpclient", "jakarta commons",
+    "axios/", "node-fetch", "undici", "got (", "superagent", "restsharp", "guzzlehttp", "rest-client/",
+    "faraday", "httparty", "mechanize", "scrapy", "colly", "postmanruntime", "insomnia/",
+    "windowspowershell", "winhttp", "urlgrabber", "libcurl", "http_request", "reqwest",
+    "hackney", "dart:io", "selenium", "webdriver", "puppeteer", "playwright",
+    "cypress", "htmlunit", "jsdom", "nutch", "apache-nutch", "httrack", "offline explorer",
+    "teleport pro", "webcopier", "webzip", "sitesucker", "getright",
+)
+
+def load_bot_signatures(path: Optional[str] = BOT_SIGNATURES_PATH) -> List[str]:
+    """Built-in signatures plus any from the file at path (one per line, # comments)."""
+    signatures = list(BOT_SIGNATURES)
+    if path:
+        with open(path, encoding="utf-8") as handle:
+            signatures.extend(line.strip().lower() for line in handle if line.strip() and not line.startswith("#"))
+    return signatures
+
+def _trie_pattern(signatures: Iterable[str]) -> str:
+    """
+    Folds the signatures into one regex shaped like a trie, so each position of a
+    UA is tested against shared prefixes once instead of against every signature.
+    A branch ends at its shortest signature: anything longer is implied.
+    """
+    trie: dict = {}
+    for signature in set(signatures):
+        if not signature:
+            continue
+        node = trie
+        for char in signature:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: dict) -> str:
+        if "" in node:
+            return ""
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+# A UA token starts after whitespace or "(;,+", never inside a word, version or URL
+_TOKEN_START = r"(?<![^\s(;,+])"
+
+# Catch-all for crawlers missing from the list: a token ending in "bot" right
+# before its version, a ";" or ")" (MyCustomBot/1.0, "compatible; FooBot;").
+# A space does not end it, so phone models such as "CUBOT X30" stay browsers.
+_BOT_SUFFIX = r"\w*bot(?=[/;)]|$)"
+
+def compile_bot_signatures(signatures: Iterable[str]) -> "re.Pattern":
+    return re.compile(f"{_TOKEN_START}(?:{_trie_pattern(signatures)}|{_BOT_SUFFIX})")
+
+def _digest(pattern: "re.Pattern") -> str:
+    return hashlib.sha256(pattern.pattern.encode("utf-8")).hexdigest()[:16]
+
+_bot_pattern = compile_bot_signatures(load_bot_signatures())
+_bot_signatures_digest = _digest(_bot_pattern)
+
+def set_bot_signatures(signatures: Iterable[str]) -> None:
+    """
+    Swaps in another signature set (e.g. a downloaded crawler list). Flags already
+    saved on visits are re-derived by enrichment.rederive_batch.
+    """
+    global _bot_pattern, _bot_signatures_digest
+    _bot_pattern = compile_bot_signatures(signatures)
+    _bot_signatures_digest = _digest(_bot_pattern)
+    cache_clear()
+
+def bot_signatures_digest() -> str:
+    """Fingerprint of the active signature set and matching rule."""
+    return _bot_signatures_digest
+
+def _classify_tokens(tokens: frozenset, is_bot: bool = False) -> UAClassification:
+    device_type = "Mobile/Tablet" if tokens & _MOBILE_TOKENS else "Desktop"
+
+    if "windows" in tokens:
+        os_info = "Windows"
+    elif tokens & _MAC_TOKENS:
+        os_info = "macOS"
+    elif "android" in tokens:
+        os_info = "Android"
+    elif tokens & _IOS_TOKENS:
+        os_info = "iOS"
+    elif "linux" in tokens:
+        os_info = "Linux"
+    else:
+        os_info = "Unknown OS"
+
+    # Bots first, whatever browser they claim; then the original substring chain:
+    # Chrome (not Chromium/Edge) wins over Safari, Edge only when it is not Chrome
+    if is_bot:
+        browser_info = "Bot/Crawler"
+    elif "chrome" in tokens and "chromium" not in tokens and "edg" not in tokens:
+        browser_info = "Chrome"
+    elif "firefox" in tokens:
+        browser_info = "Firefox"
+    elif "safari" in tokens and "chrome" not in tokens:
+        browser_info = "Safari"
+    elif "edg" in tokens:
+        browser_info = "Edge"
+    elif tokens & _OPERA_TOKENS:
+        browser_info = "Opera"
+    else:
+        browser_info = "Unknown Browser"
+
+    return UAClassification(device_type, os_info, browser_info)
+
+@lru_cache(maxsize=UA_CACHE_SIZE)
+def classify_user_agent(user_agent_string: Optional[str]) -> UAClassification:
+    """
+    Classifies a raw user agent into device type, OS and browser.
+    Results are memoized per raw string, so repeated UAs cost one dict lookup.
+    """
+    if not user_agent_string:
+        return EMPTY_CLASSIFICATION
+    ua = user_agent_string.lower()
+    tokens = frozenset([token for token in _TOKENS if token in ua])
+    return _classify_tokens(tokens, _bot_pattern.search(ua) is not None)
+
+@lru_cache(maxsize=UA_CACHE_SIZE)
+def is_bot_user_agent(user_agent_string: Optional[str]) -> bool:
+    """
+    True when the UA contains any crawler signature, whatever browser it claims.
+    One regex pass per distinct UA, however many signatures are loaded.
+    """
+    if not user_agent_string:
+        return False
+    return _bot_pattern.search(user_agent_string.lower()) is not None
+
+def classify_distinct(user_agents: Iterable[Optional[str]]) -> Dict[Optional[str], UAClassification]:
+    """
+    Batch API: classifies each distinct UA in a column once and returns a
+    lookup table that callers map back onto their rows.
+    """
+    return {user_agent: classify_user_agent(user_agent) for user_agent in set(user_agents)}
+
+def cache_info():
+    return classify_user_agent.cache_info()
+
+def cache_clear() -> None:
+    classify_user_agent.cache_clear()
+    is_bot_user_agent.cache_clear()
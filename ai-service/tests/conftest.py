@@ -1,5 +1,9 @@
+import json
 import os
 import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]
@@ -11,14 +15,20 @@ from sqlalchemy import create_engine, text  # <-- Add text import
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
-os.environ["OPENROUTER_API_KEY"] = "test-key"
-os.environ["DATABASE_URL"] = "sqlite:///:memory:"
-
+# No env vars needed: importing the service creates no engine and checks no keys
 from src.main import app
-from src.database import get_db
+from src.database import get_db, get_read_db
 
 SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
 
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Process-wide caches must not leak entries between tests"""
+    from src.analytics import summary_cache, llm_cache
+    summary_cache.clear()
+    llm_cache.clear()
+    yield
+
 @pytest.fixture(scope="function")
 def test_db():
     """Create a fresh test database session for each test"""
@@ -36,11 +46,18 @@ def test_db():
                 id INTEGER PRIMARY KEY,
                 url_id INTEGER,
                 visitor_ip_hash TEXT,
+                visitor_ip_prefix TEXT,
                 user_agent TEXT,
                 referer TEXT,
-                clicked_at TIMESTAMP
+                clicked_at TIMESTAMP,
+                device_type VARCHAR(32),
+                os VARCHAR(32),
+                browser VARCHAR(32),
+                referrer_host VARCHAR(255),
+                is_bot BOOLEAN
             )
         """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_visits_unenriched ON visits (url_id, id) WHERE is_bot IS NULL"))
         conn.commit()
     
     def override_get_db():
@@ -51,6 +68,7 @@ def test_db():
             db.close()
     
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     
     db = TestingSessionLocal()
     yield db
@@ -58,7 +76,209 @@ def test_db():
     
     app.dependency_overrides.clear()
 
+@pytest.fixture
+def seed_visits(test_db):
+    """Insert visit rows (dicts) into the test database"""
+    def _seed(visits):
+        test_db.execute(
+            text("""
+                INSERT INTO visits (url_id, visitor_ip_hash, visitor_ip_prefix, user_agent, referer, clicked_at)
+                VALUES (:url_id, :visitor_ip_hash, :visitor_ip_prefix, :user_agent, :referer, :clicked_at)
+            """),
+            [
+                {
+                    "url_id": visit.get("url_id", 1),
+                    "visitor_ip_hash": visit.get("visitor_ip_hash", "hash123"),
+                    "visitor_ip_prefix": visit.get("visitor_ip_prefix"),
+                    "user_agent": visit.get("user_agent"),
+                    "referer": visit.get("referer"),
+                    "clicked_at": visit["clicked_at"],
+                }
+                for visit in visits
+            ],
+        )
+        test_db.commit()
+    return _seed
+
 @pytest.fixture
 def client():
     """FastAPI test client"""
     return TestClient(app)
+
+
+class LLMStub:
+    """Local stand-in for the OpenRouter chat completions endpoint"""
+
+    def __init__(self):
+        self.requests = []
+        self.content = "Stub insight."
+        self.status = 200
+        self.delay = 0.0
+        self.chunk_delay = 0.0
+        self.url = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                stub.requests.append(payload)
+                if payload.get("stream") and stub.status == 200:
+                    return self._stream()
+                with stub._lock:
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                if stub.delay:
+                    time.sleep(stub.delay)
+                with stub._lock:
+                    stub.in_flight -= 1
+                body = json.dumps({"choices": [{"message": {"content": stub.content}}]}).encode()
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self):
+                # OpenAI-style SSE: one delta per word, then [DONE]; closes the connection to end the body
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+                for word in stub.content.split(" "):
+                    chunk = {"choices": [{"delta": {"content": word + " "}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    if stub.chunk_delay:
+                        time.sleep(stub.chunk_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+@pytest.fixture
+def llm_stub(monkeypatch):
+    """Runs a local fake LLM server and points the LLM client at it"""
+    stub = LLMStub()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stub.handler())
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    stub.url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+    monkeypatch.setattr("src.llm.OPENROUTER_API_URL", stub.url)
+    monkeypatch.setattr("src.llm.OPENROUTER_API_KEY", "test-key")
+    yield stub
+    server.shutdown()
+    server.server_close()
+
+# Minimal MaxMind DB (.mmdb) writer, enough to build small GeoIP City fixtures.
+# Format: https://maxmind.github.io/MaxMind-DB/ (IPv4 tree, 24-bit records).
+
+def _mmdb_control(type_id, size):
+    if size < 29:
+        size_bytes, marker = b"", size
+    elif size < 285:
+        size_bytes, marker = bytes([size - 29]), 29
+    else:
+        size_bytes, marker = (size - 285).to_bytes(2, "big"), 30
+    if type_id <= 7:
+        return bytes([(type_id << 5) | marker]) + size_bytes
+    return bytes([marker, type_id - 7]) + size_bytes
+
+def _mmdb_encode(value):
+    if isinstance(value, dict):
+        body = b"".join(_mmdb_encode(str(k)) + _mmdb_encode(v) for k, v in value.items())
+        return _mmdb_control(7, len(value)) + body
+    if isinstance(value, list):
+        return _mmdb_control(11, len(value)) + b"".join(_mmdb_encode(v) for v in value)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return _mmdb_control(2, len(data)) + data
+    if isinstance(value, tuple):  # (type_id, int) for explicitly typed unsigned ints
+        type_id, number = value
+        data = number.to_bytes((number.bit_length() + 7) // 8, "big")
+        return _mmdb_control(type_id, len(data)) + data
+    if isinstance(value, int):
+        return _mmdb_encode((9 if value >= 2 ** 32 else 6, value))
+    raise TypeError(value)
+
+def write_mmdb(path, networks, database_type="GeoLite2-City"):
+    """networks: {"203.0.113.0/24": {"country": {...}, ...}}"""
+    import ipaddress
+
+    data_section, offsets = b"", []
+    root = [None, None]
+    for network, record in networks.items():
+        offsets.append(len(data_section))
+        data_section += _mmdb_encode(record)
+        net = ipaddress.ip_network(network)
+        bits = format(int(net.network_address), "032b")[:net.prefixlen]
+        node = root
+        for bit in bits[:-1]:
+            child = node[int(bit)]
+            if not isinstance(child, list):
+                child = node[int(bit)] = [None, None]
+            node = child
+        node[int(bits[-1])] = ("data", offsets[-1])
+
+    nodes, queue = [], [root]
+    while queue:
+        node = queue.pop(0)
+        nodes.append(node)
+        queue.extend(child for child in node if isinstance(child, list))
+    index = {id(node): i for i, node in enumerate(nodes)}
+
+    def record_value(child):
+        if child is None:
+            return len(nodes)
+        if isinstance(child, list):
+            return index[id(child)]
+        return len(nodes) + 16 + child[1]
+
+    tree = b"".join(record_value(left).to_bytes(3, "big") + record_value(right).to_bytes(3, "big") for left, right in nodes)
+    metadata = _mmdb_encode({
+        "node_count": (6, len(nodes)),
+        "record_size": (5, 24),
+        "ip_version": (5, 4),
+        "database_type": database_type,
+        "languages": ["en"],
+        "binary_format_major_version": (5, 2),
+        "binary_format_minor_version": (5, 0),
+        "build_epoch": (9, 1700000000),
+        "description": {"en": "test fixture"},
+    })
+    with open(path, "wb") as f:
+        f.write(tree + b"\x00" * 16 + data_section + b"\xab\xcd\xefMaxMind.com" + metadata)
+
+def city_record(country, region=None, city=None):
+    record = {"country": {"iso_code": country, "names": {"en": country}}}
+    if region:
+        record["subdivisions"] = [{"names": {"en": region}}]
+    if city:
+        record["city"] = {"names": {"en": city}}
+    return record
+
+@pytest.fixture
+def geoip_db(tmp_path):
+    """A small GeoLite2-City style database, installed as the active GeoIP reader"""
+    from src import geo
+
+    path = tmp_path / "GeoLite2-City.mmdb"
+    write_mmdb(path, {
+        "203.0.113.0/24": city_record("US", "California", "Mountain View"),
+        "198.51.100.0/24": city_record("DE", "Berlin", "Berlin"),
+        "192.0.2.0/24": city_record("FR"),
+    })
+    geo.set_database(str(path))
+    yield path
+    geo.set_database(None)
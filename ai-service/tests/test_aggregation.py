@@ -0,0 +1,71 @@
+import pytest
+from datetime import datetime
+
+
+CHROME_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0"
+IPHONE_UA = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Safari/17.0"
+
+
+def _visit(day, hour, ua=CHROME_UA, referer=None, url_id=1):
+    return {
+        "url_id": url_id,
+        "clicked_at": datetime(2024, 1, day, hour, 15, 0),
+        "user_agent": ua,
+        "referer": referer,
+    }
+
+
+class TestStreamedAggregation:
+    def test_chunks_never_exceed_chunk_size(self, test_db, seed_visits, mocker):
+        from src import aggregation
+
+        seed_visits([_visit(15, hour % 24) for hour in range(25)])
+        spy = mocker.spy(aggregation, "visits_to_frame")
+
+        result = aggregation.aggregate_visits(test_db, 1, chunk_size=4)
+
+        assert result.total_clicks == 25
+        assert spy.call_count == 7
+        assert max(len(call.args[0]) for call in spy.call_args_list) == 4
+
+    def test_matches_rollup_analytics(self, test_db, seed_visits):
+        from src.analytics import get_full_analytics
+
+        seed_visits([
+            _visit(15, 10, referer="https://google.com"),
+            _visit(15, 10, referer="https://google.com"),
+            _visit(16, 22, ua=IPHONE_UA),
+            _visit(17, 3, ua="curl/8.0"),
+            _visit(16, 23, url_id=2),
+        ])
+
+        streamed = get_full_analytics(url_id=1, db=test_db, source="stream")
+        assert streamed == get_full_analytics(url_id=1, db=test_db, source="rollups")
+        assert streamed["total_clicks"] == 4
+
+    def test_empty_history(self, test_db):
+        from src.aggregation import aggregate_visits
+
+        result = aggregate_visits(test_db, 999).to_analytics()
+
+        assert result["total_clicks"] == 0
+        assert result["clicks_over_time"] == []
+        assert result["hourly_pattern"] == []
+
+    def test_unknown_source_is_rejected(self, test_db):
+        from src.analytics import get_full_analytics
+
+        with pytest.raises(ValueError):
+            get_full_analytics(url_id=1, db=test_db, source="nope")
+
+
+class TestSummaryCoverage:
+    def test_summary_breakdowns_cover_full_history(self, test_db, seed_visits):
+        from src import analytics
+
+        # Previously only the latest 500 visits fed the device/OS/browser breakdowns
+        seed_visits([_visit(15, 10)] * 600 + [_visit(16, 10, ua=IPHONE_UA)] * 50)
+
+        summary = analytics._build_common_summary(1, test_db)
+
+        assert "Devices: Desktop 92%, Mobile/Tablet 8%" in summary
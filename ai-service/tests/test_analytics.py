@@ -97,14 +97,48 @@ class TestVisitEnrichment:
         assert enriched[1].referer is None
 
 
+class TestVisitFrame:
+    class MockVisit:
+        def __init__(self, id, ua, ref, clicked_at):
+            self.id = id
+            self.url_id = 1
+            self.clicked_at = clicked_at
+            self.user_agent = ua
+            self.visitor_ip_hash = "hash"
+            self.visitor_ip_prefix = None
+            self.referer = ref
+
+    def test_visits_to_frame_dtypes(self):
+        from src.frames import visits_to_frame
+
+        df = visits_to_frame([
+            self.MockVisit(1, "Mozilla/5.0 (Windows) Chrome", "https://google.com", datetime(2024, 1, 15, 10)),
+            self.MockVisit(2, None, None, "2024-01-15 11:30:00"),
+        ])
+
+        assert str(df["clicked_at"].dtype).startswith("datetime64")
+        for column in ["device_type", "os", "browser", "referer"]:
+            assert df[column].dtype == "category"
+        assert df["browser"].tolist()[0] == "Chrome"
+        assert df["browser"].isna().tolist() == [False, True]
+        assert df["clicked_at"].dt.hour.tolist() == [10, 11]
+
+    def test_classifies_each_distinct_user_agent_once(self, mocker):
+        from src import frames
+        from src.user_agents import classify_user_agent
+
+        spy = mocker.patch.object(frames, "classify_user_agent", side_effect=classify_user_agent)
+        uas = ["Mozilla/5.0 (Windows) Chrome", "Mozilla/5.0 (iPhone) Safari"] * 50
+        frames.visits_to_frame([self.MockVisit(i, ua, None, datetime(2024, 1, 15)) for i, ua in enumerate(uas)])
+
+        assert spy.call_count == 2
+
+
 class TestAnalytics:
     def test_get_full_analytics_empty(self, test_db, mocker):
         """Test analytics with no visit data"""
         from src.analytics import get_full_analytics
         
-        # Mock get_raw_visits to return empty list
-        mocker.patch('src.analytics.get_raw_visits', return_value=[])
-        
         result = get_full_analytics(url_id=999, db=test_db)
         
         assert result["total_clicks"] == 0
@@ -114,26 +148,24 @@ class TestAnalytics:
         assert result["referrer_breakdown"] == []
         assert result["hourly_pattern"] == []
 
-    def test_get_full_analytics_with_visits(self, test_db, mocker):
-        """Test analytics with mock visit data"""
+    def test_get_full_analytics_with_visits(self, test_db, seed_visits):
+        """Test analytics with visit data"""
         from src.analytics import get_full_analytics
         
-        class MockVisit:
-            def __init__(self, hour, device_ua, browser_ua):
-                self.id = 1
-                self.url_id = 1
-                self.clicked_at = datetime(2024, 1, 15, hour, 0, 0)
-                self.user_agent = f"Mozilla/5.0 ({device_ua}) {browser_ua}"
-                self.visitor_ip_hash = "hash123"
-                self.referer = "https://google.com"
-        
-        mock_visits = [
-            MockVisit(10, "Windows NT 10.0", "Chrome/120.0"),
-            MockVisit(11, "Windows NT 10.0", "Chrome/120.0"),
-            MockVisit(14, "iPhone", "Safari/17.0"),
-        ]
-        
-        mocker.patch('src.analytics.get_raw_visits', return_value=mock_visits)
+        def visit(hour, device_ua, browser_ua):
+            return {
+                "url_id": 1,
+                "clicked_at": datetime(2024, 1, 15, hour, 0, 0),
+                "user_agent": f"Mozilla/5.0 ({device_ua}) {browser_ua}",
+                "visitor_ip_hash": "hash123",
+                "referer": "https://google.com",
+            }
+        
+        seed_visits([
+            visit(10, "Windows NT 10.0", "Chrome/120.0"),
+            visit(11, "Windows NT 10.0", "Chrome/120.0"),
+            visit(14, "iPhone", "Safari/17.0"),
+        ])
         
         result = get_full_analytics(url_id=1, db=test_db)
         
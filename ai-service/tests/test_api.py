@@ -48,23 +48,35 @@ def test_analytics_endpoint_no_data(client, test_db, mocker):
     assert data["total_clicks"] == 0
 
 
-@patch('src.analytics.requests.post')
-def test_ai_insight_endpoint(mock_post, client, test_db, mocker):
-    # Mock AI API response
-    mock_post.return_value.status_code = 200
-    mock_post.return_value.json.return_value = {
-        "choices": [{
-            "message": {"content": "This URL received moderate traffic from desktop users."}
-        }]
-    }
-    
-    # Mock database queries
-    mocker.patch('src.analytics.get_raw_visits', return_value=[])
-    mocker.patch('src.analytics.get_basic_stats', return_value=(0, []))
-    mocker.patch('src.analytics.get_top_referrers', return_value=[])
+def test_ai_insight_endpoint(llm_stub, client, test_db, mocker):
+    # Local stub AI API response
+    llm_stub.content = "This URL received moderate traffic from desktop users."
     
+    # Empty test database: the summary path finds no visits
     response = client.post("/ai/insight", json={"url_id": 1})
     
     assert response.status_code == 200
     data = response.json()
     assert "insight" in data
+
+
+def test_batch_analytics_endpoint(client, test_db, seed_visits):
+    from datetime import datetime
+
+    seed_visits([
+        {"url_id": 1, "clicked_at": datetime(2024, 1, 15, 10), "user_agent": "Mozilla/5.0 (Windows) Chrome/120.0"},
+        {"url_id": 1, "clicked_at": datetime(2024, 1, 15, 11), "user_agent": "Mozilla/5.0 (Windows) Chrome/120.0"},
+        {"url_id": 2, "clicked_at": datetime(2024, 1, 16, 9), "user_agent": "Mozilla/5.0 (iPhone) Safari/17.0"},
+    ])
+
+    response = client.post("/analytics/batch", json={"url_ids": [2, 1, 999, 1]})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [item["url_id"] for item in results] == [2, 1, 999]
+    assert [item["total_clicks"] for item in results] == [1, 2, 0]
+
+
+def test_batch_analytics_requires_url_ids(client, test_db):
+    response = client.post("/analytics/batch", json={"url_ids": []})
+    assert response.status_code == 422
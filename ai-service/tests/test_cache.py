@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from datetime import datetime
+
+
+CHROME_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0"
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self):
+        from src.cache import LRUCache
+
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["hits"] == 3
+        assert cache.stats()["misses"] == 1
+
+
+class TestSummaryCache:
+    def test_unchanged_fingerprint_skips_build(self):
+        from src.cache import SummaryCache
+
+        cache = SummaryCache(maxsize=4)
+        builds = []
+        build = lambda: builds.append(1) or f"summary {len(builds)}"
+
+        assert cache.get_or_build(1, lambda: (10, 5), build) == "summary 1"
+        assert cache.get_or_build(1, lambda: (10, 5), build) == "summary 1"
+        assert cache.get_or_build(1, lambda: (11, 6), build) == "summary 2"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 2
+        assert cache.stats()["invalidations"] == 1
+
+    def test_probe_interval_skips_probe(self):
+        from src.cache import SummaryCache
+
+        cache = SummaryCache(maxsize=4, probe_interval=60)
+        probes = []
+        probe = lambda: probes.append(1) or (1, 1)
+
+        cache.get_or_build(1, probe, lambda: "summary")
+        cache.get_or_build(1, probe, lambda: "other")
+
+        assert len(probes) == 1
+
+
+class TestAnalyticsSummaryCache:
+    def test_repeated_chat_calls_reuse_summary(self, test_db, seed_visits, mocker):
+        from src import analytics
+
+        mocker.patch.object(analytics.summary_cache, "probe_interval", 0)
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, 10), "user_agent": CHROME_UA}])
+        build = mocker.spy(analytics, "get_analytics_bundle")
+        mocker.patch.object(analytics, "_call_mistral", side_effect=lambda prompt, **kwargs: prompt)
+
+        for _ in range(5):
+            asyncio.run(analytics.generate_ai_chat_response(1, "How is my link doing?", None, test_db))
+        assert build.call_count == 1
+
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, 11), "user_agent": CHROME_UA}])
+        asyncio.run(analytics.generate_graph_insight(1, "device_breakdown", test_db))
+        assert build.call_count == 2
+
+    def test_fresh_entry_skips_database(self, test_db, seed_visits, mocker):
+        from src import analytics
+
+        mocker.patch.object(analytics.summary_cache, "probe_interval", 60)
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, 10), "user_agent": CHROME_UA}])
+        mocker.patch.object(analytics, "_call_mistral", side_effect=lambda prompt, **kwargs: prompt)
+        asyncio.run(analytics.generate_graph_insight(1, "device_breakdown", test_db))
+
+        execute = mocker.spy(test_db, "execute")
+        asyncio.run(analytics.generate_graph_insight(1, "device_breakdown", test_db))
+
+        assert execute.call_count == 0
@@ -0,0 +1,245 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import event, text
+
+
+# The pre-bundle get_basic_stats query, kept verbatim as the parity baseline
+LEGACY_BASIC_STATS_QUERY = text("""
+    SELECT
+        DATE_TRUNC('hour', clicked_at) as click_hour,
+        COUNT(*) as hourly_clicks
+    FROM visits
+    WHERE url_id = :url_id
+    GROUP BY DATE_TRUNC('hour', clicked_at)
+    ORDER BY click_hour;
+""")
+
+
+def _register_date_trunc(db):
+    """SQLite stand-in for Postgres DATE_TRUNC('hour', ...) so the legacy queries run"""
+    def date_trunc(unit, value):
+        assert unit == "hour"
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:00:00")
+
+    db.connection().connection.driver_connection.create_function("DATE_TRUNC", 2, date_trunc)
+
+
+@pytest.fixture
+def seeded(test_db, seed_visits):
+    start = datetime(2024, 1, 15, 8, 0, 0)
+    referers = ["https://google.com"] * 5 + ["https://t.co"] * 3 + ["https://news.ycombinator.com"] * 2 + [None, ""]
+    seed_visits([
+        {
+            "url_id": 1,
+            "clicked_at": start + timedelta(minutes=37 * i),
+            "visitor_ip_hash": f"ip{i % 7}",
+            "user_agent": "Mozilla/5.0 (Windows NT 10.0) Chrome/120.0",
+            "referer": referers[i % len(referers)],
+        }
+        for i in range(60)
+    ] + [{"url_id": 2, "clicked_at": start, "referer": "https://other.example"}])
+    return test_db
+
+
+class TestAnalyticsBundle:
+    def test_matches_legacy_queries(self, seeded):
+        from src.database import get_analytics_bundle
+
+        _register_date_trunc(seeded)
+        rows = seeded.execute(LEGACY_BASIC_STATS_QUERY, {"url_id": 1}).fetchall()
+        total_clicks = sum(row.hourly_clicks for row in rows)
+        clicks_over_time = [{"timestamp": row.click_hour, "count": row.hourly_clicks} for row in rows]
+
+        bundle = get_analytics_bundle(seeded, 1)
+
+        assert bundle["total_clicks"] == total_clicks == 60
+        assert bundle["clicks_over_time"] == clicks_over_time
+
+    def test_single_round_trip(self, seeded):
+        from src.database import get_analytics_bundle
+
+        statements = []
+        engine = seeded.get_bind()
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            get_analytics_bundle(seeded, 1)
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+
+        assert len(statements) == 1
+
+    def test_empty_url(self, test_db):
+        from src.database import get_analytics_bundle
+
+        assert get_analytics_bundle(test_db, 42) == {
+            "total_clicks": 0,
+            "clicks_over_time": [],
+        }
+
+
+def _sqlite_engine(path, label, **options):
+    from sqlalchemy import create_engine
+
+    engine = create_engine(f"sqlite:///{path}", **options)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE source (name TEXT)"))
+        conn.execute(text("INSERT INTO source (name) VALUES (:label)"), {"label": label})
+    return engine
+
+
+@pytest.fixture
+def routed(tmp_path, monkeypatch):
+    """Read sessions over a primary and a replica that say which one answered"""
+    from sqlalchemy.orm import sessionmaker
+    from src import database
+    from src.metrics import reset_metrics
+
+    reset_metrics()
+    primary = _sqlite_engine(tmp_path / "primary.db", "primary")
+    replica = database.Replica(_sqlite_engine(tmp_path / "replica.db", "replica"), max_lag=5, check_interval=60)
+    monkeypatch.setattr(database, "_replica", replica)
+    yield sessionmaker(class_=database.RoutingSession, bind=primary), replica
+    reset_metrics()
+
+
+def _source(db):
+    return db.execute(text("SELECT name FROM source")).scalar()
+
+
+class TestReadRouting:
+    def test_reads_use_the_replica_until_the_first_write(self, routed):
+        from src.metrics import DB_ROUTED_STATEMENTS
+
+        session_factory, _ = routed
+        db = session_factory()
+
+        assert _source(db) == "replica"
+        db.execute(text("INSERT INTO source (name) VALUES ('written')"))
+        db.commit()
+        # Pinned: later reads see the session's own write
+        assert db.execute(text("SELECT COUNT(*) FROM source")).scalar() == 2
+        db.close()
+
+        assert _source(session_factory()) == "replica"
+        assert DB_ROUTED_STATEMENTS.value("replica", "read") == 2
+        assert DB_ROUTED_STATEMENTS.value("primary", "write") == 1
+
+    def test_lagging_replica_falls_back_to_primary(self, routed, mocker):
+        from src.metrics import DB_ROUTED_STATEMENTS
+
+        session_factory, replica = routed
+        mocker.patch("src.database.measure_replica_lag", return_value=60.0)
+
+        assert _source(session_factory()) == "primary"
+        assert replica.lag == 60.0
+        assert DB_ROUTED_STATEMENTS.value("primary", "replica_lagging") == 1
+
+    def test_unreachable_replica_falls_back_until_rechecked(self, routed, mocker):
+        session_factory, replica = routed
+        measure = mocker.patch("src.database.measure_replica_lag", side_effect=ConnectionError("replica down"))
+
+        assert _source(session_factory()) == "primary"
+        assert _source(session_factory()) == "primary"
+        assert measure.call_count == 1  # re-measured only after check_interval
+
+        measure.side_effect = None
+        measure.return_value = 0.0
+        replica.check_interval = 0
+        assert _source(session_factory()) == "replica"
+
+    def test_without_a_replica_everything_uses_the_primary(self, routed, monkeypatch):
+        from src import database
+
+        session_factory, _ = routed
+        monkeypatch.setattr(database, "_replica", None)
+
+        assert _source(session_factory()) == "primary"
+        assert database.replica_status() == "not_configured"
+
+    def test_default_analytics_read_from_the_replica(self, client, test_db, seed_visits, monkeypatch):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import StaticPool
+        from src import database
+        from src.main import app
+        from src.metrics import DB_ROUTED_STATEMENTS, reset_metrics
+
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, hour), "user_agent": "Mozilla/5.0 Chrome/120.0"} for hour in range(3)])
+        primary = test_db.get_bind()
+        # A second engine over the same in-memory database stands in for the replica
+        replica_engine = create_engine("sqlite://", creator=lambda: primary.raw_connection().driver_connection, poolclass=StaticPool)
+        replica_statements = []
+        event.listen(replica_engine, "before_cursor_execute", lambda conn, cursor, sql, *args: replica_statements.append(sql))
+        monkeypatch.setattr(database, "_replica", database.Replica(replica_engine, check_interval=60))
+        read_sessions = []
+
+        def routed_read_db():
+            db = sessionmaker(class_=database.RoutingSession, bind=primary)()
+            read_sessions.append(db)
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[database.get_read_db] = routed_read_db
+        reset_metrics()
+        try:
+            response = client.get("/analytics/1")
+            routed_writes = DB_ROUTED_STATEMENTS.value("primary", "write")
+        finally:
+            reset_metrics()
+
+        assert response.status_code == 200
+        assert response.json()["total_clicks"] == 3
+        # The rollups were refreshed on the primary and read back from the replica
+        assert routed_writes == 0
+        assert not read_sessions[0].info.get("pinned_to_primary")
+        assert any("visit_rollups" in sql for sql in replica_statements)
+
+    @pytest.mark.parametrize("sql, read", [
+        ("SELECT id FROM visits WHERE url_id = :url_id", True),
+        ("  with recent AS (SELECT id FROM visits) SELECT COUNT(*) FROM recent", True),
+        ("SELECT last_update FROM checkpoints", True),
+        ("SELECT last_visit_id FROM rollup_watermarks FOR UPDATE", False),
+        ("WITH moved AS (DELETE FROM jobs RETURNING id) SELECT COUNT(*) FROM moved", False),
+        ("INSERT INTO rollup_watermarks (url_id, last_visit_id) VALUES (1, 0)", False),
+        ("UPDATE visits SET is_bot = false WHERE id = 1", False),
+        ("CREATE TABLE IF NOT EXISTS visit_rollups (url_id INTEGER)", False),
+    ])
+    def test_statement_classification(self, sql, read):
+        from src.database import is_read_statement
+
+        assert is_read_statement(sql) is read
+
+
+class TestEngineConfiguration:
+    def test_postgres_gets_pool_and_timeout_settings(self):
+        from src.database import _engine_options
+
+        options = _engine_options("postgresql://user:secret@db/app", 15000)
+
+        assert options["pool_pre_ping"] is True
+        assert {"pool_size", "max_overflow", "pool_timeout", "pool_recycle"} <= set(options)
+        assert options["connect_args"]["options"] == "-c statement_timeout=15000"
+
+    def test_sqlite_keeps_the_defaults(self):
+        from src.database import _engine_options
+
+        assert _engine_options("sqlite:///:memory:", 15000) == {}
+        assert "options" not in _engine_options("postgresql://db/app", 0)["connect_args"]
+
+    def test_pool_saturation_is_exported(self, tmp_path, monkeypatch):
+        from sqlalchemy.pool import QueuePool
+        from src import metrics
+        from src.database import pool_stats
+
+        engine = _sqlite_engine(tmp_path / "pool.db", "primary", poolclass=QueuePool, pool_size=2, max_overflow=2)
+        monkeypatch.setattr(metrics, "_pools", {"primary": lambda: pool_stats(engine)})
+
+        with engine.connect():
+            body = metrics.render_metrics()
+
+        assert 'db_pool_checked_out{pool="primary"} 1' in body
+        assert 'db_pool_capacity{pool="primary"} 4' in body
+        assert 'db_pool_saturation{pool="primary"} 0.25' in body
@@ -0,0 +1,240 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+
+CHROME_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0"
+GOOGLEBOT_UA = "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html) Chrome/120.0"
+
+
+def _visit(url_id=1, ua=CHROME_UA, referer=None, hour=10):
+    return {"url_id": url_id, "clicked_at": datetime(2024, 1, 15, hour), "user_agent": ua, "referer": referer}
+
+
+def _columns(db):
+    return db.execute(text("""
+        SELECT url_id, device_type, os, browser, referrer_host, is_bot FROM visits ORDER BY id
+    """)).fetchall()
+
+
+class TestReferrerHost:
+    @pytest.mark.parametrize("referer, host", [
+        ("https://www.google.com/search?q=x", "google.com"),
+        ("http://T.CO/abc", "t.co"),
+        ("news.ycombinator.com/item?id=1", "news.ycombinator.com"),
+        ("", None),
+        (None, None),
+        ("http://[::1", None),
+    ])
+    def test_referrer_host(self, referer, host):
+        from src.enrichment import referrer_host
+
+        assert referrer_host(referer) == host
+
+
+class TestEnrichment:
+    def test_unmigrated_visits_table_is_reported_not_altered(self):
+        from sqlalchemy import create_engine, inspect
+        from src.enrichment import ensure_enrichment_columns
+
+        engine = create_engine("sqlite:///:memory:")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE visits (id INTEGER PRIMARY KEY, url_id INTEGER, user_agent TEXT, is_bot BOOLEAN)"))
+        db = sessionmaker(bind=engine)()
+
+        with pytest.raises(RuntimeError, match="device_type, os, browser, referrer_host"):
+            ensure_enrichment_columns(db)
+        db.rollback()
+        assert [column["name"] for column in inspect(engine).get_columns("visits")] == ["id", "url_id", "user_agent", "is_bot"]
+
+    def test_backfill_advances_checkpoint(self, test_db, seed_visits):
+        from src.enrichment import enrich_batch, _get_checkpoint
+
+        seed_visits([_visit(url_id=1 + i % 3, referer="https://www.google.com/") for i in range(7)] + [_visit(ua=GOOGLEBOT_UA)])
+
+        assert enrich_batch(test_db, batch_size=5) == 5
+        assert _get_checkpoint(test_db) == 5
+        assert enrich_batch(test_db, batch_size=5) == 3
+        assert enrich_batch(test_db, batch_size=5) == 0
+
+        rows = _columns(test_db)
+        assert rows[0][1:] == ("Desktop", "Windows", "Chrome", "google.com", 0)
+        assert rows[-1].is_bot == 1
+
+    def test_worker_catches_up(self, test_db, seed_visits):
+        from src.enrichment import EnrichmentWorker
+
+        seed_visits([_visit() for _ in range(12)])
+        worker = EnrichmentWorker(sessionmaker(bind=test_db.get_bind()), batch_size=5)
+
+        assert worker.run_once() == 12
+        assert all(row.browser == "Chrome" for row in _columns(test_db))
+
+    def test_signature_change_rederives_saved_flags(self, test_db, seed_visits):
+        from src import user_agents
+        from src.enrichment import enrich_batch, rederive_batch, RederiveWorker
+
+        acme = "Mozilla/5.0 (Windows NT 10.0) Chrome/120.0 AcmeFetcher/1.0"
+        seed_visits([_visit(ua=acme), _visit(), _visit(ua=acme)])
+        enrich_batch(test_db)
+        # The first run checks every visit so far, but nothing changed
+        assert rederive_batch(test_db) == 3
+        assert rederive_batch(test_db) == 0
+
+        try:
+            user_agents.set_bot_signatures(user_agents.load_bot_signatures(None) + ["acmefetcher"])
+            seed_visits([_visit(ua=acme)])
+            assert rederive_batch(test_db, batch_size=2) == 2
+            assert RederiveWorker(sessionmaker(bind=test_db.get_bind()), batch_size=2).run_once() == 2
+            assert [(row.browser, row.is_bot) for row in _columns(test_db)] == [
+                ("Bot/Crawler", 1), ("Chrome", 0), ("Bot/Crawler", 1), (None, None),
+            ]
+        finally:
+            user_agents.set_bot_signatures(user_agents.load_bot_signatures(None))
+        # Back on the original set, the visits seen so far are re-derived once more
+        enrich_batch(test_db)
+        assert rederive_batch(test_db) == 4
+        assert [row.is_bot for row in _columns(test_db)] == [0, 0, 0, 0]
+
+    def test_rederive_moves_folded_counts(self, test_db, seed_visits):
+        from src import user_agents
+        from src.enrichment import enrich_batch, rederive_batch
+        from src.rollups import get_rollup_analytics, refresh_rollups
+        from src.sketches import load_day_sketches
+
+        acme = "Mozilla/5.0 (Windows NT 10.0) Chrome/120.0 AcmeFetcher/1.0"
+        seed_visits([
+            {**_visit(ua=acme), "visitor_ip_hash": "a"},
+            {**_visit(), "visitor_ip_hash": "b"},
+            {**_visit(ua=acme, hour=11), "visitor_ip_hash": "c"},
+        ])
+        enrich_batch(test_db)
+        rederive_batch(test_db)
+        refresh_rollups(test_db, 1)
+        assert load_day_sketches(test_db, [1], humans=True)[1][datetime(2024, 1, 15)].estimate() == 3
+
+        try:
+            user_agents.set_bot_signatures(user_agents.load_bot_signatures(None) + ["acmefetcher"])
+            # Neither enriched nor folded yet: the refresh classifies it under the new set
+            seed_visits([{**_visit(ua=acme, hour=12), "visitor_ip_hash": "d"}])
+            assert rederive_batch(test_db) == 4
+            refresh_rollups(test_db, 1)
+            analytics = get_rollup_analytics(test_db, 1)
+            humans = load_day_sketches(test_db, [1], humans=True)[1]
+        finally:
+            user_agents.set_bot_signatures(user_agents.load_bot_signatures(None))
+
+        assert analytics["total_clicks"] == 4
+        assert analytics["browser_breakdown"] == [
+            {"browser": "Bot/Crawler", "count": 3}, {"browser": "Chrome", "count": 1},
+        ]
+        assert {day: sketch.estimate() for day, sketch in humans.items()} == {datetime(2024, 1, 15): 1}
+
+    def test_worker_thread_stops(self, test_db, seed_visits):
+        from src.enrichment import EnrichmentWorker
+
+        seed_visits([_visit()])
+        worker = EnrichmentWorker(sessionmaker(bind=test_db.get_bind()), interval=0.01)
+        worker.start()
+        worker.stop(timeout=5)
+
+        assert worker._thread is None
+
+
+class TestReadPaths:
+    def test_analytics_group_on_persisted_columns(self, test_db, seed_visits, mocker):
+        from src import enrichment
+        from src.analytics import _build_common_summary, get_full_analytics
+
+        seed_visits([_visit(), _visit(ua=GOOGLEBOT_UA, referer="https://www.bing.com/")])
+        enrichment.enrich_batch(test_db)
+
+        # Nothing left to enrich: reads must not classify user agents in Python
+        classify = mocker.spy(enrichment, "classify_user_agent")
+        result = get_full_analytics(1, test_db)
+        summary = _build_common_summary(1, test_db)
+        window = get_full_analytics(1, test_db, start=datetime(2024, 1, 15, 10, 30), bucket="minute")
+
+        assert classify.call_count == 0
+        assert result["total_clicks"] == 2
+        assert {"browser": "Chrome", "count": 1} in result["browser_breakdown"]
+        assert {"browser": "Bot/Crawler", "count": 1} in result["browser_breakdown"]
+        assert "Bot/Crawler 50%" in summary
+        assert window["total_clicks"] == 0
+
+    @pytest.mark.parametrize("source", ["rollups", "stream"])
+    def test_unenriched_rows_are_classified_without_writing(self, test_db, seed_visits, mocker, source):
+        from src.analytics import _build_common_summary, get_full_analytics
+
+        seed_visits([_visit(referer="https://www.bing.com/"), _visit(ua=GOOGLEBOT_UA), _visit(url_id=2)])
+        execute = mocker.spy(test_db, "execute")
+        result = get_full_analytics(1, test_db, source=source)
+        humans = get_full_analytics(1, test_db, source=source, exclude_bots=True)
+        summary = _build_common_summary(1, test_db, exclude_bots=True)
+
+        assert result["browser_breakdown"] == [{"browser": "Bot/Crawler", "count": 1}, {"browser": "Chrome", "count": 1}]
+        assert humans["total_clicks"] == 1
+        assert humans["browser_breakdown"] == [{"browser": "Chrome", "count": 1}]
+        assert "bing.com" in summary
+        assert not any("UPDATE visits" in str(call.args[0]) for call in execute.call_args_list)
+        assert [row.is_bot for row in _columns(test_db)] == [None, None, None]
+
+
+class TestExcludeBots:
+    @pytest.mark.parametrize("source", ["rollups", "stream"])
+    def test_analytics_leave_bots_out(self, test_db, seed_visits, source):
+        from src.analytics import get_full_analytics
+
+        seed_visits([
+            _visit(referer="https://t.co/x"),
+            {**_visit(ua=GOOGLEBOT_UA, hour=11), "visitor_ip_hash": "crawler"},
+            {**_visit(ua="curl/8.4.0", hour=12), "visitor_ip_hash": "script"},
+        ])
+
+        everything = get_full_analytics(1, test_db, source=source)
+        humans = get_full_analytics(1, test_db, source=source, exclude_bots=True)
+
+        assert everything["total_clicks"] == 3
+        assert humans["total_clicks"] == 1
+        assert humans["unique_visitors"] == 1
+        assert humans["browser_breakdown"] == [{"browser": "Chrome", "count": 1}]
+        assert humans["hourly_pattern"] == [{"hour": 10, "count": 1}]
+        assert [point["count"] for point in humans["clicks_over_time"]] == [1]
+
+    @pytest.mark.parametrize("source", ["rollups", "stream"])
+    def test_bot_filter_alone_keeps_the_daily_payload(self, test_db, seed_visits, source):
+        from src.analytics import get_full_analytics
+
+        # Tuesday and Wednesday, long enough ago that a ranged read would bucket by week
+        seed_visits([
+            {"url_id": 1, "clicked_at": datetime(2024, 1, 16, 10), "user_agent": CHROME_UA, "visitor_ip_hash": "a"},
+            {"url_id": 1, "clicked_at": datetime(2024, 1, 17, 10), "user_agent": CHROME_UA, "visitor_ip_hash": "b"},
+            {"url_id": 1, "clicked_at": datetime(2024, 1, 17, 11), "user_agent": GOOGLEBOT_UA, "visitor_ip_hash": "c"},
+        ])
+
+        everything = get_full_analytics(1, test_db, source=source)
+        humans = get_full_analytics(1, test_db, source=source, exclude_bots=True)
+
+        assert humans.keys() == everything.keys()
+        assert humans["clicks_over_time"] == [
+            {"date": "2024-01-16", "count": 1, "unique_visitors": 1},
+            {"date": "2024-01-17", "count": 1, "unique_visitors": 1},
+        ]
+        assert humans["unique_visitors"] == 2
+        week = get_full_analytics(1, test_db, source=source, start=datetime(2024, 1, 15), end=datetime(2024, 1, 22), exclude_bots=True)
+        assert week["clicks_over_time"] == humans["clicks_over_time"]
+
+    def test_endpoint_and_insight_option(self, client, test_db, seed_visits, mocker):
+        from src import analytics
+
+        seed_visits([_visit(), _visit(ua=GOOGLEBOT_UA), _visit(ua=GOOGLEBOT_UA)])
+        mistral = mocker.patch.object(analytics, "_call_mistral", side_effect=lambda prompt, **kwargs: prompt)
+
+        data = client.get("/analytics/1", params={"exclude_bots": "true"}).json()
+        client.post("/ai/insight", json={"url_id": 1})
+        client.post("/ai/insight", json={"url_id": 1, "exclude_bots": True})
+
+        assert data["total_clicks"] == 1
+        assert "Total clicks: 3" in mistral.call_args_list[0].args[0]
+        assert "Total clicks: 1" in mistral.call_args_list[1].args[0]
@@ -0,0 +1,117 @@
+import csv
+import io
+from datetime import datetime
+
+import pytest
+
+CHROME = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+GOOGLEBOT = "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+
+
+@pytest.fixture
+def visits(seed_visits):
+    seed_visits([
+        {"url_id": 1, "user_agent": CHROME, "referer": "https://www.google.com/search?q=x", "clicked_at": datetime(2024, 1, 1, 10)},
+        {"url_id": 1, "user_agent": GOOGLEBOT, "clicked_at": datetime(2024, 1, 2, 11)},
+        {"url_id": 1, "user_agent": CHROME, "clicked_at": datetime(2024, 1, 3, 12)},
+        {"url_id": 2, "user_agent": CHROME, "referer": "https://t.co/abc", "clicked_at": datetime(2024, 1, 2, 9)},
+        {"url_id": 3, "user_agent": CHROME, "clicked_at": datetime(2024, 1, 2, 9)},
+    ])
+
+
+def _rows(response):
+    return list(csv.DictReader(io.StringIO(response.text)))
+
+
+class TestExportEncoders:
+    def test_csv_is_written_chunk_by_chunk(self, test_db, visits):
+        from src.export import EXPORT_COLUMNS, export_visits
+
+        chunks = list(export_visits(test_db, [1, 2], "csv", chunk_size=2))
+        rows = list(csv.reader(io.StringIO(b"".join(chunks).decode())))
+
+        assert len(chunks) == 2
+        assert rows[0] == list(EXPORT_COLUMNS)
+        assert len(rows) == 5
+
+    def test_unknown_format_is_rejected(self, test_db):
+        from src.export import export_visits
+
+        with pytest.raises(ValueError):
+            export_visits(test_db, [1], "xlsx")
+
+    def test_arrow_stream_round_trips(self, test_db, visits):
+        pa = pytest.importorskip("pyarrow")
+        from src.export import export_visits
+
+        body = b"".join(export_visits(test_db, [1, 2], "arrow", chunk_size=2))
+        table = pa.ipc.open_stream(body).read_all()
+
+        assert table.num_rows == 4
+        assert table.column("is_bot").to_pylist().count(True) == 1
+        assert str(table.schema.field("clicked_at").type) == "timestamp[us, tz=UTC]"
+
+    def test_parquet_has_one_row_group_per_chunk(self, test_db, visits):
+        pytest.importorskip("pyarrow")
+        import pyarrow.parquet as pq
+        from src.export import export_visits
+
+        body = b"".join(export_visits(test_db, [1, 2], "parquet", chunk_size=2))
+        parquet = pq.ParquetFile(io.BytesIO(body))
+
+        assert parquet.metadata.num_rows == 4
+        assert parquet.metadata.num_row_groups == 2
+
+
+class TestExportEndpoints:
+    def test_single_url_csv_with_derived_columns(self, client, test_db, visits):
+        response = client.get("/analytics/1/export")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert 'filename="visits-1.csv"' in response.headers["content-disposition"]
+        rows = _rows(response)
+        assert [row["clicked_at"] for row in rows] == [
+            "2024-01-01T10:00:00Z", "2024-01-02T11:00:00Z", "2024-01-03T12:00:00Z",
+        ]
+        assert rows[0]["referrer_host"] == "google.com"
+        assert rows[0]["browser"] == "Chrome"
+        assert [row["is_bot"] for row in rows] == ["False", "True", "False"]
+
+    def test_time_range_is_half_open(self, client, test_db, visits):
+        response = client.get("/analytics/1/export", params={"from": "2024-01-02T00:00:00", "to": "2024-01-03T12:00:00"})
+
+        assert [row["clicked_at"] for row in _rows(response)] == ["2024-01-02T11:00:00Z"]
+
+    def test_multi_url_export(self, client, test_db, visits):
+        response = client.post("/analytics/export", json={"url_ids": [1, 2], "from": "2024-01-02T00:00:00"})
+
+        assert response.status_code == 200
+        assert 'filename="visits.csv"' in response.headers["content-disposition"]
+        rows = _rows(response)
+        assert sorted((row["url_id"], row["clicked_at"]) for row in rows) == [
+            ("1", "2024-01-02T11:00:00Z"), ("1", "2024-01-03T12:00:00Z"), ("2", "2024-01-02T09:00:00Z"),
+        ]
+
+    def test_empty_export_is_just_the_header(self, client, test_db):
+        from src.export import EXPORT_COLUMNS
+
+        response = client.get("/analytics/99/export")
+
+        assert response.status_code == 200
+        assert response.text.strip() == ",".join(EXPORT_COLUMNS)
+
+    def test_arrow_formats_need_pyarrow(self, client, test_db, visits, monkeypatch):
+        import sys
+
+        # A None entry in sys.modules makes the import raise ImportError
+        monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+        response = client.get("/analytics/1/export", params={"format": "parquet"})
+
+        assert response.status_code == 400
+        assert "pyarrow" in response.json()["detail"]
+
+    def test_unknown_format_is_a_validation_error(self, client, test_db):
+        assert client.get("/analytics/1/export", params={"format": "xlsx"}).status_code == 422
+        assert client.post("/analytics/export", json={"url_ids": []}).status_code == 422
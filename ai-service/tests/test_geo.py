@@ -0,0 +1,109 @@
+import pytest
+from datetime import datetime
+
+
+CHROME_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0"
+
+
+def _visit(ip_prefix, day=15, url_id=1):
+    return {
+        "url_id": url_id,
+        "clicked_at": datetime(2024, 1, day, 10),
+        "user_agent": CHROME_UA,
+        "visitor_ip_prefix": ip_prefix,
+    }
+
+
+class TestLookup:
+    def test_lookup_city(self, geoip_db):
+        from src.geo import GeoLocation, lookup_ip
+
+        assert lookup_ip("203.0.113.0") == GeoLocation("US", "California", "Mountain View")
+        assert lookup_ip("192.0.2.0") == GeoLocation("FR", None, None)
+
+    def test_unknown_and_invalid_addresses(self, geoip_db):
+        from src.geo import EMPTY_LOCATION, lookup_ip
+
+        assert lookup_ip("8.8.8.0") == EMPTY_LOCATION
+        assert lookup_ip("2001:db8::") == EMPTY_LOCATION
+        assert lookup_ip("not-an-ip") == EMPTY_LOCATION
+        assert lookup_ip(None) == EMPTY_LOCATION
+
+    def test_repeated_lookups_hit_the_cache(self, geoip_db):
+        from src import geo
+
+        geo.lookup_distinct(["203.0.113.0", "198.51.100.0"] * 50)
+        geo.lookup_distinct(["203.0.113.0"])
+
+        info = geo.cache_info()
+        assert info.misses == 2
+        assert info.hits == 1
+
+    def test_missing_database_disables_geolocation(self, tmp_path):
+        from src import geo
+        from src.analytics import get_geolocation
+
+        geo.set_database(str(tmp_path / "missing.mmdb"))
+        try:
+            assert geo.lookup_ip("203.0.113.0") == geo.EMPTY_LOCATION
+            assert get_geolocation("203.0.113.0") is None
+        finally:
+            geo.set_database(None)
+
+    def test_enrichment_uses_ip_prefix(self, geoip_db):
+        from src.analytics import enrich_visit_data
+
+        class MockVisit:
+            id = 1
+            url_id = 1
+            clicked_at = datetime(2024, 1, 15, 10)
+            user_agent = CHROME_UA
+            visitor_ip_hash = "hash"
+            visitor_ip_prefix = "198.51.100.0"
+            referer = None
+
+        enriched = enrich_visit_data([MockVisit()])
+
+        assert enriched[0].geolocation.country == "DE"
+        assert enriched[0].geolocation.city == "Berlin"
+
+
+class TestGeoBreakdown:
+    @pytest.mark.parametrize("source", ["rollups", "stream"])
+    def test_breakdown_counts_located_visits(self, geoip_db, test_db, seed_visits, source):
+        from src.analytics import get_full_analytics
+
+        seed_visits([
+            _visit("203.0.113.0"), _visit("203.0.113.0"),
+            _visit("198.51.100.0"),
+            _visit("8.8.8.0"), _visit(None),
+        ])
+
+        result = get_full_analytics(1, test_db, source=source)
+
+        assert result["total_clicks"] == 5
+        assert result["geo_breakdown"] == [
+            {"country": "US", "region": "California", "city": "Mountain View", "count": 2},
+            {"country": "DE", "region": "Berlin", "city": "Berlin", "count": 1},
+        ]
+
+    def test_breakdown_is_empty_without_database(self, test_db, seed_visits):
+        from src.analytics import get_full_analytics
+
+        seed_visits([_visit("203.0.113.0")])
+
+        result = get_full_analytics(1, test_db)
+
+        assert result["total_clicks"] == 1
+        assert result["geo_breakdown"] == []
+
+    def test_endpoint_and_summary(self, geoip_db, client, test_db, seed_visits):
+        from src.analytics import _build_common_summary
+
+        seed_visits([_visit("192.0.2.0"), _visit("203.0.113.0", day=16)])
+
+        response = client.get("/analytics/1")
+
+        assert response.status_code == 200
+        assert {"country": "FR", "region": None, "city": None, "count": 1} in response.json()["geo_breakdown"]
+        assert "Locations: FR 50%, US/California/Mountain View 50%" in _build_common_summary(1, test_db)
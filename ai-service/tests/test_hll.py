@@ -0,0 +1,185 @@
+import pytest
+from datetime import datetime
+
+
+CHROME_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0"
+GOOGLEBOT_UA = "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+
+
+def _visit(day, visitor, hour=12, url_id=1, ua=CHROME_UA):
+    return {
+        "url_id": url_id,
+        "clicked_at": datetime(2024, 1, day, hour),
+        "user_agent": ua,
+        "visitor_ip_hash": f"visitor-{visitor}",
+    }
+
+
+class TestHyperLogLog:
+    def test_small_counts_are_exact(self):
+        from src.hll import HyperLogLog
+
+        sketch = HyperLogLog()
+        sketch.add(f"visitor-{i}" for i in range(100))
+        sketch.add(f"visitor-{i}" for i in range(50))
+
+        # Linear counting: exact or within a couple of the true count
+        assert HyperLogLog().estimate() == 0
+        assert abs(sketch.estimate() - 100) <= 2
+
+    @pytest.mark.parametrize("count", [20_000, 200_000])
+    def test_large_counts_within_error_bound(self, count):
+        from src.hll import HyperLogLog
+
+        sketch = HyperLogLog()
+        sketch.add(f"visitor-{i}" for i in range(count))
+
+        # Three standard errors (1.04 / sqrt(4096) ~ 1.6%)
+        assert abs(sketch.estimate() - count) / count < 0.05
+
+    def test_merge_matches_sketch_of_union(self):
+        from src.hll import HyperLogLog
+
+        left, right, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        left.add(f"visitor-{i}" for i in range(0, 30_000))
+        right.add(f"visitor-{i}" for i in range(20_000, 50_000))
+        both.add(f"visitor-{i}" for i in range(0, 50_000))
+
+        merged = HyperLogLog.union([left, right])
+
+        assert (merged.registers == both.registers).all()
+        assert abs(merged.estimate() - 50_000) / 50_000 < 0.05
+
+    def test_round_trips_through_bytes(self):
+        from src.hll import HyperLogLog
+
+        sketch = HyperLogLog(precision=14)
+        sketch.add(f"visitor-{i}" for i in range(1000))
+        data = sketch.to_bytes()
+        restored = HyperLogLog.from_bytes(data)
+
+        assert restored.precision == 14
+        assert restored.estimate() == sketch.estimate()
+        assert len(HyperLogLog().to_bytes()) < 100
+
+    def test_rejects_mixed_precision(self):
+        from src.hll import HyperLogLog
+
+        with pytest.raises(ValueError):
+            HyperLogLog(12).merge(HyperLogLog(14))
+
+    def test_union_reduces_to_the_stored_precision(self, monkeypatch):
+        from src.hll import HyperLogLog
+
+        fine, coarse, direct = HyperLogLog(14), HyperLogLog(13), HyperLogLog(13)
+        fine.add(f"visitor-{i}" for i in range(0, 30_000))
+        coarse.add(f"visitor-{i}" for i in range(20_000, 50_000))
+        direct.add(f"visitor-{i}" for i in range(0, 50_000))
+        monkeypatch.setattr("src.hll.HLL_PRECISION", 16)
+
+        merged = HyperLogLog.union([fine, coarse])
+
+        # Reducing loses nothing: it matches a sketch built at the lower precision
+        assert merged.precision == 13
+        assert (merged.registers == direct.registers).all()
+        assert HyperLogLog.union([fine]).precision == 14
+
+
+class TestVisitorSketches:
+    def test_daily_sketches_match_exact_counts(self, test_db, seed_visits):
+        from src.analytics import get_full_analytics
+
+        seed_visits(
+            [_visit(15, i) for i in range(40)]
+            + [_visit(16, i) for i in range(30, 90)]
+            + [_visit(16, 5)]
+        )
+
+        result = get_full_analytics(1, test_db)
+
+        exact = {"2024-01-15": 40, "2024-01-16": 61}
+        assert abs(result["unique_visitors"] - 90) <= 2
+        assert [point["count"] for point in result["clicks_over_time"]] == [40, 61]
+        for point in result["clicks_over_time"]:
+            assert abs(point["unique_visitors"] - exact[point["date"]]) <= 2
+
+    def test_sketches_update_incrementally(self, test_db, seed_visits, mocker):
+        from src import rollups
+        from src.analytics import get_full_analytics
+
+        seed_visits([_visit(15, i) for i in range(10)])
+        get_full_analytics(1, test_db)
+        update = mocker.spy(rollups, "update_sketches")
+
+        seed_visits([_visit(15, i) for i in range(5, 20)])
+        get_full_analytics(1, test_db)
+        result = get_full_analytics(1, test_db)
+
+        # Only the new id window is folded in, and nothing on a refresh without new visits
+        assert update.call_count == 1
+        assert update.call_args.args[2:] == (10, 25)
+        assert result["unique_visitors"] == 20
+
+    @pytest.mark.parametrize("source", ["rollups", "stream"])
+    def test_weekly_buckets_merge_days(self, test_db, seed_visits, source):
+        from src.analytics import get_full_analytics
+
+        # Mon 15th and Sun 21st share a week; the 22nd starts the next one
+        seed_visits([_visit(15, i) for i in range(10)] + [_visit(21, i) for i in range(5, 15)] + [_visit(22, 1)])
+
+        result = get_full_analytics(1, test_db, source=source, start=datetime(2024, 1, 1), end=datetime(2024, 2, 1), bucket="week")
+
+        assert result["unique_visitors"] == 15
+        assert result["clicks_over_time"] == [
+            {"date": "2024-01-15", "count": 20, "unique_visitors": 15},
+            {"date": "2024-01-22", "count": 1, "unique_visitors": 1},
+        ]
+
+    def test_unaligned_window_counts_window_only(self, test_db, seed_visits):
+        from src.analytics import get_full_analytics
+
+        seed_visits([_visit(15, i, hour=9) for i in range(10)] + [_visit(15, i, hour=15) for i in range(10, 13)])
+
+        result = get_full_analytics(1, test_db, start=datetime(2024, 1, 15, 14, 30), end=datetime(2024, 1, 16), bucket="minute")
+
+        assert result["unique_visitors"] == 3
+        assert "unique_visitors" not in result["clicks_over_time"][0]
+
+    def test_whole_day_hourly_window_merges_sketches(self, test_db, seed_visits, mocker):
+        from src import analytics
+
+        seed_visits([_visit(15, i, hour=9) for i in range(10)] + [_visit(16, i, hour=15) for i in range(5, 12)])
+        count = mocker.spy(analytics, "count_unique_visitors")
+
+        result = analytics.get_full_analytics(1, test_db, start=datetime(2024, 1, 15), end=datetime(2024, 1, 17), bucket="hour")
+        later = analytics.get_full_analytics(1, test_db, start=datetime(2024, 1, 15, 12), end=datetime(2024, 1, 17), bucket="hour")
+
+        # Only the window that does not start on a day boundary is counted from visits
+        assert result["unique_visitors"] == 12
+        assert later["unique_visitors"] == 7
+        assert count.call_count == 1
+
+    def test_summary_uses_sketch_estimate(self, test_db, seed_visits):
+        from src.analytics import get_analytics_summary
+
+        seed_visits([_visit(15, i % 7) for i in range(60)])
+
+        assert "unique visitors: 7" in get_analytics_summary(1, test_db)
+
+    def test_human_sketches_leave_bots_out(self, test_db, seed_visits, mocker):
+        from src import analytics
+        from src.enrichment import enrich_batch
+
+        seed_visits([_visit(15, i) for i in range(12)] + [_visit(16, i, ua=GOOGLEBOT_UA) for i in range(8, 20)])
+        enrich_batch(test_db)
+        # Visits enriched later are classified from their user agent
+        seed_visits([_visit(16, 30), _visit(16, 31, ua=GOOGLEBOT_UA)])
+        count = mocker.spy(analytics, "count_unique_visitors")
+
+        humans = analytics.get_full_analytics(1, test_db, exclude_bots=True, start=datetime(2024, 1, 15), end=datetime(2024, 1, 17))
+
+        assert humans["unique_visitors"] == 13
+        assert [point["unique_visitors"] for point in humans["clicks_over_time"]] == [12, 1]
+        assert "unique visitors: 13" in analytics.get_analytics_summary(1, test_db, exclude_bots=True)
+        assert "unique visitors: 22" in analytics.get_analytics_summary(1, test_db)
+        assert count.call_count == 0
@@ -0,0 +1,329 @@
+import asyncio
+import time
+
+import pytest
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    from src.jobs import MemoryJobStore, SQLiteJobStore
+
+    store = MemoryJobStore() if request.param == "memory" else SQLiteJobStore(str(tmp_path / "jobs.db"))
+    yield store
+    store.close()
+
+
+def _submit(store, user, url_id, kind="insight", **payload):
+    from src.jobs import new_job
+    job, _ = store.submit(new_job(kind, {"url_id": url_id, **payload}, user))
+    return job
+
+
+def _wait_until_finished(queue, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = queue.get(job_id)
+        if job.status in ("succeeded", "failed"):
+            return job
+        assert time.monotonic() < deadline, f"job still {job.status}"
+        time.sleep(0.01)
+
+
+def _queue(session_factory, handlers, **options):
+    from src.jobs import JobQueue, MemoryJobStore
+
+    options.setdefault("backoff", 0.01)
+    options.setdefault("poll_interval", 0.05)
+    return JobQueue(MemoryJobStore(), session_factory, handlers, **options)
+
+
+@pytest.fixture
+def session_factory(test_db):
+    from sqlalchemy.orm import sessionmaker
+    return sessionmaker(bind=test_db.get_bind())
+
+
+class TestJobStore:
+    def test_identical_pending_jobs_are_merged(self, store):
+        from src.jobs import new_job
+
+        first, created = store.submit(new_job("chat", {"url_id": 1, "message": "hi", "bypass_cache": False}, "u1"))
+        duplicate, duplicate_created = store.submit(new_job("chat", {"url_id": 1, "message": "hi", "bypass_cache": True}, "u2"))
+        other, other_created = store.submit(new_job("chat", {"url_id": 1, "message": "bye"}, "u1"))
+
+        assert created and other_created and not duplicate_created
+        assert duplicate.id == first.id
+        assert other.id != first.id
+
+    def test_finished_jobs_are_not_merged(self, store):
+        from src.jobs import SUCCEEDED
+
+        first = _submit(store, "u1", 1)
+        store.update(first.id, time.time(), status=SUCCEEDED, result="done")
+
+        assert _submit(store, "u1", 1).id != first.id
+
+    def test_claims_rotate_between_users(self, store):
+        jobs = [_submit(store, "busy", url_id) for url_id in (1, 2, 3)] + [_submit(store, "quiet", 4)]
+
+        claimed = [store.claim(time.time(), lease=60) for _ in jobs]
+
+        assert [job.payload["url_id"] for job in claimed] == [1, 4, 2, 3]
+        assert all(job.status == "running" and job.attempts == 1 for job in claimed)
+        assert store.claim(time.time(), lease=60) is None
+
+    def test_retry_waits_for_run_after(self, store):
+        job = _submit(store, "u1", 1)
+        claimed = store.claim(time.time(), lease=60)
+        store.update(claimed.id, time.time(), status="queued", error="boom", run_after=time.time() + 60)
+
+        assert store.claim(time.time(), lease=60) is None
+        assert store.next_due() > time.time()
+        assert store.claim(time.time() + 61, lease=60).id == job.id
+
+    def test_expired_lease_is_claimed_again(self, store):
+        job = _submit(store, "u1", 1)
+        store.claim(time.time(), lease=10)
+
+        assert store.claim(time.time(), lease=10) is None
+        reclaimed = store.claim(time.time() + 11, lease=10)
+        assert reclaimed.id == job.id
+        assert reclaimed.attempts == 2
+
+    def test_queue_is_bounded(self, store):
+        from src.jobs import QueueFull, new_job
+
+        store.submit(new_job("insight", {"url_id": 1}, "u1"), max_pending=1)
+
+        with pytest.raises(QueueFull):
+            store.submit(new_job("insight", {"url_id": 2}, "u1"), max_pending=1)
+
+    def test_purge_drops_old_finished_jobs(self, store):
+        done = _submit(store, "u1", 1)
+        pending = _submit(store, "u1", 2)
+        store.update(done.id, time.time() - 100, status="failed", error="boom")
+
+        assert store.purge(time.time() - 50) == 1
+        assert store.get(done.id) is None
+        assert store.get(pending.id).status == "queued"
+        assert store.counts() == {"queued": 1}
+
+    def test_sqlite_queue_survives_reopening(self, tmp_path):
+        from src.jobs import SQLiteJobStore
+
+        path = str(tmp_path / "jobs.db")
+        job = _submit(SQLiteJobStore(path), "u1", 1, kind="graph_insight", graph_type="devices")
+
+        reopened = SQLiteJobStore(path)
+        claimed = reopened.claim(time.time(), lease=60)
+        reopened.close()
+
+        assert claimed.id == job.id
+        assert claimed.payload == {"url_id": 1, "graph_type": "devices"}
+
+
+class TestJobQueue:
+    def test_runs_jobs_and_retries_with_backoff(self, session_factory):
+        attempts = []
+
+        async def flaky(payload, db):
+            attempts.append(time.monotonic())
+            if len(attempts) < 3:
+                raise RuntimeError("upstream timeout")
+            return f"insight for {payload['url_id']}"
+
+        queue = _queue(session_factory, {"insight": flaky}, backoff=0.05)
+        queue.start()
+        try:
+            job, _ = queue.submit("insight", {"url_id": 7}, "u1")
+            job = _wait_until_finished(queue, job.id)
+        finally:
+            queue.stop(timeout=5)
+
+        assert job.status == "succeeded"
+        assert job.result == "insight for 7"
+        assert job.attempts == 3
+        assert job.error is None
+        assert attempts[2] - attempts[1] > attempts[1] - attempts[0] >= 0.05
+
+    def test_gives_up_after_max_attempts(self, session_factory):
+        from src.metrics import AI_JOBS
+
+        async def broken(payload, db):
+            raise RuntimeError("upstream down")
+
+        queue = _queue(session_factory, {"insight": broken}, max_attempts=2)
+        queue.start()
+        try:
+            job, _ = queue.submit("insight", {"url_id": 1}, "u1")
+            job = _wait_until_finished(queue, job.id)
+        finally:
+            queue.stop(timeout=5)
+
+        assert job.status == "failed"
+        assert job.attempts == 2
+        assert job.error == "upstream down"
+        assert AI_JOBS.value("insight", "failed") >= 1
+
+    @pytest.mark.parametrize("outcome", ["succeeded", "failed"])
+    def test_job_dropped_while_running_does_not_stop_the_worker(self, session_factory, outcome):
+        async def dropped(payload, db):
+            # As if the job expired from the store while it ran
+            queue.store._jobs.pop(queue.store._pending.pop(next(iter(queue.store._pending))))
+            if outcome == "failed":
+                raise RuntimeError("upstream down")
+            return "lost"
+
+        async def fine(payload, db):
+            return "ok"
+
+        queue = _queue(session_factory, {"insight": dropped, "chat": fine}, workers=1, max_attempts=1)
+        queue.start()
+        try:
+            queue.submit("insight", {"url_id": 1}, "u1")
+            job, _ = queue.submit("chat", {"url_id": 2, "message": "hi"}, "u2")
+            job = _wait_until_finished(queue, job.id)
+        finally:
+            queue.stop(timeout=5)
+
+        assert job.result == "ok"
+
+    def test_pool_bounds_concurrency(self, session_factory):
+        running = []
+        peak = []
+
+        async def slow(payload, db):
+            running.append(payload["url_id"])
+            peak.append(len(running))
+            await asyncio.sleep(0.05)
+            running.remove(payload["url_id"])
+            return "ok"
+
+        queue = _queue(session_factory, {"insight": slow}, workers=2)
+        queue.start()
+        try:
+            jobs = [queue.submit("insight", {"url_id": url_id}, f"u{url_id}")[0] for url_id in range(6)]
+            finished = [_wait_until_finished(queue, job.id) for job in jobs]
+        finally:
+            queue.stop(timeout=5)
+
+        assert all(job.status == "succeeded" for job in finished)
+        assert max(peak) == 2
+
+    def test_stop_returns_running_jobs_to_the_queue(self, session_factory):
+        started = []
+
+        async def hang(payload, db):
+            started.append(payload["url_id"])
+            await asyncio.sleep(30)
+
+        queue = _queue(session_factory, {"insight": hang})
+        queue.start()
+        job, _ = queue.submit("insight", {"url_id": 1}, "u1")
+        deadline = time.monotonic() + 5
+        while not started:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        queue.stop(timeout=5)
+
+        job = queue.get(job.id)
+        assert job.status == "queued"
+        assert job.attempts == 0
+
+
+class TestJobEndpoints:
+    @pytest.fixture
+    def job_queue(self, session_factory, monkeypatch):
+        from src.jobs import JOB_HANDLERS
+
+        queue = _queue(session_factory, JOB_HANDLERS, max_attempts=2)
+        monkeypatch.setattr("src.main.job_queue", queue)
+        queue.start()
+        yield queue
+        queue.stop(timeout=5)
+
+    def test_submit_returns_immediately_then_poll(self, client, job_queue, llm_stub, mocker):
+        mocker.patch("src.analytics.get_analytics_summary", return_value="Total clicks: 3")
+        llm_stub.delay = 0.3
+
+        started = time.perf_counter()
+        response = client.post("/ai/jobs", json={"kind": "graph_insight", "url_id": 1, "graph_type": "devices", "user_id": 42})
+        elapsed = time.perf_counter() - started
+
+        assert response.status_code == 202
+        assert elapsed < 0.3
+        submitted = response.json()
+        assert submitted["status"] in ("queued", "running")
+
+        body = client.get(f"/ai/jobs/{submitted['job_id']}", params={"wait": 5}).json()
+        assert body["status"] == "succeeded"
+        assert body["result"] == "Stub insight."
+        assert body["attempts"] == 1
+
+    def test_duplicate_submission_returns_pending_job(self, client, job_queue, llm_stub, mocker):
+        mocker.patch("src.analytics.get_analytics_summary", return_value="Total clicks: 3")
+        llm_stub.delay = 0.3
+        request = {"kind": "chat", "url_id": 1, "message": "Who visits?", "user_id": 42}
+
+        first = client.post("/ai/jobs", json=request).json()
+        second = client.post("/ai/jobs", json=request).json()
+        client.get(f"/ai/jobs/{first['job_id']}", params={"wait": 5})
+
+        assert second["job_id"] == first["job_id"]
+        assert second["deduplicated"] is True
+        assert len(llm_stub.requests) == 1
+
+    def test_upstream_errors_are_retried_then_reported(self, client, job_queue, llm_stub, mocker):
+        mocker.patch("src.analytics.get_analytics_summary", return_value="Total clicks: 3")
+        llm_stub.status = 500
+
+        job_id = client.post("/ai/jobs", json={"kind": "insight", "url_id": 1}).json()["job_id"]
+        body = client.get(f"/ai/jobs/{job_id}", params={"wait": 5}).json()
+
+        assert body["status"] == "failed"
+        assert body["attempts"] == 2
+        assert "Error calling AI API" in body["error"]
+        assert len(llm_stub.requests) == 2
+
+    def test_finished_job_is_posted_to_callback_url(self, client, job_queue, llm_stub, mocker, monkeypatch):
+        mocker.patch("src.analytics.get_analytics_summary", return_value="Total clicks: 3")
+        monkeypatch.setattr("src.jobs.AI_JOB_CALLBACK_HOSTS", frozenset({"127.0.0.1"}))
+        # The stub records any JSON POST, so it doubles as the callback receiver
+        job_id = client.post("/ai/jobs", json={"kind": "insight", "url_id": 1, "callback_url": llm_stub.url}).json()["job_id"]
+        client.get(f"/ai/jobs/{job_id}", params={"wait": 5})
+
+        deadline = time.monotonic() + 5
+        while len(llm_stub.requests) < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        callback = llm_stub.requests[1]
+        assert callback["job_id"] == job_id
+        assert callback["status"] == "succeeded"
+        assert callback["result"] == "Stub insight."
+
+    @pytest.mark.parametrize("callback_url", [
+        "http://169.254.169.254/latest/meta-data/",
+        "http://hooks.example.com@127.0.0.2/",
+        "file:///etc/passwd",
+        "not a url",
+    ])
+    def test_callback_hosts_must_be_allowlisted(self, client, job_queue, monkeypatch, callback_url):
+        monkeypatch.setattr("src.jobs.AI_JOB_CALLBACK_HOSTS", frozenset({"hooks.example.com"}))
+
+        response = client.post("/ai/jobs", json={"kind": "insight", "url_id": 1, "callback_url": callback_url})
+
+        assert response.status_code == 422
+        assert job_queue.store.next_due() is None
+
+    def test_validation_and_unknown_jobs(self, client, job_queue):
+        assert client.post("/ai/jobs", json={"kind": "chat", "url_id": 1}).status_code == 422
+        assert client.post("/ai/jobs", json={"kind": "summary", "url_id": 1}).status_code == 422
+        assert client.get("/ai/jobs/does-not-exist").status_code == 404
+
+    def test_full_queue_is_503(self, client, session_factory, monkeypatch):
+        from src.jobs import JOB_HANDLERS
+
+        monkeypatch.setattr("src.main.job_queue", _queue(session_factory, JOB_HANDLERS, max_pending=1))
+
+        assert client.post("/ai/jobs", json={"kind": "insight", "url_id": 1}).status_code == 202
+        assert client.post("/ai/jobs", json={"kind": "insight", "url_id": 2}).status_code == 503
@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+
+
+class TestLLMClient:
+    def test_chat_completion_against_stub(self, llm_stub):
+        from src.llm import LLMClient
+
+        async def run():
+            client = LLMClient(llm_stub.url, "test-key")
+            try:
+                return await client.chat_completion("model-x", "Hello")
+            finally:
+                await client.aclose()
+
+        assert asyncio.run(run()) == "Stub insight."
+        assert llm_stub.requests[0]["model"] == "model-x"
+        assert llm_stub.requests[0]["messages"] == [{"role": "user", "content": "Hello"}]
+
+    def test_concurrency_limit_caps_outstanding_calls(self, llm_stub):
+        from src.llm import LLMClient
+
+        llm_stub.delay = 0.05
+
+        async def run():
+            client = LLMClient(llm_stub.url, "test-key", max_concurrency=2)
+            try:
+                await asyncio.gather(*(client.chat_completion("m", f"p{i}") for i in range(6)))
+            finally:
+                await client.aclose()
+
+        asyncio.run(run())
+
+        assert len(llm_stub.requests) == 6
+        assert llm_stub.max_in_flight <= 2
+
+    def test_read_timeout_raises_llm_error(self, llm_stub, monkeypatch):
+        from src import llm
+
+        monkeypatch.setattr(llm, "LLM_READ_TIMEOUT", 0.05)
+        llm_stub.delay = 0.3
+
+        async def run():
+            client = llm.LLMClient(llm_stub.url, "test-key")
+            try:
+                await client.chat_completion("m", "p")
+            finally:
+                await client.aclose()
+
+        with pytest.raises(llm.LLMError):
+            asyncio.run(run())
+
+    def test_client_is_shared_within_an_event_loop(self, llm_stub):
+        from src.llm import get_llm_client, close_llm_client
+
+        async def run():
+            first = get_llm_client()
+            second = get_llm_client()
+            await close_llm_client()
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert first is second
+
+
+class TestAIEndpoints:
+    def test_chat_endpoint_uses_configured_llm(self, llm_stub, client, test_db, mocker):
+        mocker.patch("src.analytics.get_analytics_summary", return_value="Total clicks: 3")
+        llm_stub.content = "Most of your traffic is desktop."
+
+        response = client.post("/ai/chat", json={"url_id": 1, "message": "Who visits?"})
+
+        assert response.status_code == 200
+        assert response.json()["response"] == "Most of your traffic is desktop."
+        assert "Who visits?" in llm_stub.requests[0]["messages"][0]["content"]
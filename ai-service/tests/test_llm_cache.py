@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+
+
+class TestLLMResponseCache:
+    def test_memory_tier_hit(self):
+        from src.llm_cache import LLMResponseCache
+
+        cache = LLMResponseCache(maxsize=4)
+        assert cache.get("model", "prompt") is None
+        cache.set("model", "prompt", "answer")
+
+        assert cache.get("model", "prompt") == "answer"
+        assert cache.get("other-model", "prompt") is None
+        assert cache.stats()["hits"] == 1
+
+    def test_entries_expire_after_ttl(self, mocker):
+        from src import llm_cache
+
+        clock = mocker.patch.object(llm_cache.time, "time", return_value=1000.0)
+        cache = llm_cache.LLMResponseCache(maxsize=4, ttl=60)
+        cache.set("model", "prompt", "answer")
+
+        clock.return_value = 1059.0
+        assert cache.get("model", "prompt") == "answer"
+        clock.return_value = 1061.0
+        assert cache.get("model", "prompt") is None
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        from src.llm_cache import LLMResponseCache
+
+        path = str(tmp_path / "llm_cache.sqlite3")
+        LLMResponseCache(maxsize=4, path=path).set("model", "prompt", "answer")
+
+        restarted = LLMResponseCache(maxsize=4, path=path)
+        assert restarted.get("model", "prompt") == "answer"
+        assert restarted.stats()["disk_hits"] == 1
+
+
+class TestCachedLLMCalls:
+    def test_identical_graph_insights_call_llm_once(self, llm_stub, test_db, mocker):
+        from src import analytics
+
+        llm_stub.content = "Desktop dominates."
+        mocker.patch.object(analytics, "get_analytics_summary", return_value="Total clicks: 3")
+
+        first = asyncio.run(analytics.generate_graph_insight(1, "device_breakdown", test_db))
+        second = asyncio.run(analytics.generate_graph_insight(1, "device_breakdown", test_db))
+
+        assert first == second == "Desktop dominates."
+        assert len(llm_stub.requests) == 1
+
+        asyncio.run(analytics.generate_graph_insight(1, "device_breakdown", test_db, bypass_cache=True))
+        assert len(llm_stub.requests) == 2
+
+    def test_errors_are_not_cached(self, llm_stub, test_db, mocker):
+        from src import analytics
+
+        llm_stub.status = 429
+        mocker.patch.object(analytics, "get_analytics_summary", return_value="Total clicks: 3")
+
+        result = asyncio.run(analytics.generate_graph_insight(1, "device_breakdown", test_db))
+        asyncio.run(analytics.generate_graph_insight(1, "device_breakdown", test_db))
+
+        assert result.startswith("Error calling AI API")
+        assert len(llm_stub.requests) == 2
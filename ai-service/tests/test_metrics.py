@@ -0,0 +1,119 @@
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    from src.metrics import reset_metrics
+    reset_metrics()
+    yield
+    reset_metrics()
+
+
+def _sample(text, name):
+    """Value of the exposition line starting with name (labels included)"""
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+class TestHistogram:
+    def test_renders_cumulative_buckets(self):
+        from src.metrics import Histogram
+
+        histogram = Histogram("demo_seconds", "Demo.", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, "db")
+
+        assert histogram.render() == [
+            "# HELP demo_seconds Demo.",
+            "# TYPE demo_seconds histogram",
+            'demo_seconds_bucket{stage="db",le="0.1"} 2',
+            'demo_seconds_bucket{stage="db",le="1.0"} 3',
+            'demo_seconds_bucket{stage="db",le="+Inf"} 4',
+            'demo_seconds_sum{stage="db"} 3.65',
+            'demo_seconds_count{stage="db"} 4',
+        ]
+
+    def test_span_records_stage(self):
+        from src.metrics import STAGE_DURATION, span, timed
+
+        @timed("aggregate")
+        def work():
+            return 42
+
+        with span("summary"):
+            assert work() == 42
+
+        assert STAGE_DURATION.count("aggregate") == 1
+        assert STAGE_DURATION.count("summary") == 1
+        assert STAGE_DURATION.sum("summary") >= STAGE_DURATION.sum("aggregate")
+
+
+    def test_failed_statements_leave_no_state_on_the_connection(self):
+        from sqlalchemy import create_engine, text
+        from sqlalchemy.exc import OperationalError
+        from src.metrics import STAGE_DURATION
+
+        engine = create_engine("sqlite:///:memory:")
+        with engine.connect() as conn:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    conn.execute(text("SELECT * FROM missing_table"))
+            conn.execute(text("SELECT 1"))
+
+            assert "query_started" not in conn.info
+        assert STAGE_DURATION.count("db") == 1
+
+
+class TestMetricsEndpoint:
+    def test_records_routes_and_stages(self, client, seed_visits):
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, 10), "user_agent": "Mozilla/5.0 (Windows NT 10.0) Chrome/120.0"}])
+
+        assert client.get("/analytics/1").status_code == 200
+        assert client.get("/analytics/2").status_code == 200
+        body = client.get("/metrics").text
+
+        assert _sample(body, 'http_request_duration_seconds_count{method="GET",route="/analytics/{url_id}",status="200"}') == 2
+        for stage in ("analytics", "db", "enrich", "rollups"):
+            assert _sample(body, f'stage_duration_seconds_count{{stage="{stage}"}}') >= 1
+        assert 'cache_hit_ratio{cache="user_agent"}' in body
+
+    def test_unmatched_paths_share_one_label(self, client):
+        client.get("/no/such/path")
+        client.get("/another/missing")
+
+        body = client.get("/metrics").text
+
+        assert _sample(body, 'http_request_duration_seconds_count{method="GET",route="unmatched",status="404"}') == 2
+
+    def test_llm_errors_and_cache_hits_are_counted(self, client, seed_visits, llm_stub):
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, 10)}])
+
+        client.post("/ai/insight", json={"url_id": 1})
+        client.post("/ai/insight", json={"url_id": 1})  # answered from the LLM cache
+        llm_stub.status = 500
+        failed = client.post("/ai/insight", json={"url_id": 1, "bypass_cache": True}).json()
+        body = client.get("/metrics").text
+
+        assert "Error calling AI API" in failed["insight"]
+        assert _sample(body, 'llm_requests_total{outcome="ok"}') == 1
+        assert _sample(body, 'llm_requests_total{outcome="error"}') == 1
+        assert _sample(body, 'cache_hits_total{cache="llm"}') == 1
+        assert _sample(body, 'stage_duration_seconds_count{stage="llm"}') == 2
+
+
+class TestServerTiming:
+    def test_header_only_when_enabled(self, client, seed_visits, monkeypatch):
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, 10)}])
+
+        assert "server-timing" not in client.get("/analytics/1").headers
+
+        monkeypatch.setattr("src.metrics.SERVER_TIMING", True)
+        header = client.get("/analytics/1").headers["server-timing"]
+
+        stages = dict(entry.split(";dur=") for entry in header.split(", "))
+        assert {"analytics", "db", "app"} <= set(stages)
+        assert float(stages["app"]) >= float(stages["analytics"])
@@ -0,0 +1,188 @@
+import pytest
+from datetime import datetime, timedelta
+
+pytest.importorskip("duckdb")
+
+CHROME_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0"
+IPHONE_UA = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Safari/17.0"
+BOT_UA = "Googlebot/2.1 (+http://www.google.com/bot.html)"
+
+
+@pytest.fixture(autouse=True)
+def olap_store(monkeypatch):
+    """A fresh in-memory DuckDB copy per test"""
+    from src.olap import OlapStore
+
+    store = OlapStore(":memory:")
+    monkeypatch.setattr("src.olap.olap_store", store)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def traffic(seed_visits):
+    """Three weeks of mixed traffic on url 1, plus some on url 2"""
+    visits = []
+    for index in range(240):
+        visits.append({
+            "url_id": 1,
+            "clicked_at": datetime(2024, 1, 1, 0, 7) + timedelta(hours=index * 2, minutes=index % 50),
+            "user_agent": (CHROME_UA, IPHONE_UA, BOT_UA)[index % 3],
+            "referer": (None, "https://t.co/abc", "https://news.ycombinator.com/item?id=1", "https://t.co/xyz")[index % 4],
+            "visitor_ip_hash": f"visitor-{index % 37}",
+        })
+    visits += [{"url_id": 2, "clicked_at": datetime(2024, 1, 3, 12), "user_agent": CHROME_UA} for _ in range(5)]
+    seed_visits(visits)
+
+
+def _analytics(db, source, **kwargs):
+    from src.analytics import get_full_analytics
+    return get_full_analytics(1, db, source=source, **kwargs)
+
+
+class TestOlapSync:
+    def test_sync_follows_the_watermark(self, test_db, seed_visits, olap_store):
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, hour)} for hour in range(5)])
+
+        assert olap_store.sync(test_db, batch_size=2) == 5
+        assert olap_store.watermark() == 5
+        assert olap_store.sync(test_db) == 0
+
+        seed_visits([{"clicked_at": datetime(2024, 1, 16, 9), "user_agent": BOT_UA}])
+        assert olap_store.sync(test_db) == 1
+        assert olap_store.query("SELECT COUNT(*), COUNT(*) FILTER (WHERE is_bot) FROM visits") == [(6, 1)]
+
+    def test_derived_columns_match_the_classifiers(self, test_db, seed_visits, olap_store):
+        from src.enrichment import referrer_host
+        from src.user_agents import classify_user_agent
+
+        seed_visits([{"clicked_at": datetime(2024, 1, 15), "user_agent": IPHONE_UA, "referer": "https://www.t.co/abc"}])
+        olap_store.sync(test_db)
+
+        expected = classify_user_agent(IPHONE_UA)
+        assert olap_store.query("SELECT device_type, os, browser, referrer_host, is_bot FROM visits") == [
+            (expected.device_type, expected.os, expected.browser, referrer_host("https://www.t.co/abc"), False),
+        ]
+
+    def test_signature_change_rebuilds_the_copy(self, test_db, seed_visits, olap_store):
+        from src import user_agents
+
+        acme = "Mozilla/5.0 (Windows NT 10.0) Chrome/120.0 AcmeFetcher/1.0"
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, hour), "user_agent": acme} for hour in range(3)])
+        olap_store.sync(test_db)
+        assert olap_store.query("SELECT COUNT(*) FILTER (WHERE is_bot) FROM visits") == [(0,)]
+
+        try:
+            user_agents.set_bot_signatures(user_agents.load_bot_signatures(None) + ["acmefetcher"])
+            assert olap_store.sync(test_db) == 3
+            assert olap_store.query("SELECT COUNT(*), COUNT(*) FILTER (WHERE is_bot) FROM visits") == [(3, 3)]
+            assert olap_store.sync(test_db) == 0
+        finally:
+            user_agents.set_bot_signatures(user_agents.load_bot_signatures(None))
+
+    def test_worker_step_copies_one_batch(self, test_db, seed_visits, olap_store):
+        from sqlalchemy.orm import sessionmaker
+        from src.olap import OlapSyncWorker
+
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, hour)} for hour in range(5)])
+        worker = OlapSyncWorker(sessionmaker(bind=test_db.get_bind()), batch_size=2)
+
+        assert worker.store is olap_store
+        assert worker.step(test_db) == 2
+        assert worker.run_once() == 3
+        assert olap_store.watermark() == 5
+
+    def test_reads_pick_up_new_visits(self, test_db, seed_visits):
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, 10)}])
+        assert _analytics(test_db, "duckdb")["total_clicks"] == 1
+
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, 11)}])
+        assert _analytics(test_db, "duckdb")["total_clicks"] == 2
+
+    def test_reads_fall_back_to_rollups_until_the_copy_is_built(self, test_db, seed_visits, olap_store, monkeypatch, mocker):
+        from sqlalchemy.orm import sessionmaker
+        from src import olap
+        from src.olap import OlapSyncWorker
+
+        seed_visits([{"clicked_at": datetime(2024, 1, 15, hour)} for hour in range(5)])
+        monkeypatch.setattr("src.olap.OLAP_SYNC_BATCH_SIZE", 2)
+        olap_read = mocker.spy(olap, "get_olap_analytics")
+
+        # A read copies one batch at most and is answered from the rollups
+        assert _analytics(test_db, "duckdb")["total_clicks"] == 5
+        assert olap_store.watermark() == 2
+        assert olap_read.call_count == 0
+
+        OlapSyncWorker(sessionmaker(bind=test_db.get_bind()), batch_size=2).run_once()
+        assert _analytics(test_db, "duckdb")["total_clicks"] == 5
+        assert olap_read.call_count == 1
+
+
+class TestOlapParity:
+    @pytest.mark.parametrize("source", ["rollups", "stream"])
+    @pytest.mark.parametrize("exclude_bots", [False, True])
+    def test_default_payload_matches(self, test_db, traffic, source, exclude_bots):
+        assert _analytics(test_db, "duckdb", exclude_bots=exclude_bots) == _analytics(test_db, source, exclude_bots=exclude_bots)
+
+    @pytest.mark.parametrize("options", [
+        {"bucket": "day"},
+        {"start": datetime(2024, 1, 3), "end": datetime(2024, 1, 10), "bucket": "hour"},
+        {"start": datetime(2024, 1, 1), "end": datetime(2024, 1, 22), "bucket": "week"},
+        {"start": datetime(2024, 1, 5, 6, 30), "end": datetime(2024, 1, 5, 9), "bucket": "minute"},
+        {"bucket": "hour", "max_points": 20},
+        {"exclude_bots": True},
+    ])
+    def test_range_payload_matches(self, test_db, traffic, options):
+        assert _analytics(test_db, "duckdb", **options) == _analytics(test_db, "stream", **options)
+
+    def test_batch_matches_single_url(self, test_db, traffic):
+        from src.analytics import get_batch_analytics
+
+        batch = get_batch_analytics([1, 2], test_db, source="duckdb")
+
+        assert batch[1] == _analytics(test_db, "rollups")
+        assert batch[2]["total_clicks"] == 5
+
+    def test_batch_query_count_does_not_grow_with_urls(self, test_db, traffic, mocker):
+        from src import olap
+        from src.analytics import get_batch_analytics, get_full_analytics
+
+        get_batch_analytics([1], test_db, source="duckdb")
+        query = mocker.spy(olap.OlapStore, "query")
+        few = get_batch_analytics([1, 2], test_db, source="duckdb")
+        few_queries = query.call_count
+        many = get_batch_analytics(list(range(1, 51)), test_db, source="duckdb")
+
+        assert query.call_count == 2 * few_queries
+        assert many[2] == few[2] == get_full_analytics(2, test_db, source="rollups")
+        assert many[50]["total_clicks"] == 0
+
+    def test_invalid_range_is_rejected(self, test_db, traffic):
+        with pytest.raises(ValueError):
+            _analytics(test_db, "duckdb", start=datetime(2024, 1, 5), end=datetime(2024, 1, 4))
+
+    @pytest.mark.parametrize("exclude_bots", [False, True])
+    def test_summary_matches(self, test_db, traffic, monkeypatch, exclude_bots):
+        from src.analytics import _build_common_summary
+        from src.heavy_hitters import catch_up_heavy_hitters
+
+        catch_up_heavy_hitters(test_db)
+        expected = _build_common_summary(1, test_db, exclude_bots)
+        monkeypatch.setattr("src.analytics.ANALYTICS_SOURCE", "duckdb")
+
+        assert _build_common_summary(1, test_db, exclude_bots) == expected
+
+    def test_summary_without_visits(self, test_db, monkeypatch):
+        from src.analytics import NO_VISITS_SUMMARY, _build_common_summary
+
+        monkeypatch.setattr("src.analytics.ANALYTICS_SOURCE", "duckdb")
+
+        assert _build_common_summary(1, test_db) == NO_VISITS_SUMMARY
+
+    def test_endpoint_serves_duckdb_source(self, client, test_db, traffic, monkeypatch):
+        monkeypatch.setattr("src.analytics.ANALYTICS_SOURCE", "duckdb")
+
+        response = client.get("/analytics/1")
+
+        assert response.status_code == 200
+        assert response.json()["total_clicks"] == 240
@@ -0,0 +1,166 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+
+CHROME_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0"
+IPHONE_UA = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Safari/17.0"
+
+
+def _visit(day, hour, ua=CHROME_UA, referer=None, url_id=1):
+    return {
+        "url_id": url_id,
+        "clicked_at": datetime(2024, 1, day, hour, 15, 0),
+        "user_agent": ua,
+        "referer": referer,
+    }
+
+
+class TestRollupRefresh:
+    def test_refresh_folds_only_new_visits(self, test_db, seed_visits):
+        from src.rollups import refresh_rollups
+
+        seed_visits([_visit(15, 10), _visit(15, 11)])
+        assert refresh_rollups(test_db, 1) == 2
+        assert refresh_rollups(test_db, 1) == 0
+
+        seed_visits([_visit(16, 9, ua=IPHONE_UA)])
+        assert refresh_rollups(test_db, 1) == 1
+
+        watermark = test_db.execute(
+            text("SELECT last_visit_id FROM rollup_watermarks WHERE url_id = 1")
+        ).scalar()
+        assert watermark == 3
+
+    def test_refresh_in_small_batches_matches_single_pass(self, test_db, seed_visits):
+        from src.rollups import refresh_rollups, get_rollup_analytics
+
+        seed_visits([_visit(15, hour % 24, referer="https://t.co") for hour in range(30)])
+
+        assert refresh_rollups(test_db, 1, batch_size=7) == 30
+        result = get_rollup_analytics(test_db, 1)
+
+        assert result["total_clicks"] == 30
+        assert sum(item["count"] for item in result["hourly_pattern"]) == 30
+        assert result["referrer_breakdown"] == [{"referrer": "https://t.co", "count": 30}]
+
+    def test_stale_watermark_is_not_double_counted(self, test_db, seed_visits, mocker):
+        from src import rollups
+
+        seed_visits([_visit(15, 10), _visit(15, 11)])
+
+        # First read sees a stale watermark, as if another worker just claimed the range
+        real_get_watermark = rollups._get_watermark
+        calls = {"n": 0}
+
+        def racing_get_watermark(db, url_id):
+            calls["n"] += 1
+            if calls["n"] == 1:
+                rollups.refresh_rollups(db, url_id)
+                return 0
+            return real_get_watermark(db, url_id)
+
+        mocker.patch.object(rollups, "_get_watermark", side_effect=racing_get_watermark)
+        rollups.refresh_rollups(test_db, 1)
+        mocker.stopall()
+
+        assert rollups.get_rollup_analytics(test_db, 1)["total_clicks"] == 2
+
+    def test_late_commit_of_a_lower_id_is_not_skipped(self, test_db, monkeypatch):
+        from src.rollups import get_rollup_analytics, refresh_rollups
+
+        def insert(visit_id, clicked_at):
+            test_db.execute(
+                text("INSERT INTO visits (id, url_id, visitor_ip_hash, user_agent, clicked_at) VALUES (:id, 1, 'h', :ua, :at)"),
+                {"id": visit_id, "ua": CHROME_UA, "at": clicked_at},
+            )
+            test_db.commit()
+
+        # Id 2 is taken by an insert still in flight while id 3 commits
+        just_now = datetime.utcnow() - timedelta(seconds=1)
+        insert(1, datetime(2024, 1, 15, 10))
+        insert(3, just_now)
+        assert refresh_rollups(test_db, 1) == 1
+
+        insert(2, just_now)
+        monkeypatch.setattr("src.database.VISIT_SETTLE_SECONDS", 0)
+        assert refresh_rollups(test_db, 1) == 2
+        assert get_rollup_analytics(test_db, 1)["total_clicks"] == 3
+
+
+class TestRollupAnalytics:
+    def test_breakdowns_and_daily_series(self, test_db, seed_visits):
+        from src.analytics import get_full_analytics
+
+        seed_visits([
+            _visit(15, 10, referer="https://google.com"),
+            _visit(15, 10, referer="https://google.com"),
+            _visit(16, 22, ua=IPHONE_UA),
+            _visit(16, 23, url_id=2),
+        ])
+
+        result = get_full_analytics(url_id=1, db=test_db)
+
+        assert result["total_clicks"] == 3
+        assert result["unique_visitors"] == 1
+        assert result["clicks_over_time"] == [
+            {"date": "2024-01-15", "count": 2, "unique_visitors": 1},
+            {"date": "2024-01-16", "count": 1, "unique_visitors": 1},
+        ]
+        assert result["device_breakdown"] == [
+            {"device": "Desktop", "count": 2},
+            {"device": "Mobile/Tablet", "count": 1},
+        ]
+        assert {"os": "Windows", "count": 2} in result["os_breakdown"]
+        assert result["referrer_breakdown"] == [
+            {"referrer": "https://google.com", "count": 2},
+            {"referrer": "Direct", "count": 1},
+        ]
+        assert result["hourly_pattern"] == [{"hour": 10, "count": 2}, {"hour": 22, "count": 1}]
+
+    def test_hourly_rollups_are_kept(self, test_db, seed_visits):
+        from src.analytics import get_full_analytics
+
+        seed_visits([_visit(15, 10), _visit(15, 10), _visit(15, 11)])
+        get_full_analytics(url_id=1, db=test_db)
+
+        rows = test_db.execute(text("""
+            SELECT bucket_start, count FROM visit_rollups
+            WHERE url_id = 1 AND granularity = 'hour' AND dimension = 'browser' AND value = 'Chrome'
+            ORDER BY bucket_start
+        """)).fetchall()
+        assert [row.count for row in rows] == [2, 1]
+
+
+class TestBatchAnalytics:
+    def test_query_count_does_not_grow_with_urls(self, test_db, seed_visits, mocker):
+        from src.analytics import get_batch_analytics
+
+        seed_visits([_visit(15, 10, url_id=url_id) for url_id in range(1, 51)])
+        get_batch_analytics(list(range(1, 51)), test_db)
+
+        # Only url 7 has new visits: seed, probe, its refresh and the reads, whatever the url count
+        seed_visits([_visit(16, 10, url_id=7)])
+        execute = mocker.spy(test_db, "execute")
+        results = get_batch_analytics(list(range(1, 201)), test_db)
+
+        assert len(results) == 200
+        assert results[7]["total_clicks"] == 2
+        assert results[150]["total_clicks"] == 0
+        assert execute.call_count < 20
+
+    @pytest.mark.parametrize("source", ["rollups", "stream"])
+    def test_matches_single_url_analytics(self, test_db, seed_visits, source):
+        from src.analytics import get_batch_analytics, get_full_analytics
+
+        seed_visits([
+            _visit(15, 10, referer="https://google.com"),
+            _visit(16, 22, ua=IPHONE_UA),
+            _visit(16, 23, url_id=2),
+            _visit(17, 1, url_id=2, referer="https://t.co"),
+        ])
+
+        results = get_batch_analytics([1, 2], test_db, source=source)
+
+        assert results[1] == get_full_analytics(url_id=1, db=test_db, source=source)
+        assert results[2] == get_full_analytics(url_id=2, db=test_db, source=source)
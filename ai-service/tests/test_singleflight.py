@@ -0,0 +1,213 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+CALLERS = 8
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    from src.metrics import reset_metrics
+    reset_metrics()
+    yield
+    reset_metrics()
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def _coalesced(operation):
+    from src.metrics import SINGLE_FLIGHT_REQUESTS
+    return SINGLE_FLIGHT_REQUESTS.value(operation, "coalesced")
+
+
+def _run_concurrently(fn, callers=CALLERS):
+    """Runs fn in `callers` threads; returns their results (or raised exceptions) in order"""
+    results = [None] * callers
+
+    def run(index):
+        try:
+            results[index] = fn()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+class Gate:
+    """Backend stand-in that counts calls and blocks until released"""
+
+    def __init__(self, result=None, error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = threading.Event()
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class TestSingleFlight:
+    def test_concurrent_callers_share_one_call(self):
+        from src.singleflight import SingleFlight
+
+        flight = SingleFlight("demo")
+        gate = Gate(result={"total_clicks": 3})
+        threads, results = _run_concurrently(lambda: flight.do("key", gate))
+        _wait_for(lambda: _coalesced("demo") == CALLERS - 1)
+        gate.release.set()
+        for thread in threads:
+            thread.join()
+
+        assert gate.calls == 1
+        assert all(result is gate.result for result in results)
+        assert flight.in_flight() == 0
+
+    def test_exception_reaches_every_caller(self):
+        from src.singleflight import SingleFlight
+
+        flight = SingleFlight("demo")
+        gate = Gate(error=ValueError("boom"))
+        threads, results = _run_concurrently(lambda: flight.do("key", gate))
+        _wait_for(lambda: _coalesced("demo") == CALLERS - 1)
+        gate.release.set()
+        for thread in threads:
+            thread.join()
+
+        assert gate.calls == 1
+        assert all(isinstance(result, ValueError) for result in results)
+
+    def test_sequential_and_distinct_calls_are_not_coalesced(self):
+        from src.metrics import SINGLE_FLIGHT_REQUESTS
+        from src.singleflight import SingleFlight
+
+        flight = SingleFlight("demo")
+        calls = []
+        for key in ("a", "a", "b"):
+            flight.do(key, lambda: calls.append(key))
+
+        assert len(calls) == 3
+        assert SINGLE_FLIGHT_REQUESTS.value("demo", "executed") == 3
+        assert _coalesced("demo") == 0
+
+
+class TestAsyncSingleFlight:
+    def test_concurrent_coroutines_share_one_call(self):
+        from src.singleflight import AsyncSingleFlight
+
+        flight = AsyncSingleFlight("demo")
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def run():
+            return await asyncio.gather(*(flight.do("key", work) for _ in range(CALLERS)))
+
+        assert asyncio.run(run()) == ["done"] * CALLERS
+        assert len(calls) == 1
+        assert _coalesced("demo") == CALLERS - 1
+        assert flight.in_flight() == 0
+
+    def test_cancelled_caller_does_not_cancel_shared_work(self):
+        from src.singleflight import AsyncSingleFlight
+
+        flight = AsyncSingleFlight("demo")
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def run():
+            first = asyncio.ensure_future(flight.do("key", work))
+            second = asyncio.ensure_future(flight.do("key", work))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await second
+
+        assert asyncio.run(run()) == "done"
+
+
+class TestCoalescedAnalytics:
+    def test_full_analytics_runs_once_for_concurrent_requests(self, test_db, mocker):
+        from src.analytics import get_full_analytics
+
+        gate = Gate()
+        mocker.patch("src.analytics.refresh_rollups", gate)
+        backend = mocker.patch("src.analytics.get_rollup_analytics", return_value={"total_clicks": 5})
+
+        threads, results = _run_concurrently(lambda: get_full_analytics(1, test_db, source="rollups"))
+        _wait_for(lambda: _coalesced("analytics") == CALLERS - 1)
+        gate.release.set()
+        for thread in threads:
+            thread.join()
+
+        assert gate.calls == 1
+        assert backend.call_count == 1
+        assert results == [{"total_clicks": 5}] * CALLERS
+
+    def test_different_parameters_are_computed_separately(self, test_db, mocker):
+        from src.analytics import get_full_analytics
+
+        mocker.patch("src.analytics.refresh_rollups")
+        backend = mocker.patch("src.analytics.get_rollup_analytics", return_value={})
+        human_backend = mocker.patch("src.analytics.get_human_analytics", return_value={})
+
+        get_full_analytics(1, test_db, source="rollups")
+        get_full_analytics(2, test_db, source="rollups")
+        get_full_analytics(1, test_db, source="rollups", exclude_bots=True)
+
+        assert backend.call_count == 2
+        assert human_backend.call_count == 1
+
+    def test_summary_is_built_once_for_concurrent_prompts(self, test_db, mocker):
+        from src.analytics import get_analytics_summary
+
+        gate = Gate(result="Total clicks: 5")
+        mocker.patch("src.analytics.get_visits_fingerprint", return_value=(5, 5))
+        mocker.patch("src.analytics._build_common_summary", gate)
+
+        threads, results = _run_concurrently(lambda: get_analytics_summary(1, test_db))
+        _wait_for(lambda: _coalesced("summary") == CALLERS - 1)
+        gate.release.set()
+        for thread in threads:
+            thread.join()
+
+        assert gate.calls == 1
+        assert results == ["Total clicks: 5"] * CALLERS
+
+    def test_identical_prompts_make_one_llm_request(self, llm_stub):
+        from src.analytics import _call_mistral
+
+        llm_stub.delay = 0.2
+
+        async def run():
+            return await asyncio.gather(*(_call_mistral("same prompt", bypass_cache=True) for _ in range(CALLERS)))
+
+        assert asyncio.run(run()) == ["Stub insight."] * CALLERS
+        assert len(llm_stub.requests) == 1
+        assert _coalesced("llm") == CALLERS - 1
+
+    def test_coalesced_requests_are_exported(self, client):
+        from src.metrics import SINGLE_FLIGHT_REQUESTS
+
+        SINGLE_FLIGHT_REQUESTS.inc("analytics", "coalesced", amount=3)
+
+        body = client.get("/metrics").text
+
+        assert 'singleflight_requests_total{operation="analytics",outcome="coalesced"} 3' in body
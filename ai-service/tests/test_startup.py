@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+PROBE = """
+import json, sys
+import src.main
+from src.database import engine_initialized
+print(json.dumps({"engine": engine_initialized(), "modules": sorted(m for m in ("pandas", "numpy", "httpx", "geoip2", "uvicorn") if m in sys.modules)}))
+"""
+
+
+class TestImport:
+    def test_import_needs_no_env_and_loads_nothing_heavy(self, tmp_path):
+        env = {key: value for key, value in os.environ.items() if key not in ("DATABASE_URL", "OPENROUTER_API_KEY")}
+        env["PYTHONPATH"] = str(ROOT)
+        # Run from an empty directory so no .env file is picked up
+        result = subprocess.run([sys.executable, "-c", PROBE], cwd=tmp_path, env=env, capture_output=True, text=True)
+
+        assert result.returncode == 0, result.stderr
+        assert json.loads(result.stdout.splitlines()[-1]) == {"engine": False, "modules": []}
+
+    def test_missing_api_key_is_reported_by_the_llm_call(self, monkeypatch):
+        from src import analytics
+
+        monkeypatch.setattr("src.llm.OPENROUTER_API_KEY", None)
+
+        assert asyncio.run(analytics._call_mistral("prompt")) == "OPENROUTER_API_KEY not set in .env file"
+
+
+class TestReadiness:
+    def test_ready_when_database_answers(self, client, test_db):
+        body = client.get("/ready").json()
+
+        assert body["ready"] is True
+        assert body["database"] == "connected"
+        assert body["resources"]["llm"] in ("configured", "missing_api_key")
+        assert set(body["resources"]["modules"]) == {"pandas", "numpy", "httpx", "geoip2"}
+
+    def test_not_ready_when_database_fails(self, client):
+        from src.database import get_db
+        from src.main import app
+
+        class BrokenSession:
+            def execute(self, *args, **kwargs):
+                raise RuntimeError("connection refused")
+
+        app.dependency_overrides[get_db] = lambda: BrokenSession()
+        try:
+            response = client.get("/ready")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 503
+        assert response.json()["database"] == "unavailable"
+
+    def test_warm_up_loads_lazy_resources(self):
+        from src import startup
+
+        startup.warm_up()
+        status = startup.resource_status()
+
+        assert status["warm_up"] == "done"
+        assert status["modules"]["pandas"] and status["modules"]["httpx"]
+        assert status["geoip"] in ("loaded", "unavailable")
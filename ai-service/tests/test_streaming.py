@@ -0,0 +1,77 @@
+import asyncio
+import json
+import time
+import pytest
+
+
+def _events(body: str):
+    """Parses an SSE body into (event, data) pairs"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = "message", None
+        for line in block.split("\n"):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+        events.append((event, data))
+    return events
+
+
+class TestStreamingClient:
+    def test_deltas_arrive_before_completion_finishes(self, llm_stub):
+        from src.llm import LLMClient
+
+        llm_stub.content = "one two three four"
+        llm_stub.chunk_delay = 0.1
+
+        async def run():
+            client = LLMClient(llm_stub.url, "test-key")
+            start = time.perf_counter()
+            arrivals = []
+            try:
+                async for delta in client.stream_chat_completion("m", "p"):
+                    arrivals.append((delta, time.perf_counter() - start))
+            finally:
+                await client.aclose()
+            return arrivals
+
+        arrivals = asyncio.run(run())
+
+        assert "".join(delta for delta, _ in arrivals).strip() == "one two three four"
+        assert arrivals[0][1] < arrivals[-1][1] - 0.2
+        assert llm_stub.requests[0]["stream"] is True
+
+
+class TestStreamingEndpoints:
+    def test_chat_streams_server_sent_events(self, llm_stub, client, test_db, mocker):
+        mocker.patch("src.analytics.get_analytics_summary", return_value="Total clicks: 3")
+        llm_stub.content = "Mostly desktop traffic."
+
+        response = client.post("/ai/chat", json={"url_id": 1, "message": "Who visits?", "stream": True})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _events(response.text)
+        assert "".join(data["delta"] for event, data in events if event == "message").strip() == "Mostly desktop traffic."
+        assert events[-1][0] == "done"
+
+    def test_graph_insight_stream_is_cached_for_json_fallback(self, llm_stub, client, test_db, mocker):
+        mocker.patch("src.analytics.get_analytics_summary", return_value="Total clicks: 3")
+        llm_stub.content = "Peak at 10am."
+
+        client.post("/ai/graph-insight", json={"url_id": 1, "graph_type": "hourly", "stream": True})
+        response = client.post("/ai/graph-insight", json={"url_id": 1, "graph_type": "hourly"})
+
+        assert response.json()["insight"] == "Peak at 10am."
+        assert len(llm_stub.requests) == 1
+
+    def test_upstream_error_becomes_error_event(self, llm_stub, client, test_db, mocker):
+        mocker.patch("src.analytics.get_analytics_summary", return_value="Total clicks: 3")
+        llm_stub.status = 502
+
+        response = client.post("/ai/graph-insight", json={"url_id": 1, "graph_type": "hourly", "stream": True})
+
+        events = _events(response.text)
+        assert events[-1][0] == "error"
+        assert "Error calling AI API" in events[-1][1]["detail"]
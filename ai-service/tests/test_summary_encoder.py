@@ -0,0 +1,108 @@
+from collections import Counter
+from datetime import datetime
+
+
+def _inputs(devices=None, browsers=None, geo=None, referrers=(), total=100):
+    from src.topk import HeavyHitter
+
+    bundle = {
+        "total_clicks": total,
+        "clicks_over_time": [
+            {"timestamp": datetime(2024, 1, 15, 9), "count": 30},
+            {"timestamp": "2024-01-16T10:00:00", "count": 40},
+            {"timestamp": datetime(2024, 1, 17, 8), "count": 30},
+        ],
+    }
+    breakdowns = {
+        "device": Counter(devices or {"Desktop": 70, "Mobile/Tablet": 30}),
+        "os": Counter(),
+        "browser": Counter(browsers or {}),
+        "geo": Counter(geo or {}),
+        "referrer_host": Counter(),
+    }
+    return bundle, breakdowns, 42, [HeavyHitter(host, count, 0) for host, count in referrers]
+
+
+class TestEstimateTokens:
+    def test_counts_words_numbers_and_punctuation(self):
+        from src.summary_encoder import estimate_tokens
+
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("Total clicks") == 4
+        assert estimate_tokens("1240") == 2
+        assert estimate_tokens("{'Desktop': 512}") == 8
+
+    def test_compact_text_is_cheaper_than_dict_dumps(self):
+        from src.summary_encoder import estimate_tokens
+
+        assert estimate_tokens("Devices: Desktop 62%, Mobile/Tablet 38%") < estimate_tokens(
+            "Device breakdown: {'Desktop': 512, 'Mobile/Tablet': 314}"
+        )
+
+
+class TestEncodeSummary:
+    def test_sections_use_shares_of_clicks(self):
+        from src.summary_encoder import encode_summary
+
+        summary = encode_summary(*_inputs(referrers=[("t.co", 40), ("news.ycombinator.com", 10)], geo={"US|CA|": 3, "FR||": 1}))
+
+        assert summary.splitlines() == [
+            "Total clicks: 100; unique visitors: 42; most active day: 2024-01-16",
+            "Devices: Desktop 70%, Mobile/Tablet 30%",
+            "Top referrers: t.co 40%, news.ycombinator.com 10%",
+            "Locations: US/CA 75%, FR 25%",
+        ]
+
+    def test_long_tail_is_folded_into_other(self):
+        from src.summary_encoder import encode_summary
+
+        browsers = {f"Browser{index}": 10 for index in range(8)}
+        browsers.update({"Chrome": 919, "Rare": 1})
+        summary = encode_summary(*_inputs(browsers=browsers, total=1000), top_n=3)
+
+        assert "Browsers: Chrome 92%, Browser0 1%, Browser1 1%, other 6%" in summary
+
+    def test_ties_rank_by_name_and_output_is_deterministic(self):
+        from src.summary_encoder import encode_summary
+
+        first = encode_summary(*_inputs(devices={"Mobile/Tablet": 50, "Desktop": 50}))
+        second = encode_summary(*_inputs(devices={"Desktop": 50, "Mobile/Tablet": 50}))
+
+        assert first == second
+        assert "Devices: Desktop 50%, Mobile/Tablet 50%" in first
+
+    def test_tiny_shares_are_not_rounded_to_zero(self):
+        from src.summary_encoder import encode_summary
+
+        summary = encode_summary(*_inputs(devices={"Desktop": 999, "Tablet": 1}, total=1000))
+
+        assert "Devices: Desktop 100%, Tablet <1%" in summary
+
+    def test_budget_trims_entries_then_sections(self):
+        from src.summary_encoder import encode_summary, estimate_tokens
+
+        browsers = {f"Browser{index}": 100 - index for index in range(10)}
+        inputs = _inputs(browsers=browsers, referrers=[("t.co", 40), ("bing.com", 30)])
+        full = encode_summary(*inputs, budget=1000)
+
+        fewer_entries = encode_summary(*inputs, budget=estimate_tokens(full) - 1)
+        headline_only = encode_summary(*inputs, budget=1)
+
+        assert "Browser4" in full and "Browser4" not in fewer_entries
+        assert estimate_tokens(fewer_entries) < estimate_tokens(full)
+        assert headline_only == "Total clicks: 100; unique visitors: 42; most active day: 2024-01-16"
+
+    def test_built_summaries_respect_the_configured_budget(self, test_db, seed_visits, monkeypatch):
+        from src.analytics import _build_common_summary
+        from src.summary_encoder import estimate_tokens
+
+        monkeypatch.setattr("src.summary_encoder.SUMMARY_TOKEN_BUDGET", 40)
+        seed_visits([
+            {"clicked_at": datetime(2024, 1, 15, hour), "user_agent": f"Mozilla/5.0 Agent{hour}", "referer": f"https://site{hour}.example/page"}
+            for hour in range(24)
+        ])
+
+        summary = _build_common_summary(1, test_db)
+
+        assert summary.startswith("Total clicks: 24;")
+        assert estimate_tokens(summary) <= 40
@@ -0,0 +1,128 @@
+import pytest
+from datetime import datetime, timedelta
+
+
+CHROME_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0"
+IPHONE_UA = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Safari/17.0"
+
+
+def _visit(clicked_at, ua=CHROME_UA, referer=None, url_id=1):
+    return {"url_id": url_id, "clicked_at": clicked_at, "user_agent": ua, "referer": referer}
+
+
+class TestBucketChoice:
+    def test_keeps_requested_bucket_when_it_fits(self):
+        from src.timeseries import choose_bucket
+
+        assert choose_bucket(datetime(2024, 1, 1), datetime(2024, 1, 2), "hour", 500) == "hour"
+
+    def test_coarsens_long_ranges(self):
+        from src.timeseries import choose_bucket
+
+        year = (datetime(2024, 1, 1), datetime(2025, 1, 1))
+        assert choose_bucket(*year, "minute", 500) == "day"
+        assert choose_bucket(*year, "minute", 100) == "week"
+        assert choose_bucket(*year, "minute", 10) == "month"
+
+    def test_merges_points_past_monthly(self):
+        from src.timeseries import merge_points
+
+        series = [{"date": f"p{i}", "count": 1} for i in range(10)]
+        merged = merge_points(series, 4)
+
+        assert [point["date"] for point in merged] == ["p0", "p3", "p6", "p9"]
+        assert sum(point["count"] for point in merged) == 10
+
+
+class TestRangeAnalytics:
+    @pytest.mark.parametrize("source", ["rollups", "stream"])
+    def test_window_filters_totals_and_breakdowns(self, test_db, seed_visits, source):
+        from src.analytics import get_full_analytics
+
+        seed_visits([
+            _visit(datetime(2024, 1, 14, 23, 50)),
+            _visit(datetime(2024, 1, 15, 10, 5), referer="https://t.co"),
+            _visit(datetime(2024, 1, 15, 10, 40), ua=IPHONE_UA),
+            _visit(datetime(2024, 1, 16, 0, 0)),
+        ])
+
+        result = get_full_analytics(
+            1, test_db, source=source,
+            start=datetime(2024, 1, 15), end=datetime(2024, 1, 16), bucket="hour",
+        )
+
+        assert result["bucket"] == "hour"
+        assert result["total_clicks"] == 2
+        assert result["clicks_over_time"] == [{"date": "2024-01-15T10:00:00", "count": 2}]
+        assert {"device": "Mobile/Tablet", "count": 1} in result["device_breakdown"]
+        assert result["hourly_pattern"] == [{"hour": 10, "count": 2}]
+
+    def test_unaligned_window_matches_stream(self, test_db, seed_visits):
+        from src.analytics import get_full_analytics
+
+        seed_visits([_visit(datetime(2024, 1, 15, 10, minute)) for minute in (1, 20, 35, 59)])
+        window = {"start": datetime(2024, 1, 15, 10, 15), "end": datetime(2024, 1, 15, 10, 45), "bucket": "minute"}
+
+        rollups = get_full_analytics(1, test_db, source="rollups", **window)
+        stream = get_full_analytics(1, test_db, source="stream", **window)
+
+        assert rollups == stream
+        assert rollups["total_clicks"] == 2
+        assert [point["date"] for point in rollups["clicks_over_time"]] == ["2024-01-15T10:20:00", "2024-01-15T10:35:00"]
+
+    @pytest.mark.parametrize("source", ["rollups", "stream"])
+    def test_weeks_start_on_monday(self, test_db, seed_visits, source):
+        from src.analytics import get_full_analytics
+
+        # 2024-01-14 is a Sunday, 2024-01-15 a Monday
+        seed_visits([_visit(datetime(2024, 1, 14, 12)), _visit(datetime(2024, 1, 15, 12)), _visit(datetime(2024, 1, 21, 12))])
+
+        result = get_full_analytics(1, test_db, source=source, start=datetime(2024, 1, 1), end=datetime(2024, 2, 1), bucket="week")
+
+        assert result["clicks_over_time"] == [
+            {"date": "2024-01-08", "count": 1, "unique_visitors": 1},
+            {"date": "2024-01-15", "count": 2, "unique_visitors": 1},
+        ]
+
+    def test_yearly_range_is_downsampled(self, test_db, seed_visits):
+        from src.analytics import get_full_analytics
+
+        seed_visits([_visit(datetime(2024, 1, 1, 12) + timedelta(days=day)) for day in range(0, 366, 3)])
+
+        result = get_full_analytics(
+            1, test_db, start=datetime(2024, 1, 1), end=datetime(2025, 1, 1), bucket="hour", max_points=60,
+        )
+
+        assert result["bucket"] == "week"
+        assert len(result["clicks_over_time"]) <= 60
+        assert sum(point["count"] for point in result["clicks_over_time"]) == result["total_clicks"] == 122
+
+    def test_default_shape_is_unchanged(self, test_db, seed_visits):
+        from src.analytics import get_full_analytics
+
+        seed_visits([_visit(datetime(2024, 1, 15, 10))])
+
+        result = get_full_analytics(1, test_db)
+
+        assert "bucket" not in result
+        assert result["clicks_over_time"] == [{"date": "2024-01-15", "count": 1, "unique_visitors": 1}]
+
+
+class TestRangeEndpoint:
+    def test_query_parameters(self, client, test_db, seed_visits):
+        seed_visits([_visit(datetime(2024, 1, 15, 10)), _visit(datetime(2024, 3, 2, 10))])
+
+        response = client.get("/analytics/1", params={"from": "2024-01-01T00:00:00Z", "to": "2024-02-01T00:00:00Z", "bucket": "month"})
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["bucket"] == "month"
+        assert data["clicks_over_time"] == [{"date": "2024-01-01", "count": 1, "unique_visitors": 1}]
+
+    def test_inverted_range_is_rejected(self, client, test_db):
+        response = client.get("/analytics/1", params={"from": "2024-02-01", "to": "2024-01-01"})
+        assert response.status_code == 400
+
+    def test_unknown_bucket_is_rejected(self, client, test_db):
+        response = client.get("/analytics/1", params={"bucket": "fortnight"})
+        assert response.status_code == 422
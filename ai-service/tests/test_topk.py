@@ -0,0 +1,141 @@
+import random
+from collections import Counter
+from datetime import datetime
+
+
+CHROME_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0"
+
+
+def _visit(referer, url_id=1):
+    return {"url_id": url_id, "clicked_at": datetime(2024, 1, 15, 10), "user_agent": CHROME_UA, "referer": referer}
+
+
+def _zipf_stream(count, distinct, seed=7):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, distinct + 1)]
+    return rng.choices([f"site{rank}.example" for rank in range(distinct)], weights=weights, k=count)
+
+
+class TestSpaceSaving:
+    def test_exact_below_capacity(self):
+        from src.topk import SpaceSaving
+
+        summary = SpaceSaving(capacity=10)
+        summary.update({"a": 3, "b": 1})
+        summary.update({"a": 1, "c": 2})
+
+        assert [tuple(hitter) for hitter in summary.top()] == [("a", 4, 0), ("c", 2, 0), ("b", 1, 0)]
+
+    def test_skewed_stream_keeps_heavy_hitters(self):
+        from src.topk import SpaceSaving
+
+        stream = _zipf_stream(50_000, 2_000)
+        exact = Counter(stream)
+        summary = SpaceSaving(capacity=100)
+        for start in range(0, len(stream), 1000):
+            summary.update(Counter(stream[start:start + 1000]))
+
+        kept = {hitter.value: hitter for hitter in summary.top()}
+        threshold = len(stream) / summary.capacity
+        for value, count in exact.items():
+            if count > threshold:
+                assert value in kept
+        for value, hitter in kept.items():
+            assert hitter.count - hitter.error <= exact[value] <= hitter.count
+        assert [hitter.value for hitter in summary.top(10)] == [value for value, _ in exact.most_common(10)]
+
+    def test_round_trips_through_counters(self):
+        from src.topk import SpaceSaving
+
+        summary = SpaceSaving(capacity=2)
+        summary.update({"a": 5, "b": 2, "c": 1})
+        restored = SpaceSaving(2, {hitter.value: (hitter.count, hitter.error) for hitter in summary.top()})
+        restored.update({"d": 1})
+
+        assert [tuple(hitter) for hitter in restored.top()] == [("a", 5, 0), ("d", 4, 3)]
+
+
+class TestHeavyHitterTables:
+    def test_matches_exact_grouping(self, test_db, seed_visits):
+        from src.heavy_hitters import top_referrers, update_heavy_hitters
+
+        referers = [f"https://{host}/path" for host in _zipf_stream(3_000, 300)]
+        seed_visits([_visit(referer, url_id=1 + i % 2) for i, referer in enumerate(referers)] + [_visit(None)])
+        while update_heavy_hitters(test_db, batch_size=500, capacity=50, global_capacity=100):
+            pass
+
+        for url_id in (1, 2):
+            # Exact grouping of the same visits by host
+            exact = Counter(referer.split("/")[2] for i, referer in enumerate(referers) if 1 + i % 2 == url_id)
+            exact["Direct"] += url_id == 1
+            for hitter in top_referrers(test_db, url_id, limit=5):
+                assert hitter.count - hitter.error <= exact[hitter.value] <= hitter.count
+            assert [hitter.value for hitter in top_referrers(test_db, url_id, limit=3)] == [value for value, _ in exact.most_common(3)]
+
+        everywhere = Counter(referer.split("/")[2] for referer in referers)
+        assert [hitter.value for hitter in top_referrers(test_db, limit=3)] == [value for value, _ in everywhere.most_common(3)]
+
+    def test_feeds_only_new_visits(self, test_db, seed_visits):
+        from src.heavy_hitters import catch_up_heavy_hitters, top_referrers
+
+        seed_visits([_visit("https://www.google.com/search"), _visit("https://t.co/x"), _visit(None, url_id=2)])
+        catch_up_heavy_hitters(test_db)
+        assert [tuple(hitter) for hitter in top_referrers(test_db, 1)] == [("google.com", 1, 0), ("t.co", 1, 0)]
+
+        seed_visits([_visit("https://google.com/"), _visit("https://google.com/", url_id=2)])
+        catch_up_heavy_hitters(test_db)
+
+        assert [tuple(hitter) for hitter in top_referrers(test_db, 1)] == [("google.com", 2, 0), ("t.co", 1, 0)]
+        assert [tuple(hitter) for hitter in top_referrers(test_db)] == [("google.com", 3, 0), ("Direct", 1, 0), ("t.co", 1, 0)]
+
+    def test_stale_checkpoint_is_not_counted_twice(self, test_db, seed_visits, mocker):
+        from src import heavy_hitters
+
+        seed_visits([_visit("https://google.com/")])
+        heavy_hitters.update_heavy_hitters(test_db)
+        # A feeder that read the checkpoint before the batch above was claimed
+        mocker.patch.object(heavy_hitters, "_get_checkpoint", return_value=0)
+        heavy_hitters.update_heavy_hitters(test_db)
+        mocker.stopall()
+
+        assert [tuple(hitter) for hitter in heavy_hitters.top_referrers(test_db, 1)] == [("google.com", 1, 0)]
+
+    def test_reads_do_not_feed_the_tables(self, test_db, seed_visits, monkeypatch):
+        from src import heavy_hitters
+
+        seed_visits([_visit("https://google.com/") for _ in range(3)])
+        assert heavy_hitters.top_referrers(test_db, 1) == []
+        assert heavy_hitters.heavy_hitters_lag(test_db) == 3
+
+        # Without the worker, each read folds in one batch at most
+        monkeypatch.setattr(heavy_hitters, "TOPK_WORKER", False)
+        monkeypatch.setattr(heavy_hitters, "TOPK_BATCH_SIZE", 2)
+        assert [tuple(hitter) for hitter in heavy_hitters.top_referrers(test_db, 1)] == [("google.com", 2, 0)]
+        assert heavy_hitters.heavy_hitters_lag(test_db) == 1
+
+    def test_summary_lists_referrer_hosts(self, test_db, seed_visits):
+        from src.analytics import get_analytics_summary
+        from src.heavy_hitters import catch_up_heavy_hitters
+
+        seed_visits([_visit("https://www.google.com/a"), _visit("https://google.com/b"), _visit(None)])
+        catch_up_heavy_hitters(test_db)
+
+        assert "Top referrers: google.com 67%" in get_analytics_summary(1, test_db)
+
+
+class TestTopReferrersEndpoint:
+    def test_global_and_per_url(self, client, test_db, seed_visits):
+        from src.heavy_hitters import catch_up_heavy_hitters
+
+        seed_visits([_visit("https://t.co/a"), _visit("https://t.co/b", url_id=2), _visit("https://bing.com/", url_id=2)])
+        catch_up_heavy_hitters(test_db)
+
+        everywhere = client.get("/analytics/referrers/top").json()
+        one_url = client.get("/analytics/referrers/top", params={"url_id": 2, "limit": 1}).json()
+
+        assert everywhere == {
+            "url_id": None,
+            "referrers": [{"referrer": "t.co", "clicks": 2, "error": 0}, {"referrer": "bing.com", "clicks": 1, "error": 0}],
+            "lag": 0,
+        }
+        assert one_url == {"url_id": 2, "referrers": [{"referrer": "bing.com", "clicks": 1, "error": 0}], "lag": 0}
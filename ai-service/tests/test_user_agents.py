@@ -0,0 +1,184 @@
+import pytest
+
+
+def legacy_parse_user_agent(user_agent_string):
+    """The original substring-chain parser, kept as the reference behaviour"""
+    if not user_agent_string:
+        return {"device_type": None, "os": None, "browser": None}
+
+    ua = user_agent_string.lower()
+    device_type = "Desktop"
+    os_info = "Unknown OS"
+    browser_info = "Unknown Browser"
+
+    if "mobile" in ua or "android" in ua or "iphone" in ua or "ipad" in ua:
+        device_type = "Mobile/Tablet"
+    if "windows" in ua:
+        os_info = "Windows"
+    elif "macintosh" in ua or "mac os x" in ua:
+        os_info = "macOS"
+    elif "android" in ua:
+        os_info = "Android"
+    elif "iphone" in ua or "ipad" in ua or "ios" in ua:
+        os_info = "iOS"
+    elif "linux" in ua:
+        os_info = "Linux"
+
+    if "chrome" in ua and "chromium" not in ua and "edg" not in ua:
+        browser_info = "Chrome"
+    elif "firefox" in ua:
+        browser_info = "Firefox"
+    elif "safari" in ua and "chrome" not in ua:
+        browser_info = "Safari"
+    elif "edg" in ua:
+        browser_info = "Edge"
+    elif "opera" in ua or "opr" in ua:
+        browser_info = "Opera"
+    elif "bot" in ua or "crawler" in ua or "spider" in ua:
+        browser_info = "Bot/Crawler"
+
+    return {"device_type": device_type, "os": os_info, "browser": browser_info}
+
+
+USER_AGENTS = [
+    None,
+    "",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.2210.91",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (iPad; CPU OS 16_6 like Mac OS X) AppleWebKit/605.1.15 CriOS/120.0 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 Chrome/120.0.6099.144 Mobile Safari/537.36",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chromium/119.0 Chrome/119.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 Chrome/119.0 Safari/537.36 OPR/105.0",
+    "Opera/9.80 (Windows NT 6.1) Presto/2.12.388 Version/12.18",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; bingbot/2.0) Chrome/116.0 Safari/537.36",
+    "Mozilla/5.0 (compatible; Baiduspider/2.0)",
+    "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+    "curl/8.4.0",
+    "Mozilla/5.0 (radios; BIOS) crawler",
+    "MyCustomBot/1.0",
+    "Mozilla/5.0 (compatible; AcmeBot; +https://acme.example/bot) Chrome/120.0 Safari/537.36",
+]
+
+# Real browsers whose UAs contain words that crawler signatures used to match on
+NOT_BOT_USER_AGENTS = [
+    "Mozilla/5.0 (Linux; Android 10; CUBOT X30) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 13; SM-S911N; wv) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36 NAVER(inapp; search; 2000; 12.1.2)",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148 DaumApps/6.9.2",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36 ShopPreview/2.1",
+    "Mozilla/5.0 (Linux; Android 12; RubySplash Build/SP1A) AppleWebKit/537.36 Chrome/119.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 Chrome/120.0 Safari/537.36 BurpeeFit/3.0 FuzzyCam/1.0",
+    "Mozilla/5.0 (Linux; Android 11) AppleWebKit/537.36 Chrome/118.0 Mobile Safari/537.36 MyJava/1.0 app.php/2",
+]
+
+BOT_USER_AGENTS = {
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; bingbot/2.0) Chrome/116.0 Safari/537.36",
+    "Mozilla/5.0 (compatible; Baiduspider/2.0)",
+    "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+    "curl/8.4.0",
+    "Mozilla/5.0 (radios; BIOS) crawler",
+    "MyCustomBot/1.0",
+    "Mozilla/5.0 (compatible; AcmeBot; +https://acme.example/bot) Chrome/120.0 Safari/537.36",
+}
+
+
+def expected_classification(ua):
+    """Legacy behaviour, except that a crawler signature now wins over any browser token"""
+    result = legacy_parse_user_agent(ua)
+    if ua in BOT_USER_AGENTS:
+        result["browser"] = "Bot/Crawler"
+    return result
+
+
+class TestClassifier:
+    @pytest.mark.parametrize("ua", USER_AGENTS)
+    def test_matches_legacy_parser(self, ua):
+        from src.analytics import parse_user_agent
+
+        assert parse_user_agent(ua) == expected_classification(ua)
+
+    def test_repeated_lookups_hit_the_cache(self):
+        from src import user_agents
+
+        user_agents.cache_clear()
+        ua = USER_AGENTS[2]
+        first = user_agents.classify_user_agent(ua)
+        second = user_agents.classify_user_agent(ua)
+
+        assert first is second
+        assert user_agents.cache_info().hits == 1
+
+    def test_parse_user_agent_returns_independent_dicts(self):
+        from src.analytics import parse_user_agent
+
+        result = parse_user_agent(USER_AGENTS[2])
+        result["browser"] = "mutated"
+
+        assert parse_user_agent(USER_AGENTS[2])["browser"] == "Chrome"
+
+
+class TestBatchClassification:
+    def test_classify_distinct_returns_one_entry_per_value(self):
+        from src.user_agents import classify_distinct
+
+        column = USER_AGENTS * 3
+        table = classify_distinct(column)
+
+        assert len(table) == len(set(USER_AGENTS))
+        for ua in column:
+            assert table[ua]._asdict() == expected_classification(ua)
+
+
+class TestBotSignatures:
+    @pytest.mark.parametrize("ua", USER_AGENTS)
+    def test_flags_crawlers_whatever_browser_they_claim(self, ua):
+        from src.user_agents import is_bot_user_agent
+
+        assert is_bot_user_agent(ua) == (ua in BOT_USER_AGENTS)
+
+    @pytest.mark.parametrize("ua", NOT_BOT_USER_AGENTS)
+    def test_signatures_only_match_whole_product_names(self, ua):
+        from src.user_agents import classify_user_agent, is_bot_user_agent
+
+        assert not is_bot_user_agent(ua)
+        assert classify_user_agent(ua).browser != "Bot/Crawler"
+
+    def test_trie_pattern_matches_naive_search(self):
+        import random
+        import string
+        from src.user_agents import compile_bot_signatures
+
+        def at_token_start(signature, ua):
+            start = ua.find(signature)
+            while start != -1:
+                if start == 0 or ua[start - 1] in " (;,+":
+                    return True
+                start = ua.find(signature, start + 1)
+            return False
+
+        rng = random.Random(3)
+        signatures = ["".join(rng.choices("abcde", k=rng.randint(2, 6))) for _ in range(3000)] + ["a", "ab/"]
+        pattern = compile_bot_signatures(signatures)
+        for _ in range(500):
+            ua = "".join(rng.choices(string.ascii_lowercase[:8] + "/ (", k=rng.randint(0, 20)))
+            assert (pattern.search(ua) is not None) == any(at_token_start(signature, ua) for signature in signatures)
+
+    def test_signature_file_and_swap(self, tmp_path):
+        from src import user_agents
+
+        path = tmp_path / "signatures.txt"
+        path.write_text("# extra crawlers\nAcmeFetcher\n\n")
+        ua = "Mozilla/5.0 (Windows NT 10.0) Chrome/120.0 AcmeFetcher/1.0"
+        assert not user_agents.is_bot_user_agent(ua)
+
+        try:
+            user_agents.set_bot_signatures(user_agents.load_bot_signatures(str(path)))
+            assert user_agents.is_bot_user_agent(ua)
+            assert user_agents.classify_user_agent(ua).browser == "Bot/Crawler"
+        finally:
+            user_agents.set_bot_signatures(user_agents.load_bot_signatures(None))
+        assert not user_agents.is_bot_user_agent(ua)
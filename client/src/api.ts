@@ -12,4 +12,87 @@ api.interceptors.request.use((config) => {
   return config;
 });
 
+// POST that consumes a Server-Sent Events response, calling onDelta for each
+// token chunk as it arrives. Resolves with the full text once the stream ends.
+export const streamPost = async (
+  path: string,
+  body: object,
+  onDelta: (delta: string) => void
+): Promise<string> => {
+  const token = localStorage.getItem('token');
+  const response = await fetch(`${api.defaults.baseURL}${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      Accept: 'text/event-stream',
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify({ ...body, stream: true }),
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Streaming request failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let text = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+
+      const payload = JSON.parse(data);
+      if (event === 'error') throw new Error(payload.detail);
+      if (event === 'message' && payload.delta) {
+        text += payload.delta;
+        onDelta(payload.delta);
+      }
+    }
+  }
+  return text;
+};
+
+export interface AIJob {
+  job_id: string;
+  kind: 'insight' | 'graph_insight' | 'chat';
+  url_id: number;
+  status: 'queued' | 'running' | 'succeeded' | 'failed';
+  attempts: number;
+  result: string | null;
+  error: string | null;
+}
+
+// Queues an AI insight, graph insight or chat answer and resolves with the
+// finished job, long-polling instead of holding one request open meanwhile.
+export const runAIJob = async (body: {
+  kind: AIJob['kind'];
+  url_id: number;
+  graph_type?: string;
+  message?: string;
+  context?: string;
+  exclude_bots?: boolean;
+}): Promise<AIJob> => {
+  let { data: job } = await api.post<AIJob>('/ai/jobs', body);
+  while (job.status === 'queued' || job.status === 'running') {
+    ({ data: job } = await api.get<AIJob>(`/ai/jobs/${job.job_id}`, { params: { wait: 25 } }));
+  }
+  return job;
+};
+
 export default api;
@@ -1,5 +1,5 @@
 import React, { useState, useRef, useEffect } from 'react';
-import api from '../api';
+import api, { streamPost } from '../api';
 
 interface Message {
   role: 'user' | 'ai';
@@ -30,11 +30,40 @@ export const AIChatbox: React.FC<AIChatboxProps> = ({ urlId, context, onClose })
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages]);
 
+  // Streams an AI reply into a new message as tokens arrive; if streaming is
+  // unavailable, falls back to the plain JSON endpoint
+  const streamAIMessage = async (path: string, body: object, fallback: () => Promise<string>) => {
+    let started = false;
+    const appendDelta = (delta: string) => {
+      if (!started) {
+        started = true;
+        setLoading(false);
+        setMessages(prev => [...prev, { role: 'ai', content: delta }]);
+        return;
+      }
+      setMessages(prev => {
+        const last = prev[prev.length - 1];
+        return [...prev.slice(0, -1), { ...last, content: last.content + delta }];
+      });
+    };
+
+    try {
+      await streamPost(path, body, appendDelta);
+    } catch (err) {
+      if (started) throw err;
+      const content = await fallback();
+      setMessages(prev => [...prev, { role: 'ai', content }]);
+    }
+  };
+
   const fetchGraphInsight = async (graphType: string) => {
     setLoading(true);
     try {
-      const { data } = await api.post('/ai/graph-insight', { url_id: urlId, graph_type: graphType });
-      setMessages(prev => [...prev, { role: 'ai', content: data.insight }]);
+      const body = { url_id: urlId, graph_type: graphType };
+      await streamAIMessage('/ai/graph-insight', body, async () => {
+        const { data } = await api.post('/ai/graph-insight', body);
+        return data.insight;
+      });
     } catch (err) {
       setMessages(prev => [...prev, { role: 'ai', content: 'Failed to generate insight.' }]);
     } finally {
@@ -59,13 +88,15 @@ export const AIChatbox: React.FC<AIChatboxProps> = ({ urlId, context, onClose })
             ? context.graph
             : context;
 
-      const { data } = await api.post('/ai/chat', {
+      const body = {
         url_id: urlId,
         message: userMessage,
         context: effectiveContext,
+      };
+      await streamAIMessage('/ai/chat', body, async () => {
+        const { data } = await api.post('/ai/chat', body);
+        return data.response;
       });
-
-      setMessages(prev => [...prev, { role: 'ai', content: data.response }]);
     } catch (err) {
       setMessages(prev => [...prev, { role: 'ai', content: 'Error: Could not process your request.' }]);
     } finally {
@@ -6,6 +6,19 @@ import { query } from '../db';
 
 const mockedQuery = query as jest.MockedFunction<typeof query>;
 
+describe('anonymizeIp', () => {
+  it('should truncate IPv4 to /24 and IPv6 to /48', async () => {
+    const { anonymizeIp } = await import('../index');
+
+    expect(anonymizeIp('203.0.113.57')).toBe('203.0.113.0');
+    expect(anonymizeIp('203.0.113.57, 10.0.0.1')).toBe('203.0.113.0');
+    expect(anonymizeIp('::ffff:198.51.100.7')).toBe('198.51.100.0');
+    expect(anonymizeIp('2001:db8:85a3:8d3:1319:8a2e:370:7348')).toBe('2001:db8:85a3::');
+    expect(anonymizeIp('2001:db8::1')).toBe('2001:db8:0::');
+    expect(anonymizeIp('not an ip')).toBeNull();
+  });
+});
+
 describe('URL Shortening API', () => {
   let app: express.Application;
   let authToken: string;
@@ -129,6 +142,33 @@ describe('URL Shortening API', () => {
       expect(response.header.location).toBe('https://example.com');
     });
 
+    it('should log only the network prefix next to the IP hash', async () => {
+      mockedQuery
+        .mockResolvedValueOnce({
+          rows: [{ id: 1, original_url: 'https://example.com' }],
+          command: 'SELECT',
+          rowCount: 1,
+          oid: 0,
+          fields: [],
+        } as any)
+        .mockResolvedValueOnce({
+          rows: [],
+          command: 'INSERT',
+          rowCount: 1,
+          oid: 0,
+          fields: [],
+        } as any);
+
+      await request(app)
+        .get('/abc123')
+        .set('X-Forwarded-For', '203.0.113.57')
+        .redirects(0);
+
+      const [sql, params] = mockedQuery.mock.calls[1];
+      expect(sql).toContain('visitor_ip_prefix');
+      expect(params?.[2]).toBe('203.0.113.0');
+    });
+
     it('should return 404 for non-existent code', async () => {
       mockedQuery.mockResolvedValueOnce({
         rows: [],
@@ -38,12 +38,58 @@ export const initDB = async () => {
         id SERIAL PRIMARY KEY,
         url_id INTEGER REFERENCES urls(id) ON DELETE CASCADE,
         visitor_ip_hash VARCHAR(64),
+        visitor_ip_prefix VARCHAR(45),
         user_agent TEXT,
         referer TEXT,
         clicked_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
       );
     `);
-    
+
+    // Columns added after launch: the anonymized network prefix used for GeoIP
+    // lookups, and the derived per-visit columns filled in by the AI service's
+    // enrichment worker (is_bot IS NULL marks visits it has not reached yet). Added
+    // here, before the server takes traffic, so the AI service never alters visits
+    // while redirects are inserting into it. Only missing columns are altered, and the
+    // lock timeout makes a busy table fail fast rather than queue inserts behind the ALTER.
+    const addedColumns: Record<string, string> = {
+      visitor_ip_prefix: 'VARCHAR(45)',
+      device_type: 'VARCHAR(32)',
+      os: 'VARCHAR(32)',
+      browser: 'VARCHAR(32)',
+      referrer_host: 'VARCHAR(255)',
+      is_bot: 'BOOLEAN',
+    };
+    const existing = await client.query(
+      `SELECT column_name FROM information_schema.columns WHERE table_name = 'visits' AND column_name = ANY($1)`,
+      [Object.keys(addedColumns)]
+    );
+    const present = new Set(existing.rows.map((row: { column_name: string }) => row.column_name));
+    const missing = Object.entries(addedColumns).filter(([name]) => !present.has(name));
+    if (missing.length > 0) {
+      await client.query(`SET lock_timeout = '5s'`);
+      try {
+        await client.query(
+          `ALTER TABLE visits ${missing.map(([name, type]) => `ADD COLUMN IF NOT EXISTS ${name} ${type}`).join(', ')}`
+        );
+      } finally {
+        await client.query(`RESET lock_timeout`);
+      }
+    }
+
+    // Lets the enrichment hook find a URL's unenriched visits without a scan. Built
+    // CONCURRENTLY so inserts keep flowing; an interrupted build leaves an invalid
+    // index behind, which is dropped and rebuilt.
+    const invalidIndex = await client.query(`
+      SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+      WHERE c.relname = 'idx_visits_unenriched' AND NOT i.indisvalid
+    `);
+    if (invalidIndex.rows.length > 0) {
+      await client.query(`DROP INDEX CONCURRENTLY IF EXISTS idx_visits_unenriched`);
+    }
+    await client.query(`
+      CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_visits_unenriched ON visits (url_id, id) WHERE is_bot IS NULL;
+    `);
+
     console.log("Database tables verified.");
   } catch (err) {
     console.error("Error initializing DB:", err);
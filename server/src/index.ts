@@ -4,6 +4,7 @@ import helmet from 'helmet';
 import bcrypt from 'bcryptjs';
 import jwt from 'jsonwebtoken';
 import crypto from 'crypto';
+import net from 'net';
 import axios from 'axios';
 import rateLimit from 'express-rate-limit';
 import { query, initDB } from './db';
@@ -92,6 +93,29 @@ function normalizeUrl(input: unknown): string | null {
   return u.toString();
 }
 
+// Truncate a client address to a coarse network prefix (IPv4 /24, IPv6 /48):
+// enough for GeoIP country/city lookups, not enough to identify a visitor.
+export function anonymizeIp(raw: string): string | null {
+  let ip = raw.split(',')[0].trim().split('%')[0];
+  if (ip.toLowerCase().startsWith('::ffff:') && net.isIPv4(ip.slice(7))) {
+    ip = ip.slice(7);
+  }
+  if (net.isIPv4(ip)) {
+    const [a, b, c] = ip.split('.');
+    return `${a}.${b}.${c}.0`;
+  }
+  if (net.isIPv6(ip) && !ip.includes('.')) {
+    const [head, tail] = ip.split('::');
+    const headGroups = head ? head.split(':') : [];
+    const tailGroups = tail ? tail.split(':') : [];
+    const groups = ip.includes('::')
+      ? [...headGroups, ...Array(8 - headGroups.length - tailGroups.length).fill('0'), ...tailGroups]
+      : headGroups;
+    return `${groups.slice(0, 3).map(group => parseInt(group, 16).toString(16)).join(':')}::`;
+  }
+  return null;
+}
+
 
 // Routes
 
@@ -178,6 +202,35 @@ app.get('/api/urls', authenticateToken, async (req: AuthRequest, res) => {
     }
 });
 
+// BATCH ANALYTICS ENDPOINT (one upstream call for a whole dashboard)
+app.post('/api/analytics/batch', authenticateToken, async (req: AuthRequest, res) => {
+  const { url_ids } = req.body;
+  const userId = req.user?.id;
+
+  if (!Array.isArray(url_ids) || url_ids.length === 0) {
+    return res.status(400).json({ error: 'url_ids must be a non-empty array' });
+  }
+
+  try {
+    // Security: only forward URLs that belong to the user
+    const owned = await query('SELECT id FROM urls WHERE user_id = $1 AND id = ANY($2::int[])', [userId, url_ids]);
+    if (owned.rows.length === 0) {
+      return res.json({ results: [] });
+    }
+
+    const response = await axios.post(
+      `${AI_SERVICE_URL}/analytics/batch`,
+      { url_ids: owned.rows.map((row: { id: number }) => row.id) },
+      { timeout: 10000 }
+    );
+
+    res.json(response.data);
+  } catch (err) {
+    console.error('Batch analytics error:', err);
+    res.status(500).json({ error: 'Failed to fetch analytics data' });
+  }
+});
+
 // ADVANCED ANALYTICS ENDPOINT
 app.get('/api/analytics/:url_id', authenticateToken, async (req: AuthRequest, res) => {
   const { url_id } = req.params;
@@ -203,9 +256,90 @@ app.get('/api/analytics/:url_id', authenticateToken, async (req: AuthRequest, re
   }
 });
 
+// Streams have no overall deadline (a long reply takes minutes); they are cut
+// after this long without data. Above the AI service's LLM read timeout, so its
+// own error event normally arrives first.
+const AI_STREAM_IDLE_TIMEOUT_MS = Number(process.env.AI_STREAM_IDLE_TIMEOUT_MS) || 90000;
+
+const writeEvent = (res: Response, event: string, data: object) => {
+  res.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+};
+
+// Pass a Server-Sent Events response from the AI service through event by event,
+// so tokens reach the browser as the model produces them. Upstream failures and
+// idle timeouts end the stream with an "error" event; a browser that goes away
+// cancels the upstream request.
+const proxyEventStream = async (path: string, body: object, res: Response) => {
+  const controller = new AbortController();
+  let idleTimer: NodeJS.Timeout | undefined;
+  let finish = (_error?: string) => {
+    clearTimeout(idleTimer);
+    controller.abort();
+  };
+  const resetIdleTimer = () => {
+    clearTimeout(idleTimer);
+    idleTimer = setTimeout(() => finish('AI service stopped responding'), AI_STREAM_IDLE_TIMEOUT_MS);
+  };
+  // The response closes when the client disconnects; the request's 'close' only
+  // means its body has been read
+  res.on('close', () => finish());
+  resetIdleTimer();
+
+  // Errors before the first byte reject here and become the route's JSON 500
+  const upstream = await axios.post(`${AI_SERVICE_URL}${path}`, body, {
+    responseType: 'stream',
+    signal: controller.signal,
+  });
+  if (controller.signal.aborted) {
+    upstream.data.destroy();
+    return;
+  }
+
+  res.setHeader('Content-Type', 'text/event-stream');
+  res.setHeader('Cache-Control', 'no-cache');
+  res.setHeader('X-Accel-Buffering', 'no');
+  res.flushHeaders();
+
+  const stream = upstream.data;
+  let pending = '';
+  let finished = false;
+  let completed = false; // the AI service sent its closing done or error event
+  finish = (error?: string) => {
+    if (finished) return;
+    finished = true;
+    clearTimeout(idleTimer);
+    if (!res.writableEnded && !res.destroyed) {
+      // Only whole events are forwarded, so the error event is never glued to a partial one
+      if (error) writeEvent(res, 'error', { detail: error });
+      res.end();
+    }
+    stream.destroy();
+    controller.abort();
+  };
+
+  stream.setEncoding('utf8');
+  stream.on('data', (chunk: string) => {
+    resetIdleTimer();
+    pending += chunk;
+    const boundary = pending.lastIndexOf('\n\n');
+    if (boundary !== -1) {
+      const events = pending.slice(0, boundary + 2);
+      pending = pending.slice(boundary + 2);
+      completed = completed || /^event: (done|error)$/m.test(events);
+      res.write(events);
+    }
+  });
+  stream.on('end', () => finish(completed ? undefined : 'AI stream ended unexpectedly'));
+  stream.on('error', (err: Error) => {
+    if (finished) return;
+    console.error('AI stream error:', err.message);
+    finish('AI stream interrupted');
+  });
+};
+
 // GRAPH-SPECIFIC AI OVERVIEW
 app.post('/api/ai/graph-insight', authenticateToken, async (req: AuthRequest, res) => {
-  const { url_id, graph_type } = req.body;
+  const { url_id, graph_type, stream } = req.body;
   const userId = req.user?.id;
 
   if (!url_id || !graph_type) {
@@ -218,6 +352,10 @@ app.post('/api/ai/graph-insight', authenticateToken, async (req: AuthRequest, re
       return res.status(403).json({ error: 'Unauthorized' });
     }
 
+    if (stream) {
+      return await proxyEventStream('/ai/graph-insight', { url_id, graph_type, stream: true }, res);
+    }
+
     const response = await axios.post(
       `${AI_SERVICE_URL}/ai/graph-insight`,
       { url_id, graph_type },
@@ -233,7 +371,7 @@ app.post('/api/ai/graph-insight', authenticateToken, async (req: AuthRequest, re
 
 // Advanced analytics chat endpoint
 app.post('/api/ai/chat', authenticateToken, async (req: AuthRequest, res) => {
-  const { url_id, message, context } = req.body;
+  const { url_id, message, context, stream } = req.body;
   const userId = req.user?.id;
 
   if (!url_id || !message) {
@@ -246,6 +384,10 @@ app.post('/api/ai/chat', authenticateToken, async (req: AuthRequest, res) => {
       return res.status(403).json({ error: 'Unauthorized' });
     }
 
+    if (stream) {
+      return await proxyEventStream('/ai/chat', { url_id, message, context: context || 'general', stream: true }, res);
+    }
+
     const response = await axios.post(
       `${AI_SERVICE_URL}/ai/chat`,
       { url_id, message, context: context || 'general' },
@@ -279,10 +421,12 @@ app.get('/:code', async (req, res) => {
       
       // Simple hash for privacy
       const ipHash = crypto.createHash('sha256').update(String(ip)).digest('hex');
+      // Network prefix only, for country/city geolocation
+      const ipPrefix = anonymizeIp(String(ip));
 
       query(
-        'INSERT INTO visits (url_id, visitor_ip_hash, user_agent, referer) VALUES ($1, $2, $3, $4)',
-        [id, ipHash, userAgent, referer]
+        'INSERT INTO visits (url_id, visitor_ip_hash, visitor_ip_prefix, user_agent, referer) VALUES ($1, $2, $3, $4, $5)',
+        [id, ipHash, ipPrefix, userAgent, referer]
       ).catch(err => console.error("Logging error:", err));
 
     } else {
@@ -322,6 +466,66 @@ app.post('/api/insight', authenticateToken, insightLimiter, async (req: AuthRequ
     }
 });
 
+// Queued AI jobs: submitted on the user's behalf, so the AI service schedules them
+// fairly per user, then polled until they finish. callback_url is not forwarded:
+// callbacks are for services that talk to the AI service directly.
+app.post('/api/ai/jobs', authenticateToken, insightLimiter, async (req: AuthRequest, res) => {
+  const { kind, url_id, graph_type, message, context, exclude_bots } = req.body;
+  const userId = req.user?.id;
+
+  if (!kind || !url_id) {
+    return res.status(400).json({ error: 'Missing kind or url_id' });
+  }
+
+  try {
+    const verify = await query('SELECT id FROM urls WHERE id = $1 AND user_id = $2', [url_id, userId]);
+    if (verify.rows.length === 0) {
+      return res.status(403).json({ error: 'Unauthorized' });
+    }
+
+    // 202 with the job, 422 for an invalid job, 503 when the queue is full
+    const response = await axios.post(
+      `${AI_SERVICE_URL}/ai/jobs`,
+      { kind, url_id, graph_type, message, context, exclude_bots, user_id: userId },
+      { timeout: 10000, validateStatus: (status) => status < 500 || status === 503 }
+    );
+
+    res.status(response.status).json(response.data);
+  } catch (err) {
+    console.error('AI job submit error:', err);
+    res.status(500).json({ error: 'Failed to queue AI job' });
+  }
+});
+
+app.get('/api/ai/jobs/:job_id', authenticateToken, async (req: AuthRequest, res) => {
+  const { job_id } = req.params;
+  const userId = req.user?.id;
+  // Long-poll: the AI service holds the request up to this many seconds for the job to finish
+  const wait = Math.min(Math.max(Number(req.query.wait) || 0, 0), 30);
+
+  try {
+    const response = await axios.get(`${AI_SERVICE_URL}/ai/jobs/${encodeURIComponent(job_id)}`, {
+      params: { wait },
+      timeout: (wait + 10) * 1000,
+      validateStatus: (status) => status === 200 || status === 404,
+    });
+    if (response.status === 404) {
+      return res.status(404).json({ error: 'Job not found or expired' });
+    }
+
+    // Only the owner of the job's URL may read it
+    const verify = await query('SELECT id FROM urls WHERE id = $1 AND user_id = $2', [response.data.url_id, userId]);
+    if (verify.rows.length === 0) {
+      return res.status(404).json({ error: 'Job not found or expired' });
+    }
+
+    res.json(response.data);
+  } catch (err) {
+    console.error('AI job poll error:', err);
+    res.status(500).json({ error: 'Failed to fetch AI job' });
+  }
+});
+
 // Start Server (only if not in test mode)
 if (process.env.NODE_ENV !== 'test') {
   initDB().then(() => {